@@ -57,7 +57,7 @@ fi
 
 # FIXME paho-mqtt V2 has new API. stick to V1.x for now
 pip install --upgrade paho-mqtt==1.6.1
-pip install requests py-sds011 sdm_modbus minimalmodbus
+pip install requests py-sds011 minimalmodbus
 
 # Custom rpi-rfm69 library used for SPI RFM69 Low Power Labs interfacer
 echo "- Installing rpi-rfm69 library"
@@ -1,12 +1,20 @@
 import time
+import itertools
+
+# Cargos are created by several interfacer threads, next() on a count is atomic
+_uris = itertools.count(1)
+
+
+def next_uri():
+    return next(_uris)
+
 
 class EmonHubCargo:
     uri = 0
 
     # The class "constructor" - It's actually an initializer
     def __init__(self, timestamp, target, nodeid, nodename, names, realdata, rssi, rawdata):
-        EmonHubCargo.uri += 1
-        self.uri = EmonHubCargo.uri
+        self.uri = next_uri()
         self.timestamp = float(timestamp)
         self.target = int(target)
         self.nodeid = int(nodeid)
@@ -11,35 +11,34 @@
 
 
 import sys
+import math
 import time
 import logging
 import logging.handlers
 import signal
 import argparse
 import pprint
-import glob
 import os
 import getpass
 from collections import defaultdict
 
+_core_import_start = time.perf_counter()
 import emonhub_setup as ehs
 import emonhub_coder as ehc
 import emonhub_interfacer as ehi
 import emonhub_auto_conf as eha
-from interfacers import *
-
-# this namespace and path
-namespace = sys.modules[__name__]
+import emonhub_dedup as ehdd
+import emonhub_cache as ehca
+import emonhub_buffer as ehb
+import emonhub_memo as ehm
+import emonhub_logging as ehl
+# Interfacers are imported on demand by interfacers.get_interfacer()
+import interfacers
+_core_import_time = time.perf_counter() - _core_import_start
+
+# this path
 path = os.path.dirname(os.path.abspath(os.path.realpath(__file__)))
 
-# scan interfacers directory and import all interfacers
-for f in glob.glob(path + "/interfacers/*.py"):
-    name = f.replace(".py", "").replace(path + "/interfacers/", "")
-    if name != "__init__":
-        # print "Loading: " + name
-        setattr(ehi, name, getattr(getattr(namespace, name), name))
-del name
-
 """class EmonHub
 
 Monitors data inputs through EmonHubInterfacer instances,
@@ -76,11 +75,19 @@ class EmonHub:
         self._set_logging_level('INFO', False)
         self._log.info("EmonHub %s", self.__version__)
         self._log.info("Opening hub...")
-        self._log.info("Running as user: "+str(getpass.getuser()))
+        self._log.info("Running as user: %s", getpass.getuser())
         
         # Initialize Interfacers
         self._interfacers = {}
 
+        # Deduplication of the frames received by several gateways, see dedup_window
+        self._dedup = None
+
+        # Last values served over HTTP, see api_port
+        self._cache = None
+        self._api = None
+        self._api_channels = None
+
         # Update settings
         self._update_settings(settings)
         
@@ -136,14 +143,15 @@ class EmonHub:
                         # POP cargo item (one at a time)
                         cargo = I._pub_channels[pub_channel].pop(0)
 
-                        # Post to each subscriber interface
-                        for sub_interfacer in self._interfacers.values():
-                            # For each subscriber channel
-                            for sub_channel in sub_interfacer._settings['subchannels']:
-                                # If channel names match
-                                if sub_channel == pub_channel:
-                                    # APPEND cargo item
-                                    sub_interfacer._sub_channels.setdefault(sub_channel, []).append(cargo)
+                        if self._dedup:
+                            self._dedup.submit(pub_channel, cargo, I.name)
+                        else:
+                            self._publish(pub_channel, cargo)
+
+            # Post the frames held for deduplication
+            if self._dedup:
+                for pub_channel, cargo in self._dedup.ready():
+                    self._publish(pub_channel, cargo)
 
             # ->avoid modification of iterable within loop
             for name in kill_list:
@@ -161,6 +169,31 @@ class EmonHub:
             # Sleep until next iteration
             time.sleep(0.2)
 
+    def _publish(self, pub_channel, cargo):
+        """Post cargo to each interfacer subscribed to pub_channel."""
+        if self._cache and (not self._api_channels or pub_channel in self._api_channels):
+            self._cache.update(cargo)
+
+        # Values built from the cargo are shared by the subscribers of the same output format
+        ehm.memo.expect(cargo.uri, [name for name, sub_interfacer in self._interfacers.items()
+                                    for sub_channel in sub_interfacer._settings['subchannels']
+                                    if sub_channel == pub_channel])
+
+        logged = False
+        for sub_interfacer in self._interfacers.values():
+            # For each subscriber channel
+            for sub_channel in sub_interfacer._settings['subchannels']:
+                # If channel names match
+                if sub_channel == pub_channel:
+                    if sub_interfacer.uses_shared_log():
+                        # Appended once, read by each subscriber through its cursor
+                        if not logged:
+                            ehb.get_shared_log(pub_channel).append(cargo)
+                            logged = True
+                        continue
+                    # APPEND cargo item
+                    sub_interfacer._sub_channels.setdefault(sub_channel, []).append(cargo)
+
     def close(self):
         """Close hub. Do some cleanup before leaving."""
 
@@ -170,6 +203,9 @@ class EmonHub:
             I.stop = True
             I.join()
 
+        if self._api:
+            self._api.close()
+
         self._log.info("Exit completed")
 
     def _signal_handler(self, signal, frame):
@@ -188,17 +224,84 @@ class EmonHub:
         else:
             self._set_logging_level()
 
+        # The handlers are behind the logging queue
         if 'log_backup_count' in settings['hub']:
-            for handler in self._log.handlers:
+            for handler in ehl.handlers(self._log):
                 if isinstance(handler, logging.handlers.RotatingFileHandler):
                     handler.backupCount = int(settings['hub']['log_backup_count'])
                     self._log.info("Logging backup count set to %d", handler.backupCount)
         if 'log_max_bytes' in settings['hub']:
-            for handler in self._log.handlers:
+            for handler in ehl.handlers(self._log):
                 if isinstance(handler, logging.handlers.RotatingFileHandler):
                     handler.maxBytes = int(settings['hub']['log_max_bytes'])
                     self._log.info("Logging max file size set to %d bytes", handler.maxBytes)
 
+        # Times a message is logged per period before it is suppressed
+        try:
+            log_rate_limit = int(settings['hub'].get('log_rate_limit', ehl.RATE_LIMIT))
+            log_rate_period = float(settings['hub'].get('log_rate_period', ehl.RATE_PERIOD))
+        except ValueError:
+            self._log.error("Invalid log_rate_limit or log_rate_period setting")
+        else:
+            if (ehl.rate_limit.limit, ehl.rate_limit.period) != (log_rate_limit, log_rate_period):
+                ehl.set_rate_limit(log_rate_limit, log_rate_period)
+                if log_rate_limit:
+                    self._log.info("Logging rate limit set to %d messages per %ss", log_rate_limit, log_rate_period)
+                else:
+                    self._log.info("Logging rate limit disabled")
+
+        # Deduplication of frames received by several gateways
+        try:
+            dedup_window = float(settings['hub'].get('dedup_window', 0))
+            dedup_hold = float(settings['hub'].get('dedup_hold', 0.5))
+        except ValueError:
+            self._log.error("Invalid dedup_window or dedup_hold setting")
+        else:
+            settings_changed = not self._dedup or (self._dedup.window, self._dedup.hold) != (dedup_window, dedup_hold)
+            if self._dedup and (not dedup_window or settings_changed):
+                # Post the frames still held before dropping the index
+                for pub_channel, cargo in self._dedup.ready(math.inf):
+                    self._publish(pub_channel, cargo)
+                self._dedup = None
+                self._log.info("Frame deduplication disabled")
+            if dedup_window and settings_changed:
+                self._log.info("Frame deduplication window set to %ss, hold %ss", dedup_window, dedup_hold)
+                self._dedup = ehdd.FrameDeduplicator(dedup_window, dedup_hold)
+
+        # Log of the frames of each channel shared by the buffered interfacers
+        # subscribed to it, applies to the interfacers created next
+        try:
+            ehb.configure_shared_logs(str(settings['hub'].get('shared_log', 0)).lower() in ['1', 'yes', 'true'],
+                                      int(settings['hub'].get('shared_log_size', 100000)),
+                                      settings['hub'].get('shared_log_path', ''))
+        except ValueError:
+            self._log.error("Invalid shared_log_size setting")
+
+        # Last values HTTP API
+        api_host = settings['hub'].get('api_host', '127.0.0.1')
+        api_channels = settings['hub'].get('api_channels', [])
+        if isinstance(api_channels, str):
+            api_channels = [api_channels]
+        self._api_channels = [channel for channel in api_channels if channel]
+        try:
+            api_port = int(settings['hub'].get('api_port', 0))
+        except ValueError:
+            self._log.error("Invalid api_port setting")
+        else:
+            if self._api and (self._api.host, self._api.port) != (api_host, api_port):
+                self._api.close()
+                self._api = None
+                self._log.info("Last values API stopped")
+            if api_port and not self._api:
+                if not self._cache:
+                    self._cache = ehca.LastValueCache()
+                try:
+                    self._api = ehca.CacheServer(self._cache, api_host, api_port)
+                except OSError as e:
+                    self._log.error("Unable to serve last values on %s:%d: %s", api_host, api_port, e)
+            if not api_port:
+                self._cache = None
+
         # Interfacers
         interfacers_to_delete = []
         for name in self._interfacers:
@@ -221,6 +324,10 @@ class EmonHub:
             self._log.info("Deleting interfacer '%s'", name)
             self._interfacers[name].stop = True
             interfacers_to_delete.append(name)
+            if name not in settings['interfacers']:
+                # A new interfacer of the same name would carry on from its cursors and memo key
+                ehb.unsubscribe_shared_logs(name)
+                ehm.memo.unregister(name)
 
         for name in interfacers_to_delete:
             del self._interfacers[name]
@@ -232,8 +339,8 @@ class EmonHub:
                     if 'Type' not in I:
                         continue
                     self._log.info("Creating %s '%s'", I['Type'], name)
-                    # This gets the class from the 'Type' string
-                    interfacer = getattr(ehi, I['Type'])(name, **I['init_settings'])
+                    # This gets the class from the 'Type' string, importing it if needed
+                    interfacer = interfacers.get_interfacer(I['Type'])(name, **I['init_settings'])
                     interfacer.set(**I['runtimesettings'])
                     interfacer.init_settings = I['init_settings']
                     interfacer.start()
@@ -301,6 +408,9 @@ if __name__ == "__main__":
     # Show version
     parser.add_argument('--version', action='store_true',
                         help='display version number and exit')
+    # Profile startup
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='print import time per module once the interfacers are created and exit')
     # Parse arguments
     args = parser.parse_args()
 
@@ -343,7 +453,10 @@ if __name__ == "__main__":
             syslogger.setFormatter(logging.Formatter(
                 'emonHub[%(process)d]: %(levelname)-8s %(threadName)-10s %(message)s'))
             logger.addHandler(syslogger)
-    
+
+    # Write the log from a background thread
+    ehl.start(logger)
+
     # If in "Show settings" mode, print settings and exit
     if args.show_settings:
         setup.check_settings()
@@ -356,6 +469,14 @@ if __name__ == "__main__":
         except Exception as e:
             sys.exit("Could not start EmonHub: " + str(e))
         else:
+            if args.profile_startup:
+                print("%-50s %10s" % ("Module", "Time (ms)"))
+                print("%-50s %10.1f" % ("core (emonhub_*, configobj)", _core_import_time * 1000))
+                for module_name, import_time in interfacers.import_times.items():
+                    print("%-50s %10.1f" % (module_name, import_time * 1000))
+                hub.close()
+                sys.exit()
             hub.run()
             # When done, close hub
             hub.close()
+    ehl.stop()
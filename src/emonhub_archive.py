@@ -0,0 +1,370 @@
+"""
+
+  This code is released under the GNU Affero General Public License.
+
+  OpenEnergyMonitor project:
+  http://openenergymonitor.org
+
+"""
+
+import io
+import os
+import re
+import csv
+import gzip
+import time
+import logging
+import calendar
+import Cargo
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+"""Archive of the frames received
+
+Frames are stored by node and hour of their timestamp (UTC), as columns named
+after the inputs of the node:
+
+    <path>/<node>/2024-01-31T13.csv.gz    (or .csv.zst, with zstandard)
+    <path>/<node>/2024-01-31T13.parquet   (with pyarrow)
+
+    time,rssi,P1,P2,T1
+    1706706000.0,-52,1250.0,15.0,19.5
+    ...
+
+An ArchiveWriter keeps the frames in memory, as a column per input, and
+appends them to the file of their hour on flush(). Each flush is appended as a
+complete gzip member or zstd frame starting with a header row, so a file cut
+short by a power failure loses the last flush only, and the columns can change
+from one flush to the next when the inputs of a node change.
+
+With the parquet format, the CSV file of an hour is converted to parquet
+once the hour is over. Both are read by read_frames(), parquet conversion
+doesn't lose the frames written since, e.g. late frames of an hour already
+converted are kept in a new CSV file and converted to another parquet file.
+
+"""
+
+# Seconds without writes to an hour that is over before it is converted to
+# parquet, for late frames and backfills
+PARQUET_DELAY = 300
+
+# Interval in seconds between write reports in the log
+ARCHIVE_STATS_INTERVAL = 300
+
+_log = logging.getLogger("EmonHub")
+
+
+def formats():
+    """Return the formats and compressions available, the preferred first"""
+    return (['parquet', 'csv'] if pyarrow else ['csv'],
+            ['zstd', 'gzip'] if zstandard else ['gzip'])
+
+
+def _node_directory(node):
+    """Return the directory name of a node id or name, unsafe characters replaced"""
+    name = re.sub(r'[^\w.-]', '_', str(node))
+    # No hidden directory, nor . or ..
+    return re.sub(r'^\.', '_', name) or '_'
+
+
+def _hour_name(hour):
+    return time.strftime('%Y-%m-%dT%H', time.gmtime(hour))
+
+
+def _hour_of(file_name):
+    """Return the start of the hour of a file name, None if not an archive file"""
+    try:
+        return calendar.timegm(time.strptime(file_name[:13], '%Y-%m-%dT%H'))
+    except ValueError:
+        return None
+
+
+def _file_order(file_name):
+    """Sort key of the files of a node, by hour, parquet parts then CSV"""
+    rest = file_name[13:]
+    part = int(rest[1:].split('.')[0]) if rest.startswith('-') else 0
+    return (file_name[:13], '.csv' in rest, part)
+
+
+class _Batch:
+    """Frames of one node and hour, as columns"""
+
+    __slots__ = ('names', 'columns', 'rows')
+
+    def __init__(self):
+        # Input names in order of appearance, and a column per name
+        self.names = []
+        self.columns = {'time': [], 'rssi': []}
+        self.rows = 0
+
+    def append(self, cargo):
+        columns = self.columns
+        names = cargo.names
+        for i, value in enumerate(cargo.realdata):
+            # Unnamed values are numbered from 1, as emoncms does
+            name = str(names[i]) if i < len(names) else str(i + 1)
+            if name in ('time', 'rssi'):
+                name = '_' + name
+            column = columns.get(name)
+            if column is None:
+                # New input, empty for the rows before
+                column = columns[name] = [None] * self.rows
+                self.names.append(name)
+            column.append(value)
+        self.rows += 1
+        columns['time'].append(cargo.timestamp)
+        columns['rssi'].append(cargo.rssi or None)
+        # Inputs missing from this frame
+        for column in columns.values():
+            if len(column) < self.rows:
+                column.append(None)
+
+    def csv(self):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        header = ['time', 'rssi'] + self.names
+        writer.writerow(header)
+        writer.writerows(zip(*[self.columns[name] for name in header]))
+        return buffer.getvalue().encode()
+
+
+class ArchiveWriter:
+    """Writes frames under path in hourly files per node
+
+    fmt (str): 'parquet' or 'csv', see formats()
+    compression (str): 'zstd' or 'gzip', for CSV files
+    max_rows (int): frames held in memory, flushed at once when reached
+
+    """
+
+    def __init__(self, path, fmt='csv', compression='gzip', max_rows=10000):
+        self.path = path
+        self.format = fmt
+        self.compression = compression
+        self.max_rows = int(max_rows)
+        if fmt == 'parquet' and not pyarrow:
+            raise ValueError("the parquet format needs pyarrow")
+        if compression not in ('zstd', 'gzip') or (compression == 'zstd' and not zstandard):
+            raise ValueError("compression %s not available" % compression)
+
+        # By (node, hour)
+        self._batches = {}
+        self._rows = 0
+        # Hours written to CSV and not converted to parquet yet: {(node, hour): last write}
+        self._to_convert = {}
+        if fmt == 'parquet':
+            self._find_unconverted()
+
+        self.stats = {'frames': 0, 'bytes': 0, 'files': 0, 'flushes': 0, 'seconds': 0.0}
+        self._stats_timestamp = time.time()
+
+    def _csv_path(self, node, hour):
+        return os.path.join(self.path, _node_directory(node), _hour_name(hour)
+                            + ('.csv.zst' if self.compression == 'zstd' else '.csv.gz'))
+
+    def _find_unconverted(self):
+        """Queue the CSV files left by a previous run for conversion"""
+        if not os.path.isdir(self.path):
+            return
+        for node in os.listdir(self.path):
+            directory = os.path.join(self.path, node)
+            if not os.path.isdir(directory):
+                continue
+            for file_name in os.listdir(directory):
+                hour = _hour_of(file_name)
+                if hour is not None and '.csv' in file_name:
+                    self._to_convert[(node, hour)] = 0
+
+    def append(self, cargo):
+        """Add a frame, written by the next flush(), or at once if max_rows is reached"""
+        timestamp = float(cargo.timestamp)
+        key = (_node_directory(cargo.nodeid), int(timestamp // 3600 * 3600))
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = _Batch()
+        batch.append(cargo)
+        self._rows += 1
+        self.stats['frames'] += 1
+        if self._rows >= self.max_rows:
+            self.flush()
+
+    def flush(self):
+        """Append the frames in memory to their files, convert the hours over to parquet"""
+        start = time.perf_counter()
+        batches, self._batches = self._batches, {}
+        self._rows = 0
+        for (node, hour), batch in batches.items():
+            data = batch.csv()
+            if self.compression == 'zstd':
+                data = zstandard.ZstdCompressor().compress(data)
+            else:
+                data = gzip.compress(data)
+            path = self._csv_path(node, hour)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'ab') as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+            except OSError as e:
+                _log.error("Archive: unable to write %d frames to %s: %s", batch.rows, path, e)
+                continue
+            self.stats['bytes'] += len(data)
+            if self.format == 'parquet':
+                self._to_convert[(node, hour)] = time.time()
+
+        if self._to_convert:
+            done = time.time() - PARQUET_DELAY
+            for (node, hour), written in sorted(self._to_convert.items()):
+                if hour + 3600 <= done and written <= done:
+                    self._convert(node, hour)
+                    del self._to_convert[(node, hour)]
+
+        self.stats['flushes'] += 1
+        self.stats['seconds'] += time.perf_counter() - start
+        if time.time() - self._stats_timestamp > ARCHIVE_STATS_INTERVAL:
+            self._stats_timestamp = time.time()
+            _log.debug("Archive: %d frames, %d bytes written in %d flushes, %d parquet files, %.3f s",
+                       self.stats['frames'], self.stats['bytes'], self.stats['flushes'],
+                       self.stats['files'], self.stats['seconds'])
+
+    def _convert(self, node, hour):
+        """Convert the CSV files of an hour of a node to a parquet file"""
+        directory = os.path.join(self.path, node)
+        prefix = _hour_name(hour)
+        csv_files = sorted(f for f in os.listdir(directory) if f.startswith(prefix) and '.csv' in f)
+        if not csv_files:
+            return
+
+        columns = {'time': [], 'rssi': []}
+        rows = 0
+        for file_name in csv_files:
+            for header, row in _read_csv(os.path.join(directory, file_name)):
+                for name, value in zip(header, row):
+                    column = columns.get(name)
+                    if column is None:
+                        column = columns[name] = [None] * rows
+                    column.append(_number(value))
+                rows += 1
+                for column in columns.values():
+                    if len(column) < rows:
+                        column.append(None)
+
+        # Late frames of an hour already converted go to a new file
+        path = os.path.join(directory, prefix + '.parquet')
+        part = 1
+        while os.path.exists(path):
+            path = os.path.join(directory, '%s-%d.parquet' % (prefix, part))
+            part += 1
+        try:
+            table = pyarrow.table({name: pyarrow.array(column, type=pyarrow.float64())
+                                   for name, column in columns.items()})
+            pyarrow.parquet.write_table(table, path + '.tmp', compression='zstd')
+            os.replace(path + '.tmp', path)
+        except (OSError, pyarrow.ArrowException) as e:
+            _log.error("Archive: unable to convert %s %s to parquet, kept as CSV: %s", node, prefix, e)
+            return
+        for file_name in csv_files:
+            os.remove(os.path.join(directory, file_name))
+        self.stats['files'] += 1
+
+    def close(self):
+        self.flush()
+
+
+def _number(value):
+    """Return value as a float, None if it isn't a number"""
+    if value == '' or value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _read_csv(path):
+    """Yield (header, row) from a CSV archive file, up to where a truncated file ends"""
+    if path.endswith('.zst'):
+        if not zstandard:
+            _log.warning("Archive: zstandard is needed to read %s", path)
+            return
+        f = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True,
+                                                       closefd=True)
+        errors = (EOFError, OSError, zstandard.ZstdError)
+    else:
+        f = gzip.open(path, 'rb')
+        errors = (EOFError, OSError)
+    header = None
+    try:
+        with io.TextIOWrapper(f, encoding='utf-8', newline='') as text:
+            for row in csv.reader(text):
+                if row and row[0] == 'time':
+                    header = row
+                elif header and row:
+                    yield header, row
+    except errors as e:
+        _log.warning("Archive: %s is truncated: %s", path, e)
+
+
+def _read_parquet(path):
+    if not pyarrow:
+        _log.warning("Archive: pyarrow is needed to read %s", path)
+        return
+    table = pyarrow.parquet.read_table(path)
+    header = table.column_names
+    columns = [table.column(name).to_pylist() for name in header]
+    for row in zip(*columns):
+        yield header, row
+
+
+def read_frames(path, node=None, start=None, end=None):
+    """Yield the frames archived under path as cargos, by node and hour
+
+    node: only this node id or name
+    start, end (float): only the frames from start to end
+
+    """
+    if not os.path.isdir(path):
+        return
+    nodes = [_node_directory(node)] if node is not None else sorted(os.listdir(path), key=lambda n: (len(n), n))
+    for nodeid in nodes:
+        directory = os.path.join(path, nodeid)
+        if nodeid != _node_directory(nodeid) or not os.path.isdir(directory):
+            continue
+        for file_name in sorted(os.listdir(directory), key=_file_order):
+            hour = _hour_of(file_name)
+            if hour is None or file_name.endswith('.tmp'):
+                continue
+            if (start is not None and hour + 3600 <= start) or (end is not None and hour > end):
+                continue
+            file_path = os.path.join(directory, file_name)
+            reader = _read_parquet if file_name.endswith('.parquet') else _read_csv
+            for header, row in reader(file_path):
+                timestamp = float(row[0])
+                if (start is not None and timestamp < start) or (end is not None and timestamp > end):
+                    continue
+                names = []
+                values = []
+                for name, value in zip(header[2:], row[2:]):
+                    if value is None or value == '':
+                        continue
+                    if isinstance(value, str):
+                        # Values of CSV files that aren't numbers are kept as text
+                        number = _number(value)
+                        value = number if number is not None else value
+                    names.append(name)
+                    values.append(value)
+                rssi = _number(row[1])
+                c = Cargo.new_cargo(timestamp=timestamp, names=names, realdata=values, rssi=rssi or 0)
+                # Interfacers such as MBUS or Modbus name their nodes
+                c.nodeid = int(nodeid) if nodeid.isdigit() else nodeid
+                yield c
@@ -7,7 +7,14 @@
 
 """
 
+import os
+import re
+import pickle
 import logging
+import threading
+from collections import deque
+
+import emonhub_memo as ehm
 
 """class AbstractBuffer
 
@@ -96,12 +103,360 @@ class InMemoryBuffer(AbstractBuffer):
         return len(self._data_buffer)
 
 
+"""class SharedLog
+
+One log of the frames published on a channel, shared by the interfacers
+subscribed to it. Each interfacer holds a cursor, its position in the log,
+rather than a copy of every frame. Frames are held in segments, a segment is
+dropped once every cursor has passed it. With a path, the segments beyond
+the newest memory_segments are kept in files until they are read.
+
+Enabled by the shared_log setting of the hub, see configure_shared_logs().
+"""
+
+# Frames per segment
+SEGMENT_SIZE = 1000
+
+
+class LoggedFrame:
+    """The fields of a cargo read by the formatters, without the raw data"""
+
+    __slots__ = ('uri', 'timestamp', 'target', 'nodeid', 'nodename', 'names', 'realdata', 'rssi')
+
+    def __init__(self, cargo):
+        for field in self.__slots__:
+            setattr(self, field, getattr(cargo, field))
+
+
+class _Segment:
+    __slots__ = ('base', 'items', 'path')
+
+    def __init__(self, base):
+        # Position of the first frame, the frames or None while in a file, the file
+        self.base = base
+        self.items = []
+        self.path = None
+
+
+class SharedLog:
+
+    def __init__(self, channel, max_entries=100000, path=None, memory_segments=10):
+        self._channel = str(channel)
+        self._maximumEntriesInLog = int(max_entries)
+        self._path = path
+        self._memory_segments = int(memory_segments)
+        self._log = logging.getLogger("EmonHub")
+        self._lock = threading.Lock()
+
+        self._segments = deque()
+        # Position of the next frame appended
+        self._head = 0
+        # Position by interfacer name
+        self._cursors = {}
+
+        if path:
+            os.makedirs(path, exist_ok=True)
+            # Segments of a previous run aren't reloaded
+            for file_name in os.listdir(path):
+                if file_name.startswith(self._file_prefix()):
+                    os.remove(os.path.join(path, file_name))
+
+    def _file_prefix(self):
+        return re.sub(r'[^A-Za-z0-9_-]', '_', self._channel) + '-'
+
+    def append(self, cargo):
+        with self._lock:
+            if not self._cursors:
+                # Nobody to read it
+                self._head += 1
+                return
+            # The last segment is always in memory
+            if not self._segments or len(self._segments[-1].items) >= SEGMENT_SIZE:
+                self._segments.append(_Segment(self._head))
+                self._spill()
+            self._segments[-1].items.append(LoggedFrame(cargo))
+            self._head += 1
+            if self._head - self._segments[0].base > self._maximumEntriesInLog:
+                self._drop_oldest()
+
+    def _spill(self):
+        """Move the oldest segments in memory to files, beyond memory_segments"""
+        if not self._path:
+            return
+        in_memory = [segment for segment in self._segments if segment.items is not None]
+        for segment in in_memory[:-self._memory_segments - 1]:
+            if segment.path is None:
+                segment.path = os.path.join(self._path, "%s%d.seg" % (self._file_prefix(), segment.base))
+                try:
+                    with open(segment.path, 'wb') as f:
+                        pickle.dump(segment.items, f, pickle.HIGHEST_PROTOCOL)
+                except (OSError, pickle.PicklingError) as e:
+                    self._log.warning("Shared log (%s) unable to write %s: %s", self._channel, segment.path, e)
+                    segment.path = None
+                    continue
+            segment.items = None
+
+    def _items(self, segment, end):
+        """Return the frames of segment, end the position after its last frame"""
+        if segment.items is not None:
+            return segment.items
+        # Read again for each batch rather than kept in memory
+        try:
+            with open(segment.path, 'rb') as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            # Skipped by the interfacers, as frames they don't post
+            self._log.error("Shared log (%s) unable to read %s, %d frames lost: %s",
+                            self._channel, segment.path, end - segment.base, e)
+            self._delete(segment)
+            segment.path = None
+            segment.items = [None] * (end - segment.base)
+            return segment.items
+
+    def _drop_oldest(self):
+        end = self._segments[1].base if len(self._segments) > 1 else self._head
+        lagging = [name for name, position in self._cursors.items() if position < end]
+        self._log.warning("Shared log (%s) reached limit of %d items, deleting oldest for %s",
+                          self._channel, self._maximumEntriesInLog, ", ".join(lagging))
+        # Values shared with the other subscribers won't be used, see emonhub_memo
+        for frame in self._items(self._segments[0], end):
+            if frame is not None:
+                for name in lagging:
+                    ehm.memo.skip(frame.uri, name)
+        for name in lagging:
+            self._cursors[name] = end
+        self._delete(self._segments.popleft())
+
+    def _delete(self, segment):
+        if segment.path:
+            try:
+                os.remove(segment.path)
+            except OSError:
+                pass
+
+    def _reclaim(self):
+        """Drop the segments every cursor has passed"""
+        oldest = min(self._cursors.values()) if self._cursors else self._head
+        while self._segments:
+            end = self._segments[1].base if len(self._segments) > 1 else self._head
+            if end > oldest:
+                break
+            self._delete(self._segments.popleft())
+
+    def subscribe(self, name):
+        """Add the cursor of name at the end of the log, unless it exists already"""
+        with self._lock:
+            self._cursors.setdefault(name, self._head)
+
+    def unsubscribe(self, name):
+        with self._lock:
+            self._cursors.pop(name, None)
+            self._reclaim()
+
+    def pending(self, name):
+        """Number of frames after the cursor of name"""
+        with self._lock:
+            return self._head - self._cursors.get(name, self._head)
+
+    def read(self, name, position, number):
+        """Return (cursor of name, start, up to number frames from start)
+
+        start is position, or the cursor if position is None or before it, e.g.
+        when the cursor was moved past frames dropped as the log was full.
+
+        """
+        with self._lock:
+            cursor = self._cursors.get(name, self._head)
+            if position is None or position < cursor:
+                position = cursor
+            start = position
+            end = min(position + number, self._head)
+            items = []
+            for index, segment in enumerate(self._segments):
+                if position >= end:
+                    break
+                segment_end = self._segments[index + 1].base if index + 1 < len(self._segments) else self._head
+                if segment_end <= position:
+                    continue
+                segment_items = self._items(segment, segment_end)
+                items.extend(segment_items[position - segment.base:end - segment.base])
+                position = min(segment_end, end)
+            return cursor, start, items
+
+    def advance_to(self, name, position):
+        """Move the cursor of name forward to position, return the cursor"""
+        with self._lock:
+            if name not in self._cursors:
+                return self._head
+            self._cursors[name] = max(self._cursors[name], min(position, self._head))
+            self._reclaim()
+            return self._cursors[name]
+
+
+_shared_logs = {}
+_shared_log_settings = {'enabled': False, 'size': 100000, 'path': None}
+
+
+def configure_shared_logs(enabled, size=100000, path=None):
+    """Set the shared_log settings of the hub, for the interfacers created next"""
+    _shared_log_settings.update({'enabled': bool(enabled), 'size': int(size), 'path': path or None})
+
+
+def shared_logs_enabled():
+    return _shared_log_settings['enabled']
+
+
+def get_shared_log(channel):
+    """Return the log of channel, created if needed"""
+    log = _shared_logs.get(channel)
+    if log is None:
+        log = _shared_logs[channel] = SharedLog(channel, _shared_log_settings['size'], _shared_log_settings['path'])
+    return log
+
+
+def unsubscribe_shared_logs(name):
+    """Remove the cursors of an interfacer from every log"""
+    for log in list(_shared_logs.values()):
+        log.unsubscribe(name)
+
+
+"""class SharedLogBuffer
+
+The buffer of an interfacer reading the shared logs of its subchannels
+through cursors. Frames are formatted by the formatter of the interfacer
+when they are retrieved, rather than when they are published, and are kept
+formatted until they are discarded. The formatter returns None for frames
+that must not be posted, which are skipped.
+"""
+
+
+class SharedLogBuffer(AbstractBuffer):
+
+    def __init__(self, bufferName, buffer_size):
+        self._bufferName = str(bufferName)
+        self._buffer_type = "log"
+        self._log = logging.getLogger("EmonHub")
+        self.formatter = None
+        self._channels = []
+        # By channel: frames formatted from the cursor on, None for frames skipped,
+        # and the position of the first in the log
+        self._formatted = {}
+        self._bases = {}
+        # [(channel, position, frames)] of the last retrieveItems()
+        self._retrieved = []
+
+    def subscribe(self, channels):
+        """Follow the logs of channels, stop following the others"""
+        for channel in self._channels:
+            if channel not in channels:
+                get_shared_log(channel).unsubscribe(self._bufferName)
+                self._formatted.pop(channel, None)
+                self._bases.pop(channel, None)
+        for channel in channels:
+            get_shared_log(channel).subscribe(self._bufferName)
+        self._channels = list(channels)
+
+    def _format(self, channel, count):
+        """Return the formatted frames of channel from the cursor on, at least count if available"""
+        formatted = self._formatted.setdefault(channel, [])
+        base = self._bases.get(channel)
+        position = base + len(formatted) if base is not None else None
+        cursor, start, cargos = get_shared_log(channel).read(self._bufferName, position,
+                                                             max(0, count - len(formatted)))
+        if cursor != base:
+            # The log moved the cursor past the frames it dropped, those formatted are gone
+            if start == position:
+                del formatted[:cursor - base]
+            else:
+                del formatted[:]
+            self._bases[channel] = cursor
+        formatted.extend(self.formatter(cargo) if cargo is not None else None for cargo in cargos)
+        return formatted
+
+    def _advance(self, channel, position):
+        """Move the cursor of channel to position, drop the frames formatted before it"""
+        cursor = get_shared_log(channel).advance_to(self._bufferName, position)
+        formatted = self._formatted.get(channel, [])
+        del formatted[:cursor - self._bases.get(channel, cursor)]
+        self._bases[channel] = cursor
+
+    def _retrieve(self, channel, number):
+        """Return the first number frames of channel not skipped, their position and the frames they span"""
+        formatted = self._format(channel, number)
+        base = self._bases[channel]
+        items = []
+        used = 0
+        while len(items) < number:
+            if used == len(formatted):
+                formatted = self._format(channel, used + number - len(items))
+                if self._bases[channel] != base:
+                    # Frames dropped by the log meanwhile, start again from the cursor
+                    return self._retrieve(channel, number)
+                if used == len(formatted):
+                    break
+            if formatted[used] is not None:
+                items.append(formatted[used])
+            used += 1
+        return items, base, formatted[:used]
+
+    def storeItem(self, data):
+        raise NotImplementedError("frames are appended to the shared log by the hub")
+
+    def retrieveItems(self, number):
+        items = []
+        self._retrieved = []
+        for channel in self._channels:
+            channel_items, base, frames = self._retrieve(channel, number - len(items))
+            items.extend(channel_items)
+            if frames:
+                self._retrieved.append((channel, base, frames))
+            if len(items) >= number:
+                break
+        return items
+
+    def retrieveItem(self):
+        return self.retrieveItems(1)[0]
+
+    def discardLastRetrievedItem(self):
+        self.discardLastRetrievedItems(1)
+
+    def discardLastRetrievedItems(self, number):
+        for channel, base, frames in self._retrieved:
+            count = 0
+            while count < len(frames) and number:
+                if frames[count] is not None:
+                    number -= 1
+                count += 1
+            # Frames skipped after the last one discarded
+            while count < len(frames) and frames[count] is None:
+                count += 1
+            # From the position they were retrieved at, the log may have moved the cursor since
+            self._advance(channel, base + count)
+        self._retrieved = []
+
+    def hasItems(self):
+        # Frames skipped at the start of the logs are discarded at once
+        for channel in self._channels:
+            while True:
+                formatted = self._format(channel, 1)
+                if not formatted:
+                    break
+                if formatted[0] is not None:
+                    return True
+                self._advance(channel, self._bases[channel] + 1)
+        return False
+
+    def size(self):
+        return sum(get_shared_log(channel).pending(self._bufferName) for channel in self._channels)
+
+
 """
 The getBuffer function returns the buffer class corresponding to a
 buffering method passed as argument.
 """
 bufferMethodMap = {
-                   'memory': InMemoryBuffer
+                   'memory': InMemoryBuffer,
+                   'log': SharedLogBuffer
                   }
 
 
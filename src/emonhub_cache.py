@@ -0,0 +1,186 @@
+"""
+
+  This code is released under the GNU Affero General Public License.
+
+  OpenEnergyMonitor project:
+  http://openenergymonitor.org
+
+"""
+
+import sys
+import json
+import math
+import logging
+import threading
+from array import array
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import unquote
+
+"""Last value cache
+
+The hub keeps the last value of every input of every node, with its
+timestamp and the RSSI of the frame it came in, updated from every frame
+published on a channel. It can be read locally over HTTP without
+subscribing to MQTT:
+
+    [hub]
+        api_port = 8081
+
+    GET /nodes                  every node
+    GET /nodes/emontx4          the inputs of a node, by node name or id
+    GET /nodes/emontx4/P1       one input
+
+    {"P1": {"value": 1250.0, "time": 1700000000.0, "rssi": -52}, ...}
+
+Responses carry an ETag that changes when the values they hold change, a
+request with If-None-Match gets a 304 reply if nothing changed since.
+
+"""
+
+_log = logging.getLogger("EmonHub")
+
+
+class _Node:
+    """Last values of one node, one slot per input name in arrays"""
+
+    __slots__ = ('nodeid', 'slots', 'names', 'values', 'times', 'rssi', 'version')
+
+    def __init__(self, nodeid):
+        self.nodeid = nodeid
+        # Slot of each input name, names interned as they repeat in every frame
+        self.slots = {}
+        self.names = []
+        self.values = array('d')
+        self.times = array('d')
+        self.rssi = array('i')
+        self.version = 0
+
+    def as_dict(self, names=None):
+        inputs = {}
+        for name in names or self.names:
+            slot = self.slots.get(name)
+            if slot is None:
+                continue
+            value = self.values[slot]
+            inputs[name] = {'value': value if not math.isnan(value) else None,
+                            'time': self.times[slot],
+                            'rssi': self.rssi[slot]}
+        return inputs
+
+
+class LastValueCache:
+    """Last value, time and RSSI by node and input"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # By node name, or node id when the node has no name
+        self._nodes = {}
+        self._aliases = {}
+        self.version = 0
+
+    def update(self, cargo):
+        """Store the values of a frame"""
+        node_key = str(cargo.nodename or cargo.nodeid)
+        names = cargo.names
+        timestamp = float(cargo.timestamp)
+        rssi = int(cargo.rssi or 0)
+
+        with self._lock:
+            node = self._nodes.get(node_key)
+            if node is None:
+                node = self._nodes[node_key] = _Node(cargo.nodeid)
+                self._aliases[str(cargo.nodeid)] = node_key
+
+            slots = node.slots
+            for i, value in enumerate(cargo.realdata):
+                # Unnamed values are numbered from 1, as emoncms does
+                name = names[i] if i < len(names) else str(i + 1)
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    value = math.nan
+                slot = slots.get(name)
+                if slot is None:
+                    name = sys.intern(str(name))
+                    slot = slots[name] = len(node.names)
+                    node.names.append(name)
+                    node.values.append(value)
+                    node.times.append(timestamp)
+                    node.rssi.append(rssi)
+                else:
+                    node.values[slot] = value
+                    node.times[slot] = timestamp
+                    node.rssi[slot] = rssi
+            # Versions are taken from a single counter so that an ETag can't
+            # stand for two different contents of a path
+            self.version += 1
+            node.version = self.version
+
+    def get(self, node_key=None, name=None):
+        """Return (version, data) for every node, a node or an input, (None, None) if unknown"""
+        with self._lock:
+            if node_key is None:
+                return self.version, {key: node.as_dict() for key, node in self._nodes.items()}
+
+            node = self._nodes.get(node_key) or self._nodes.get(self._aliases.get(node_key))
+            if node is None:
+                return None, None
+            if name is None:
+                return node.version, node.as_dict()
+            data = node.as_dict([name])
+            if not data:
+                return None, None
+            return node.version, data[name]
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+
+    server_version = "emonhub"
+
+    def do_GET(self):
+        parts = [unquote(part) for part in self.path.split('?')[0].strip('/').split('/')]
+        if not parts or parts[0] != 'nodes' or len(parts) > 3:
+            self.send_error(404)
+            return
+
+        version, data = self.server.cache.get(*parts[1:])
+        if data is None:
+            self.send_error(404)
+            return
+
+        etag = '"%d"' % version
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        body = json.dumps(data, separators=(',', ':')).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        _log.debug("API %s %s", self.address_string(), format % args)
+
+
+class CacheServer:
+    """Serves a LastValueCache over HTTP from a background thread"""
+
+    def __init__(self, cache, host='127.0.0.1', port=8081):
+        self.host = host
+        self.port = int(port)
+        self._httpd = ThreadingHTTPServer((host, self.port), _RequestHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.cache = cache
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="api", daemon=True)
+        self._thread.start()
+        _log.info("Serving last values on http://%s:%d/nodes", host, self.port)
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
@@ -0,0 +1,142 @@
+"""
+
+  This code is released under the GNU Affero General Public License.
+
+  OpenEnergyMonitor project:
+  http://openenergymonitor.org
+
+"""
+
+import copy
+import Cargo
+
+"""Report by exception
+
+A subscribing interfacer can filter the frames it receives so that a value is
+only passed on when it has moved away from the last value passed on:
+
+    deadband = DeadbandFilter('0.5', {'T1': '2%'}, heartbeat=600)
+    cargo = deadband.filter(cargo, by_name=True)
+    if cargo:
+        ...
+
+A threshold is an absolute change, e.g. '0.5', or a change relative to the
+last value passed on, e.g. '2%'. A threshold of '0' passes on every change.
+Whatever the change, a value is passed on again heartbeat seconds after it was
+last passed on, so that outputs can tell a steady input from a silent one.
+
+When the output identifies the values by name, e.g. emoncms with sendnames,
+and the values of a frame are named, the frame passed on only holds the
+values that changed, and None is returned if there are none. Otherwise the
+position of each value identifies it, e.g. the emoncms CSV format, so the
+frame is passed on whole if any of its values changed.
+
+"""
+
+
+def parse_threshold(setting):
+    """Return (absolute, relative) from '0.5' or '2%', raises ValueError"""
+    setting = str(setting).strip()
+    if setting.endswith('%'):
+        relative = float(setting[:-1]) / 100.0
+        if relative < 0:
+            raise ValueError("negative threshold '%s'" % setting)
+        return (0.0, relative)
+    absolute = float(setting)
+    if absolute < 0:
+        raise ValueError("negative threshold '%s'" % setting)
+    return (absolute, 0.0)
+
+
+class DeadbandFilter:
+    """Change-only filter of the frames received by one interfacer
+
+    threshold: default threshold for every input, see parse_threshold, or None to
+               only filter the inputs listed in inputs
+    inputs: {input name: threshold} overriding the default for some inputs
+    heartbeat (float): seconds after which an unchanged value is passed on, 0 never
+
+    """
+
+    def __init__(self, threshold='0', inputs=None, heartbeat=0):
+        self.threshold = parse_threshold(threshold) if threshold is not None else None
+        self.inputs = {name: parse_threshold(value) for name, value in (inputs or {}).items()}
+        self.heartbeat = float(heartbeat)
+
+        # By node: {input name or position: [last value passed on, its timestamp]}
+        self._sent = {}
+
+        # Frames and values received and passed on
+        self.stats = {'frames_in': 0, 'frames_out': 0, 'values_in': 0, 'values_out': 0}
+
+    def _changed(self, sent, key, value, timestamp):
+        """Return True if value must be passed on, and record it as sent if so"""
+        thresholds = self.inputs.get(key, self.threshold)
+        if thresholds is None:
+            return True
+
+        last = sent.get(key)
+        if last is None:
+            sent[key] = [value, timestamp]
+            return True
+
+        changed = False
+        if self.heartbeat and timestamp - last[1] >= self.heartbeat:
+            changed = True
+        elif value != last[0]:
+            absolute, relative = thresholds
+            try:
+                delta = abs(value - last[0])
+                changed = delta > absolute and delta > relative * abs(last[0])
+            except TypeError:
+                # Not a number, any change is passed on
+                changed = True
+        if changed:
+            last[0] = value
+            last[1] = timestamp
+        return changed
+
+    def filter(self, cargo, by_name=False):
+        """Return the cargo holding the changed values, or None if nothing changed
+
+        by_name (bool): the output identifies the values by name, the cargo passed
+                        on can hold only the values that changed
+
+        """
+        stats = self.stats
+        stats['frames_in'] += 1
+        stats['values_in'] += len(cargo.realdata)
+
+        sent = self._sent.setdefault(cargo.nodeid, {})
+        timestamp = cargo.timestamp
+
+        named = len(cargo.names) == len(cargo.realdata)
+        if named and by_name:
+            names = []
+            values = []
+            for name, value in zip(cargo.names, cargo.realdata):
+                if self._changed(sent, name, value, timestamp):
+                    names.append(name)
+                    values.append(value)
+            if not names:
+                return None
+            if len(names) < len(cargo.names):
+                # The cargo is shared with the other subscribers, don't modify it.
+                # A new uri, its values differ from those of the cargo
+                cargo = copy.copy(cargo)
+                cargo.uri = Cargo.next_uri()
+                cargo.names = names
+                cargo.realdata = values
+        else:
+            keys = cargo.names if named else range(len(cargo.realdata))
+            changed = [self._changed(sent, key, value, timestamp)
+                       for key, value in zip(keys, cargo.realdata)]
+            if not any(changed):
+                return None
+            # Every value is passed on
+            for key, value in zip(keys, cargo.realdata):
+                sent[key] = [value, timestamp]
+
+        stats['frames_out'] += 1
+        stats['values_out'] += len(cargo.realdata)
+        return cargo
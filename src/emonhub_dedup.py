@@ -0,0 +1,201 @@
+"""
+
+  This code is released under the GNU Affero General Public License.
+
+  OpenEnergyMonitor project:
+  http://openenergymonitor.org
+
+"""
+
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+
+"""Frames received by several gateways
+
+When a node is in range of more than one base station (e.g. an emonPi and a
+RFM69 Pi forwarding to it), the same radio packet reaches the hub once per
+gateway. The hub passes the frames published on each channel through a
+FrameDeduplicator, which holds a frame for a moment, keeps the copy received
+with the best RSSI and drops the others:
+
+    [hub]
+        dedup_window = 2
+        dedup_hold = 0.5
+
+Frames are identified by node and MSG counter when the first input of the
+node is MSG, otherwise by node and values. Copies are looked for within
+dedup_window seconds, among the frames received by the other interfacers: a
+node sending the same values twice through one gateway gets both frames
+through.
+
+The MSG counter bookkeeping of the missed and missedprc inputs is shared by
+all interfacers through message_counter, so a packet lost by one gateway but
+received by another is not counted as missed.
+
+"""
+
+# Interval in seconds between duplicates reports in the log
+DEDUP_STATS_INTERVAL = 300
+
+# Number of MSG counter values remembered per node to recognise copies and
+# late packets
+MSG_HISTORY = 64
+
+# Seconds after the latest packet of a node during which a lower MSG counter
+# is a late copy from another gateway, later it is a counter reset
+MSG_LATE = 5
+
+# Forward jump of the MSG counter taken as a reset rather than missed packets,
+# e.g. a corrupted counter or a node id reused by another node
+MSG_MAX_JUMP = 100000
+
+_log = logging.getLogger("EmonHub")
+
+
+class MessageCounter:
+    """Missed packet count per node from the MSG counter, shared by all interfacers"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # By node: [first msg, last msg, missed, bit mask of the last MSG_HISTORY msgs received,
+        #           time last msg was received]
+        self._nodes = {}
+
+    def update(self, node, msg, now=None):
+        """Record msg received for node, return (missed, missed percentage)"""
+        msg = int(msg)
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            state = self._nodes.get(node)
+            if state is None or msg - state[1] > MSG_MAX_JUMP \
+                    or msg < state[1] and (msg <= state[1] - MSG_HISTORY or now - state[4] > MSG_LATE):
+                # First packet, or counter reset by a node restart
+                state = self._nodes[node] = [msg, msg - 1, 0, 0, now]
+
+            first, last, missed, received, timestamp = state
+            if msg > last:
+                if msg - last < MSG_HISTORY:
+                    received = ((received << (msg - last)) | 1) & ((1 << MSG_HISTORY) - 1)
+                else:
+                    received = 1
+                missed += msg - last - 1
+                last = msg
+                timestamp = now
+            else:
+                bit = 1 << (last - msg)
+                if not received & bit and msg >= first:
+                    # Counted as missed, received late through another gateway
+                    received |= bit
+                    missed = max(missed - 1, 0)
+            state[:] = [first, last, missed, received, timestamp]
+
+            msgcount = last - first
+            if msgcount:
+                return missed, 100.0 * missed / msgcount
+            return missed, 0
+
+
+message_counter = MessageCounter()
+
+
+class FrameDeduplicator:
+    """Time-bounded index of the frames recently published on each channel
+
+    window (float): seconds during which a copy of a frame is dropped
+    hold (float): seconds a frame is held, waiting for a copy with a better RSSI
+    max_entries (int): upper bound of the index size
+
+    """
+
+    def __init__(self, window=2.0, hold=0.5, max_entries=4096):
+        self.window = float(window)
+        self.hold = float(hold)
+        self.max_entries = max_entries
+
+        # By key, in order of arrival: [arrival time, cargo while held or None once released,
+        #                               sources of the copies]
+        self._index = OrderedDict()
+        self._held = deque()
+
+        self.stats = {'frames': 0, 'duplicates': 0, 'replaced': 0}
+        self._stats_timestamp = time.time()
+
+    @staticmethod
+    def key(channel, cargo):
+        """Return the identity of a frame on a channel"""
+        if cargo.names and cargo.realdata and str(cargo.names[0]).upper() == "MSG":
+            return (channel, cargo.nodeid, 'msg', cargo.realdata[0])
+        try:
+            return (channel, cargo.nodeid, hash(tuple(cargo.realdata)))
+        except TypeError:
+            return (channel, cargo.nodeid, repr(cargo.realdata))
+
+    def submit(self, channel, cargo, source=None, now=None):
+        """Add a frame published on channel, copies of a known frame are dropped
+
+        source (string): interfacer that received the frame, a frame is not a
+        copy of a frame from the same source
+
+        """
+        if now is None:
+            now = time.monotonic()
+        self.stats['frames'] += 1
+        frame = self.key(channel, cargo)
+        # The nth identical frame of a source is a copy of the nth of another source
+        n = 0
+        while True:
+            key = frame + (n,)
+            entry = self._index.get(key)
+            if entry is None or now - entry[0] > self.window:
+                break
+            if source is None or source not in entry[2]:
+                entry[2].add(source)
+                self.stats['duplicates'] += 1
+                held = entry[1]
+                # RSSI is negative dBm, 0 when unknown
+                if held is not None and cargo.rssi and (not held.rssi or cargo.rssi > held.rssi):
+                    entry[1] = cargo
+                    self.stats['replaced'] += 1
+                return
+            n += 1
+
+        self._index[key] = [now, cargo, {source}]
+        self._index.move_to_end(key)
+        self._held.append((key, channel))
+
+    def ready(self, now=None):
+        """Return [(channel, cargo)] of the frames held long enough, oldest first"""
+        if now is None:
+            now = time.monotonic()
+        released = []
+        while self._held:
+            key, channel = self._held[0]
+            entry = self._index.get(key)
+            if entry is None or entry[1] is None:
+                # Evicted or released already
+                self._held.popleft()
+                continue
+            if now - entry[0] < self.hold:
+                break
+            self._held.popleft()
+            released.append((channel, entry[1]))
+            entry[1] = None
+
+        # Evict the frames older than the window, and the oldest if over the bound
+        index = self._index
+        while index:
+            key, entry = next(iter(index.items()))
+            if now - entry[0] <= self.window and len(index) <= self.max_entries:
+                break
+            if entry[1] is not None:
+                released.append((key[0], entry[1]))
+            index.popitem(last=False)
+
+        if time.time() - self._stats_timestamp > DEDUP_STATS_INTERVAL:
+            self._stats_timestamp = time.time()
+            _log.debug("Deduplication: %d frames, %d duplicates dropped, %d replaced by a better RSSI copy",
+                       self.stats['frames'], self.stats['duplicates'], self.stats['replaced'])
+        return released
@@ -0,0 +1,156 @@
+"""
+
+  This code is released under the GNU Affero General Public License.
+
+  OpenEnergyMonitor project:
+  http://openenergymonitor.org
+
+"""
+
+import ast
+import math
+import logging
+
+"""Derived inputs
+
+Inputs computed from the other inputs of a frame, set per node in the nodes
+section of emonhub.conf:
+
+    [[28]]
+        nodename = heatpump
+        [[[rx]]]
+            names = FlowT, ReturnT, FlowRate, elec
+        [[[derived]]]
+            heat = 4150 * (FlowT - ReturnT) * FlowRate / 3.6
+            cop = heat / elec if elec > 0 else 0
+
+Each expression is an arithmetic expression over the input names of the node
+and the derived inputs above it. The results are appended to the names and
+values of the frame in order. Expressions are checked and compiled once to
+Python code objects, evaluating them for a frame doesn't parse anything.
+
+Allowed in expressions: numbers, input names, + - * / // % **, comparisons,
+and, or, not, x if condition else y, and the functions in FUNCTIONS.
+
+"""
+
+FUNCTIONS = {
+    'abs': abs,
+    'min': min,
+    'max': max,
+    'round': round,
+    'sqrt': math.sqrt,
+    'exp': math.exp,
+    'log': math.log,
+    'log10': math.log10,
+    'sin': math.sin,
+    'cos': math.cos,
+    'atan2': math.atan2,
+    'pi': math.pi,
+}
+
+_ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.IfExp,
+    ast.Call, ast.Name, ast.Load, ast.Constant,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+    ast.UAdd, ast.USub, ast.Not, ast.And, ast.Or,
+    ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE,
+)
+
+_log = logging.getLogger("EmonHub")
+
+# Compiled code objects by expression
+_compiled = {}
+
+# By node: (derived section, [(name, code object)])
+_nodes = {}
+
+# Globals of the evaluated expressions, no builtins
+_globals = dict(FUNCTIONS, __builtins__={})
+
+
+class DerivedInputError(Exception):
+    """Raised when an expression is not valid"""
+    pass
+
+
+def compile_expression(expression):
+    """Check an expression and return its code object, raises DerivedInputError"""
+    code = _compiled.get(expression)
+    if code is not None:
+        return code
+
+    try:
+        tree = ast.parse(expression.strip(), mode='eval')
+    except SyntaxError as e:
+        raise DerivedInputError("invalid expression '%s': %s" % (expression, e.msg))
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            raise DerivedInputError("'%s' not allowed in expression '%s'" % (type(node).__name__, expression))
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+            raise DerivedInputError("only numbers are allowed as constants in expression '%s'" % expression)
+        if isinstance(node, ast.Call) and (not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS
+                                           or node.keywords):
+            raise DerivedInputError("only %s can be called in expression '%s'" % (", ".join(FUNCTIONS), expression))
+
+    code = compile(tree, '<derived>', 'eval')
+    _compiled[expression] = code
+    return code
+
+
+def get_expressions(node, node_settings):
+    """Return [(name, code object)] for the derived section of a node
+
+    The expressions are compiled again only when the section changes, invalid
+    expressions are logged and skipped.
+
+    """
+    derived = node_settings.get('derived') if node_settings else None
+    if not derived:
+        return []
+
+    cached = _nodes.get(node)
+    if cached is not None and cached[0] == derived:
+        return cached[1]
+
+    expressions = []
+    for name, expression in derived.items():
+        # configobj splits unquoted values on commas, e.g. max(a, b)
+        if isinstance(expression, (list, tuple)):
+            expression = ", ".join(expression)
+        try:
+            expressions.append((name, compile_expression(str(expression))))
+        except DerivedInputError as e:
+            _log.error("Node %s derived input %s: %s", node, name, e)
+    _nodes[node] = (dict(derived), expressions)
+    return expressions
+
+
+def derive(cargo, expressions):
+    """Append the derived inputs of expressions to the names and values of cargo
+
+    Expressions that can't be evaluated for this frame, e.g. if an input is
+    missing or on division by zero, are left out.
+
+    """
+    if len(cargo.names) != len(cargo.realdata):
+        return cargo
+
+    inputs = dict(zip(cargo.names, cargo.realdata))
+    names = []
+    values = []
+    for name, code in expressions:
+        try:
+            value = eval(code, _globals, inputs)
+        except (NameError, ArithmeticError, ValueError, TypeError) as e:
+            _log.debug("%s derived input %s not computed: %s", cargo.uri, name, e)
+            continue
+        inputs[name] = value
+        names.append(name)
+        values.append(value)
+
+    if names:
+        # The lists may be shared, e.g. with the interfacer that made the cargo
+        cargo.names = cargo.names + names
+        cargo.realdata = cargo.realdata + values
+    return cargo
@@ -0,0 +1,220 @@
+"""
+
+  This code is released under the GNU Affero General Public License.
+
+  OpenEnergyMonitor project:
+  http://openenergymonitor.org
+
+"""
+
+import time
+import logging
+import threading
+import concurrent.futures
+from urllib.parse import urlsplit
+
+import requests
+
+import emonhub_json
+
+"""Shared HTTP polling
+
+Interfacers that poll a cloud or LAN JSON API declare the endpoints they
+read and fetch them through an HttpPoller:
+
+    self._http = emonhub_http.HttpPoller(self.name)
+    self._endpoints = [emonhub_http.Endpoint('status', 'http://192.168.1.10/api/status', ttl=5)]
+    ...
+    responses = self._http.fetch(self._endpoints)
+    status = responses['status']
+
+Requests to a host go through one keep-alive requests.Session shared by the
+whole process. GET responses carrying an ETag or Last-Modified header are
+kept and the next request for the same endpoint is made conditional, a 304
+reply returns the kept body. JSON bodies are decoded with emonhub_json.loads.
+An endpoint with a ttl is not requested again
+until its last response is ttl seconds old. The endpoints of one fetch are
+requested concurrently, and the latency of every endpoint is recorded in
+HttpPoller.stats.
+
+"""
+
+# Default request timeout in seconds
+HTTP_TIMEOUT = 10
+
+# Maximum number of requests in flight for the whole process
+HTTP_MAX_WORKERS = 8
+
+# Interval in seconds between endpoint metrics reports in the log
+HTTP_STATS_INTERVAL = 300
+
+_log = logging.getLogger("EmonHub")
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_executor = None
+
+
+class Endpoint:
+    """An HTTP endpoint read by an interfacer
+
+    name: key of the response in the dict returned by HttpPoller.fetch()
+    url: full URL of the endpoint
+    method: 'GET' or 'POST'
+    ttl (float): seconds a response is reused without a new request, 0 always requests
+    parse: 'json' to decode the body as JSON, 'text' to return it as a string
+    timeout (float): request timeout in seconds, defaults to the poller timeout
+    Other keyword arguments (auth, headers, data, verify...) are passed to requests.
+
+    """
+
+    def __init__(self, name, url, method='GET', ttl=0, parse='json', timeout=None, **kwargs):
+        self.name = name
+        self.url = url
+        self.method = method.upper()
+        self.ttl = float(ttl)
+        self.parse = parse
+        self.timeout = timeout
+        self.kwargs = kwargs
+
+    def __repr__(self):
+        return "Endpoint(%s, %s %s)" % (self.name, self.method, self.url)
+
+
+def get_session(url):
+    """Return the keep-alive session for the scheme, host and port of url"""
+    parts = urlsplit(url)
+    key = (parts.scheme, parts.netloc)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_MAX_WORKERS)
+            session.mount(parts.scheme + "://", adapter)
+            _sessions[key] = session
+    return session
+
+
+def _get_executor():
+    global _executor
+    with _sessions_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(max_workers=HTTP_MAX_WORKERS,
+                                                              thread_name_prefix="http")
+    return _executor
+
+
+class HttpPoller:
+    """Fetches the endpoints of one interfacer, keeping its response cache and metrics
+
+    owner: name of the interfacer, used in log messages
+    timeout (float): default request timeout in seconds
+
+    """
+
+    def __init__(self, owner, timeout=HTTP_TIMEOUT):
+        self.owner = owner
+        self.timeout = timeout
+
+        # By endpoint name: (time, etag, last modified, value)
+        self._cache = {}
+
+        # By endpoint name: requests, errors, not modified and cached
+        # replies, last, average and maximum latency in seconds
+        self.stats = {}
+        self._stats_timestamp = time.time()
+
+    def request(self, method, url, timeout=None, **kwargs):
+        """Make a single request on the shared session for url and return the response"""
+        if timeout is None:
+            timeout = self.timeout
+        return get_session(url).request(method, url, timeout=timeout, **kwargs)
+
+    def _stats(self, name):
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = {'requests': 0, 'errors': 0, 'not_modified': 0, 'cached': 0,
+                                        'latency': 0.0, 'latency_avg': 0.0, 'latency_max': 0.0}
+        return stats
+
+    def _fetch_one(self, endpoint):
+        stats = self._stats(endpoint.name)
+        cached = self._cache.get(endpoint.name)
+        now = time.monotonic()
+        if cached is not None and endpoint.ttl and now - cached[0] < endpoint.ttl:
+            stats['cached'] += 1
+            return cached[3]
+
+        kwargs = dict(endpoint.kwargs)
+        if endpoint.method == 'GET' and cached is not None:
+            headers = dict(kwargs.get('headers') or {})
+            if cached[1]:
+                headers['If-None-Match'] = cached[1]
+            if cached[2]:
+                headers['If-Modified-Since'] = cached[2]
+            kwargs['headers'] = headers
+
+        stats['requests'] += 1
+        try:
+            reply = self.request(endpoint.method, endpoint.url, endpoint.timeout, **kwargs)
+            latency = time.monotonic() - now
+            stats['latency'] = latency
+            stats['latency_max'] = max(stats['latency_max'], latency)
+            if stats['latency_avg']:
+                stats['latency_avg'] += 0.1 * (latency - stats['latency_avg'])
+            else:
+                stats['latency_avg'] = latency
+
+            if reply.status_code == 304 and cached is not None:
+                stats['not_modified'] += 1
+                self._cache[endpoint.name] = (now,) + cached[1:]
+                return cached[3]
+
+            reply.raise_for_status()
+            if endpoint.parse == 'json':
+                value = emonhub_json.loads(reply.content)
+            else:
+                value = reply.text
+        except Exception:
+            stats['errors'] += 1
+            raise
+
+        etag = reply.headers.get('ETag')
+        last_modified = reply.headers.get('Last-Modified')
+        if endpoint.ttl or etag or last_modified:
+            self._cache[endpoint.name] = (now, etag, last_modified, value)
+        return value
+
+    def fetch(self, endpoints):
+        """Fetch endpoints, concurrently when there are several
+
+        Returns {endpoint name: decoded response}. If a request fails the
+        exception of the first failed endpoint is raised (requests exceptions,
+        or ValueError if the body is not valid JSON).
+
+        """
+        if time.time() - self._stats_timestamp > HTTP_STATS_INTERVAL:
+            self._stats_timestamp = time.time()
+            self.log_stats()
+
+        if len(endpoints) == 1:
+            return {endpoints[0].name: self._fetch_one(endpoints[0])}
+
+        futures = [(endpoint, _get_executor().submit(self._fetch_one, endpoint)) for endpoint in endpoints]
+        responses = {}
+        error = None
+        for endpoint, future in futures:
+            try:
+                responses[endpoint.name] = future.result()
+            except Exception as e:
+                if error is None:
+                    error = e
+        if error is not None:
+            raise error
+        return responses
+
+    def log_stats(self):
+        for name, stats in sorted(self.stats.items()):
+            _log.debug("%s %s: %d requests, %d errors, %d not modified, %d cached, latency %.0f ms (avg %.0f, max %.0f)",
+                       self.owner, name, stats['requests'], stats['errors'], stats['not_modified'], stats['cached'],
+                       stats['latency'] * 1000, stats['latency_avg'] * 1000, stats['latency_max'] * 1000)
@@ -7,13 +7,19 @@
 
 """
 
+import math
 import time
+import random
 import logging
 import threading
 import traceback
 
 import emonhub_coder as ehc
+import emonhub_deadband as ehd
+import emonhub_derived as ehdv
+import emonhub_dedup as ehdd
 import emonhub_buffer as ehb
+import emonhub_memo as ehm
 import emonhub_auto_conf as eha
 """class EmonHubInterfacer
 
@@ -30,7 +36,7 @@ def log_exceptions_from_class_method(func):
         try:
             return func(*args)
         except Exception:
-            self._log.warning("Exception caught in " + self.name + " thread. " + traceback.format_exc())
+            self._log.warning("Exception caught in %s thread. %s", self.name, traceback.format_exc())
     return wrapper
 
 class EmonHubInterfacer(threading.Thread):
@@ -53,7 +59,12 @@ class EmonHubInterfacer(threading.Thread):
                           'pubchannels': [],
                           'subchannels': [],
                           'batchsize': '1',
-                          'nodelistonly': False
+                          'nodelistonly': False,
+                          'read_phase': 0,
+                          'read_jitter': 0,
+                          'deadband': 'off',
+                          'deadband_inputs': [],
+                          'deadband_heartbeat': 300
                           }
 
         self.init_settings = {}
@@ -74,8 +85,15 @@ class EmonHubInterfacer(threading.Thread):
         buffer_type = "memory"
         buffer_size = 1000
 
+        # Interfacers that only format the frames they buffer read them from the
+        # log of their subchannels shared with the other subscribers, see shared_log
+        if ehb.shared_logs_enabled() and type(self).add is EmonHubInterfacer.add:
+            buffer_type = "log"
+
         # Create underlying buffer implementation
         self.buffer = ehb.getBuffer(buffer_type)(name, buffer_size)
+        if buffer_type == "log":
+            self.buffer.formatter = self._format_logged
 
         # set an absolute upper limit for number of items to process per post
         # number of items posted is the lower of this item limit, buffer_size, or the
@@ -85,11 +103,15 @@ class EmonHubInterfacer(threading.Thread):
         # create a stop
         self.stop = False
         
-        self.first_msg = {}
-        self.last_msg = {}
-        self.missed = {}
         self.rx_msg = {}
 
+        # Polling deadlines and metrics, by poll key (see _poll_due)
+        self._polls = {}
+        self.poll_stats = {}
+
+        # Report by exception filter of the frames received, see the deadband settings
+        self._deadband = None
+
     @log_exceptions_from_class_method
     def run(self):
         """
@@ -106,6 +128,8 @@ class EmonHubInterfacer(threading.Thread):
                 if rxc:
                     rxc = self._process_rx(rxc)
                     if rxc:
+                        self._derive(rxc)
+
                         for channel in self._settings["pubchannels"]:
                             self._log.debug("%d Sent to channel(start)' : %s", rxc.uri, channel)
 
@@ -125,18 +149,142 @@ class EmonHubInterfacer(threading.Thread):
                     for _ in range(len(self._sub_channels[channel])):
                         # FIXME pop(0) has O(n) complexity. Can we use pop's default of last?
                         frame = self._sub_channels[channel].pop(0)
+                        if self._deadband:
+                            frame = self._filter(frame)
+                            if not frame:
+                                continue
                         self.add(frame)
 
-            # Don't loop too fast
-            time.sleep(0.1)
+            # Don't loop too fast, if only polling sleep until the next poll is due
+            self._wait_for_input(self._loop_timeout())
             # Action reporter tasks
             self.action()
 
+    def _loop_timeout(self):
+        """Return how long the run loop can sleep, in seconds"""
+        if not self._polls or len(self._settings["subchannels"]):
+            return 0.1
+        deadline = min(poll['deadline'] for poll in self._polls.values())
+        # Wake at least once a second to notice stop and settings changes
+        return min(max(deadline - time.monotonic(), 0.01), 1.0)
+
+    def _poll_due(self, interval, key='read', immediate=False):
+        """Return True when the poll identified by key is due, and schedule the next one
+
+        interval (float): seconds between polls
+        key (str): identifies the poll, e.g. one key per meter on a bus
+        immediate (bool): poll at once the first time rather than at the first slot
+
+        Polls are due on deadlines at multiples of interval in wall-clock time, offset
+        by the read_phase setting and each delayed by a random 0 to read_jitter seconds
+        so that interfacers sharing a bus or server don't all poll at the same moment.
+        Deadlines are kept on the monotonic clock. When a poll is late by more than an
+        interval the skipped deadlines are counted as missed in poll_stats.
+
+        """
+        interval = float(interval)
+        now = time.monotonic()
+        params = (interval, float(self._settings['read_phase']), min(float(self._settings['read_jitter']), interval))
+        poll = self._polls.get(key)
+        if poll is None or poll['params'] != params:
+            # First slot after now, aligned in wall-clock time
+            nominal = now + interval - (time.time() - params[1]) % interval
+            poll = {'params': params, 'nominal': nominal, 'deadline': nominal + random.uniform(0, params[2])}
+            if immediate and key not in self._polls:
+                poll['deadline'] = now
+            self._polls[key] = poll
+
+        if now < poll['deadline']:
+            return False
+
+        late = now - poll['deadline']
+        missed = 0
+        if now >= poll['nominal']:
+            slots = int((now - poll['nominal']) // interval) + 1
+            poll['nominal'] += slots * interval
+            missed = slots - 1
+        poll['deadline'] = poll['nominal'] + random.uniform(0, params[2])
+
+        stats = self.poll_stats.setdefault(key, {'polls': 0, 'missed': 0, 'drift': 0.0, 'drift_max': 0.0})
+        stats['polls'] += 1
+        stats['missed'] += missed
+        stats['drift'] = late
+        stats['drift_max'] = max(stats['drift_max'], late)
+        if missed:
+            self._log.warning("%s poll %s %0.1f s late, %d deadlines missed (%d in total)",
+                              self.name, key, late, missed, stats['missed'])
+        return True
+
+    def _poll_retry(self, seconds, key='read'):
+        """Make the poll identified by key due again in seconds, e.g. after an error"""
+        poll = self._polls.get(key)
+        if poll is None:
+            return
+        poll['deadline'] = time.monotonic() + seconds
+        # Slots skipped on purpose are not missed
+        interval = poll['params'][0]
+        if poll['nominal'] < poll['deadline']:
+            poll['nominal'] += math.ceil((poll['deadline'] - poll['nominal']) / interval) * interval
+
+    def _poll_reset(self, key=None):
+        """Forget the deadline of one poll, or of all polls"""
+        if key is None:
+            self._polls.clear()
+        else:
+            self._polls.pop(key, None)
+
+    def _wait_for_input(self, timeout):
+        """Pause the run loop between iterations.
+
+        Interfacers that receive data asynchronously can override this to
+        return as soon as new input is available.
+
+        timeout (float): maximum time to wait in seconds
+
+        """
+        time.sleep(timeout)
+
+    def uses_shared_log(self):
+        """Return True if the frames of the subchannels are read from the shared logs"""
+        return isinstance(self.buffer, ehb.SharedLogBuffer)
+
     def add(self, cargo):
         """Append data to buffer.
 
         data (list): node and values (eg: '[node,val1,val2,...]')
 
+        """
+        self.buffer.storeItem(self._format(cargo))
+
+    def _format_logged(self, cargo):
+        """Return the buffered frame of a cargo read from a shared log, None if filtered out"""
+        if self._deadband:
+            cargo = self._filter(cargo)
+            if not cargo:
+                return None
+        return self._format(cargo)
+
+    def _filter(self, cargo):
+        """Return the cargo passed on by the deadband filter, None if filtered out"""
+        filtered = self._deadband.filter(cargo, self._sends_names())
+        if filtered is not cargo:
+            # Values shared with the other subscribers are not used, see emonhub_memo
+            ehm.memo.skip(cargo.uri, self.name)
+        return filtered
+
+    def _sends_names(self):
+        """Return True if the output identifies values by name rather than position
+
+        The deadband filter only drops the unchanged values of a frame when it does.
+
+        """
+        return False
+
+    def _format(self, cargo):
+        """Return the frame of a cargo as stored in the buffer and passed to _process_post
+
+        Interfacers posting another format override this rather than add().
+
         """
 
         # Create a frame of data in "emonCMS format"
@@ -166,7 +314,7 @@ class EmonHubInterfacer(threading.Thread):
 
         # databuffer format can be overwritten by interfacer
 
-        self.buffer.storeItem(f)
+        return f
 
     def read(self):
         """Read raw data from interface and pass for processing.
@@ -236,6 +384,12 @@ class EmonHubInterfacer(threading.Thread):
         """
         pass
 
+    def _derive(self, cargo):
+        """Append the derived inputs set for the node in the nodes section"""
+        expressions = ehdv.get_expressions(cargo.nodeid, ehc.nodelist.get(str(cargo.nodeid)))
+        if expressions:
+            ehdv.derive(cargo, expressions)
+
     def _process_rx(self, cargo):
         """Process a frame of data
 
@@ -282,7 +436,7 @@ class EmonHubInterfacer(threading.Thread):
         if eha.auto_conf_enabled and not node in ehc.nodelist:
             match = eha.match_from_available(rxc.nodeid,rxc.realdata)
             if match:
-                self._log.debug("Match found: "+str(match));
+                self._log.debug("Match found: %s", match)
                 # Assign node to nodelist
                 ehc.nodelist[node] = eha.available[match].copy()
                 ehc.nodelist[node]['nodename'] = match+"_"+str(node)
@@ -418,29 +572,11 @@ class EmonHubInterfacer(threading.Thread):
             names = ehc.nodelist[node]['rx']['names'].copy()
         rxc.names = names
          
-        # Count missed packets
+        # Count missed packets, across all the gateways receiving the node
         if len(names) and names[0].upper()=="MSG":
-            msg = rxc.realdata[0]
-            if not node in self.last_msg: 
-                self.first_msg[node] = msg
-                self.last_msg[node] = msg-1
-                self.missed[node] = 0
-                
-            if self.last_msg[node]>msg:
-                self.first_msg[node] = msg
-                self.last_msg[node] = msg-1
-                self.missed[node] = 0
-
-            self.missed[node] += msg - self.last_msg[node] - 1
-            self.last_msg[node] = msg
-            
-            msgcount = msg - self.first_msg[node]
-            if msgcount:
-                missedprc = 100.0 * self.missed[node] / msgcount;
-            else: 
-                missedprc = 0
-            
-            rxc.realdata.append(self.missed[node])
+            missed, missedprc = ehdd.message_counter.update(node, rxc.realdata[0])
+
+            rxc.realdata.append(missed)
             rxc.names.append('missed')
             rxc.realdata.append(missedprc)
             rxc.names.append('missedprc')
@@ -638,15 +774,70 @@ class EmonHubInterfacer(threading.Thread):
                 setting = str(setting).lower() == "true"
             elif key == 'nodelistonly' and str(setting).lower() in ['true', 'false','1','0']:
                 setting = str(setting).lower() == "true" or str(setting).lower() == "1"
+            elif key in ['read_phase', 'read_jitter']:
+                try:
+                    setting = float(setting)
+                except ValueError:
+                    self._log.warning("In interfacer set '%s' is not a valid number for %s: %s", setting, self.name, key)
+                    continue
+            elif key == 'deadband':
+                setting = str(setting).strip().lower()
+                if setting not in ['', 'off']:
+                    try:
+                        ehd.parse_threshold(setting)
+                    except ValueError:
+                        self._log.warning("In interfacer set '%s' is not a valid threshold for %s: %s", setting, self.name, key)
+                        continue
+            elif key == 'deadband_inputs':
+                if isinstance(setting, str):
+                    setting = [setting]
+                try:
+                    self._parse_deadband_inputs(setting)
+                except ValueError:
+                    self._log.warning("In interfacer set '%s' is not valid for %s: %s", setting, self.name, key)
+                    continue
+            elif key == 'deadband_heartbeat':
+                try:
+                    setting = float(setting)
+                except ValueError:
+                    self._log.warning("In interfacer set '%s' is not a valid number for %s: %s", setting, self.name, key)
+                    continue
             elif key == 'pubchannels':
                 pass
             elif key == 'subchannels':
-                pass
+                if self.uses_shared_log():
+                    self.buffer.subscribe(setting)
             else:
                 self._log.warning("In interfacer set '%s' is not a valid setting for %s: %s", setting, self.name, key)
                 continue
             self._settings[key] = setting
             self._log.debug("Setting %s %s: %s", self.name, key, setting)
+            if key.startswith('deadband'):
+                self._set_deadband()
+
+    @staticmethod
+    def _parse_deadband_inputs(entries):
+        """Return {input name: threshold} from 'name:threshold' entries, raises ValueError"""
+        inputs = {}
+        for entry in entries:
+            name, sep, threshold = str(entry).rpartition(':')
+            if not sep or not name.strip():
+                raise ValueError("invalid entry '%s'" % entry)
+            ehd.parse_threshold(threshold)
+            inputs[name.strip()] = threshold.strip()
+        return inputs
+
+    def _set_deadband(self):
+        """Create the deadband filter from the settings, or remove it if disabled"""
+        threshold = self._settings['deadband']
+        inputs = self._parse_deadband_inputs(self._settings['deadband_inputs'])
+        if threshold in ['', 'off']:
+            if not inputs:
+                self._deadband = None
+                return
+            # Only the listed inputs are filtered
+            threshold = None
+        self._deadband = ehd.DeadbandFilter(threshold, inputs, self._settings['deadband_heartbeat'])
 
 
 """class EmonHubInterfacerInitError
@@ -0,0 +1,194 @@
+"""
+
+  This code is released under the GNU Affero General Public License.
+
+  OpenEnergyMonitor project:
+  http://openenergymonitor.org
+
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+"""JSON payload decoding and value extraction
+
+Interfacers reading JSON documents (HTTP APIs, MQTT or Redis messages)
+describe the values they publish with an extraction spec rather than walking
+the decoded document by hand. Each entry of a spec is a string:
+
+    path[:name[:scale[:type]]]
+
+path: keys separated by dots, list indexes in brackets, e.g. site.meters[0].power
+      A last key of * selects every item of a dict, the item keys being used as
+      names, prefixed with name if one is given.
+name: name of the published input, defaults to the last key of path
+scale: factor applied to the value, e.g. 0.001 to publish kW from W
+type: 'float', 'int' or 'bool' (published as 1 or 0), values are left as
+      decoded by default
+
+    extractor = emonhub_json.JsonExtractor(["percentage:soc", "load.instant_power:load:0.001"])
+    names, values, missing = extractor.extract(emonhub_json.loads(payload))
+
+A spec is compiled once into one accessor per entry, so extraction only costs
+the lookups and conversions themselves. Documents are decoded with orjson
+when it is installed, falling back to the standard json module.
+
+"""
+
+
+def loads(data):
+    """Decode a JSON document from bytes or str, raises ValueError if invalid"""
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def parse_path(path):
+    """Split a path into its keys, list indexes converted to int
+
+    'a.b[0].c' -> ['a', 'b', 0, 'c']
+
+    """
+    keys = []
+    for part in path.strip().split('.'):
+        key, _, indexes = part.partition('[')
+        if key:
+            keys.append(key)
+        if indexes:
+            for index in indexes.rstrip(']').split(']['):
+                keys.append(int(index))
+        elif not key:
+            raise ValueError("Empty key in path '%s'" % path)
+    if not keys:
+        raise ValueError("Empty path")
+    return keys
+
+
+def _accessor(keys):
+    """Return a function getting keys from a document, raising LookupError or TypeError"""
+    if len(keys) == 1:
+        k0, = keys
+        return lambda doc: doc[k0]
+    if len(keys) == 2:
+        k0, k1 = keys
+        return lambda doc: doc[k0][k1]
+    if len(keys) == 3:
+        k0, k1, k2 = keys
+        return lambda doc: doc[k0][k1][k2]
+
+    def get(doc):
+        for key in keys:
+            doc = doc[key]
+        return doc
+    return get
+
+
+def _converter(scale, datatype):
+    """Return a function applying type and scale to a value, None if there is nothing to do"""
+    if datatype == 'bool':
+        if scale != 1:
+            return lambda value: int(bool(value)) * scale
+        return lambda value: int(bool(value))
+    if datatype == 'int':
+        if scale != 1:
+            return lambda value: int(float(value) * scale)
+        return int
+    if scale != 1:
+        return lambda value: float(value) * scale
+    if datatype == 'float':
+        return float
+    return None
+
+
+class JsonExtractor:
+    """A compiled extraction spec
+
+    spec: list of entry strings (see module documentation) or a single
+          comma separated string
+
+    """
+
+    DATATYPES = ('', 'float', 'int', 'bool')
+
+    def __init__(self, spec):
+        if isinstance(spec, str):
+            spec = spec.split(',')
+
+        self.spec = []
+        self._fields = []
+        self._wildcards = []
+        for entry in spec:
+            entry = entry.strip()
+            if not entry:
+                continue
+            self._compile(entry)
+            self.spec.append(entry)
+
+    def __repr__(self):
+        return "JsonExtractor(%s)" % ", ".join(self.spec)
+
+    def __eq__(self, other):
+        return isinstance(other, JsonExtractor) and self.spec == other.spec
+
+    def _compile(self, entry):
+        parts = [part.strip() for part in entry.split(':')]
+        if len(parts) > 4:
+            raise ValueError("Invalid extraction entry '%s'" % entry)
+        parts += [''] * (4 - len(parts))
+        path, name, scale, datatype = parts
+
+        keys = parse_path(path)
+        scale = float(scale) if scale else 1
+        if datatype not in self.DATATYPES:
+            raise ValueError("Invalid type '%s' in extraction entry '%s'" % (datatype, entry))
+        convert = _converter(scale, datatype)
+
+        if keys[-1] == '*':
+            get = _accessor(keys[:-1]) if len(keys) > 1 else (lambda doc: doc)
+            prefix = name + "_" if name else ""
+            self._wildcards.append((path, get, prefix, convert))
+        else:
+            self._fields.append((path, _accessor(keys), name or str(keys[-1]), convert))
+
+    def extract(self, doc):
+        """Extract the values of the spec from a decoded document
+
+        Returns (names, values, missing), missing being the paths not found
+        in doc or whose value could not be converted.
+
+        """
+        names = []
+        values = []
+        missing = []
+        for path, get, name, convert in self._fields:
+            try:
+                value = get(doc)
+                if convert is not None:
+                    value = convert(value)
+            except (LookupError, TypeError, ValueError):
+                missing.append(path)
+                continue
+            names.append(name)
+            values.append(value)
+
+        for path, get, prefix, convert in self._wildcards:
+            try:
+                items = get(doc).items()
+            except (LookupError, TypeError, AttributeError):
+                missing.append(path)
+                continue
+            for key, value in items:
+                if convert is not None:
+                    try:
+                        value = convert(value)
+                    except (TypeError, ValueError):
+                        missing.append(path[:-1] + key)
+                        continue
+                names.append(prefix + key)
+                values.append(value)
+
+        return names, values, missing
@@ -0,0 +1,147 @@
+"""
+
+  This code is released under the GNU Affero General Public License.
+
+  OpenEnergyMonitor project:
+  http://openenergymonitor.org
+
+"""
+
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+
+"""Logging pipeline
+
+The interfacer threads log through a QueueHandler, writing to the log file
+or syslog is done by a QueueListener thread, so that a slow SD card doesn't
+hold up reading and posting data:
+
+    logger.addHandler(logging.handlers.RotatingFileHandler(...))
+    emonhub_logging.start(logger)
+
+Records go through a RateLimitFilter first: a message logged more than
+log_rate_limit times in log_rate_period seconds, e.g. the same connection
+error on every post attempt, is suppressed until the period is over, and a
+summary of the number suppressed is logged then. DEBUG messages, e.g. the
+frames received, are not limited.
+
+"""
+
+# Times a message is logged per period before it is suppressed
+RATE_LIMIT = 20
+RATE_PERIOD = 60
+# Distinct messages counted at most, the others are not limited
+RATE_MESSAGES = 1000
+
+
+class RateLimitFilter(logging.Filter):
+    """Passes a message at most limit times every period seconds, 0 no limit"""
+
+    def __init__(self, limit=RATE_LIMIT, period=RATE_PERIOD):
+        super().__init__()
+        self.limit = limit
+        self.period = period
+        self._lock = threading.Lock()
+        # By (level, message): [period start, records, records suppressed, logger name]
+        self._messages = {}
+        self._next_expiry = 0
+
+    def _expire(self, now):
+        """Return the summaries of the periods over, forget their messages"""
+        summaries = []
+        for key, counts in list(self._messages.items()):
+            if now - counts[0] >= self.period:
+                if counts[2]:
+                    summaries.append((counts[3], key[0], counts[2], key[1]))
+                del self._messages[key]
+        self._next_expiry = now + 1
+        return summaries
+
+    def _log_summaries(self, summaries):
+        for name, level, count, message in summaries:
+            logging.getLogger(name).log(level, "Suppressed %d similar messages: %s", count, message,
+                                        extra={'rate_limit_summary': True})
+
+    def filter(self, record):
+        if not self.limit or not logging.INFO <= record.levelno < logging.CRITICAL \
+                or getattr(record, 'rate_limit_summary', False):
+            return True
+
+        # Formatted once, the handlers use the message as is
+        record.msg = record.getMessage()
+        record.args = None
+
+        now = record.created
+        key = (record.levelno, record.msg)
+        with self._lock:
+            summaries = self._expire(now) if now >= self._next_expiry else []
+            counts = self._messages.get(key)
+            if counts is None:
+                if len(self._messages) >= RATE_MESSAGES:
+                    counts = [now, 0, 0, record.name]
+                else:
+                    counts = self._messages[key] = [now, 0, 0, record.name]
+            counts[1] += 1
+            passed = counts[1] <= self.limit
+            if not passed:
+                counts[2] += 1
+
+        # Logged outside of the lock, the summaries go through this filter too
+        self._log_summaries(summaries)
+        return passed
+
+    def flush(self):
+        """Log the summaries of every message suppressed"""
+        with self._lock:
+            summaries = self._expire(float('inf'))
+            self._next_expiry = 0
+        self._log_summaries(summaries)
+
+
+rate_limit = RateLimitFilter()
+
+_listener = None
+
+
+def start(logger):
+    """Move the handlers of logger behind a queue emptied by a background thread"""
+    global _listener
+    if _listener:
+        return
+    handlers = list(logger.handlers)
+    for handler in handlers:
+        logger.removeHandler(handler)
+
+    records = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(records)
+    queue_handler.addFilter(rate_limit)
+    logger.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop)
+
+
+def stop():
+    """Log the pending summaries and write the records queued"""
+    global _listener
+    rate_limit.flush()
+    if _listener:
+        _listener.stop()
+        _listener = None
+
+
+def handlers(logger):
+    """Return the handlers writing the records of logger"""
+    if _listener:
+        return list(_listener.handlers)
+    return list(logger.handlers)
+
+
+def set_rate_limit(limit, period):
+    """Set the times a message is logged per period, limit 0 disables"""
+    rate_limit.limit = int(limit)
+    rate_limit.period = float(period)
@@ -0,0 +1,184 @@
+"""
+
+  This code is released under the GNU Affero General Public License.
+
+  OpenEnergyMonitor project:
+  http://openenergymonitor.org
+
+"""
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+"""Serialization shared by the output interfacers
+
+When several output interfacers of the same type subscribe to a channel,
+e.g. a local and a remote emoncms, each of them builds the same frames,
+JSON strings and compressed bodies from the same cargos. They share them
+through memo instead:
+
+    memo.register(self.name, ('emoncms', sendnames))
+    frame = memo.get(cargo.uri, self.name, build)
+    body = memo.get_batch(frames, ('emoncms', sendnames), 'json', build)
+
+The key identifies the output format, the interfacers registered with the
+same key are the consumers of the values built for it. The hub tells the
+memo which interfacers receive a cargo before delivering it:
+
+    memo.expect(cargo.uri, [names of the interfacers subscribed to the channel])
+
+Each of them then calls get() once for the cargo, or skip() if it doesn't
+post it, e.g. when its deadband filter drops it. The value is built by the
+first consumer and dropped once every consumer that received the cargo has
+had it, or when the memo is full, the oldest first. A cargo received by a
+single consumer of a format is not kept.
+
+A batch is identified by the frames in it, the same frame objects, as
+returned by get() to the consumers. Batches are shared when the consumers
+post the same frames together, e.g. when they have the same batchsize and
+interval and none of them is catching up after a failure.
+
+"""
+
+# Interval in seconds between memo reports in the log
+MEMO_STATS_INTERVAL = 300
+
+# Value of an entry not built yet
+_MISSING = object()
+
+_log = logging.getLogger("EmonHub")
+
+
+class SerializationMemo:
+    """Values built from cargos, shared by the consumers of an output format
+
+    max_entries (int): cargos kept at most
+    max_batches (int): batches kept at most
+
+    """
+
+    def __init__(self, max_entries=10000, max_batches=16):
+        self.max_entries = max_entries
+        self.max_batches = max_batches
+        self._lock = threading.Lock()
+        # Key by consumer
+        self._consumers = {}
+        # By (uri, key): [value, consumers still to get it, consumers]
+        self._entries = OrderedDict()
+        # Consumers by id of the values shared, for the batches starting with them
+        self._shared = OrderedDict()
+        # By (key, kind, number of frames, id of the first): [frames, value, consumers still to get it]
+        self._batches = OrderedDict()
+
+        self.stats = {'hits': 0, 'misses': 0, 'batch_hits': 0, 'batch_misses': 0, 'evicted': 0}
+        self._stats_timestamp = time.time()
+
+    def register(self, consumer, key):
+        """Set the output format of consumer, e.g. an interfacer name"""
+        with self._lock:
+            self._consumers[consumer] = key
+
+    def unregister(self, consumer):
+        with self._lock:
+            self._consumers.pop(consumer, None)
+
+    def expect(self, uri, consumers):
+        """Record that the cargo of uri is delivered to consumers, call before delivering it"""
+        if not self._consumers:
+            return
+        with self._lock:
+            counts = {}
+            for consumer in consumers:
+                key = self._consumers.get(consumer)
+                if key is not None:
+                    counts[key] = counts.get(key, 0) + 1
+            for key, count in counts.items():
+                if count < 2:
+                    continue
+                entry = self._entries.get((uri, key))
+                if entry is not None:
+                    # Delivered on another channel too
+                    entry[1] += count
+                    entry[2] += count
+                    continue
+                self._entries[(uri, key)] = [_MISSING, count, count]
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.stats['evicted'] += 1
+
+    def _take(self, uri, consumer):
+        """Return the entry of the cargo of uri for consumer, counted as had, None if not shared"""
+        key = self._consumers.get(consumer)
+        entry = self._entries.get((uri, key))
+        if entry is not None:
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self._entries[(uri, key)]
+        return entry
+
+    def get(self, uri, consumer, build):
+        """Return the value for the cargo of uri in the format of consumer, build() if not built yet"""
+        with self._lock:
+            entry = self._take(uri, consumer)
+            if entry is not None and entry[0] is not _MISSING:
+                self.stats['hits'] += 1
+                return entry[0]
+        value = build()
+        if entry is not None:
+            # Kept for the other consumers, if they haven't built it too meanwhile
+            entry[0] = value
+            with self._lock:
+                self._shared[id(value)] = entry[2]
+                while len(self._shared) > self.max_entries:
+                    self._shared.popitem(last=False)
+        self.stats['misses'] += 1
+        self._log_stats()
+        return value
+
+    def skip(self, uri, consumer):
+        """Record that consumer won't get the value for the cargo of uri"""
+        with self._lock:
+            self._take(uri, consumer)
+
+    def get_batch(self, frames, key, kind, build):
+        """Return the value of kind for a batch of frames, build() if not built yet"""
+        if not frames:
+            return build()
+
+        def match(entry):
+            stored = entry[0]
+            return len(stored) == len(frames) and all(a is b for a, b in zip(stored, frames))
+
+        batch_key = (key, kind, len(frames), id(frames[0]))
+        with self._lock:
+            # Only the consumers of the first frame can post the same batch
+            consumers = self._shared.get(id(frames[0]), 1)
+            entry = self._batches.get(batch_key)
+            if entry is not None and match(entry):
+                entry[2] -= 1
+                if entry[2] <= 0:
+                    del self._batches[batch_key]
+                self.stats['batch_hits'] += 1
+                return entry[1]
+        value = build()
+        self.stats['batch_misses'] += 1
+        if consumers > 1:
+            with self._lock:
+                # The entry holds the frames, their ids can't be reused while it exists
+                self._batches[batch_key] = [list(frames), value, consumers - 1]
+                while len(self._batches) > self.max_batches:
+                    self._batches.popitem(last=False)
+                    self.stats['evicted'] += 1
+        return value
+
+    def _log_stats(self):
+        if time.time() - self._stats_timestamp > MEMO_STATS_INTERVAL:
+            self._stats_timestamp = time.time()
+            _log.debug("Serialization memo: %d frames shared, %d built, %d batches shared, %d built, %d evicted",
+                       self.stats['hits'], self.stats['misses'], self.stats['batch_hits'],
+                       self.stats['batch_misses'], self.stats['evicted'])
+
+
+memo = SerializationMemo()
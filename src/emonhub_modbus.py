@@ -0,0 +1,324 @@
+"""
+
+  This code is released under the GNU Affero General Public License.
+
+  OpenEnergyMonitor project:
+  http://openenergymonitor.org
+
+"""
+
+import os
+import time
+import heapq
+import logging
+import threading
+
+"""Shared Modbus transports
+
+A Modbus bus (a serial port with an RS485 adapter) or endpoint (a Modbus TCP
+host and port) only carries one request at a time. Several interfacers may
+poll devices on the same bus, so they don't open their own connection but
+share a ModbusTransport:
+
+    transport = emonhub_modbus.get_serial_transport(self.name, "/dev/ttyUSB0", 9600)
+    words = transport.request(self.name, lambda instrument: instrument.read_registers(0, 2))
+
+There is one transport, and one open connection, per bus or endpoint for the
+whole process. Interfacers detach from it when their thread stops, the
+connection is closed when the last one does. Requests wait in a priority queue until the bus is free, the
+RTU inter-frame gap is respected between requests of different interfacers,
+the bus time used by each interfacer is accounted for, and a connection that
+fails is reopened with a shared backoff rather than by every interfacer.
+
+"""
+
+# Request priorities, lower values are served first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+# Delay before reopening a failed connection, doubled on each failure
+TRANSPORT_RETRY = 10
+TRANSPORT_MAX_RETRY = 320
+
+# Interval in seconds between bus usage reports in the log
+TRANSPORT_STATS_INTERVAL = 300
+
+_log = logging.getLogger("EmonHub")
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+class ModbusTransportError(Exception):
+    """Raised when a request can't be sent because the bus is not connected"""
+    pass
+
+
+class ModbusTransport:
+    """One connection to a Modbus bus or endpoint, shared by all interfacers
+
+    key: identifies the bus, e.g. the serial device or (host, port)
+    open_connection: callable returning a new connection object, raises on failure
+    close_connection: callable closing a connection object
+    frame_gap (float): minimum silence in seconds between two requests
+    settings: connection settings, kept to detect conflicting users
+
+    """
+
+    def __init__(self, key, open_connection, close_connection, frame_gap=0.0, settings=None):
+        self.key = key
+        self.frame_gap = frame_gap
+        self.settings = settings
+        self._open_connection = open_connection
+        self._close_connection = close_connection
+
+        self._connection = None
+        self._failures = 0
+        self._next_attempt = 0
+        self._reset = False
+
+        # Attachments by interfacer name, an interfacer being replaced and its
+        # replacement have the same name
+        self._users = {}
+        self._lock = threading.Condition()
+        self._queue = []
+        self._sequence = 0
+        self._busy = False
+        self._last_request = 0
+
+        # Per interfacer: [requests, errors, bus time, wait time]
+        self._usage = {}
+        self._stats_timestamp = time.time()
+
+    def __repr__(self):
+        return "ModbusTransport(%s)" % (self.key,)
+
+    @property
+    def connected(self):
+        return self._connection is not None
+
+    def attach(self, owner):
+        """Start using the transport, called with _transports_lock held, see get_transport()"""
+        with self._lock:
+            self._users[owner] = self._users.get(owner, 0) + 1
+            self._usage.setdefault(owner, [0, 0, 0.0, 0.0])
+
+    def detach(self, owner):
+        """Stop using the transport, the connection is closed after the last user"""
+        with _transports_lock:
+            with self._lock:
+                if owner not in self._users:
+                    return
+                self._users[owner] -= 1
+                if self._users[owner] <= 0:
+                    del self._users[owner]
+                    self._usage.pop(owner, None)
+                if self._users:
+                    return
+                if _transports.get(self.key) is self:
+                    del _transports[self.key]
+        # Closed once the request in progress, if any, is done
+        with self._lock:
+            while self._busy:
+                self._lock.wait()
+            self._disconnect()
+            _log.info("Modbus %s closed", self.key)
+
+    def reconfigure(self, owner, open_connection, close_connection, frame_gap, settings):
+        """Use other connection settings, the connection is reopened before the next request"""
+        with self._lock:
+            if len(self._users) > 1:
+                _log.warning("%s: Modbus %s settings changed from %s to %s, for its other users too",
+                             owner, self.key, self.settings, settings)
+            else:
+                _log.info("%s: Modbus %s settings changed from %s to %s", owner, self.key, self.settings, settings)
+            self._open_connection = open_connection
+            self._close_connection = close_connection
+            self.frame_gap = frame_gap
+            self.settings = settings
+            self._reset = True
+            # Not waiting for a retry with the settings that failed
+            self._failures = 0
+            self._next_attempt = 0
+
+    def _connect(self):
+        """Open the connection if it's time to (re)try, called with the bus held"""
+        now = time.time()
+        if now < self._next_attempt:
+            raise ModbusTransportError("%s not connected, retry in %ds" % (self.key, self._next_attempt - now))
+        try:
+            self._connection = self._open_connection()
+        except Exception as e:
+            self._failures += 1
+            retry = min(TRANSPORT_RETRY * 2 ** (self._failures - 1), TRANSPORT_MAX_RETRY)
+            self._next_attempt = now + retry
+            if self._failures == 1:
+                _log.error("Could not connect to Modbus %s: %s (retry in %ds)", self.key, e, retry)
+            else:
+                _log.debug("Could not connect to Modbus %s: %s (retry in %ds)", self.key, e, retry)
+            raise ModbusTransportError("%s not connected" % (self.key,))
+        _log.info("Connected to Modbus %s", self.key)
+        self._failures = 0
+        self._next_attempt = 0
+
+    def _disconnect(self):
+        if self._connection is not None:
+            try:
+                self._close_connection(self._connection)
+            except Exception as e:
+                _log.debug("Error closing Modbus %s: %s", self.key, e)
+            self._connection = None
+
+    def invalidate(self, owner, reason=""):
+        """Report a link failure, the connection is reopened before the next request"""
+        if self._connection is not None and not self._reset:
+            _log.warning("Modbus %s connection reset by %s: %s", self.key, owner, reason)
+            self._reset = True
+
+    def request(self, owner, func, priority=PRIORITY_NORMAL):
+        """Run func(connection) with exclusive use of the bus
+
+        Requests are queued by priority, then in order of arrival.
+        Returns the return value of func, and raises its exceptions or
+        ModbusTransportError if the bus is not connected.
+
+        """
+        queued = time.time()
+        with self._lock:
+            self._sequence += 1
+            ticket = (priority, self._sequence)
+            heapq.heappush(self._queue, ticket)
+            while self._busy or self._queue[0] != ticket:
+                self._lock.wait()
+            heapq.heappop(self._queue)
+            self._busy = True
+            usage = self._usage.setdefault(owner, [0, 0, 0.0, 0.0])
+
+        start = time.time()
+        errors = 0
+        try:
+            if self._reset:
+                self._reset = False
+                self._disconnect()
+            if self._connection is None:
+                self._connect()
+            gap = self._last_request + self.frame_gap - time.time()
+            if gap > 0:
+                time.sleep(gap)
+            return func(self._connection)
+        except Exception:
+            errors = 1
+            raise
+        finally:
+            end = time.time()
+            self._last_request = end
+            with self._lock:
+                usage[0] += 1
+                usage[1] += errors
+                usage[2] += end - start
+                usage[3] += start - queued
+                self._busy = False
+                self._lock.notify_all()
+                report = None
+                if end - self._stats_timestamp > TRANSPORT_STATS_INTERVAL:
+                    report = (end - self._stats_timestamp, self._usage_counts())
+                    self._stats_timestamp = end
+                    for counts in self._usage.values():
+                        counts[:] = [0, 0, 0.0, 0.0]
+            if report:
+                self._log_usage(*report)
+
+    def _usage_counts(self):
+        return {owner: tuple(counts) for owner, counts in self._usage.items()}
+
+    def usage(self):
+        """Return {owner: (requests, errors, bus time, wait time)} since the last report"""
+        with self._lock:
+            return self._usage_counts()
+
+    def _log_usage(self, period, usage):
+        for owner, (requests, errors, bus_time, wait_time) in sorted(usage.items()):
+            _log.debug("Modbus %s %s: %d requests, %d errors, bus time %.1f%%, waited %.1fs",
+                       self.key, owner, requests, errors, 100.0 * bus_time / period, wait_time)
+
+
+def get_transport(owner, key, open_connection, close_connection, frame_gap=0.0, settings=None):
+    """Return the transport for key, creating it on first use
+
+    The transport is reconfigured if settings differ from those it was opened with.
+
+    """
+    with _transports_lock:
+        transport = _transports.get(key)
+        if transport is None:
+            transport = ModbusTransport(key, open_connection, close_connection, frame_gap, settings)
+            _transports[key] = transport
+        elif transport.settings != settings:
+            transport.reconfigure(owner, open_connection, close_connection, frame_gap, settings)
+        # Attached under the lock, so that the last user detaching doesn't remove it meanwhile
+        transport.attach(owner)
+    return transport
+
+
+def get_serial_transport(owner, device, baud, parity="none", timeout=1.0):
+    """Return the shared transport for a Modbus RTU serial bus
+
+    The connection is a minimalmodbus.Instrument, requests set its address
+    before each transaction. The serial settings of the last interfacer that
+    attached to a bus are used, a warning is logged if they change the settings
+    of other interfacers on the bus.
+
+    """
+    import minimalmodbus
+
+    key = os.path.realpath(device)
+    settings = (int(baud), str(parity).lower())
+
+    def open_connection():
+        instrument = minimalmodbus.Instrument(device, 1, close_port_after_each_call=False)
+        instrument.serial.baudrate = settings[0]
+        instrument.serial.bytesize = 8
+        instrument.serial.parity = {
+            'even': minimalmodbus.serial.PARITY_EVEN,
+            'odd': minimalmodbus.serial.PARITY_ODD,
+            'mark': minimalmodbus.serial.PARITY_MARK,
+            'space': minimalmodbus.serial.PARITY_SPACE
+        }.get(settings[1], minimalmodbus.serial.PARITY_NONE)
+        instrument.serial.stopbits = 1
+        instrument.serial.timeout = timeout
+        instrument.debug = False
+        instrument.mode = minimalmodbus.MODE_RTU
+        return instrument
+
+    def close_connection(instrument):
+        instrument.serial.close()
+
+    # Modbus RTU frames are separated by at least 3.5 characters of silence,
+    # fixed at 1.75 ms above 19200 baud
+    if settings[0] > 19200:
+        frame_gap = 0.00175
+    else:
+        frame_gap = 3.5 * 11 / settings[0]
+
+    return get_transport(owner, key, open_connection, close_connection, frame_gap, settings)
+
+
+def get_tcp_transport(owner, host, port=502, timeout=3.0):
+    """Return the shared transport for a Modbus TCP endpoint
+
+    The connection is a pymodbus ModbusTcpClient.
+
+    """
+    from pymodbus.client import ModbusTcpClient
+
+    def open_connection():
+        client = ModbusTcpClient(host, port=int(port), timeout=timeout)
+        if not client.connect():
+            raise ModbusTransportError("connection to %s:%s refused" % (host, port))
+        return client
+
+    def close_connection(client):
+        client.close()
+
+    return get_transport(owner, (host, int(port)), open_connection, close_connection)
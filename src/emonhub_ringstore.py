@@ -0,0 +1,359 @@
+"""
+
+  This code is released under the GNU Affero General Public License.
+
+  OpenEnergyMonitor project:
+  http://openenergymonitor.org
+
+"""
+
+import os
+import re
+import mmap
+import json
+import math
+import time
+import struct
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import unquote, urlsplit, parse_qs
+
+"""Ring store
+
+Fixed interval time series of the inputs of each node, kept on local storage
+so that recent history can be graphed when the network is down. Each input is
+a ring file of a fixed size, like an RRD:
+
+    <path>/<node>/<input>.ring
+
+    header      one 4096 bytes page: magic, version, step, slots
+    slots       16 bytes each: slot time (uint32), count (uint32), mean (float64)
+
+The value of slot time t is at index (t / step) % slots, so writing a value
+costs the same whatever the size of the file, and the file holds the last
+slots * step seconds. Values received within the same step are averaged.
+
+Values are appended to a RingStore in memory and written to the files by
+flush(), a batch at a time. The files are memory mapped, writing a batch
+dirties a few pages of each file and only those pages are synced, runs of
+consecutive pages together, so that an SD card sees a few page writes per
+input and batch rather than a write per value.
+
+"""
+
+MAGIC = b'EHRS'
+VERSION = 1
+
+# The header fills one page so that slots are page aligned
+HEADER_SIZE = 4096
+_HEADER = struct.Struct('<4sIII')
+_SLOT = struct.Struct('<IId')
+
+# Upper bound of the number of points returned by a query
+MAX_POINTS = 10000
+
+# Interval in seconds between write reports in the log
+RINGSTORE_STATS_INTERVAL = 300
+
+_log = logging.getLogger("EmonHub")
+
+
+class RingStoreError(Exception):
+    pass
+
+
+def _safe(name):
+    """Return name usable as a file name"""
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', str(name)).lstrip('.') or '_'
+
+
+class RingFile:
+    """One input, step seconds per slot"""
+
+    def __init__(self, path, step, slots):
+        self.path = path
+        exists = os.path.exists(path)
+        self._file = open(path, 'r+b' if exists else 'w+b')
+        try:
+            if exists:
+                magic, version, step, slots = _HEADER.unpack(self._file.read(_HEADER.size))
+                if magic != MAGIC or version != VERSION:
+                    raise RingStoreError("%s is not a ring file" % path)
+            else:
+                self._file.write(_HEADER.pack(MAGIC, VERSION, int(step), int(slots)))
+                # Sparse file, slots of time 0 are empty
+                self._file.truncate(HEADER_SIZE + int(slots) * _SLOT.size)
+            self.step = int(step)
+            self.slots = int(slots)
+            self._map = mmap.mmap(self._file.fileno(), HEADER_SIZE + self.slots * _SLOT.size)
+        except (OSError, struct.error, ValueError) as e:
+            self._file.close()
+            raise RingStoreError("unable to open %s: %s" % (path, e))
+        except RingStoreError:
+            self._file.close()
+            raise
+
+        # Pages written since the last sync
+        self._dirty = set()
+
+    def _offset(self, slot_time):
+        return HEADER_SIZE + (slot_time // self.step) % self.slots * _SLOT.size
+
+    def write(self, slot_time, total, count):
+        """Add count values summing to total to the slot of slot_time, return False if too old"""
+        slot_time = slot_time // self.step * self.step
+        offset = self._offset(slot_time)
+        stored_time, stored_count, mean = _SLOT.unpack_from(self._map, offset)
+        if stored_time > slot_time:
+            # Overwritten by newer values already
+            return False
+        if stored_time == slot_time:
+            total += mean * stored_count
+            count += stored_count
+        _SLOT.pack_into(self._map, offset, slot_time, count, total / count)
+        self._dirty.add(offset // mmap.PAGESIZE)
+        return True
+
+    def sync(self):
+        """Write the dirty pages to storage, return the number of pages"""
+        if not self._dirty:
+            return 0
+        pages = sorted(self._dirty)
+        self._dirty.clear()
+        start = previous = pages[0]
+        for page in pages[1:] + [None]:
+            if page != previous + 1:
+                # mmap.flush() needs an offset aligned on the allocation granularity
+                offset = start * mmap.PAGESIZE // mmap.ALLOCATIONGRANULARITY * mmap.ALLOCATIONGRANULARITY
+                end = min((previous + 1) * mmap.PAGESIZE, len(self._map))
+                self._map.flush(offset, end - offset)
+                start = page
+            previous = page
+        return len(pages)
+
+    def read(self, start, end):
+        """Return [(slot time, count, mean)] of the slots from start to end, oldest first"""
+        step = self.step
+        start = max(start // step * step, (end // step - self.slots + 1) * step)
+        end = end // step * step
+        if end < start:
+            return []
+        first = (start // step) % self.slots
+        count = (end - start) // step + 1
+        data = memoryview(self._map)[HEADER_SIZE:]
+        try:
+            if first + count <= self.slots:
+                chunks = [data[first * _SLOT.size:(first + count) * _SLOT.size]]
+            else:
+                chunks = [data[first * _SLOT.size:],
+                          data[:(first + count - self.slots) * _SLOT.size]]
+            slots = []
+            slot_time = start
+            for chunk in chunks:
+                for stored_time, stored_count, mean in _SLOT.iter_unpack(chunk):
+                    if stored_time == slot_time and stored_count:
+                        slots.append((slot_time, stored_count, mean))
+                    slot_time += step
+            return slots
+        finally:
+            data.release()
+
+    def close(self):
+        self.sync()
+        self._map.close()
+        self._file.close()
+
+
+class RingStore:
+    """Ring files of the inputs of every node under path
+
+    step (int): seconds per slot of new files
+    length (int): seconds of history held by new files
+
+    """
+
+    def __init__(self, path, step=10, length=604800):
+        self.path = path
+        self.step = int(step)
+        if self.step <= 0:
+            raise RingStoreError("invalid step %s" % step)
+        self.slots = max(int(length) // self.step, 1)
+
+        self._lock = threading.Lock()
+        # By (node, input name)
+        self._files = {}
+        # By (node, input name): {slot time: [total, count]}
+        self._pending = {}
+
+        self.stats = {'values': 0, 'old': 0, 'pages': 0, 'flushes': 0}
+        self._stats_timestamp = time.time()
+
+    def append(self, node, name, timestamp, value):
+        """Add a value, written by the next flush()"""
+        slot_time = int(timestamp) // self.step * self.step
+        pending = self._pending.setdefault((_safe(node), _safe(name)), {})
+        slot = pending.get(slot_time)
+        if slot is None:
+            pending[slot_time] = [value, 1]
+        else:
+            slot[0] += value
+            slot[1] += 1
+        self.stats['values'] += 1
+
+    def _file(self, key, create=True):
+        # key is (node, input name) made safe as file names
+        ring = self._files.get(key)
+        if ring is None:
+            directory = os.path.join(self.path, key[0])
+            path = os.path.join(directory, key[1] + '.ring')
+            if not create and not os.path.exists(path):
+                return None
+            os.makedirs(directory, exist_ok=True)
+            ring = self._files[key] = RingFile(path, self.step, self.slots)
+            if (ring.step, ring.slots) != (self.step, self.slots):
+                _log.warning("%s has a step of %d s and %d slots, delete it to use the new settings",
+                             path, ring.step, ring.slots)
+        return ring
+
+    def flush(self):
+        """Write the values appended since the last flush and sync the pages written"""
+        pending, self._pending = self._pending, {}
+        with self._lock:
+            for key, slots in pending.items():
+                try:
+                    ring = self._file(key)
+                except (OSError, RingStoreError) as e:
+                    _log.error("Ring store %s.%s: %s", key[0], key[1], e)
+                    continue
+                for slot_time in sorted(slots):
+                    total, count = slots[slot_time]
+                    if not ring.write(slot_time, total, count):
+                        self.stats['old'] += count
+            for ring in self._files.values():
+                self.stats['pages'] += ring.sync()
+        self.stats['flushes'] += 1
+
+        if time.time() - self._stats_timestamp > RINGSTORE_STATS_INTERVAL:
+            self._stats_timestamp = time.time()
+            _log.debug("Ring store: %d values in %d flushes, %d pages written, %d values too old",
+                       self.stats['values'], self.stats['flushes'], self.stats['pages'], self.stats['old'])
+
+    def inputs(self):
+        """Return {node: [input names]} of the ring files under path"""
+        inputs = {}
+        if not os.path.isdir(self.path):
+            return inputs
+        for node in sorted(os.listdir(self.path)):
+            directory = os.path.join(self.path, node)
+            if os.path.isdir(directory):
+                names = sorted(f[:-5] for f in os.listdir(directory) if f.endswith('.ring'))
+                if names:
+                    inputs[node] = names
+        return inputs
+
+    def query(self, node, name, start, end, interval=None):
+        """Return [[time, mean, min, max]] from start to end, one point per interval
+
+        Intervals are multiples of the step, and made longer if needed to
+        return at most MAX_POINTS points. Intervals without values are left
+        out. Returns None if the input is unknown.
+
+        """
+        with self._lock:
+            try:
+                ring = self._file((_safe(node), _safe(name)), create=False)
+            except (OSError, RingStoreError) as e:
+                _log.error("Ring store %s.%s: %s", node, name, e)
+                return None
+            if ring is None:
+                return None
+            step = ring.step
+            interval = max(int(interval or step) // step * step, step,
+                           math.ceil((end - start) / MAX_POINTS / step) * step)
+            slots = ring.read(int(start), int(end))
+
+        points = []
+        bucket = None
+        for slot_time, count, mean in slots:
+            bucket_time = slot_time // interval * interval
+            if bucket is None or bucket[0] != bucket_time:
+                bucket = [bucket_time, 0.0, 0, mean, mean]
+                points.append(bucket)
+            bucket[1] += mean * count
+            bucket[2] += count
+            if mean < bucket[3]:
+                bucket[3] = mean
+            if mean > bucket[4]:
+                bucket[4] = mean
+        return [[t, total / count, low, high] for t, total, count, low, high in points]
+
+    def close(self):
+        with self._lock:
+            for ring in self._files.values():
+                ring.close()
+            self._files = {}
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+
+    server_version = "emonhub"
+
+    def _reply(self, code, data):
+        body = json.dumps(data, separators=(',', ':')).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = [unquote(part) for part in url.path.strip('/').split('/')]
+        store = self.server.store
+        if parts == ['feeds']:
+            self._reply(200, store.inputs())
+            return
+        if len(parts) != 3 or parts[0] != 'feeds':
+            self.send_error(404)
+            return
+
+        query = parse_qs(url.query)
+        try:
+            end = float(query.get('end', [time.time()])[0])
+            start = float(query.get('start', [end - 86400])[0])
+            interval = float(query.get('interval', [0])[0])
+        except ValueError:
+            self.send_error(400, "start, end and interval must be numbers")
+            return
+
+        points = store.query(parts[1], parts[2], start, end, interval)
+        if points is None:
+            self.send_error(404)
+            return
+        self._reply(200, points)
+
+    def log_message(self, format, *args):
+        _log.debug("Ring store API %s %s", self.address_string(), format % args)
+
+
+class RingStoreServer:
+    """Serves the queries of a RingStore over HTTP from a background thread
+
+    GET /feeds                                  {node: [input names]}
+    GET /feeds/<node>/<input>?start=&end=&interval=
+                                                [[time, mean, min, max], ...]
+
+    """
+
+    def __init__(self, store, host='127.0.0.1', port=8082):
+        self._httpd = ThreadingHTTPServer((host, int(port)), _RequestHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.store = store
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="ringstore-api", daemon=True)
+        self._thread.start()
+        _log.info("Serving the ring store on http://%s:%d/feeds", host, int(port))
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
@@ -352,6 +352,64 @@ class _UdpInverterProtocol(asyncio.DatagramProtocol):
             self.transport.close()
 
 
+class _UdpConnection(asyncio.DatagramProtocol):
+    """
+    Long-lived UDP endpoint to one inverter, carrying one request at a time.
+    Responses that don't pass the validator of the pending request are ignored.
+    """
+
+    def __init__(self):
+        self.transport: Optional[asyncio.transports.DatagramTransport] = None
+        self._pending: Optional[Tuple[asyncio.futures.Future, Callable[[bytes], bool]]] = None
+        self._lock = asyncio.Lock()
+
+    def connection_made(self, transport: asyncio.transports.DatagramTransport):
+        self.transport = transport
+
+    def connection_lost(self, exc: Exception):
+        if exc is not None:
+            _LOGGER.debug("Socket closed with error: '%s'", exc)
+        self.transport = None
+        if self._pending is not None and not self._pending[0].done():
+            self._pending[0].set_exception(InverterError("Socket closed"))
+
+    def datagram_received(self, data: bytes, addr: Tuple[str, int]):
+        _LOGGER.debug("Received: '%s'", data.hex())
+        if self._pending is not None and not self._pending[0].done() and self._pending[1](data):
+            self._pending[0].set_result(data)
+        else:
+            _LOGGER.debug("Invalid or unexpected response, length: %d", len(data))
+
+    def error_received(self, exc: Exception):
+        _LOGGER.debug("Received error: '%s'", exc)
+
+    async def request(self, command: "ProtocolCommand", timeout: int = 2, retries: int = 3) -> bytes:
+        """
+        Send the command and wait for a valid response, re-trying up to retries times.
+        Return raw response data
+        """
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            for retry_nr in range(retries + 1):
+                if self.transport is None:
+                    break
+                if retry_nr:
+                    _LOGGER.debug("Re-try #%d", retry_nr)
+                future = loop.create_future()
+                self._pending = (future, command.validator)
+                _LOGGER.debug("Send: '%s'", command.request.hex())
+                self.transport.sendto(command.request)
+                try:
+                    return await asyncio.wait_for(future, timeout)
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    self._pending = None
+            raise InverterError(
+                "No valid response received to '" + command.request.hex() + "' request"
+            )
+
+
 class ProtocolCommand:
     """Definition of inverter protocol command"""
 
@@ -500,9 +558,29 @@ class Inverter:
         self.model_name = model_name
         self.serial_number = serial_number
         self.software_version = software_version
+        self._connection: Optional[_UdpConnection] = None
+        self._connection_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def _connect(self) -> _UdpConnection:
+        """Return the UDP endpoint to the inverter, opened on first use and kept open"""
+        loop = asyncio.get_running_loop()
+        if self._connection is None or self._connection.transport is None or self._connection_loop is not loop:
+            _, self._connection = await loop.create_datagram_endpoint(
+                _UdpConnection, remote_addr=(self.host, self.port)
+            )
+            self._connection_loop = loop
+        return self._connection
 
     async def _read_from_socket(self, command: ProtocolCommand) -> bytes:
-        return await command.execute(self.host, self.port, self.timeout, self.retries)
+        connection = await self._connect()
+        return await connection.request(command, self.timeout, self.retries)
+
+    def close(self):
+        """Close the UDP endpoint to the inverter, it is reopened by the next request"""
+        if self._connection is not None and self._connection.transport is not None:
+            if self._connection_loop.is_closed():
+                return
+            self._connection_loop.call_soon_threadsafe(self._connection.transport.close)
 
     async def read_device_info(self):
         """
@@ -664,6 +742,7 @@ async def discover(host: str, port: int = 8899, timeout: int = 2, retries: int =
             )
             return i
         except InverterError as ex:
+            i.close()
             failures.append(ex)
     raise InverterError(
         "Unable to connect to the inverter at "
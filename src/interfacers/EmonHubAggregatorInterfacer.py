@@ -0,0 +1,346 @@
+import time
+import json
+import math
+import Cargo
+from emonhub_interfacer import EmonHubInterfacer
+
+"""
+[[Aggregator]]
+    Type = EmonHubAggregatorInterfacer
+    [[[init_settings]]]
+    [[[runtimesettings]]]
+        subchannels = ToEmonCMS,
+        pubchannels = ToEmonCMSAggregated,
+        window = 60
+        functions = mean,
+        inputs = emontx4.E1:last, emontx4.P1:mean+max
+"""
+
+"""class EmonHubAggregatorInterfacer
+
+Aggregates the frames received on its subchannels over time windows and
+publishes one frame per node and window on its pubchannels, so that output
+interfacers subscribed to those channels post once a minute rather than on
+every frame.
+
+Windows are aligned on multiples of the window length in wall-clock time
+(e.g. :00 and :01:00 for 60 s), using the frame timestamps. A window is
+published when a frame of the next window arrives for the node, or
+window_delay seconds after the end of the window. Buffered frames with old
+timestamps are aggregated in their own windows all the same.
+
+Each input is published with the functions set for it:
+
+    mean    time-weighted mean of the window, published under the input name
+    min     minimum, published as <name>_min
+    max     maximum, published as <name>_max
+    last    last value, published as <name>_last
+    energy  integral of the value over time in value-hours (Wh for a power
+            in W), published as <name>_energy
+
+The mean and energy integrate the values between consecutive frames. An
+interval that spans the end of a window is split at the boundary, with the
+value there interpolated linearly. When the window was published on its
+deadline before the next frame arrived, its part of the interval is lost.
+
+The functions setting applies to every input, the inputs setting overrides
+it for some inputs, given as name, nodename.name or nodeid.name followed by
+:function+function...
+
+"""
+
+FUNCTIONS = ('mean', 'min', 'max', 'last', 'energy')
+
+# Interval in seconds between bytes and messages saved reports in the log
+AGGREGATE_STATS_INTERVAL = 300
+
+
+class _Input:
+    """Running state of one input, constant size whatever the number of frames"""
+
+    __slots__ = ('count', 'weighted', 'duration', 'total', 'min', 'max', 'last', 'last_time', 'energy')
+
+    def __init__(self):
+        self.last = None
+        self.last_time = None
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.weighted = 0.0
+        self.duration = 0.0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.energy = 0.0
+
+    def _integrate(self, value, timestamp, max_gap, start=-math.inf, end=math.inf):
+        """Add the area from the last sample to (value, timestamp), clipped to start and end
+
+        Trapezoidal integration, the value at start or end is interpolated
+        linearly. Gaps longer than max_gap (missing data) are not integrated.
+
+        """
+        dt = timestamp - self.last_time
+        if not 0 < dt <= max_gap:
+            return
+        t0 = max(self.last_time, start)
+        t1 = min(timestamp, end)
+        if t1 <= t0:
+            return
+        slope = (value - self.last) / dt
+        area = (2 * self.last + slope * (t0 + t1 - 2 * self.last_time)) * 0.5 * (t1 - t0)
+        self.weighted += area
+        self.duration += t1 - t0
+        self.energy += area / 3600.0
+
+    def close_interval(self, value, timestamp, max_gap, end):
+        """Add the part before end, the end of the window, of the interval up to the next sample"""
+        if self.last_time is not None:
+            self._integrate(value, timestamp, max_gap, end=end)
+
+    def update(self, value, timestamp, max_gap, start=-math.inf):
+        """Add a sample, start is the beginning of the window it is aggregated in"""
+        if self.last_time is not None:
+            self._integrate(value, timestamp, max_gap, start=start)
+        if self.last_time is None or timestamp >= self.last_time:
+            self.last = value
+            self.last_time = timestamp
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def result(self, function):
+        if function == 'mean':
+            if self.duration:
+                return self.weighted / self.duration
+            return self.total / self.count
+        if function == 'min':
+            return self.min
+        if function == 'max':
+            return self.max
+        if function == 'last':
+            return self.last
+        return self.energy
+
+
+class EmonHubAggregatorInterfacer(EmonHubInterfacer):
+
+    def __init__(self, name):
+        """Initialize Interfacer
+
+        """
+        super().__init__(name)
+
+        self._settings.update(self._defaults)
+
+        # Interfacer specific settings
+        self._aggregator_settings = {'window': 60,
+                                     'window_delay': 5,
+                                     'functions': ['mean'],
+                                     'inputs': []}
+
+        # Functions by input key, from the inputs setting
+        self._input_functions = {}
+        # Functions resolved for each (node, input name)
+        self._resolved = {}
+
+        # By node: {'window': window start, 'deadline': monotonic time it is published at,
+        # 'nodename', 'names': [input names in order], 'inputs': {name: _Input}}
+        self._nodes = {}
+        # Aggregated frames waiting to be published
+        self._ready = []
+
+        self.aggregate_stats = {'frames_in': 0, 'frames_out': 0, 'bytes_in': 0, 'bytes_out': 0, 'late': 0}
+        self._stats_timestamp = time.time()
+
+    @staticmethod
+    def _frame_size(timestamp, node, names, values):
+        """Size in bytes of the frame in the emoncms bulk JSON format"""
+        return len(json.dumps([int(timestamp), node, dict(zip(names, values))], separators=(',', ':')))
+
+    def _functions(self, node, nodename, name):
+        key = (node, name)
+        functions = self._resolved.get(key)
+        if functions is None:
+            functions = (self._input_functions.get("%s.%s" % (nodename, name))
+                         or self._input_functions.get("%s.%s" % (node, name))
+                         or self._input_functions.get(name)
+                         or self._settings['functions'])
+            self._resolved[key] = functions
+        return functions
+
+    def _sends_names(self):
+        return True
+
+    def add(self, cargo):
+        """Add a frame to the window of its node
+
+        """
+        window = float(self._settings['window'])
+        node = cargo.nodeid
+        names = list(cargo.names[:len(cargo.realdata)])
+        # Unnamed values are numbered from 1, as emoncms does
+        names += [str(i + 1) for i in range(len(names), len(cargo.realdata))]
+
+        self.aggregate_stats['frames_in'] += 1
+        self.aggregate_stats['bytes_in'] += self._frame_size(cargo.timestamp, node, names, cargo.realdata)
+
+        values = []
+        for name, value in zip(names, cargo.realdata):
+            try:
+                values.append((name, float(value)))
+            except (TypeError, ValueError):
+                continue
+
+        start = math.floor(cargo.timestamp / window) * window
+        state = self._nodes.get(node)
+        if state is None:
+            state = self._nodes[node] = {'window': None, 'deadline': None, 'nodename': cargo.nodename,
+                                         'names': [], 'inputs': {}}
+        inputs = state['inputs']
+        if state['window'] is not None and start > state['window']:
+            # The window ends between the last frame and this one, its part of the interval is added to it
+            for name, value in values:
+                aggregate = inputs.get(name)
+                if aggregate is not None:
+                    aggregate.close_interval(value, cargo.timestamp, window, start)
+            self._close(node, state)
+        if state['window'] is None:
+            state['window'] = start
+            # The window ends in as much time as there is between the frame and its end
+            state['deadline'] = (time.monotonic() + start + window - cargo.timestamp
+                                 + float(self._settings['window_delay']))
+        elif start < state['window']:
+            # Late frame of a window already published, counted in the current one
+            self.aggregate_stats['late'] += 1
+        state['nodename'] = cargo.nodename
+
+        for name, value in values:
+            aggregate = inputs.get(name)
+            if aggregate is None:
+                aggregate = inputs[name] = _Input()
+                state['names'].append(name)
+            aggregate.update(value, cargo.timestamp, window, state['window'])
+
+    def _close(self, node, state):
+        """Queue the aggregated frame of the current window of a node and start a new one"""
+        names = []
+        values = []
+        for name in state['names']:
+            aggregate = state['inputs'][name]
+            if not aggregate.count:
+                continue
+            for function in self._functions(node, state['nodename'], name):
+                names.append(name if function == 'mean' else name + "_" + function)
+                values.append(aggregate.result(function))
+            aggregate.reset()
+
+        if names:
+            c = Cargo.new_cargo(timestamp=state['window'])
+            c.nodeid = node
+            c.nodename = state['nodename']
+            c.names = names
+            c.realdata = values
+            self._ready.append(c)
+            self.aggregate_stats['frames_out'] += 1
+            self.aggregate_stats['bytes_out'] += self._frame_size(c.timestamp, node, names, values)
+        state['window'] = None
+
+    def read(self):
+        """Return the next aggregated frame, closing the windows that have ended
+
+        """
+        now = time.monotonic()
+        for node, state in self._nodes.items():
+            if state['window'] is not None and now >= state['deadline']:
+                self._close(node, state)
+
+        if time.time() - self._stats_timestamp > AGGREGATE_STATS_INTERVAL:
+            self._stats_timestamp = time.time()
+            self._log_stats()
+
+        if self._ready:
+            return self._ready.pop(0)
+
+    def _process_rx(self, cargo):
+        # Frames are already decoded by the interfacer that received them
+        return cargo
+
+    def _derive(self, cargo):
+        # The aggregates of the derived inputs are published already
+        pass
+
+    def _log_stats(self):
+        stats = self.aggregate_stats
+        if not stats['frames_in']:
+            return
+        self._log.debug("%s: %d frames in, %d out (%.0f%% saved), %d bytes in, %d out (%.0f%% saved), %d late",
+                        self.name, stats['frames_in'], stats['frames_out'],
+                        100.0 * (1 - stats['frames_out'] / stats['frames_in']),
+                        stats['bytes_in'], stats['bytes_out'],
+                        100.0 * (1 - stats['bytes_out'] / stats['bytes_in']), stats['late'])
+
+    def _parse_functions(self, setting):
+        if isinstance(setting, str):
+            setting = setting.replace('+', ',').split(',')
+        functions = [function.strip().lower() for function in setting if function.strip()]
+        for function in functions:
+            if function not in FUNCTIONS:
+                raise ValueError("unknown function '%s'" % function)
+        return functions
+
+    def set(self, **kwargs):
+        for key, setting in self._aggregator_settings.items():
+            # Decide which setting value to use
+            if key in kwargs:
+                setting = kwargs[key]
+            else:
+                setting = self._aggregator_settings[key]
+            if key in self._settings and self._settings[key] == setting:
+                continue
+            elif key in ['window', 'window_delay']:
+                try:
+                    value = float(setting)
+                except ValueError:
+                    self._log.warning("'%s' is not valid for %s: %s", setting, self.name, key)
+                    continue
+                if key == 'window' and value <= 0:
+                    self._log.warning("'%s' is not valid for %s: %s", setting, self.name, key)
+                    continue
+                self._log.info("Setting %s %s: %s", self.name, key, setting)
+                self._settings[key] = setting
+                continue
+            elif key == 'functions':
+                try:
+                    functions = self._parse_functions(setting)
+                except ValueError as e:
+                    self._log.warning("'%s' is not valid for %s: %s (%s)", setting, self.name, key, e)
+                    continue
+                self._log.info("Setting %s %s: %s", self.name, key, ", ".join(functions))
+                self._settings[key] = functions
+                self._resolved = {}
+                continue
+            elif key == 'inputs':
+                if isinstance(setting, str):
+                    setting = [setting]
+                input_functions = {}
+                for entry in setting:
+                    name, _, functions = entry.strip().rpartition(':')
+                    try:
+                        input_functions[name.strip()] = self._parse_functions(functions.replace('+', ','))
+                    except ValueError as e:
+                        self._log.warning("'%s' is not valid for %s: %s (%s)", entry, self.name, key, e)
+                self._log.info("Setting %s %s: %s", self.name, key, ", ".join(setting))
+                self._settings[key] = setting
+                self._input_functions = input_functions
+                self._resolved = {}
+                continue
+            else:
+                self._log.warning("'%s' is not valid for %s: %s", setting, self.name, key)
+
+        # include kwargs from parent
+        super().set(**kwargs)
@@ -0,0 +1,167 @@
+import time
+import emonhub_archive as ehar
+from emonhub_interfacer import EmonHubInterfacer, EmonHubInterfacerInitError
+
+"""
+[[Archive]]
+    Type = EmonHubArchiveInterfacer
+    [[[init_settings]]]
+        path = /var/lib/emonhub/archive
+    [[[runtimesettings]]]
+        subchannels = ToEmonCMS,
+        write_interval = 300
+"""
+
+"""class EmonHubArchiveInterfacer
+
+Archives the frames received on its subchannels in hourly files per node,
+parquet when pyarrow is installed, compressed CSV otherwise (see
+emonhub_archive).
+
+Archived frames can be published again on the pubchannels, e.g. to fill a
+gap in an emoncms server after an outage, by setting replay_start and
+replay_end. The pubchannels must differ from the subchannels, or the
+replayed frames are archived a second time.
+
+"""
+
+
+class EmonHubArchiveInterfacer(EmonHubInterfacer):
+
+    def __init__(self, name, path='/var/lib/emonhub/archive', format=None, compression=None):
+        """Initialize Interfacer
+
+        path (string): directory of the archive
+        format (string): 'parquet' or 'csv', parquet if pyarrow is installed
+        compression (string): 'zstd' or 'gzip' for CSV, zstd if zstandard is installed
+
+        """
+        super().__init__(name)
+
+        self._settings.update(self._defaults)
+
+        # Interfacer specific settings
+        self._archive_settings = {'write_interval': 300,
+                                  'max_rows': 10000,
+                                  'replay_start': '',
+                                  'replay_end': '',
+                                  'replay_node': ''}
+
+        formats, compressions = ehar.formats()
+        try:
+            self._writer = ehar.ArchiveWriter(path, format or formats[0], compression or compressions[0])
+        except ValueError as e:
+            raise EmonHubInterfacerInitError("Invalid archive settings: %s (available: %s, %s)"
+                                             % (e, ", ".join(formats), ", ".join(compressions)))
+        self._log.info("%s archiving to %s as %s", self.name, path,
+                       self._writer.format if self._writer.format == 'parquet' else "csv " + self._writer.compression)
+
+        self._write_timestamp = time.time()
+        # Frames being replayed, and count
+        self._replay = None
+        self._replayed = 0
+        # Set when the replay settings change, the replay starts in the interfacer thread
+        self._replay_changed = False
+
+    def _sends_names(self):
+        return True
+
+    def add(self, cargo):
+        """Append a frame to the archive
+
+        """
+        self._writer.append(cargo)
+
+    def action(self):
+        """Write the frames in memory every write_interval
+
+        """
+        if time.time() - self._write_timestamp >= float(self._settings['write_interval']):
+            self._write_timestamp = time.time()
+            self._writer.flush()
+
+    def read(self):
+        """Return the next archived frame while replaying
+
+        """
+        if self._replay_changed:
+            self._replay_changed = False
+            self._start_replay()
+        if self._replay is None:
+            return
+        cargo = next(self._replay, None)
+        if cargo is None:
+            self._log.info("%s replay done, %d frames", self.name, self._replayed)
+            self._replay = None
+            return
+        self._replayed += 1
+        return cargo
+
+    def _process_rx(self, cargo):
+        # Archived frames are already decoded
+        return cargo
+
+    def _derive(self, cargo):
+        # Archived frames have their derived inputs
+        pass
+
+    def _loop_timeout(self):
+        if self._replay is not None or self._replay_changed:
+            return 0.01
+        return super()._loop_timeout()
+
+    def run(self):
+        super().run()
+        # Stopped, write the frames in memory
+        self._writer.close()
+
+    def _start_replay(self):
+        start = self._settings['replay_start']
+        end = self._settings['replay_end']
+        if start == '' or end == '':
+            self._replay = None
+            return
+        # Replay what is in memory too
+        self._writer.flush()
+        node = self._settings['replay_node']
+        self._replay = ehar.read_frames(self._writer.path, node if node != '' else None, float(start), float(end))
+        self._replayed = 0
+        self._log.info("%s replaying frames from %s to %s", self.name, start, end)
+
+    def set(self, **kwargs):
+        replay = False
+        for key, setting in self._archive_settings.items():
+            # Decide which setting value to use
+            if key in kwargs:
+                setting = kwargs[key]
+            else:
+                setting = self._archive_settings[key]
+            if key in self._settings and self._settings[key] == setting:
+                continue
+            elif key in ['write_interval', 'max_rows', 'replay_start', 'replay_end']:
+                try:
+                    # The replay is off while replay_start or replay_end is empty
+                    if setting != '' or not key.startswith('replay'):
+                        float(setting)
+                except ValueError:
+                    self._log.warning("'%s' is not valid for %s: %s", setting, self.name, key)
+                    continue
+                if key == 'max_rows':
+                    self._writer.max_rows = int(float(setting))
+                replay = replay or key.startswith('replay')
+                self._log.info("Setting %s %s: %s", self.name, key, setting)
+                self._settings[key] = setting
+                continue
+            elif key == 'replay_node':
+                replay = True
+                self._log.info("Setting %s %s: %s", self.name, key, setting)
+                self._settings[key] = setting
+                continue
+            else:
+                self._log.warning("'%s' is not valid for %s: %s", setting, self.name, key)
+
+        # include kwargs from parent
+        super().set(**kwargs)
+
+        if replay:
+            self._replay_changed = True
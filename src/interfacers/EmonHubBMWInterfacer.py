@@ -12,8 +12,8 @@ import sys
 import traceback
 import json
 import os.path
-import requests
 import Cargo
+import emonhub_http
 from emonhub_interfacer import EmonHubInterfacer
 
 """class EmonHubBMWInterfacer
@@ -46,6 +46,8 @@ class EmonHubBMWInterfacer(EmonHubInterfacer):
         self._TempCredentialFile = tempcredentialfile
         self._first_time_loop = True
 
+        self._http = emonhub_http.HttpPoller(name, timeout=60)
+
         if os.path.exists(self._TempCredentialFile):  # FIXME race condition
             with open(self._TempCredentialFile, "r") as cf:
                 credentials = json.load(cf)
@@ -71,7 +73,7 @@ class EmonHubBMWInterfacer(EmonHubInterfacer):
             "password": self._Password
         }
 
-        r = requests.post("https://customer.bmwgroup.com/gcdm/oauth/authenticate", allow_redirects=False, data=data, headers=headers)
+        r = self._http.request("POST", "https://customer.bmwgroup.com/gcdm/oauth/authenticate", allow_redirects=False, data=data, headers=headers)
         #We expect a 302 reply (redirect)
 
         if r.status_code == 302:
@@ -168,9 +170,9 @@ class EmonHubBMWInterfacer(EmonHubInterfacer):
         #self._log.debug("headers=%s", headers)
 
         if post_data is None:
-            r = requests.get(self.ROOT_URL + path, headers=headers, timeout=60)
+            r = self._http.request("GET", self.ROOT_URL + path, headers=headers)
         else:
-            r = requests.post(self.ROOT_URL + path, headers=headers, data=post_data, timeout=60)
+            r = self._http.request("POST", self.ROOT_URL + path, headers=headers, data=post_data)
 
         #Raise exception if problem with request
         r.raise_for_status()
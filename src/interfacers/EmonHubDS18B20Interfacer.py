@@ -3,6 +3,8 @@ import json
 import Cargo
 import os
 import glob
+import logging
+import concurrent.futures
 from emonhub_interfacer import EmonHubInterfacer
 
 """
@@ -17,10 +19,40 @@ from emonhub_interfacer import EmonHubInterfacer
 """
 
 class DS18B20:
-    def __init__(self):
-        os.system('modprobe w1-gpio')
-        os.system('modprobe w1-therm')
-        self._base_dir = '/sys/bus/w1/devices/'
+    """1-Wire DS18B20 sensors, read through the kernel w1-therm sysfs interface
+
+    The device list is cached and rescanned every scan_interval seconds, or
+    when a sensor disappears. Each w1_slave read makes the kernel run a 750 ms
+    temperature conversion, so where the bus master supports it a single bulk
+    conversion is triggered for all sensors with therm_bulk_read and the
+    sensors then only return the converted value. Sensors are read
+    concurrently and a read failing its CRC check is retried by its own
+    worker without holding up the other sensors.
+
+    """
+
+    # Seconds between rescans of the device list
+    scan_interval = 300
+
+    # Reads retried after a CRC failure
+    retries = 2
+    retry_delay = 0.1
+
+    # Maximum number of sensors read at the same time
+    max_workers = 4
+
+    # Maximum time for a bulk conversion to complete, in seconds
+    bulk_timeout = 1.5
+
+    def __init__(self, base_dir='/sys/bus/w1/devices/'):
+        if base_dir == '/sys/bus/w1/devices/':
+            os.system('modprobe w1-gpio')
+            os.system('modprobe w1-therm')
+        self._base_dir = base_dir
+        self._log = logging.getLogger("EmonHub")
+        self._sensors = []
+        self._next_scan = 0
+        self._pool = None
 
     def scan(self):
         devices = glob.glob(self._base_dir + '28*')
@@ -30,6 +62,21 @@ class DS18B20:
             sensors.append(sensor)
         return sensors
 
+    def sensors(self):
+        """Return the cached list of sensors, rescanning it when due"""
+        now = time.monotonic()
+        if now >= self._next_scan:
+            sensors = sorted(self.scan())
+            if sensors != self._sensors:
+                self._log.info("DS18B20 sensors found: %s", ", ".join(sensors) or "none")
+            self._sensors = sensors
+            self._next_scan = now + self.scan_interval
+        return self._sensors
+
+    def rescan(self):
+        """Rescan the device list on the next call to sensors()"""
+        self._next_scan = 0
+
     def _read_raw(self, sensor):
         f = open(self._base_dir + sensor + '/w1_slave', 'r')
         lines = f.readlines()
@@ -37,21 +84,87 @@ class DS18B20:
         return lines
 
     def tempC(self, sensor):
-        lines = self._read_raw(sensor)
-        # retry = 0
-        if len(lines[0]):
-            while lines[0].strip()[-3:] != 'YES':
-                # time.sleep(0.2)
-                # lines = self._read_raw(sensor)
-                # retry += 1
-                # if retry==3: return False
-                return False
-
-        equals_pos = lines[1].find('t=')
-        if equals_pos != -1:
-            temp_string = lines[1][equals_pos+2:]
-            temp_c = float(temp_string) / 1000.0
-            return temp_c
+        """Return the temperature of sensor in degrees C
+
+        Returns False if the reading fails its CRC check after all retries,
+        None if the sensor can't be read.
+
+        """
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.retry_delay)
+            try:
+                lines = self._read_raw(sensor)
+            except OSError as e:
+                self._log.warning("DS18B20 %s could not be read: %s", sensor, e)
+                self.rescan()
+                return None
+            if len(lines) < 2:
+                continue
+            if lines[0].strip()[-3:] != 'YES':
+                self._log.debug("DS18B20 %s CRC check failed (attempt %d)", sensor, attempt + 1)
+                continue
+
+            equals_pos = lines[1].find('t=')
+            if equals_pos != -1:
+                temp_string = lines[1][equals_pos+2:]
+                temp_c = float(temp_string) / 1000.0
+                return temp_c
+        return False
+
+    def _bus_masters(self, sensors):
+        """Return the therm_bulk_read files of the bus masters of sensors"""
+        masters = set()
+        for sensor in sensors:
+            master = os.path.dirname(os.path.realpath(self._base_dir + sensor))
+            bulk_read = os.path.join(master, 'therm_bulk_read')
+            if os.path.exists(bulk_read):
+                masters.add(bulk_read)
+        return masters
+
+    def bulk_convert(self, sensors):
+        """Start one temperature conversion on all sensors of each bus
+
+        Sensors on a bus that ran a bulk conversion return the converted value
+        when read, without a conversion of their own.
+
+        """
+        masters = self._bus_masters(sensors)
+        triggered = []
+        for bulk_read in masters:
+            try:
+                with open(bulk_read, 'w') as f:
+                    f.write('trigger\n')
+                triggered.append(bulk_read)
+            except OSError as e:
+                self._log.debug("DS18B20 bulk conversion not available on %s: %s", bulk_read, e)
+
+        # therm_bulk_read reads -1 while a conversion is in progress
+        deadline = time.monotonic() + self.bulk_timeout
+        for bulk_read in triggered:
+            while time.monotonic() < deadline:
+                try:
+                    with open(bulk_read) as f:
+                        if int(f.read().strip() or 0) >= 0:
+                            break
+                except (OSError, ValueError):
+                    break
+                time.sleep(0.05)
+
+    def read_all(self, sensors):
+        """Return {sensor: temperature} for all sensors, read concurrently"""
+        if not sensors:
+            return {}
+        self.bulk_convert(sensors)
+        if self._pool is None:
+            self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers,
+                                                               thread_name_prefix="DS18B20")
+        return dict(zip(sensors, self._pool.map(self.tempC, sensors)))
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
 
 """class EmonHubDS18B20Interfacer
 
@@ -76,8 +189,6 @@ class EmonHubDS18B20Interfacer(EmonHubInterfacer):
 
         self.ds = DS18B20()
 
-        self.next_interval = True
-
 
     def read(self):
         """Read data and process
@@ -86,44 +197,52 @@ class EmonHubDS18B20Interfacer(EmonHubInterfacer):
 
         """
 
-        if int(time.time()) % self._settings['read_interval'] == 0:
-            if self.next_interval:
-                self.next_interval = False
-
-                c = Cargo.new_cargo()
-                c.names = []
-                c.realdata = []
-                c.nodeid = self._settings['nodename']
-
-                if self.ds:
-                    for sensor in self.ds.scan():
-                        # Check if user has set a name for given sensor id
-                        name = sensor
-                        try:
-                            index = self._settings['ids'].index(sensor)
-                            if index < len(self._settings['names']):
-                                name = self._settings['names'][index]
-                        except ValueError:
-                            pass
-
-                        # Read sensor value
-                        value = self.ds.tempC(sensor)
-
-                        # Add sensor to arrays
-                        c.names.append(name)
-                        c.realdata.append(value)
-
-                        # Log output
-                        self._log.debug(sensor + ": " + name + " " + str(value))
-
-                    if len(c.realdata) > 0:
-                        return c
-
-        else:
-            self.next_interval = True
+        if not self._poll_due(self._settings['read_interval']):
+            return False
+
+        c = Cargo.new_cargo()
+        c.names = []
+        c.realdata = []
+        c.nodeid = self._settings['nodename']
+
+        if self.ds:
+            sensors = self.ds.sensors()
+            values = self.ds.read_all(sensors)
+            for sensor in sensors:
+                # Check if user has set a name for given sensor id
+                name = sensor
+                try:
+                    index = self._settings['ids'].index(sensor)
+                    if index < len(self._settings['names']):
+                        name = self._settings['names'][index]
+                except ValueError:
+                    pass
+
+                value = values[sensor]
+                if value is None or value is False:
+                    self._log.warning("%s: no valid reading from %s", self.name, sensor)
+                    continue
+
+                # Add sensor to arrays
+                c.names.append(name)
+                c.realdata.append(value)
+
+                # Log output
+                self._log.debug("%s: %s %s", sensor, name, value)
+
+            if len(c.realdata) > 0:
+                return c
 
         return False
 
+    def run(self):
+        super().run()
+        # Stopped, e.g. replaced after a configuration change, release the read workers
+        self.close()
+
+    def close(self):
+        if self.ds:
+            self.ds.close()
 
     def set(self, **kwargs):
         for key, setting in self._DS18B20_settings.items():
@@ -6,10 +6,9 @@
 __author__ = 'Dan Conlon'
 
 import sys
-import time
 import traceback
-import requests
 import Cargo
+import emonhub_http
 from emonhub_interfacer import EmonHubInterfacer
 from requests.auth import HTTPBasicAuth
 
@@ -98,28 +97,21 @@ class EmonHubEconet300Interfacer(EmonHubInterfacer):
         self._password = password
         self._poll_interval = int(pollinterval)
 
-        # Timestamp for next scheduled poll (None => first loop should run)
-        self._next_poll_time = None
-
         # Only the Grant Aerona R290 is supported for now
         self._params_map = PARAMS_GRANT_AERONA_R290
 
+        # The mappings require two endpoints: '/econet/regParams' and '/econet/editParams', which
+        # together contain the values referenced by `_params_map`. Both are fetched concurrently.
+        basic = HTTPBasicAuth(self._username, self._password)
+        self._http = emonhub_http.HttpPoller(name)
+        self._endpoints = [
+            emonhub_http.Endpoint(path, "http://" + self._host + "/econet/" + path, auth=basic)
+            for path in ("regParams", "editParams")
+        ]
+
     def close(self):
         return None
         
-    def _set_poll_timer(self, seconds):
-        """Schedule the next poll `seconds` from now."""
-        self._next_poll_time = time.time() + seconds
-
-    def _is_it_time(self):
-        """Return True if the next poll time has been reached (or unset). On the first run
-        `_next_poll_time` will be None so the method returns True to allow an immediate poll.
-        """
-        if not self._next_poll_time: # First time loop
-            return True
-            
-        return time.time() > self._next_poll_time
-
     # Override base _process_rx code from emonhub_interfacer
     def _process_rx(self, rxc):
         if not rxc:
@@ -134,8 +126,8 @@ class EmonHubEconet300Interfacer(EmonHubInterfacer):
         transient errors by scheduling a short retry.
         """
 
-        # Wait until we are ready to fetch
-        if not self._is_it_time():
+        # Wait until we are ready to fetch, the first poll is immediate
+        if not self._poll_due(self._poll_interval, immediate=True):
             return
 
         cargo = None
@@ -144,9 +136,6 @@ class EmonHubEconet300Interfacer(EmonHubInterfacer):
             # Perform HTTP fetch and mapping
             cargo = self._fetch_data()
 
-            # Poll timer reset after successful fetch
-            self._set_poll_timer(self._poll_interval)
-
         except Exception as err2:
             # Log the detailed traceback for debugging
             exc_type, exc_value, exc_traceback = sys.exc_info()
@@ -154,7 +143,7 @@ class EmonHubEconet300Interfacer(EmonHubInterfacer):
             self._log.debug(repr(traceback.format_exception(exc_type, exc_value, exc_traceback)))
 
             # Retry shortly in case of errors
-            self._set_poll_timer(10) # Retry in 10 seconds
+            self._poll_retry(10) # Retry in 10 seconds
 
         return cargo
 
@@ -163,10 +152,9 @@ class EmonHubEconet300Interfacer(EmonHubInterfacer):
         endpoints and nested structures; `_params_map` tells this method where to look for
         each metric.
         """
-        # The mappings below require two endpoints: '/econet/regParams' and '/econet/editParams', which
-        # together contain the values referenced by `_params_map`.
-        regParams  = self._econet_http_request("/econet/regParams")
-        editParams = self._econet_http_request("/econet/editParams")
+        responses = self._http.fetch(self._endpoints)
+        regParams = responses["regParams"]
+        editParams = responses["editParams"]
 
         data = {}
 
@@ -197,20 +185,3 @@ class EmonHubEconet300Interfacer(EmonHubInterfacer):
         c.nodename = self._NodeName
 
         return c
-
-    def _econet_http_request(self, path):
-        """Perform an authenticated GET against the bridge and return parsed JSON. Raises an Exception
-        on non-200 responses or if the response body cannot be decoded as JSON.
-        """
-        basic = HTTPBasicAuth(self._username, self._password)
-
-        r = requests.get("http://" + self._host + path, auth=basic)
-
-        if r.status_code != 200:
-            raise Exception(f"Couldn't fetch data ({r.status_code})")
-        
-        try:
-            body = r.json()
-            return body
-        except Exception as e:
-            raise Exception(f"Invalid data from path: {r.content}")
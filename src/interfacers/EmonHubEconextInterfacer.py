@@ -4,11 +4,12 @@
 __author__ = "Linus Reitmayr"
 
 import sys
-import time
 import traceback
 
 import Cargo
 import requests
+import emonhub_http
+import emonhub_json
 from emonhub_interfacer import EmonHubInterfacer
 
 """class EmonHubEconextInterfacer
@@ -63,35 +64,18 @@ class EmonHubEconextInterfacer(EmonHubInterfacer):
         for key, val in self._template_settings.items():
             self._settings[key] = val
 
-        self._next_poll_time = None
         self._consecutive_failures = 0
 
+        self._http = emonhub_http.HttpPoller(name)
+
         # User-configured parameter overrides/additions: list of (gateway_name, emoncms_name)
         self._config_parameters = []
+        self._extractor = self._compile_parameters()
 
     def close(self):
         """Close interfacer"""
         pass
 
-    def _set_poll_timer(self, seconds):
-        """Set next poll time
-
-        Args:
-            seconds (int): Seconds until next poll
-        """
-        self._next_poll_time = time.time() + seconds
-
-    def _is_it_time(self):
-        """Check if it's time to poll
-
-        Returns:
-            bool: True if ready to poll
-        """
-        if not self._next_poll_time:  # First time loop
-            return True
-
-        return time.time() > self._next_poll_time
-
     def _parse_parameters(self, raw):
         """Parse parameters config value.
 
@@ -99,6 +83,7 @@ class EmonHubEconextInterfacer(EmonHubInterfacer):
             raw: String or list from configobj. Each entry is either:
                  "GatewayName" (passed through using the gateway name) or
                  "GatewayName:FeedName" (gateway param mapped to custom feed name)
+                 "GatewayName:FeedName:scale[:type]" (scaled and/or converted, see emonhub_json)
 
         Returns:
             list of (gateway_name, feed_name) tuples
@@ -132,6 +117,19 @@ class EmonHubEconextInterfacer(EmonHubInterfacer):
 
         return result
 
+    def _compile_parameters(self):
+        """Build the extractor for the effective mapping
+
+        Returns:
+            emonhub_json.JsonExtractor over the name->value lookup of the gateway parameters
+        """
+        # Defaults overridden/extended by config
+        config_by_gw = dict(self._config_parameters)
+        mapping = [(gw, config_by_gw.pop(gw, feed)) for gw, feed in self.DEFAULT_PARAMETERS]
+        mapping.extend(config_by_gw.items())  # remaining config entries are additions
+
+        return emonhub_json.JsonExtractor([f"{gw}:{feed}" for gw, feed in mapping])
+
     # Override base _process_rx code from emonhub_interfacer
     def _process_rx(self, rxc):
         if not rxc:
@@ -147,14 +145,14 @@ class EmonHubEconextInterfacer(EmonHubInterfacer):
             Cargo object with data, or None if not ready/error
         """
 
-        # Wait until we are ready to fetch
-        if not self._is_it_time():
+        # Wait until we are ready to fetch, the first poll is immediate
+        if not self._poll_due(self._settings["pollinterval"], immediate=True):
             return None
 
         # Validate required settings
         if not self._settings.get("host"):
             self._log.error("Host not configured")
-            self._set_poll_timer(60)
+            self._poll_retry(60)
             return None
 
         cargo = None
@@ -162,8 +160,6 @@ class EmonHubEconextInterfacer(EmonHubInterfacer):
         try:
             cargo = self._fetch()
 
-            # Poll timer reset after successful fetch
-            self._set_poll_timer(self._settings["pollinterval"])
             self._consecutive_failures = 0
 
         except requests.exceptions.Timeout as err:
@@ -171,20 +167,20 @@ class EmonHubEconextInterfacer(EmonHubInterfacer):
             self._consecutive_failures += 1
             retry_interval = min(60, 10 * self._consecutive_failures)  # Backoff: 10s, 20s, 30s... max 60s
             self._log.info("Retrying in %d seconds", retry_interval)
-            self._set_poll_timer(retry_interval)
+            self._poll_retry(retry_interval)
 
         except requests.exceptions.ConnectionError as err:
             self._log.warning("Connection error to %s: %s", self._settings["host"], err)
             self._consecutive_failures += 1
             retry_interval = min(60, 10 * self._consecutive_failures)
             self._log.info("Retrying in %d seconds", retry_interval)
-            self._set_poll_timer(retry_interval)
+            self._poll_retry(retry_interval)
 
         except requests.exceptions.RequestException as err:
             self._log.error("HTTP request failed: %s", err)
             self._consecutive_failures += 1
             retry_interval = min(60, 10 * self._consecutive_failures)
-            self._set_poll_timer(retry_interval)
+            self._poll_retry(retry_interval)
 
         except Exception as err:
             exc_type, exc_value, exc_traceback = sys.exc_info()
@@ -192,7 +188,7 @@ class EmonHubEconextInterfacer(EmonHubInterfacer):
             self._log.debug(repr(traceback.format_exception(exc_type, exc_value, exc_traceback)))
             self._consecutive_failures += 1
             retry_interval = min(60, 10 * self._consecutive_failures)
-            self._set_poll_timer(retry_interval)
+            self._poll_retry(retry_interval)
 
         return cargo
 
@@ -213,14 +209,13 @@ class EmonHubEconextInterfacer(EmonHubInterfacer):
         url = f"http://{host}:{port}/api/parameters"
         self._log.debug("Fetching from %s", url)
 
-        r = requests.get(url, timeout=timeout)
-        r.raise_for_status()
+        reply = self._http.fetch([emonhub_http.Endpoint("parameters", url, timeout=timeout)])
 
         # Gateway returns: {"parameters": {"<index>": {"index": N, "name": "...", "value": V, ...}}}
         # Build name->value lookup from index-keyed response
         data = {}
         try:
-            raw_params = r.json()["parameters"]
+            raw_params = reply["parameters"]["parameters"]
             params = {p["name"]: p["value"] for p in raw_params.values()}
 
             # Computed parameters (always included, need special transforms)
@@ -230,18 +225,12 @@ class EmonHubEconextInterfacer(EmonHubInterfacer):
         except (ValueError, KeyError) as e:
             raise Exception("Invalid data from gateway") from e
 
-        # Build effective mapping: defaults overridden/extended by config
-        config_by_gw = dict(self._config_parameters)
-        mapping = [(gw, config_by_gw.pop(gw, feed)) for gw, feed in self.DEFAULT_PARAMETERS]
-        mapping.extend(config_by_gw.items())  # remaining config entries are additions
-
-        for gateway_name, feed_name in mapping:
-            if gateway_name in params:
-                data[feed_name] = params[gateway_name]
-            else:
-                self._log.warning(
-                    "Parameter '%s' not found in gateway response", gateway_name
-                )
+        names, values, missing = self._extractor.extract(params)
+        data.update(zip(names, values))
+        for gateway_name in missing:
+            self._log.warning(
+                "Parameter '%s' not found in gateway response", gateway_name
+            )
 
         self._log.debug("Fetched data: %s", data)
 
@@ -264,8 +253,15 @@ class EmonHubEconextInterfacer(EmonHubInterfacer):
         # Handle parameters separately (needs custom parsing)
         if "parameters" in kwargs:
             parsed = self._parse_parameters(kwargs["parameters"])
-            if parsed != self._config_parameters:
+            previous = self._config_parameters
+            if parsed != previous:
                 self._config_parameters = parsed
+                try:
+                    self._extractor = self._compile_parameters()
+                except ValueError as e:
+                    self._log.warning("Invalid parameters for %s: %s", self.name, e)
+                    self._config_parameters = previous
+            if self._config_parameters != previous:
                 self._log.info(
                     "Setting %s parameters: %s",
                     self.name,
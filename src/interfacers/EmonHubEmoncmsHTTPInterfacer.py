@@ -5,6 +5,7 @@ import json
 import requests
 import zlib
 from binascii import hexlify
+import emonhub_memo as ehm
 from emonhub_interfacer import EmonHubInterfacer
 
 class EmonHubEmoncmsHTTPInterfacer(EmonHubInterfacer):
@@ -39,11 +40,21 @@ class EmonHubEmoncmsHTTPInterfacer(EmonHubInterfacer):
 
         self.session = requests.Session()
 
-    def add(self, cargo):
-        """Append data to buffer.
+    def _memo_key(self):
+        # Interfacers with the same key build the same frames and bodies, see emonhub_memo
+        return ('emoncms', bool(self._settings['sendnames']))
+
+    def _sends_names(self):
+        # Without sendnames the values are posted by position
+        return self._settings['sendnames']
+
+    def _format(self, cargo):
+        """Return the frame of a cargo for the buffer.
 
         """
-        
+        return ehm.memo.get(cargo.uri, self.name, lambda: self._emoncms_frame(cargo))
+
+    def _emoncms_frame(self, cargo):
         f = []
         try:
             f.append(int(cargo.timestamp))
@@ -67,11 +78,11 @@ class EmonHubEmoncmsHTTPInterfacer(EmonHubInterfacer):
                     f.append(cargo.rssi)
                 # Note if number of names and values do not match
                 if len(cargo.names) > 0 and self._settings['sendnames']:
-                    self._log.warning("cargo.names and cargo.realdata have different lengths - " + str(len(cargo.names)) + " vs " + str(len(cargo.realdata)))
+                    self._log.warning("cargo.names and cargo.realdata have different lengths - %d vs %d", len(cargo.names), len(cargo.realdata))
         except:
             self._log.warning("Failed to create emonCMS frame %s", f)
 
-        self.buffer.storeItem(f)
+        return f
 
     def _process_post(self, databuffer):
         """Send data to server."""
@@ -93,7 +104,8 @@ class EmonHubEmoncmsHTTPInterfacer(EmonHubInterfacer):
             # exit and be restarted by supervisord which is preferable to a NaN
             # from LeChacal RPICT7V1 blocking emonhub buffer and no data getting to
             # EmonCMS.
-            data_string = json.dumps(databuffer, separators=(',', ':'), allow_nan=False)
+            data_string = ehm.memo.get_batch(databuffer, self._memo_key(), 'json',
+                                             lambda: json.dumps(databuffer, separators=(',', ':'), allow_nan=False))
             
             # Prepare URL string of the form
             # http://domain.tld/emoncms/input/bulk.json?apikey=12345
@@ -114,22 +126,23 @@ class EmonHubEmoncmsHTTPInterfacer(EmonHubInterfacer):
             if self._settings['compress']:
                 json_str_size = len(data_string)
                 # Compress data and encode as hex string.
-                compressed = zlib.compress(data_string.encode())
+                compressed = ehm.memo.get_batch(databuffer, self._memo_key(), 'zlib',
+                                                lambda: zlib.compress(data_string.encode()))
                 compression_ratio = len(compressed) / json_str_size
                 # Only use compression if it makes sense!
                 if compression_ratio<1.0:
                     post_body = compressed
                     # Set compression flag (cb = compression binary).
                     post_url = post_url + "&cb=1"
-                    self._log.info("sending: %s (%d bytes of data, %d frames, compressed)", post_url, len(post_body),number_of_frames)
-                    self._log.info("compression ratio: %d%%",compression_ratio*100)
+                    self._log.debug("sending: %s (%d bytes of data, %d frames, compressed, ratio %d%%)",
+                                    post_url, len(post_body), number_of_frames, compression_ratio*100)
                 else: 
                     post_body = {'data': data_string}
-                    self._log.info("sending: %s (%d bytes of data, %d frames, uncompressed)", post_url, len(data_string),number_of_frames)
-                    self._log.info("compression ratio: %d%%, sent original",compression_ratio*100)
+                    self._log.debug("sending: %s (%d bytes of data, %d frames, uncompressed, ratio %d%%, sent original)",
+                                    post_url, len(data_string), number_of_frames, compression_ratio*100)
             else: 
                 post_body = {'data': data_string}
-                self._log.info("sending: %s (%d bytes of data, %d frames, uncompressed)", post_url, len(data_string),number_of_frames)
+                self._log.debug("sending: %s (%d bytes of data, %d frames, uncompressed)", post_url, len(data_string), number_of_frames)
             
             result = False
             try:
@@ -152,7 +165,7 @@ class EmonHubEmoncmsHTTPInterfacer(EmonHubInterfacer):
         # Sends status to myip module if enabled
         if self._settings['sendstatus']:
             post_url = self._settings['url'] + '/myip/set.json?apikey='
-            self._log.info("sending: " + post_url + "E-M-O-N-C-M-S-A-P-I-K-E-Y")
+            self._log.debug("sending: %sE-M-O-N-C-M-S-A-P-I-K-E-Y", post_url)
             post_url = post_url + self._settings['apikey']
             try:
                 reply = self.session.get(post_url, timeout=60)
@@ -207,12 +220,14 @@ class EmonHubEmoncmsHTTPInterfacer(EmonHubInterfacer):
                 self._settings[key] = int(setting)
                 continue
             elif key == 'sendnames':
-                self._log.info("Setting " + self.name + " sendnames: " + str(setting))
+                self._log.info("Setting %s sendnames: %s", self.name, setting)
                 self._settings[key] = bool(int(setting))
                 continue
             elif key == 'compress':
-                self._log.info("Setting " + self.name + " compress: " + str(setting))
+                self._log.info("Setting %s compress: %s", self.name, setting)
                 self._settings[key] = bool(int(setting))
                 continue
             else:
                 self._log.warning("'%s' is not valid for %s: %s", setting, self.name, key)
+
+        ehm.memo.register(self.name, self._memo_key())
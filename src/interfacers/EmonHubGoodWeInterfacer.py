@@ -6,8 +6,8 @@
 __author__ = 'Jo Vanvoorden'
 
 import asyncio
+import threading
 import Cargo
-import time
 
 from emonhub_interfacer import EmonHubInterfacer
 from goodwe import Goodwe_inverter
@@ -17,8 +17,32 @@ from goodwe import Goodwe_inverter
 
 Fetch GoodWe state of charge and other variables
 
+The inverter model is discovered once and the inverter object is kept, along
+with its UDP endpoint, until a read fails or the connection settings change.
+All GoodWe interfacers run their requests on one event loop in a background
+thread, so several inverters are polled concurrently without creating an
+event loop and a socket for every read.
+
 """
 
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _run(coro, timeout):
+    """Run coro on the event loop shared by the GoodWe interfacers and return its result"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="GoodWe-asyncio", daemon=True).start()
+    future = asyncio.run_coroutine_threadsafe(coro, _loop)
+    try:
+        return future.result(timeout)
+    except BaseException:
+        future.cancel()
+        raise
+
 class EmonHubGoodWeInterfacer(EmonHubInterfacer):
 
     def __init__(self, name):
@@ -36,49 +60,66 @@ class EmonHubGoodWeInterfacer(EmonHubInterfacer):
         # set an absolute upper limit for number of items to process per post
         self._item_limit = 250
 
+        # Discovered inverter, kept between reads
+        self._inverter = None
+
+    def _drop_inverter(self):
+        """Forget the discovered inverter, it is discovered again on the next read"""
+        if self._inverter is not None:
+            self._inverter.close()
+            self._inverter = None
+
+    def run(self):
+        super().run()
+        # Stopped, e.g. replaced after a configuration change, close the UDP endpoint
+        self.close()
+
+    def close(self):
+        self._drop_inverter()
 
-        # Fetch first reading at one interval lengths time
-        self._last_time = 0
-    
     def read(self):
         # Request GoodWe data at user specified interval
-        if time.time() - self._last_time >= self._settings['readinterval']:
-            self._last_time = time.time()
-
-            # If URL is set, fetch the SOC
-            if self._settings['ip'] != None:
-                try:
-                    self._inverter = asyncio.run(Goodwe_inverter.discover(self._settings['ip'], self._settings['port'], self._settings['timeout'], self._settings['retries']))
-                    data = asyncio.run(self._inverter.read_runtime_data())
-                except asyncio.CancelledError:
-                    self._log.warning("The task %s is cancelled", self.name)
-                
-                self._log.debug("%s Request response: %s", self.name, data)
-
-                names = []
-                values = []
-
-                for key in self._inverter.sensors():
-                    self._log.debug("Key %s found", key.id)
-                    # Check if key.id is in data object readout
-                    if not key.id in data:
-                        self._log.warning("Key %s not found", key.id)
-                        return
-                    # Check if we have a numerical response and return it
-                    if isinstance(data[key.id], (int, float)):
-                        names.append(key.id)
-                        values.append(data[key.id])
-
-                # Create cargo object
-                c = Cargo.new_cargo()
-                c.nodeid = self._settings['name']
-
-                c.names = names
-                c.realdata = values
-                return c
-
-        # return empty if not time
-        return
+        if not self._poll_due(self._settings['readinterval'], immediate=True):
+            return
+
+        # If URL is set, fetch the SOC
+        if self._settings['ip'] != None:
+            # Every request may be retried, discovery probes several protocols
+            timeout = self._settings['timeout'] * (self._settings['retries'] + 1) * 8
+            try:
+                if self._inverter is None:
+                    self._inverter = _run(Goodwe_inverter.discover(self._settings['ip'], self._settings['port'], self._settings['timeout'], self._settings['retries']), timeout)
+                    self._log.info("%s: found GoodWe %s inverter, S/N %s", self.name, self._inverter.model_name, self._inverter.serial_number)
+                data = _run(self._inverter.read_runtime_data(), timeout)
+            except Exception as e:
+                self._log.warning("%s: could not read GoodWe inverter at %s: %s", self.name, self._settings['ip'], str(e) or type(e).__name__)
+                self._drop_inverter()
+                return
+
+            self._log.debug("%s Request response: %s", self.name, data)
+
+            names = []
+            values = []
+
+            for key in self._inverter.sensors():
+                self._log.debug("Key %s found", key.id)
+                # Check if key.id is in data object readout
+                if not key.id in data:
+                    self._log.warning("Key %s not found", key.id)
+                    return
+                # Check if we have a numerical response and return it
+                if isinstance(data[key.id], (int, float)):
+                    names.append(key.id)
+                    values.append(data[key.id])
+
+            # Create cargo object
+            c = Cargo.new_cargo()
+            c.nodeid = self._settings['name']
+
+            c.names = names
+            c.realdata = values
+            return c
+
 
     def set(self, **kwargs):
         for key, setting in self._template_settings.items():
@@ -100,18 +141,22 @@ class EmonHubGoodWeInterfacer(EmonHubInterfacer):
             elif key == 'ip':
                 self._log.info("Setting %s %s: %s", self.name, key, setting)
                 self._settings[key] = setting
+                self._drop_inverter()
                 continue
             elif key == 'port':
                 self._log.info("Setting %s %s: %s", self.name, key, setting)
-                self._settings[key] = setting
+                self._settings[key] = int(setting)
+                self._drop_inverter()
                 continue
             elif key == 'timeout':
                 self._log.info("Setting %s %s: %s", self.name, key, setting)
-                self._settings[key] = setting
+                self._settings[key] = float(setting)
+                self._drop_inverter()
                 continue
             elif key == 'retries':
                 self._log.info("Setting %s %s: %s", self.name, key, setting)
-                self._settings[key] = setting
+                self._settings[key] = int(setting)
+                self._drop_inverter()
                 continue
             else:
                 self._log.warning("'%s' is not valid for %s: %s", setting, self.name, key)
@@ -26,8 +26,11 @@ class EmonHubGraphiteInterfacer(EmonHubInterfacer):
         # set an absolute upper limit for number of items to process per post
         self._item_limit = 250
 
-    def add(self, cargo):
-        """Append data to buffer.
+    def _sends_names(self):
+        return True
+
+    def _format(self, cargo):
+        """Return the frame of a cargo for the buffer.
 
           format: {"emontx":{"power1":100,"power2":200,"power3":300}}
 
@@ -52,7 +55,7 @@ class EmonHubGraphiteInterfacer(EmonHubInterfacer):
         if cargo.rssi:
             f['data']['rssi'] = cargo.rssi
 
-        self.buffer.storeItem(f)
+        return f
 
 
     def _process_post(self, databuffer):
@@ -24,7 +24,7 @@ class EmonHubJeeInterfacer(ehi.EmonHubSerialInterfacer):
 
         # Display device firmware version and current settings
         self.info = ["", ""]
-        if self._ser is not None:
+        if self._ser:
             self._ser.write(b"v")
             time.sleep(2)  # FIXME sleep in initialiser smells
             self._rx_buf = self._rx_buf + self._ser.readline().decode()
@@ -43,8 +43,8 @@ class EmonHubJeeInterfacer(ehi.EmonHubSerialInterfacer):
                     self._log.info("%s device firmware version & configuration: not available", self.name)
             else:
                 self._log.warning("Device communication error - check settings")
+            self._ser.flushInput()
         self._rx_buf = ""
-        self._ser.flushInput()
 
         # Initialize settings
         self._defaults.update({'pause': 'off', 'interval': 0, 'datacode': 'h'})
@@ -80,22 +80,15 @@ class EmonHubJeeInterfacer(ehi.EmonHubSerialInterfacer):
 
         """
 
-        # Read serial RX
-        try:
-            self._rx_buf = self._rx_buf + self._ser.readline().decode()
-        except UnicodeDecodeError:
+        if not self._reconnect():
             return
 
-        # If line incomplete, exit
-        if '\r\n' not in self._rx_buf:
+        # Next complete line received, if any
+        f = self._readline()
+        if f is None:
             return
 
-        # Remove CR,LF.
-        f = self._rx_buf[:-2].strip()
-
-        # Reset buffer
-        self._rx_buf = ''
-
+        f = f.strip()
         if not f:
             return
 
@@ -198,6 +191,9 @@ class EmonHubJeeInterfacer(ehi.EmonHubSerialInterfacer):
                 continue
             self._settings[key] = setting
             self._log.info("Setting %s %s: %s (%s)", self.name, key, setting, command)
+            if not self._ser:
+                self._log.warning("%s serial port closed, %s not sent to the device", self.name, key)
+                continue
             self._ser.write(command.encode())
             # Wait a sec between two settings
             time.sleep(1)
@@ -216,11 +212,11 @@ class EmonHubJeeInterfacer(ehi.EmonHubSerialInterfacer):
 
         # Broadcast time to synchronize emonGLCD
         interval = int(self._settings['interval'])
-        if interval:  # A value of 0 means don't do anything
+        if interval and self._ser:  # A value of 0 means don't do anything
             if t - self._interval_timestamp > interval:
                 self._interval_timestamp = t
                 now = datetime.datetime.now()
-                self._log.debug(self.name + " broadcasting time: %02d:%02d" % (now.hour, now.minute))
+                self._log.debug("%s broadcasting time: %02d:%02d", self.name, now.hour, now.minute)
                 self._ser.write(b"00,%02d,%02d,00,s" % (now.hour, now.minute))
 
     def _process_post(self, databuffer):
@@ -245,11 +241,15 @@ class EmonHubJeeInterfacer(ehi.EmonHubSerialInterfacer):
         payload = ""
         for value in range(0, len(data)):
             if int(data[value]) < 0 or int(data[value]) > 255:
-                self._log.warning(self.name + " discarding Tx packet: values out of scope" )
+                self._log.warning("%s discarding Tx packet: values out of scope", self.name)
                 return
             payload += str(int(data[value]))+","
 
         payload += '0' + cmd
 
-        self._log.info(str(f.uri) + " sent TX packet: " + payload)
+        if not self._ser:
+            self._log.warning("%s serial port closed, discarding Tx packet", self.name)
+            return
+
+        self._log.info("%s sent TX packet: %s", f.uri, payload)
         self._ser.write(payload.encode())
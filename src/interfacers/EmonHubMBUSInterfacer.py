@@ -5,6 +5,9 @@ import serial
 import serial.tools.list_ports
 import struct
 import os
+import select
+import operator
+import concurrent.futures
 from emonhub_interfacer import EmonHubInterfacer
 
 """
@@ -25,58 +28,135 @@ from emonhub_interfacer import EmonHubInterfacer
             [[[[[qalcosonic]]]]]
                 address = 2
                 type = qalcosonic_e3
+                # optional: read this meter less often than read_interval
+                read_interval = 60
+            [[[[[kamstrup]]]]]
+                address = 3
+                type = kamstrup403
+                # optional: meter on a second bus, polled in parallel
+                device = /dev/ttyUSB1
+                baud = 2400
 """
 
-"""class EmonHubMBUSInterfacer
-
-MBUS interfacer for use in development
+# M-Bus timing (EN 13757-2) in bit periods
+MBUS_BITS_PER_CHAR = 11          # start bit, 8 data bits, even parity, stop bit
+MBUS_RESPONSE_BITS = 330         # a slave must answer within 330 bit periods + 50 ms
+MBUS_RESPONSE_EXTRA = 0.05
+MBUS_IDLE_BITS = 33              # minimum bus idle time between two frames
+
+# Allowance for the latency of USB serial converters
+MBUS_ADAPTER_LATENCY = 0.1
+
+# A meter that doesn't answer is polled at most this many times less often
+MBUS_MAX_BACKOFF = 8
+
+# Data records start after the fixed header of a RSP_UD long frame
+MBUS_RECORDS_START = 19
+
+# Length and coding of the data field, indexed by DIF & 0x0F
+MBUS_DATA_TYPES =   ('null','int','int','int','int','float','int','int','null','bcd','bcd','bcd','bcd','var','bcd','null')
+MBUS_DATA_LENGTHS = (0,1,2,3,4,4,6,8,0,1,2,3,4,6,6,0)
+
+# Name suffix, indexed by the function field (DIF & 0x30) >> 4
+MBUS_FUNCTION_TYPES = ("","_Max","_Min","_error")
+
+# (scale, name, unit) by VIF
+MBUS_VIF = {
+    0x03: (0.001, "Energy", "kWh"),
+    0x04: (0.01, "Energy", "kWh"),
+    0x05: (0.1, "Energy", "kWh"),
+    0x06: (1, "Energy", "kWh"),
+    0x07: (10, "Energy", "kWh"),
+    0x13: (0.001, "Volume", "m3"),
+    0x14: (0.01, "Volume", "m3"),
+    0x15: (0.1, "Volume", "m3"),
+    0x16: (1, "Volume", "m3"),
+    0x17: (10, "Volume", "m3"),
+    0x20: (1, "Ontime", "s"),
+    0x22: (1, "Ontime Hours", "h"),
+    0x24: (1, "OperatingTime", "s"),
+    0x2a: (0.1, "Power", "W"),
+    0x2b: (1, "Power", "W"),
+    0x2c: (10, "Power", "W"),
+    0x2d: (100, "Power", "W"),
+    0x2e: (1000, "Power", "W"),
+
+    0x38: (0.000001, "FlowRate", "m3/h"), # mm3/h
+    0x39: (0.00001, "FlowRate", "m3/h"), # mm3/h
+    0x3a: (0.0001, "FlowRate", "m3/h"), # mm3/h
+    0x3b: (0.001, "FlowRate", "m3/h"), # mm3/h
+    0x3c: (0.01, "FlowRate", "m3/h"), # mm3/h
+    0x3d: (0.1, "FlowRate", "m3/h"), # mm3/h
+    0x3e: (1, "FlowRate", "m3/h"), # m3/h
+    # 0x40: (0.06, "FlowRate", "m3/h"), # 1.0e-7 m3/min
+    0x59: (0.01, "FlowT", "C"),
+    0x5a: (0.1, "FlowT", "C"),
+    0x5b: (1, "FlowT", "C"),
+    0x5d: (0.01, "ReturnT", "C"),
+    0x5e: (0.1, "ReturnT", "C"),
+    0x5f: (1, "ReturnT", "C"),
+    0x61: (0.01, "DeltaT", "C"),
+    0x62: (0.1, "DeltaT", "C"),
+    0x63: (1, "DeltaT", "C"),
+    0x67: (1, "ExternalT", "C"),
+
+    0x6d: (1, "DateTime", ""),
+    #0x70: (1, "Average duration", ""),
+    #0x74: (1, "Duration seconds actual", ""),
+    #0x75: (1, "Duration minutes actual", ""),
+    #0x78: (1, "Fab No", ""),
+    #0x79: (1, "Enhanced", "")
+    0x84: (10, "Energy", "Wh"),
+    0x78: (1,"FabNo",""),
+    0x7f: (1,"ManSpec","")
+    # 0xfd: (1, "Extended", "")
+}
+
+# (scale, name, unit) by VIFE
+MBUS_VIFE = {
+    0x47: (0.01, "Voltage", "V"),  # SDM120
+    0x59: (0.001, "Current", "A"), # SDM120
+    0x3a: (0.01, "Frequency", "Hz"), # SDM120
+    0x3b: (1, "Energy", "kWh"),    # Qalcosonic
+    0x3c: (1, "Cooling", "kWh"),   # Qalcosonic
+}
+
+# Value of a BCD byte, a sign (0xF) or invalid upper nibble counts as 0
+BCD_BYTE = tuple((b >> 4 if b >> 4 < 0xA else 0) * 10 + (b & 0xF) for b in range(256))
+
+FLOAT = struct.Struct("<f")
+
+"""class MBusSerial
+
+One M-Bus serial line (device and baud rate) and the request/response
+transactions on it.
+
+Frames are read with one ser.read() for the 4 byte header and one for the
+remainder, whose length is given by the header. Read timeouts and the idle
+time between frames are derived from the baud rate.
 
 """
 
-class EmonHubMBUSInterfacer(EmonHubInterfacer):
-
-    def __init__(self, name, device="/dev/ttyUSB0", device_vid=False, device_pid=False, baud=2400, use_meterbus_lib=False):
-        """Initialize Interfacer
-
-        """
-        # Initialization
-        super(EmonHubMBUSInterfacer, self).__init__(name)
-
-        # This line will stop the default values printing to logfile at start-up
-        # self._settings.update(self._defaults)
-
-        # Interfacer specific settings
-        self._MBUS_settings = {'read_interval': 10.0,
-                               'nodename':'MBUS',
-                               'validate_checksum': True,
-                               'meters':[]}
+class MBusSerial:
 
-        self.next_interval = True
-        
+    def __init__(self, log, device, baud, device_vid=False, device_pid=False):
+        self._log = log
         self.device = device
         self.device_vid = device_vid
         self.device_pid = device_pid
-        self.baud = baud
-        
-        self.debug_data_frame = False
-        
+        self.baud = int(baud)
+
+        self.char_time = MBUS_BITS_PER_CHAR / self.baud
+        self.response_timeout = MBUS_RESPONSE_BITS / self.baud + MBUS_RESPONSE_EXTRA + MBUS_ADAPTER_LATENCY
+        self.idle_time = MBUS_IDLE_BITS / self.baud
+
+        self.ser = False
         self.invalid_count = 0
+        # Time the bus was last active and time to send the last request
+        self._last_activity = 0
+        self._tx_time = 0
 
-        # Only load module if it is installed
         self.connect()
-            
-        # If use_meterbus_lib is true, try to load module
-        # pip3 install pyMeterBus
-        self.use_meterbus_lib = False
-        if use_meterbus_lib:
-            try:
-                from pyMeterBus import meterbus
-                self.meterbus = meterbus
-                self.use_meterbus_lib = True
-            except ModuleNotFoundError as err:
-                self._log.error(err)
-                self.use_meterbus_lib = False
-
 
     def connect(self):
         """Connect to MBUS
@@ -117,24 +197,51 @@ class EmonHubMBUSInterfacer(EmonHubInterfacer):
 
         # if device is still False, log error and return False
         if not device:
-            self._log.error("Could not find MBUS device")
+            self._log.error("Could not find MBUS device %s", self.device)
             self.ser = False
             return False
 
         try:
             self._log.debug("Connecting to MBUS serial: " + device + " " + str(self.baud))
-            self.ser = serial.Serial(device, self.baud, 8, 'E', 1, 0.5)
+            self.ser = serial.Serial(device, self.baud, 8, 'E', 1, self.response_timeout)
         except Exception:
             self._log.error("Could not connect to MBUS serial")
             self.ser = False
 
     def mbus_serial_write(self,data):
+        # Leave the bus idle between frames
+        idle = self._last_activity + self.idle_time - time.monotonic()
+        if idle > 0:
+            time.sleep(idle)
         try:
+            # Discard anything left over from a previous transaction
+            self.ser.reset_input_buffer()
             self.ser.write(data)
+            self._tx_time = len(data) * self.char_time
         except Exception:
             self.ser = False
             self._log.error("Could not write to MBUS serial port")
 
+    def _read(self, length, timeout):
+        """Read up to length bytes, waiting at most timeout seconds
+
+        Bytes are read in as few ser.read() calls as they arrive in, without
+        reconfiguring the port timeout for every transaction.
+
+        """
+        deadline = time.monotonic() + timeout
+        data = bytearray()
+        while len(data) < length:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            ready, _, _ = select.select([self.ser.fileno()], [], [], remaining)
+            if not ready:
+                break
+            data += self.ser.read(min(length - len(data), max(self.ser.in_waiting, 1)))
+        self._last_activity = time.monotonic()
+        return bytes(data)
+
     def mbus_short_frame(self, address, C_field):
         data = [0x10,C_field,address,0x0,0x16]
         data[3] = (data[1]+data[2]) % 256
@@ -149,7 +256,7 @@ class EmonHubMBUSInterfacer(EmonHubInterfacer):
         data = [0x68,0x06,0x06,0x68,0x53,old_address,0x51,0x01,0x7A,new_address,0x0,0x16]
         data = self.checksum(data)
         self.mbus_serial_write(data)
-        
+
     def mbus_set_baudrate(self, address, baudrate):
         baudrate_hex = 0xBB # default is 2400
         if baudrate==300: baudrate_hex = 0xB8
@@ -158,7 +265,7 @@ class EmonHubMBUSInterfacer(EmonHubInterfacer):
         if baudrate==2400: baudrate_hex = 0xBB
         if baudrate==4800: baudrate_hex = 0xBC
         if baudrate==9600: baudrate_hex = 0xBD
-    
+
         data = [0x68,0x03,0x03,0x68,0x53,address,baudrate_hex,0x0,0x16]
         data = self.checksum(data)
         self.mbus_serial_write(data)
@@ -168,7 +275,7 @@ class EmonHubMBUSInterfacer(EmonHubInterfacer):
         data = [0x68,0x0B,0x0B,0x68,0x73,0xFD,0x52,a2d,a2c,a2b,a2a,0xFF,0xFF,0xFF,0xFF,0x0,0x16]
         data = self.checksum(data)
         self.mbus_serial_write(data)
-        
+
     def mbus_request(self, address, telegram):
         data = [0x68,0x07,0x07,0x68,0x53,address,0x51,0x01,0xFF,0x08,telegram,0x0,0x16]
         data = self.checksum(data)
@@ -189,252 +296,276 @@ class EmonHubMBUSInterfacer(EmonHubInterfacer):
     def set_page(self, address, page):
         for retry in range(10):
             self.mbus_request(address, page)
-            time.sleep(0.3)
-            
+            if not self.ser:
+                return False
             try:
-                if self.ser.in_waiting and ord(self.ser.read(1)) == 0xE5:
+                if self._read(1, self._tx_time + self.response_timeout) == b'\xe5':
                     self._log.debug("ACK")
-                    time.sleep(0.5)
                     return True
-                else:
-                    time.sleep(0.2)
             except Exception:
                 self.ser = False
                 self._log.error("set_page could not read from serial port")
-                   
+                return False
+
         return False
 
+    def request_data(self, address, validate_checksum=True):
+        """Request user data (REQ_UD2) and return the response frame"""
+        for i in range(0,2):
+            self.mbus_short_frame(address, 0x5b)
+            frame = self.read_data_frame(validate_checksum)
+            if frame is not None:
+                return frame
+
+    def request_data_sdm120(self, address, validate_checksum=True):
+        for i in range(0,2):
+            self.mbus_request_sdm120(address)
+            frame = self.read_data_frame(validate_checksum)
+            if frame is not None:
+                return frame
+
+    def read_data_frame(self, validate_checksum=True):
+        """Read a long frame (0x68 L L 0x68 ... CS 0x16)
+
+        Returns the frame as bytes or None if no valid frame was received.
+
+        """
+        if not self.ser:
+            return None
+
+        start_time = time.time()
+        frame = b''
+        try:
+            # Header, once the request has been sent and the slave has answered
+            frame = self._read(4, self._tx_time + self.response_timeout)
+            if len(frame) == 4 and frame[0] == 0x68 and frame[3] == 0x68 and frame[1] == frame[2]:
+                length = frame[1]
+                # Remainder: data, checksum and stop byte, allowing for gaps between characters
+                remainder = length + 2
+                frame += self._read(remainder, 2 * remainder * self.char_time + self.response_timeout)
+
+                if len(frame) == length + 6 and frame[-1] == 0x16:
+                    if not validate_checksum or sum(frame[4:-2]) % 256 == frame[-2]:
+                        self.invalid_count = 0
+                        return frame
+        except Exception:
+            self.ser = False
+            self._log.error("read_data_frame could not read from serial port")
+
+        # If we are here data response is corrupt
+        time_elapsed = time.time()-start_time
+        self.invalid_count += 1
+        self._log.debug("Invalid MBUS data received %d bytes %0.1f ms, count: %d", len(frame), time_elapsed*1000, self.invalid_count)
+
+        if self.invalid_count>=10:
+            # Reset invalid count
+            self.invalid_count = 0
+            self._log.debug("Invalid count = 10. Restarting MBUS serial connection on next read")
+            self.ser = False
+        return None
+
+"""class EmonHubMBUSInterfacer
+
+MBUS interfacer for use in development
+
+Meters are scheduled individually, each on its own read_interval, and meters
+on different serial buses are read in parallel.
+
+"""
+
+class EmonHubMBUSInterfacer(EmonHubInterfacer):
+
+    def __init__(self, name, device="/dev/ttyUSB0", device_vid=False, device_pid=False, baud=2400, use_meterbus_lib=False):
+        """Initialize Interfacer
+
+        """
+        # Initialization
+        super(EmonHubMBUSInterfacer, self).__init__(name)
+
+        # This line will stop the default values printing to logfile at start-up
+        # self._settings.update(self._defaults)
+
+        # Interfacer specific settings
+        self._MBUS_settings = {'read_interval': 10.0,
+                               'nodename':'MBUS',
+                               'validate_checksum': True,
+                               'meters':[]}
+
+        self.device = device
+        self.baud = int(baud)
+
+        self.debug_data_frame = False
+
+        # Record layout of the frames of each meter
+        self._layouts = {}
+
+        # Serial buses by (device, baud), the interfacer's own bus is opened straight away
+        self._buses = {(device, self.baud): MBusSerial(self._log, device, self.baud, device_vid, device_pid)}
+        self._executor = None
+        self._executor_workers = 0
+
+        # Per meter consecutive failed reads, meters are polled with the meter name as poll key
+        self._failures = {}
+
+        # Cycle time instrumentation
+        self.cycle_time = 0
+        self.cycle_time_max = 0
+        self.cycle_overruns = 0
+
+        # If use_meterbus_lib is true, try to load module
+        # pip3 install pyMeterBus
+        self.use_meterbus_lib = False
+        if use_meterbus_lib:
+            try:
+                from pyMeterBus import meterbus
+                self.meterbus = meterbus
+                self.use_meterbus_lib = True
+            except ModuleNotFoundError as err:
+                self._log.error(err)
+                self.use_meterbus_lib = False
+
+
+    def run(self):
+        super().run()
+        # Stopped, e.g. replaced after a configuration change, release the buses
+        self.close()
+
+    def close(self):
+        """Stop the bus worker threads and close the serial ports"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+            self._executor_workers = 0
+        for bus in self._buses.values():
+            if bus.ser:
+                bus.ser.close()
+                bus.ser = False
+
     def decodeBCD(self, bcd_data):
         val = 0
-        i = len(bcd_data)
-        while i > 0:
-            val = val * 10
-            if bcd_data[i-1] >> 4 < 0xA:
-                val += (bcd_data[i-1] >> 4) & 0xF
-            val = (val * 10) + (bcd_data[i-1] & 0xF)
-            i -= 1
+        for byte in reversed(bcd_data):
+            val = val * 100 + BCD_BYTE[byte]
         if bcd_data[-1] >> 4 == 0xF:
             val *= -1
         return val
 
     def decodeInt(self,bytes):
-        if len(bytes) == 1:
-            return bytes[0]
-        if len(bytes) == 2:
-            return struct.unpack("h", bytearray(bytes))[0]
-        if len(bytes) == 3:
-            return bytes[0] + (bytes[1]<<8) + (bytes[2]<<16)
-        if len(bytes) == 4:
-            return struct.unpack("i", bytearray(bytes))[0]
+        # 1 and 3 byte values are unsigned, others are signed
+        if len(bytes) in (1, 3):
+            return int.from_bytes(bytes, 'little')
+        if len(bytes) in (2, 4, 6, 8):
+            return int.from_bytes(bytes, 'little', signed=True)
         return False
 
-    def parse_frame(self,data,records):
-        data_types =   ['null','int','int','int','int','float','int','int','null','bcd','bcd','bcd','bcd','var','bcd','null']
-        data_lengths = [0,1,2,3,4,4,6,8,0,1,2,3,4,6,6,0]
-        vif = {
-            0x03: (0.001, "Energy", "kWh"),
-            0x04: (0.01, "Energy", "kWh"),
-            0x05: (0.1, "Energy", "kWh"),
-            0x06: (1, "Energy", "kWh"),
-            0x07: (10, "Energy", "kWh"),
-            0x13: (0.001, "Volume", "m3"),
-            0x14: (0.01, "Volume", "m3"),
-            0x15: (0.1, "Volume", "m3"),
-            0x16: (1, "Volume", "m3"),
-            0x17: (10, "Volume", "m3"),
-            0x20: (1, "Ontime", "s"),
-            0x22: (1, "Ontime Hours", "h"),
-            0x24: (1, "OperatingTime", "s"),
-            0x2a: (0.1, "Power", "W"),
-            0x2b: (1, "Power", "W"),
-            0x2c: (10, "Power", "W"),
-            0x2d: (100, "Power", "W"),       
-            0x2e: (1000, "Power", "W"),
-            
-            0x38: (0.000001, "FlowRate", "m3/h"), # mm3/h
-            0x39: (0.00001, "FlowRate", "m3/h"), # mm3/h
-            0x3a: (0.0001, "FlowRate", "m3/h"), # mm3/h
-            0x3b: (0.001, "FlowRate", "m3/h"), # mm3/h
-            0x3c: (0.01, "FlowRate", "m3/h"), # mm3/h
-            0x3d: (0.1, "FlowRate", "m3/h"), # mm3/h
-            0x3e: (1, "FlowRate", "m3/h"), # m3/h
-            # 0x40: (0.06, "FlowRate", "m3/h"), # 1.0e-7 m3/min
-            0x59: (0.01, "FlowT", "C"),
-            0x5a: (0.1, "FlowT", "C"),
-            0x5b: (1, "FlowT", "C"),
-            0x5d: (0.01, "ReturnT", "C"),
-            0x5e: (0.1, "ReturnT", "C"),
-            0x5f: (1, "ReturnT", "C"),
-            0x61: (0.01, "DeltaT", "C"),
-            0x62: (0.1, "DeltaT", "C"),
-            0x63: (1, "DeltaT", "C"),
-            0x67: (1, "ExternalT", "C"),
-
-            0x6d: (1, "DateTime", ""),
-            #0x70: (1, "Average duration", ""),
-            #0x74: (1, "Duration seconds actual", ""),
-            #0x75: (1, "Duration minutes actual", ""),
-            #0x78: (1, "Fab No", ""),
-            #0x79: (1, "Enhanced", "")
-            0x84: (10, "Energy", "Wh"),
-            0x78: (1,"FabNo",""),
-            0x7f: (1,"ManSpec","")
-            # 0xfd: (1, "Extended", "")
-        }
-        vife = {
-            0x47: (0.01, "Voltage", "V"),  # SDM120
-            0x59: (0.001, "Current", "A"), # SDM120
-            0x3a: (0.01, "Frequency", "Hz"), # SDM120
-            0x3b: (1, "Energy", "kWh"),    # Qalcosonic
-            0x3c: (1, "Cooling", "kWh"),   # Qalcosonic
-        }
-        
-        function_types = ["","Max","Min","error","special","special","more_to_follow"]
+    def decodeFloat(self,bytes):
+        return FLOAT.unpack(bytes)[0]
 
-        header = ["START","LEN","LEN","START","C FIELD","ADDRESS","CI FIELD","ID","ID","ID","ID","MID","MID","GEN","MEDIA","ACCESS","ACCESS","SIGNATURE","SIGNATURE"]
+    def compile_layout(self,data,records):
+        """Walk the data records of a frame and return its layout
 
-        checksum = 0
-        next = 'START'
-        length = 0
-        bid_end = len(data)-1
-        bid_checksum = len(data)-2
+        Returns (positions, layout): the offsets of all DIF/DIFE/VIF/VIFE bytes,
+        which identify the record structure, and a list of
+        (name, offset, length, decoder, scale, unit) for the selected records.
 
-        result = {}
+        """
+        decoders = {'int': self.decodeInt, 'float': self.decodeFloat, 'bcd': self.decodeBCD}
+
+        positions = []
+        selected = {}
         name_count = {}
         record = 0
-        
-        debug = self.debug_data_frame
 
-        for bid in range(0,len(data)):
-            this = next
+        pos = MBUS_RECORDS_START
+        end = len(data) - 2      # checksum and stop byte
+        while pos < end:
+            # DIF
+            DIF = data[pos]
+            positions.append(pos)
+            pos += 1
+            data_len = MBUS_DATA_LENGTHS[DIF & 0x0F]
+            data_type = MBUS_DATA_TYPES[DIF & 0x0F]
+            function = MBUS_FUNCTION_TYPES[(DIF & 0x30) >> 4]
+            # No data to decode, e.g. idle filler or manufacturer specific data
+            if data_len == 0:
+                break
+
+            # DIFE
+            val = DIF
+            while val >= 0x80 and pos < end:
+                val = data[pos]
+                positions.append(pos)
+                pos += 1
+            if pos >= end:
+                break
+
+            # VIF
+            val = data[pos]
+            positions.append(pos)
+            pos += 1
+            scale, name, unit = MBUS_VIF.get(val, (1, "", ""))
+
+            # VIFE
+            while val >= 0x80 and pos < end:
+                val = data[pos]
+                positions.append(pos)
+                pos += 1
+                if val in MBUS_VIFE:
+                    scale, name, unit = MBUS_VIFE[val]
+
+            # DATA
+            if pos + data_len > end:
+                break
+            offset = pos
+            pos += data_len
+            record = record + 1
+
+            # --------------------------
+            if name=="": name = "Record"
+            # Apply function
+            name += function
+            # Count variables with same name
+            if name not in name_count:
+                name_count[name] = 0
+            name_count[name] += 1
+            # Apply name index
+            if name != "Record":
+                if name in selected:
+                    name += str(name_count[name])
+            else:
+                name += str(record)
+            # --------------------------
 
-            val = data[bid]
-            if debug: print(bid,end='\t')
-            if debug: print(val,end='\t')
-            if debug: print(hex(val),end='\t')
-            
-            # Header info for debug
-            if bid<len(header): this = header[bid]
-            
-            # Start
-            if bid==0 and val!=0x68: this += " INVALID"
-            # Length
-            if bid==1:
-                length = val
-                bid_end = length+4+2-1
-                bid_checksum = bid_end-1
-            # Length
-            if bid==2 and val!=length: this += " INVALID"
-            # Start repeat
-            if bid==3 and val!=0x68: this += " INVALID"
-
-            # Checksum
-            if bid>3 and bid<bid_checksum:
-                checksum += val
-
-            if bid==bid_checksum:
-                this = "CHECKSUM"
-                if val!=checksum%256:
-                    this += " INVALID"
-            
-            if bid==bid_end and val==0x16: this = "END"
-
-            if debug: print(this,end=' \t')
-
-            if bid==18:
-                if debug: print("\n-----------------------------------------",end='\t')
-                next = 'DIF'
-
-            if bid>=19 and bid<len(data):
-                
-                if this=='DIF':
-                    DIF = val
-                    if DIF>=0x80: next='DIFE'
-                    else: next='VIF'
-                        
-                    data_count = 0
-                    data_field = DIF & 0x0F
-                    data_len = data_lengths[data_field]
-                    data_type = data_types[data_field]
-
-                    function = (DIF & 0x30) >> 4
-                    if function < len(function_types):
-                        function = function_types[function]
-                    else:
-                        function = ""
-
-                    if debug: print(str(data_type)+"("+str(data_len)+") "+str(function)+" "+str(record+1),end='\t')
-                    
-                    name = ""
-                    scale = 1
-                    unit = ""
+            if data_type in decoders and (record in records or len(records)==0):
+                selected[name] = (name, offset, data_len, decoders[data_type], scale, unit)
+                if self.debug_data_frame:
+                    self._log.debug("MBUS record %d %s offset %d %s %d bytes, scale %s %s",
+                                    record, name, offset, data_type, data_len, scale, unit)
 
-                if this=='DIFE':
-                    if val>=0x80: next='DIFE' 
-                    else: next='VIF'
-                    
-                if this=='VIF':
-                    VIF = val
-                    if VIF in vif:
-                        scale = vif[VIF][0]
-                        name = vif[VIF][1]                
-                        unit = vif[VIF][2]
-                        if debug: print(name,end='\t')
-                    
-                    if val>=0x80: next='VIFE'
-                    else: next='DATA'
-                  
-                if this=='VIFE':
-                    VIFE = val
-                    if VIFE in vife:
-                        scale = vife[VIFE][0]
-                        name = vife[VIFE][1]                
-                        unit = vife[VIFE][2]
-                        if debug: print(name,end='\t')
-                              
-                    if val>=0x80: next='VIFE'
-                    else: next='DATA'
-
-                if this=='DATA':
-                    data_count = data_count + 1
-                    if data_count==data_len:
-                    
-                      bytes = data[bid-data_len+1:bid+1]
-                      if data_type == "int": value = self.decodeInt(bytes)
-
-                      if data_type == "float":
-                          if data_len == 4:
-                              value = struct.unpack("f", bytearray(bytes))[0]
-
-                      if data_type == "bcd":
-                          value = self.decodeBCD(bytes)
-                      
-                      if debug: print(str(value*scale)+" "+str(unit),end='\t')
-                      record = record + 1
-                      
-                      # --------------------------
-                      if name=="": name = "Record"
-                      # Apply function 
-                      if function != '':
-                          name += "_" + function
-                      # Count variables with same name
-                      if name not in name_count:
-                          name_count[name] = 0
-                      name_count[name] += 1
-                      # Apply name index
-                      if name != "Record":
-                          if name in result:
-                              name += str(name_count[name])
-                      else: 
-                          name += str(record)
-                      # --------------------------
-                      
-                      if record in records or len(records)==0:
-                          result[name] = [value*scale,unit]
-                      if debug: print("\n-----------------------------------------",end='\t')
-                      next='DIF'
-            
-            if debug: print()
+        return positions, list(selected.values())
+
+    def parse_frame(self,data,records,meter=None):
+        """Decode the records of a frame
+
+        The record layout of each meter is cached, keyed by its DIF/VIF bytes,
+        so repeat telegrams with the same structure skip straight to decoding.
+
+        """
+        data = bytes(data)
+        key = (meter, tuple(records))
+        cached = self._layouts.get(key) if meter is not None else None
+
+        if cached and cached[0] == len(data) and cached[1](data) == cached[2]:
+            layout = cached[3]
+        else:
+            positions, layout = self.compile_layout(data,records)
+            if meter is not None and positions:
+                signature = operator.itemgetter(*positions)
+                self._layouts[key] = (len(data), signature, signature(data), layout)
+
+        view = memoryview(data)
+        result = {}
+        for name, offset, length, decode, scale, unit in layout:
+            result[name] = [decode(view[offset:offset+length])*scale, unit]
 
         if 'FlowT' in result and 'ReturnT' in result and 'FlowRate' in result:
             value = 4150 * (result['FlowT'][0] - result['ReturnT'][0]) * (result['FlowRate'][0] * (1000 / 3600))
@@ -456,103 +587,72 @@ class EmonHubMBUSInterfacer(EmonHubInterfacer):
             
         return result
 
-    def request_data(self, address, records):
-        for i in range(0,2):
-            self.mbus_short_frame(address, 0x5b)
-            # time.sleep(1.0)
-            result = self.read_data_frame(records)
-            if result!=None:
-                return result
-            else:
-                time.sleep(0.2) 
-
-    def request_data_sdm120(self, address, records):
-        for i in range(0,2):
-            self.mbus_request_sdm120(address)
-            # time.sleep(1.0)
-            result = self.read_data_frame(records)
-            if result!=None:
-                return result
-            else:
-                time.sleep(0.2) 
-
+    def parse(self, frame, records, meter=None):
+        """Decode the records of a response frame, None if there is no frame"""
+        if frame is None:
+            return None
+        if self.use_meterbus_lib:
+            return self.parse_frame_meterbus_lib(list(frame),records)
+        return self.parse_frame(frame,records,meter)
+
+    def read_meter(self, bus, meter):
+        """Run the transactions for one meter and return the list of decoded results"""
+        address = self._settings['meters'][meter]['address']
+        meter_type = self._settings['meters'][meter]['type']
+        validate = self._settings['validate_checksum']
+        results = []
+
+        # Most mbus meters use standard request, page 0 or default, all records
+        if meter_type=="standard":
+            results.append(self.parse(bus.request_data(address,validate),[],meter))
+
+        # Qalcosonic E3
+        elif meter_type=="qalcosonic_e3":
+            results.append(self.parse(bus.request_data(address,validate),[4,5,6,7,8,9,10,11,12,13,14,15],meter))
+
+        # ------------------------------------------------------
+        # Sontex Multical 531
+        elif meter_type=="sontex531":
+            # p1
+            bus.set_page(address, 1)
+            results.append(self.parse(bus.request_data(address,validate),[4,5],meter))
+            # p3
+            bus.set_page(address, 3)
+            results.append(self.parse(bus.request_data(address,validate),[1,2,3,4],meter))
+
+        # SDM120 special request command
+        elif meter_type=="sdm120":
+            # 1. Get energy data
+            results.append(self.parse(bus.request_data(address,validate),[1],meter))
+            # 2. Get instantaneous data
+            results.append(self.parse(bus.request_data_sdm120(address,validate),[1,7,11,23],meter))
+        elif meter_type=="kamstrup403":
+            results.append(self.parse(bus.request_data(address,validate),[1,4,7,8,9,10,11,12,14],meter))
+            # ------------------------------------------------------
+
+        return results
+
+    def poll_bus(self, bus, meters):
+        """Read the meters on one bus, one after the other
+
+        Returns a list of (meter, results, read time) in the order given.
 
-    def read_data_frame(self,records):
-        data = []
-        bid = 0
-        bid_end = 255
-        bid_checksum = 255
-        checksum = 0
-        valid = False
-        
-        start_time = time.time()
-        
-        val = 0
-        try:
-            while (time.time()-start_time)<2.0:
-                while self.ser.in_waiting:
-                    # Read in byte
-                    val = ord(self.ser.read(1))
-                    data.append(val)
-                    # print(str(bid)+" "+str(val)+" "+str(hex(val)))
-                    # Long frame start, reset checksum
-                    if bid == 0 and val == 0x68:
-                        # print("MBUS start")
-                        valid = True
-                        checksum = 0
-
-                    # 2nd byte is the frame length
-                    if valid and bid == 1:
-                        length = val
-                        bid_end = length + 4 + 2 - 1
-                        bid_checksum = bid_end - 1
-                        # print("MBUS length "+str(length))
-                        # print("MBUS bid_end "+str(bid_end))
-                        # print("MBUS bid_checksum "+str(bid_checksum))
-
-                    if valid and bid == 2 and val != length:
-                        valid = False                       # 3rd byte is also length, check that its the same as 2nd byte
-                    if valid and bid == 3 and val != 0x68:
-                        valid = False                         # 4th byte is the start byte again
-                    if valid and bid > 3 and bid < bid_checksum:
-                        checksum += val                 # Increment checksum during data portion of frame
-
-                    if valid and bid == bid_checksum and val != checksum % 256:
-                        if self._settings['validate_checksum']: 
-                            valid = False  # Validate checksum
-                            
-                    if bid == bid_end and val == 0x16:
-                        time_elapsed = time.time()-start_time
-
-                        self.invalid_count += 1
-                        self._log.debug("Invalid MBUS data received %d bytes %0.1f ms, count: %d" % (bid,time_elapsed*1000,self.invalid_count))
-                                
-                        if valid: # Parse frame if still valid
-                            if self.use_meterbus_lib:
-                                return self.parse_frame_meterbus_lib(data,records)
-                            else:
-                                return self.parse_frame(data,records)
-
-                    bid += 1
-                time.sleep(0.1)
-        except Exception:
-            self.ser = False
-            self._log.error("read_data_frame could not read from serial port")         
-        # If we are here data response is corrupt
-        time_elapsed = time.time()-start_time
-        self.invalid_count += 1
-        self._log.debug("Invalid MBUS data received %d bytes %0.1f ms, count: %d" % (bid,time_elapsed*1000,self.invalid_count))
-        # end of read_data_frame
-        
-        if self.invalid_count>=10:
-            # Reset invalid count
-            self.invalid_count = 0
-            self._log.debug("Invalid count = 10. Restarting MBUS serial connection on next read")
-            self.ser = False
+        """
+        if not bus.ser:
+            bus.connect()
+        if not bus.ser:
+            return []
+
+        polled = []
+        for meter in meters:
+            start = time.monotonic()
+            results = self.read_meter(bus, meter)
+            polled.append((meter, results, time.monotonic() - start))
+        return polled
 
     def add_result_to_cargo(self,meter,c,result):
         if result != None:
-            self._log.debug("Decoded MBUS data: " + json.dumps(result))
+            self._log.debug("Decoded MBUS data: %s", result)
 
             for key in result:
                 c.names.append(meter+"_"+key)
@@ -564,6 +664,24 @@ class EmonHubMBUSInterfacer(EmonHubInterfacer):
     
     
 
+    def _bus(self, meter):
+        """Return the serial bus a meter is attached to"""
+        settings = self._settings['meters'][meter]
+        key = (settings.get('device', self.device), settings.get('baud', self.baud))
+        if key not in self._buses:
+            self._buses[key] = MBusSerial(self._log, key[0], key[1])
+        return self._buses[key]
+
+    def _meter_interval(self, meter):
+        """Return the read interval of a meter
+
+        Meters that failed to answer are backed off so that they don't hold up
+        the bus for the others.
+
+        """
+        interval = self._settings['meters'][meter].get('read_interval', self._settings['read_interval'])
+        return interval * min(2 ** self._failures.get(meter, 0), MBUS_MAX_BACKOFF)
+
     def read(self):
         """Read data and process
 
@@ -571,67 +689,66 @@ class EmonHubMBUSInterfacer(EmonHubInterfacer):
 
         """
 
-        if int(time.time()) % self._settings['read_interval'] == 0:
-            if self.next_interval:
-                self.next_interval = False
-                
-                if not self.ser:
-                    self.connect()
-                        
-                c = Cargo.new_cargo()
-                c.names = []
-                c.realdata = []
-                c.units = []
-                c.nodeid = self._settings['nodename']
-                
-                # Support for multiple MBUS meters on a single bus
-                for meter in self._settings['meters']:
-                    
-                    address = self._settings['meters'][meter]['address']
-                    meter_type = self._settings['meters'][meter]['type']
-                
-                    # Most mbus meters use standard request, page 0 or default, all records
-                    if meter_type=="standard":
-                        result = self.request_data(address,[])
-                        self.add_result_to_cargo(meter,c,result)
-
-                    # Qalcosonic E3
-                    if meter_type=="qalcosonic_e3":
-                        result = self.request_data(address,[4,5,6,7,8,9,10,11,12,13,14,15])
-                        self.add_result_to_cargo(meter,c,result) 
-
-                    # ------------------------------------------------------
-                    # Sontex Multical 531
-                    if meter_type=="sontex531":
-                        # p1
-                        self.set_page(address, 1)
-                        result = self.request_data(address,[4,5])
-                        self.add_result_to_cargo(meter,c,result)
-                        # p3
-                        self.set_page(address, 3)                     
-                        result = self.request_data(address,[1,2,3,4])
-                        self.add_result_to_cargo(meter,c,result)                            
-                            
-                    # SDM120 special request command
-                    elif meter_type=="sdm120":
-                        # 1. Get energy data
-                        result = self.request_data(address,[1])
-                        self.add_result_to_cargo(meter,c,result)                       
-                        # 2. Get instantaneous data
-                        result = self.request_data_sdm120(address,[1,7,11,23])
-                        self.add_result_to_cargo(meter,c,result)
-                    elif meter_type=="kamstrup403":
-                        result = self.request_data(address,[1,4,7,8,9,10,11,12,14])
-                        self.add_result_to_cargo(meter,c,result)
-                        # ------------------------------------------------------
-                            
-
-                            
-                if len(c.realdata) > 0:
-                    return c
+        now = time.time()
+
+        # Meters due for a reading, grouped by bus
+        due = []
+        buses = {}
+        for meter in self._settings['meters']:
+            if self._poll_due(self._meter_interval(meter), meter):
+                due.append(meter)
+                buses.setdefault(self._bus(meter), []).append(meter)
+
+        if not buses:
+            return False
+
+        start = time.monotonic()
 
+        # Support for multiple MBUS meters on a single bus, buses are read in parallel
+        if len(buses) == 1:
+            polled = [self.poll_bus(bus, meters) for bus, meters in buses.items()]
         else:
-            self.next_interval = True
+            if self._executor_workers < len(buses):
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                self._executor = concurrent.futures.ThreadPoolExecutor(len(buses), thread_name_prefix=self.name)
+                self._executor_workers = len(buses)
+            polled = list(self._executor.map(self.poll_bus, buses.keys(), buses.values()))
+
+        results = {}
+        for bus_polled in polled:
+            for meter, meter_results, read_time in bus_polled:
+                results[meter] = meter_results
+                self._log.debug("MBUS %s read in %0.1f ms", meter, read_time * 1000)
+
+        c = Cargo.new_cargo(timestamp=now)
+        c.names = []
+        c.realdata = []
+        c.units = []
+        c.nodeid = self._settings['nodename']
+
+        for meter in self._settings['meters']:
+            if meter not in due:
+                continue
+            if meter in results and any(result is not None for result in results[meter]):
+                self._failures[meter] = 0
+            else:
+                self._failures[meter] = self._failures.get(meter, 0) + 1
+
+            for result in results.get(meter, []):
+                self.add_result_to_cargo(meter,c,result)
+
+        # Cycle time instrumentation
+        self.cycle_time = time.monotonic() - start
+        self.cycle_time_max = max(self.cycle_time, self.cycle_time_max)
+        self._log.debug("MBUS read cycle %0.1f ms (max %0.1f ms)", self.cycle_time * 1000, self.cycle_time_max * 1000)
+        if self.cycle_time > self._settings['read_interval']:
+            self.cycle_overruns += 1
+            self._log.warning("MBUS read cycle took %0.1f s, longer than read_interval (%d times)",
+                              self.cycle_time, self.cycle_overruns)
+
+        if len(c.realdata) > 0:
+            return c
 
         return False
 
@@ -649,6 +766,7 @@ class EmonHubMBUSInterfacer(EmonHubInterfacer):
             elif key == 'read_interval':
                 self._log.info("Setting %s read_interval: %s", self.name, setting)
                 self._settings[key] = float(setting)
+                self._poll_reset()
                 continue
             elif key == 'nodename':
                 self._log.info("Setting %s nodename: %s", self.name, setting)
@@ -680,6 +798,15 @@ class EmonHubMBUSInterfacer(EmonHubInterfacer):
                         'address':address,
                         'type':meter_type,
                     }
+                    # optional per meter read interval and bus
+                    if 'read_interval' in setting[meter]:
+                        self._settings['meters'][meter]['read_interval'] = float(setting[meter]['read_interval'])
+                    if 'device' in setting[meter]:
+                        self._settings['meters'][meter]['device'] = str(setting[meter]['device'])
+                    if 'baud' in setting[meter]:
+                        self._settings['meters'][meter]['baud'] = int(setting[meter]['baud'])
+                # reschedule all meters
+                self._poll_reset()
                 continue
             else:
                 self._log.warning("'%s' is not valid for %s: %s", setting, self.name, key)
@@ -1,10 +1,12 @@
 import time
 import json
+import struct
 import Cargo
 import os
 import serial.tools.list_ports
 
 import glob
+import emonhub_modbus
 from emonhub_interfacer import EmonHubInterfacer
 
 
@@ -88,10 +90,18 @@ from emonhub_interfacer import EmonHubInterfacer
 
 """
 
+# Maximum number of registers in one read request
+MODBUS_MAX_REGISTERS = 125
+
 """class EmonHubSDM120Interfacer
 
 SDM120 interfacer for use in development
 
+Registers are read in blocks: registers with the same function code that are
+close together are fetched with one read_registers request and decoded
+locally. Use max_gap = 0 in a meter section to only merge registers that are
+directly adjacent, e.g for devices that reject reads of unmapped registers.
+
 """
 
 class EmonHubMinimalModbusInterfacer(EmonHubInterfacer):
@@ -114,17 +124,14 @@ class EmonHubMinimalModbusInterfacer(EmonHubInterfacer):
             'meters':[]
         }
         
-        self.next_interval = True
         
         # Only load module if it is installed
-        self._rs485 = False
+        self._transport = False
         try:
             import minimalmodbus
             self.minimalmodbus = minimalmodbus
-            # import serial
         except ModuleNotFoundError as err:
             self._log.error(err)
-            self._rs485 = False
         
         self.device = device
         self.device_vid = device_vid
@@ -133,9 +140,14 @@ class EmonHubMinimalModbusInterfacer(EmonHubInterfacer):
         self.baud = baud
         self.parity = parity
         self.datatype = datatype
+
+        # Block reads for each meter
+        self._blocks = {}
+
         self.rs485_connect()  
                     
     def rs485_connect(self):
+        """Find the Modbus device and attach to the transport shared by all interfacers on that bus"""
 
         device = False
 
@@ -173,32 +185,95 @@ class EmonHubMinimalModbusInterfacer(EmonHubInterfacer):
         # if device is still False, log error and return False
         if not device:
             self._log.error("Could not find Modbus device")
-            self.ser = False
+            self.close()
             return False
 
         try:
             self._log.info("Connecting to Modbus device="+str(device)+" baud="+str(self.baud)+" parity="+str(self.parity)+" datatype="+str(self.datatype))
-            
-            self._rs485 = self.minimalmodbus.Instrument(device, 1)
-            self._rs485.serial.baudrate = self.baud
-            self._rs485.serial.bytesize = 8
-            if self.parity == 'even':
-                self._rs485.serial.parity = self.minimalmodbus.serial.PARITY_EVEN
-            elif self.parity == 'odd':
-                self._rs485.serial.parity = self.minimalmodbus.serial.PARITY_ODD
-            elif self.parity == 'mark':
-                self._rs485.serial.parity = self.minimalmodbus.serial.PARITY_MARK
-            elif self.parity == 'space':
-                self._rs485.serial.parity = self.minimalmodbus.serial.PARITY_SPACE
-            else:
-                self._rs485.serial.parity = self.minimalmodbus.serial.PARITY_NONE
-            self._rs485.serial.stopbits = 1
-            self._rs485.serial.timeout = 1
-            self._rs485.debug = False
-            self._rs485.mode = self.minimalmodbus.MODE_RTU
+            transport = emonhub_modbus.get_serial_transport(self.name, device, self.baud, self.parity)
         except Exception:
             self._log.error("Could not connect to Modbus device")
-            self._rs485 = False
+            transport = False
+        # Each attachment is released, even to the same transport
+        if self._transport:
+            self._transport.detach(self.name)
+        self._transport = transport
+
+    def run(self):
+        super().run()
+        # Stopped, e.g. replaced after a configuration change, release the shared Modbus transport
+        self.close()
+
+    def close(self):
+        """Release the shared Modbus transport"""
+        if self._transport:
+            self._transport.detach(self.name)
+            self._transport = False
+
+    def plan_blocks(self, meter):
+        """Group the registers of a meter into block reads
+
+        Registers with the same function code that are at most max_gap
+        registers apart are read with a single read_registers request, up to
+        the Modbus limit of 125 registers per request.
+
+        Returns a list of (functioncode, start, count, [(index, offset, datatype)]).
+
+        """
+        settings = self._settings['meters'][meter]
+        max_gap = settings['max_gap']
+
+        items = []
+        for i, register in enumerate(settings['registers']):
+            if settings['datatypes'] == []:
+                datatype = self.datatype
+            else:
+                datatype = settings['datatypes'][i]
+
+            if settings['functioncodes'] == []:
+                functioncode = 3 if datatype == 'int' else 4
+            else:
+                functioncode = settings['functioncodes'][i]
+
+            length = 1 if datatype == 'int' else 2
+            items.append((functioncode, register, length, i, datatype))
+
+        blocks = []
+        for functioncode, register, length, i, datatype in sorted(items):
+            if blocks:
+                last_fc, start, count, block_items = blocks[-1]
+                end = register + length
+                if last_fc == functioncode and register - (start + count) <= max_gap \
+                        and max(end, start + count) - start <= MODBUS_MAX_REGISTERS:
+                    block_items.append((i, register - start, datatype))
+                    blocks[-1] = (last_fc, start, max(end, start + count) - start, block_items)
+                    continue
+            blocks.append((functioncode, register, length, [(i, 0, datatype)]))
+        return blocks
+
+    def decode_registers(self, words, offset, datatype, byteorder):
+        """Decode a value from the 16 bit words returned by read_registers"""
+        if datatype == 'int':
+            return struct.unpack('>h', struct.pack('>H', words[offset]))[0]
+        raw = struct.pack('>HH', words[offset], words[offset + 1])
+        # Bytes arrive as ABCD, reorder as minimalmodbus byteorder 0..3
+        if byteorder == 1:
+            raw = raw[::-1]
+        elif byteorder == 2:
+            raw = raw[1::-1] + raw[:1:-1]
+        elif byteorder == 3:
+            raw = raw[2:] + raw[:2]
+        return struct.unpack('>f', raw)[0]
+
+    def read_block(self, address, block):
+        """Read the registers of a block from the device at address"""
+        functioncode, start, count, block_items = block
+
+        def read_registers(instrument):
+            instrument.address = address
+            return instrument.read_registers(start, count, functioncode=functioncode)
+
+        return self._transport.request(self.name, read_registers)
 
     def read(self):
         """Read data and process
@@ -207,94 +282,109 @@ class EmonHubMinimalModbusInterfacer(EmonHubInterfacer):
 
         """
 
-        if int(time.time())%self._settings['read_interval']==0:
-            if self.next_interval:
-                self.next_interval = False
-
-                c = Cargo.new_cargo()
-                c.names = []
-                c.realdata = []
-                c.nodeid = self._settings['nodename']
-             
-                if self._rs485:
-                    invalid_count = 0
-                    register_count = 0
-                    
-                    # Support for multiple MBUS meters on a single bus
-                    for meter in self._settings['meters']:
-                        
-                        self._rs485.address = self._settings['meters'][meter]['address']
-                        byteorder = int(self._settings['meters'][meter]['byteorder'])
-                        if self._settings['meters'][meter]['device_type'] == 'samsung':
-                            self._log.debug("Samsung device active")
-                            # map Flow rate (l/min), OutdoorT, 3-way valve 0=CH 1=DHW, Compressor controll %, Compressor freq (Hz), Immersion heater status
-                            self._rs485.write_registers(7005,[0x42E9, 0x8204, 0x4067, 0x42F1, 0x8238, 0x4087])
-                            
-                        for i in range(0,len(self._settings['meters'][meter]['registers'])):
-                            register_count += 1
-                            valid = True
-                            currreg = int(self._settings['meters'][meter]['registers'][i])
-                            
-                            if self._settings['meters'][meter]['datatypes'] == []:
-                                curr_datatype = self.datatype
-                            else:
-                                curr_datatype = self._settings['meters'][meter]['datatypes'][i]
-
-                            if self._settings['meters'][meter]['functioncodes'] == []:
-                                curr_functioncode = 3 if curr_datatype == 'int' else 4
-                            else:
-                                curr_functioncode = self._settings['meters'][meter]['functioncodes'][i]
-
-                            try:
-                                if curr_datatype == 'int':
-                                    time.sleep(0.1)
-                                    value = self._rs485.read_register(int(self._settings['meters'][meter]['registers'][i]), functioncode=curr_functioncode, signed=True)
-                                        
-                                elif curr_datatype == 'float':
-                                    time.sleep(0.1)
-                                    value = self._rs485.read_float(int(self._settings['meters'][meter]['registers'][i]), functioncode=curr_functioncode, number_of_registers=2, byteorder=byteorder)
-                                else:
-                                    time.sleep(0.1)
-                                    value = self._rs485.read_float(int(self._settings['meters'][meter]['registers'][i]), functioncode=curr_functioncode, number_of_registers=2, byteorder=byteorder)
-                            
-                                    
-                            except Exception as e:
-                                valid = False
-                                invalid_count += 1
-                                self._log.error("Could not read register @ "+str(self._settings['meters'][meter]['registers'][i])+": " + str(e))
-                            
-                            if valid:
-                                # replace datafield name with custom name
-                                if i<len(self._settings['meters'][meter]['names']):
-                                    name = self._settings['meters'][meter]['names'][i]
-                                else:
-                                    name = "r"+str(self._settings['meters'][meter]['registers'][i])
-                                # apply rounding if set
-                                if i<len(self._settings['meters'][meter]['precision']):
-                                    value = round(value,int(self._settings['meters'][meter]['precision'][i]))
-                                # apply scales
-                                if i<len(self._settings['meters'][meter]['scales']) and self._settings['meters'][meter]['scales'][i] is not None:
-                                    value = value*self._settings['meters'][meter]['scales'][i]
-                                c.names.append(self._settings['prefix']+str(meter)+"_"+name)
-                                c.realdata.append(value)
-                                # self._log.debug(str(name)+": "+str(value))
-                                
-                        time.sleep(0.1)
-                        
-                    if invalid_count==register_count:
-                        self._log.error("Could not read all registers")
-                        self.rs485_connect()
-                           
-                    if len(c.realdata)>0:
-                        self._log.debug(c.realdata)
-                        return c
-                else:
-                     self._log.error("Not connected to modbus device")
-                     self.rs485_connect()
-                    
+        if not self._poll_due(self._settings['read_interval']):
+            return False
+
+        c = Cargo.new_cargo()
+        c.names = []
+        c.realdata = []
+        c.nodeid = self._settings['nodename']
+
+        if self._transport:
+            invalid_count = 0
+            register_count = 0
+            start_time = time.time()
+
+            # Support for multiple MBUS meters on a single bus
+            for meter in self._settings['meters']:
+
+                address = self._settings['meters'][meter]['address']
+                byteorder = int(self._settings['meters'][meter]['byteorder'])
+                if self._settings['meters'][meter]['device_type'] == 'samsung':
+                    self._log.debug("Samsung device active")
+                    # map Flow rate (l/min), OutdoorT, 3-way valve 0=CH 1=DHW, Compressor controll %, Compressor freq (Hz), Immersion heater status
+                    def write_mapping(instrument):
+                        instrument.address = address
+                        instrument.write_registers(7005,[0x42E9, 0x8204, 0x4067, 0x42F1, 0x8238, 0x4087])
+                    try:
+                        self._transport.request(self.name, write_mapping, emonhub_modbus.PRIORITY_HIGH)
+                    except Exception as e:
+                        self._log.error("Could not write Samsung register mapping: " + str(e))
+
+                values = {}
+                blocks = self._blocks[meter]
+                for block in list(blocks):
+                    register_count += len(block[3])
+                    try:
+                        words = self.read_block(address, block)
+                    except emonhub_modbus.ModbusTransportError as e:
+                        self._log.debug(str(e))
+                        return False
+                    except self.minimalmodbus.IllegalRequestError as e:
+                        if len(block[3]) > 1:
+                            # The device doesn't allow reading the gaps between
+                            # registers, read them one by one from now on
+                            self._log.warning("Could not read registers %d-%d, reading them individually: %s",
+                                              block[1], block[1] + block[2] - 1, e)
+                            single = [(block[0], block[1] + offset, 1 if datatype == 'int' else 2, [(i, 0, datatype)])
+                                      for i, offset, datatype in block[3]]
+                            position = blocks.index(block)
+                            blocks[position:position + 1] = single
+                            register_count -= len(block[3])
+                            for single_block in single:
+                                register_count += 1
+                                try:
+                                    words = self.read_block(address, single_block)
+                                except Exception as e:
+                                    invalid_count += 1
+                                    self._log.error("Could not read register @ "+str(single_block[1])+": " + str(e))
+                                    continue
+                                i, offset, datatype = single_block[3][0]
+                                values[i] = self.decode_registers(words, offset, datatype, byteorder)
+                        else:
+                            invalid_count += 1
+                            self._log.error("Could not read register @ %d: %s", block[1], e)
+                        continue
+                    except Exception as e:
+                        # No response, CRC error...: the meter may be offline for a while, the block
+                        # is read again on the next poll
+                        invalid_count += len(block[3])
+                        self._log.error("Could not read registers %d-%d: %s", block[1], block[1] + block[2] - 1, e)
+                        continue
+                    for i, offset, datatype in block[3]:
+                        values[i] = self.decode_registers(words, offset, datatype, byteorder)
+
+                for i in range(0,len(self._settings['meters'][meter]['registers'])):
+                    if i in values:
+                        value = values[i]
+                        # replace datafield name with custom name
+                        if i<len(self._settings['meters'][meter]['names']):
+                            name = self._settings['meters'][meter]['names'][i]
+                        else:
+                            name = "r"+str(self._settings['meters'][meter]['registers'][i])
+                        # apply rounding if set
+                        if i<len(self._settings['meters'][meter]['precision']):
+                            value = round(value,int(self._settings['meters'][meter]['precision'][i]))
+                        # apply scales
+                        if i<len(self._settings['meters'][meter]['scales']) and self._settings['meters'][meter]['scales'][i] is not None:
+                            value = value*self._settings['meters'][meter]['scales'][i]
+                        c.names.append(self._settings['prefix']+str(meter)+"_"+name)
+                        c.realdata.append(value)
+                        # self._log.debug(str(name)+": "+str(value))
+
+            self._log.debug("Modbus read cycle %0.1f ms", (time.time() - start_time) * 1000)
+
+            if invalid_count==register_count:
+                self._log.error("Could not read all registers")
+                self._transport.invalidate(self.name, "no response to any register")
+
+            if len(c.realdata)>0:
+                self._log.debug(c.realdata)
+                return c
         else:
-            self.next_interval = True
-            
+             self._log.error("Not connected to modbus device")
+             self.rs485_connect()
+
         return False
 
 
@@ -332,6 +422,7 @@ class EmonHubMinimalModbusInterfacer(EmonHubInterfacer):
                     device_type = []
                     address = 1
                     byteorder = 0
+                    max_gap = 10
                     registers = []
                     functioncodes = []
                     datatypes = []
@@ -387,6 +478,10 @@ class EmonHubMinimalModbusInterfacer(EmonHubInterfacer):
                         byteorder = setting[meter]['byteorder']
                         self._log.info("Setting %s meter %s byteorder %s", self.name, meter, str(byteorder))
 
+                    if 'max_gap' in setting[meter]:
+                        max_gap = int(setting[meter]['max_gap'])
+                        self._log.info("Setting %s meter %s max_gap %s", self.name, meter, str(max_gap))
+
                     #assign
                     self._settings['meters'][meter] = {
                         'device_type':device_type,
@@ -397,8 +492,12 @@ class EmonHubMinimalModbusInterfacer(EmonHubInterfacer):
                         'scales':scales,
                         'byteorder':byteorder,
                         'functioncodes':functioncodes,
-                        'datatypes':datatypes
+                        'datatypes':datatypes,
+                        'max_gap':max_gap
                     }
+                    self._blocks[meter] = self.plan_blocks(meter)
+                    self._log.info("Setting %s meters %s block reads %s", self.name, meter,
+                                   json.dumps([(block[1], block[2]) for block in self._blocks[meter]]))
                     
                 continue
             else:
@@ -2,17 +2,19 @@ import time
 import datetime
 import Cargo
 import sys
+import importlib.util
+import emonhub_modbus
 
-try:
-    from pymodbus.client.sync import ModbusSerialClient as ModbusClient
-    pymodbus_found = True
-except ImportError:
-    pymodbus_found = False
+# Used by the shared Modbus transport, see emonhub_modbus.get_serial_transport()
+minimalmodbus_found = importlib.util.find_spec('minimalmodbus') is not None
 
 from emonhub_interfacer import EmonHubInterfacer
 
 """class EmonModbusTcpInterfacer
 Monitors Renogy Rover via USB RS232 Cable over modbus
+
+The controller is read through the Modbus transport shared with the other
+Modbus interfacers on the same serial port.
 """
 
 class EmonHubModbusRenogyInterfacer(EmonHubInterfacer):
@@ -26,25 +28,41 @@ class EmonHubModbusRenogyInterfacer(EmonHubInterfacer):
         super(EmonHubModbusRenogyInterfacer, self).__init__(name)
 
         self._modcon = False
-        if not pymodbus_found:
-            self._log.error("PYMODBUS NOT PRESENT BUT NEEDED !!")
+        self._con = None
+        if not minimalmodbus_found:
+            self._log.error("MINIMALMODBUS NOT PRESENT BUT NEEDED !!")
         # open connection
-        if pymodbus_found:
-            self._log.info("pymodbus installed")
+        if minimalmodbus_found:
+            self._log.info("minimalmodbus installed")
             self._log.debug("EmonHubModbusRenogyInterfacer args: " + str(com_port) + " - " + str(com_baud) )
             
-            self._con = self._open_modbus(com_port,com_baud)
+            self._open_modbus(com_port,com_baud)
             if self._modcon :
                  self._log.info("Modbus client Connected!")                 
             else:
                  self._log.info("Connection to Modbus client failed. Will try again later")
 
+    def run(self):
+        super().run()
+        # Stopped, e.g. replaced after a configuration change, release the shared Modbus transport
+        self.close()
+
     def close(self):
 
-        # Close TCP connection
+        # Release the shared serial port
         if self._con is not None:
             self._log.debug("Closing USB/Serial port")
-            self._con.close()
+            self._con.detach(self.name)
+            self._con = None
+
+    def _read_registers(self, register, count, priority=emonhub_modbus.PRIORITY_NORMAL):
+        """Read holding registers from the controller, returns a list of values"""
+
+        def read_registers(instrument):
+            instrument.address = 1
+            return instrument.read_registers(register, count, functioncode=3)
+
+        return self._con.request(self.name, read_registers, priority)
 
     def _open_modbus(self,com_port,com_baud):
         """ Open connection to modbus device """
@@ -60,14 +78,14 @@ class EmonHubModbusRenogyInterfacer(EmonHubInterfacer):
             self._modcon = False
             self._log.info("Starting Modbus client on " + com_port + " at " + com_baud)
             # Connect to the controller and get values
-            client = ModbusClient(method = 'rtu', port = com_port, baudrate = int(com_baud), stopbits = 1, bytesize = 8, parity = 'N')
-            client.connect()
+            if self._con is None:
+                self._con = emonhub_modbus.get_serial_transport(self.name, com_port, com_baud)
 
-            Model = client.read_holding_registers(12, 8, slave=1)
-            self._log.info("Connected to Renogy Model: " + str(Model.registers[0]))
+            Model = self._read_registers(12, 8, emonhub_modbus.PRIORITY_LOW)
+            self._log.info("Connected to Renogy Model: " + str(Model[0]))
 
-            BatteryType = client.read_holding_registers(57348, 1, slave=1).registers[0]
-            BatteryCapacity = client.read_holding_registers(57346, 1, slave=1).registers[0]
+            BatteryType = self._read_registers(57348, 1, emonhub_modbus.PRIORITY_LOW)[0]
+            BatteryCapacity = self._read_registers(57346, 1, emonhub_modbus.PRIORITY_LOW)[0]
             self._log.info("Battery Type: " + BATTERY_TYPE[BatteryType] + " " + str(BatteryCapacity) + "ah") 
             
             self._modcon = True
@@ -76,8 +94,6 @@ class EmonHubModbusRenogyInterfacer(EmonHubInterfacer):
             self._log.error("modbus connection failed " + str(e))           
             self._log.error("Error on line {}".format(sys.exc_info()[-1].tb_lineno))
             pass            
-        else:
-            return client
 
     def read(self):
 
@@ -92,40 +108,44 @@ class EmonHubModbusRenogyInterfacer(EmonHubInterfacer):
         }
 
         """ Read registers from client"""
-        if pymodbus_found:
+        if minimalmodbus_found:
             time.sleep(float(self._settings["interval"]))
                        
             if not self._modcon :
-                self.close()
                 self._log.info("Not connected, retrying connect" + str(self.init_settings))
-                self._con = self._open_modbus(self.init_settings["com_port"], self.init_settings["com_baud"])
+                self._open_modbus(self.init_settings["com_port"], self.init_settings["com_baud"])
 
             if self._modcon :
                                       
-                # read battery registers
-                BatteryPercent = self._con.read_holding_registers(256, 1, slave=1).registers[0]
-                Charging_Stage = self._con.read_holding_registers(288, 1, slave=1).registers[0]
-                self._log.debug("Battery Percent " + str(BatteryPercent) + "%")
-                self._log.debug("Charging Stage " + str(CHARGING_STATE[Charging_Stage]))
-
-                Temp_raw = self._con.read_holding_registers(259, 2, slave=1)
-                temp_value = Temp_raw.registers[0] & 0x0ff
-                sign = Temp_raw.registers[0] >> 7
-                BatteryTemp_C = -(temp_value - 128) if sign == 1 else temp_value
-                BatteryTemp_F = (BatteryTemp_C * 9/5) + 32
-                self._log.debug("BatteryTemp_C " + str(BatteryTemp_C))
-                self._log.debug("BatteryTemp_F " +str(BatteryTemp_F))
-
-                # read Solar registers
-                SolarVoltage = self._con.read_holding_registers(263, 1, slave=1).registers[0]
-                SolarCurrent = self._con.read_holding_registers(264, 1, slave=1).registers[0]
-                SolarPower = self._con.read_holding_registers(265, 1, slave=1).registers[0]
-                self._log.debug("SolarVoltage " + str(SolarVoltage) + "v")
-                self._log.debug("SolarCurrent " + str(SolarCurrent) + "a")
-                self._log.debug("SolarPower " + str(SolarPower) + "w")
-
-                PowerGenToday = self._con.read_holding_registers(275, 1, slave=1).registers[0]
-                self._log.debug("PowerGenToday " + str(PowerGenToday) + "kWh")
+                try:
+                    # read battery registers
+                    BatteryPercent = self._read_registers(256, 1)[0]
+                    Charging_Stage = self._read_registers(288, 1)[0]
+                    self._log.debug("Battery Percent %s%%", BatteryPercent)
+                    self._log.debug("Charging Stage %s", CHARGING_STATE[Charging_Stage])
+
+                    Temp_raw = self._read_registers(259, 2)
+                    temp_value = Temp_raw[0] & 0x0ff
+                    sign = Temp_raw[0] >> 7
+                    BatteryTemp_C = -(temp_value - 128) if sign == 1 else temp_value
+                    BatteryTemp_F = (BatteryTemp_C * 9/5) + 32
+                    self._log.debug("BatteryTemp_C %s", BatteryTemp_C)
+                    self._log.debug("BatteryTemp_F " +str(BatteryTemp_F))
+
+                    # read Solar registers
+                    SolarVoltage = self._read_registers(263, 1)[0]
+                    SolarCurrent = self._read_registers(264, 1)[0]
+                    SolarPower = self._read_registers(265, 1)[0]
+                    self._log.debug("SolarVoltage %sv", SolarVoltage)
+                    self._log.debug("SolarCurrent %sa", SolarCurrent)
+                    self._log.debug("SolarPower %sw", SolarPower)
+
+                    PowerGenToday = self._read_registers(275, 1)[0]
+                    self._log.debug("PowerGenToday %skWh", PowerGenToday)
+                except Exception as e:
+                    self._log.error("Could not read from Renogy: %s", e)
+                    self._modcon = False
+                    return
 
                 # Create a Payload object
                 c = Cargo.new_cargo()
@@ -137,7 +157,7 @@ class EmonHubModbusRenogyInterfacer(EmonHubInterfacer):
                     self._log.error("nodeoffset needed in emonhub configuration, make sure it exits and is integer ")
                     pass
 
-                self._log.debug("Return from read data: " + str(c.realdata))
+                self._log.debug("Return from read data: %s", c.realdata)
                 return c
 
 
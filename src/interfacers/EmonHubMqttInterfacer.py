@@ -38,6 +38,7 @@ Example emonhub configuration
 import time
 import paho.mqtt.client as mqtt
 from emonhub_interfacer import EmonHubInterfacer
+import emonhub_memo as ehm
 import Cargo
 import json
 
@@ -106,6 +107,10 @@ class EmonHubMqttInterfacer(EmonHubInterfacer):
             except Exception as e:
                 self._log.error("Failed to configure TLS for MQTT: %s", e)
 
+    def _sends_names(self):
+        # The 'node' format is a list of values identified by position
+        return int(self._settings["node_format_enable"]) != 1
+
     def add(self, cargo):
         """Append data to buffer.
 
@@ -127,6 +132,9 @@ class EmonHubMqttInterfacer(EmonHubInterfacer):
         if cargo.rssi:
             f['rssi'] = cargo.rssi
 
+        # Got once per cargo, whether it is published or not, see emonhub_memo
+        f['payloads'] = ehm.memo.get(cargo.uri, self.name, lambda: self._payloads(f))
+
         # This basic QoS level 1 MQTT interfacer does not require buffering
         # therefore we call _process_post here directly with an array
         # containing only the one frame.
@@ -202,12 +210,9 @@ class EmonHubMqttInterfacer(EmonHubInterfacer):
             if int(self._settings["node_format_enable"]) == 1:
                 topic = self._settings["node_format_basetopic"] + "rx/" + str(nodeid) + "/values"
 
-                payload = ",".join(map(str, frame['data']))
-
-                if 'rssi' in frame:
-                    payload = payload + "," + str(frame['rssi'])
+                payload = frame['payloads'][0]
 
-                self._log.info("Publishing 'node' formatted msg")
+                self._log.debug("Publishing 'node' formatted msg")
                 self._log.debug("Publishing: %s %s", topic, payload)
                 result = self._mqttc.publish(topic, payload=payload, qos=2, retain=False)
 
@@ -220,14 +225,9 @@ class EmonHubMqttInterfacer(EmonHubInterfacer):
             # ----------------------------------------------------------
             if int(self._settings["node_JSON_enable"]) == 1:
                 topic = self._settings["node_JSON_basetopic"] + nodename
-                payload = dict(zip(frame['names'], frame['data']))
-                payload['time'] = frame['timestamp']
-                if 'rssi' in frame:
-                    payload['rssi'] = frame['rssi']
-
-                payloadJSON = json.dumps(payload)
+                payloadJSON = frame['payloads'][1]
 
-                self._log.debug("Publishing: " + topic + " " + payloadJSON)
+                self._log.debug("Publishing: %s %s", topic, payloadJSON)
                 result = self._mqttc.publish(topic, payload=payloadJSON, qos=2, retain=False)
 
                 if result[0] == 4:
@@ -236,6 +236,30 @@ class EmonHubMqttInterfacer(EmonHubInterfacer):
 
         return True
 
+    def _payloads(self, frame):
+        """Return the 'node' and JSON format payloads of frame, None if disabled"""
+        values = json_payload = None
+        if int(self._settings["node_format_enable"]) == 1:
+            values = self._values_payload(frame)
+        if int(self._settings["node_JSON_enable"]) == 1:
+            json_payload = self._json_payload(frame)
+        return values, json_payload
+
+    @staticmethod
+    def _values_payload(frame):
+        payload = ",".join(map(str, frame['data']))
+        if 'rssi' in frame:
+            payload = payload + "," + str(frame['rssi'])
+        return payload
+
+    @staticmethod
+    def _json_payload(frame):
+        payload = dict(zip(frame['names'], frame['data']))
+        payload['time'] = frame['timestamp']
+        if 'rssi' in frame:
+            payload['rssi'] = frame['rssi']
+        return json.dumps(payload)
+
     def action(self):
         self._mqttc.loop(0)
 
@@ -309,7 +333,7 @@ class EmonHubMqttInterfacer(EmonHubInterfacer):
                                 # Add cargo item to channel
                                 self._pub_channels[channel].append(rxc)
                                 
-                                self._log.debug(str(rxc.uri) + " Sent to channel' : " + str(channel))
+                                self._log.debug("%s Sent to channel' : %s", rxc.uri, channel)
                                 
 
     def set(self, **kwargs):
@@ -339,12 +363,16 @@ class EmonHubMqttInterfacer(EmonHubInterfacer):
                 self._settings[key] = setting
                 continue
             elif key == 'node_JSON_enable':
-                self._log.info("Setting " + self.name + " node_JSON_enable: " + setting)
+                self._log.info("Setting %s node_JSON_enable: %s", self.name, setting)
                 self._settings[key] = setting
                 continue
             elif key == 'node_JSON_basetopic':
-                self._log.info("Setting " + self.name + " node_JSON_basetopic: " + setting)
+                self._log.info("Setting %s node_JSON_basetopic: %s", self.name, setting)
                 self._settings[key] = setting
                 continue
             else:
                 self._log.warning("'%s' is not valid for %s: %s", setting, self.name, key)
+
+        # Payloads are the same whatever the broker and topics, see emonhub_memo
+        ehm.memo.register(self.name, ('mqtt', int(self._settings["node_format_enable"]),
+                                      int(self._settings["node_JSON_enable"])))
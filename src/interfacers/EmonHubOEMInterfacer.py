@@ -6,6 +6,9 @@ import re
 
 from . import EmonHubSerialInterfacer as ehi
 
+# Input names may only contain alphanumeric characters, '_' and '-'
+INPUT_NAME_RE = re.compile(r'[\w-]+')
+
 """class EmonHubOEMInterfacer
 
 Monitors the serial port for data from 'Serial Format 2' type devices
@@ -27,7 +30,6 @@ class EmonHubOEMInterfacer(ehi.EmonHubSerialInterfacer):
         # Display device firmware version and current settings
         self.info = ["", ""]
 
-        self._rx_buf = ""
         # self._ser.flushInput()
 
         # Initialize settings
@@ -60,11 +62,11 @@ class EmonHubOEMInterfacer(ehi.EmonHubSerialInterfacer):
         self._settings.update(self._defaults)
 
         self._first_data_packet_received = False
+
+        # Input names already validated, per node
+        self._valid_names = {}
         
         
-        self._com_port = com_port
-        self._com_baud = com_baud
-        self._last_connection_attempt = time.time()
 
 
     def add(self, cargo):
@@ -79,6 +81,20 @@ class EmonHubOEMInterfacer(ehi.EmonHubSerialInterfacer):
         self.send(txc)
 
 
+    def _valid_name(self, node, name):
+        """Check an input name, remembering the names already seen for each node"""
+
+        names = self._valid_names.setdefault(node, set())
+        if name in names:
+            return True
+        if not isinstance(name, str) or not INPUT_NAME_RE.fullmatch(name):
+            return False
+        # Don't let a stream of corrupt frames grow the cache without limit
+        if len(names) >= 256:
+            names.clear()
+        names.add(name)
+        return True
+
     def pre_process_data_format(self, f):
         """Pre process data
 
@@ -103,7 +119,7 @@ class EmonHubOEMInterfacer(ehi.EmonHubSerialInterfacer):
             try:                                        # Attempt to decode json
                 json_data = json.loads(f)
                 for name in json_data:
-                    if re.match(r'^[\w-]+$', name):     # only alpha-numeric input names
+                    if self._valid_name(c.nodeid, name):     # only alpha-numeric input names
                         c.realdata.append(float(json_data[name])) # check that value is numeric
                         c.names.append(name)
                     # else:
@@ -117,19 +133,20 @@ class EmonHubOEMInterfacer(ehi.EmonHubSerialInterfacer):
         # -------------------------------------------------------------------
         elif ":" in f:
             for kv_str in f.split(','):
-                kv = kv_str.split(':')
-                if len(kv) == 2:
-                    if re.match(r'^[\w-]+$', kv[0]):
-                        if len(kv[1]) > 0:
-                            try:
-                                c.realdata.append(float(kv[1]))
-                                c.names.append(kv[0])
-                            except Exception:
-                                # self._log.debug("input value is not numeric: %s" % kv[1])
-                                return False
-                    else:
-                        # self._log.debug("invalid input name: %s" % kv[0])
+                name, sep, value = kv_str.partition(':')
+                # Skip anything that isn't a single key:value pair
+                if not sep or ':' in value:
+                    continue
+                if not self._valid_name(c.nodeid, name):
+                    # self._log.debug("invalid input name: %s" % name)
+                    return False
+                if value:
+                    try:
+                        c.realdata.append(float(value))
+                    except ValueError:
+                        # self._log.debug("input value is not numeric: %s" % value)
                         return False
+                    c.names.append(name)
             self._settings['datacode'] = False          # Disable further attempt at data decode
         # -------------------------------------------------------------------
         # BINARY FORMAT e.g OK 5 0 0 0 0 (-0)'
@@ -173,34 +190,15 @@ class EmonHubOEMInterfacer(ehi.EmonHubSerialInterfacer):
 
         """
 
-        if not self._ser:
-            if (time.time()-self._last_connection_attempt)>=10:
-                self._last_connection_attempt = time.time()
-                self._ser = self._open_serial_port(self._com_port, self._com_baud)
-        
-        if not self._ser:
-            return
-
-        # Read serial RX
-        try:
-            ser_data = self._ser.readline()
-            self._rx_buf = self._rx_buf + ser_data.decode()
-        except UnicodeDecodeError:
+        if not self._reconnect():
             return
-        except Exception as e:
-            self._log.error(e)
-            self._ser = False
 
-        # If line incomplete, exit
-        if '\r\n' not in self._rx_buf:
+        # Next complete line received, if any
+        f = self._readline()
+        if f is None:
             return
 
-        # Remove CR,LF.
-        f = self._rx_buf[:-2].strip()
-
-        # Reset buffer
-        self._rx_buf = ''
-
+        f = f.strip()
         if not f:
             return
 
@@ -249,25 +247,25 @@ class EmonHubOEMInterfacer(ehi.EmonHubSerialInterfacer):
             if key in self._config:
                 cmd = "%s%s" % (id,self._config[key])
                 if f == cmd:
-                    self._log.debug(key+" correct: "+cmd)
+                    self._log.debug("%s correct: %s", key, cmd)
                 else:
                     self.send_cal(key,cmd)
-                    self._log.debug(key+" updated: "+cmd)
+                    self._log.debug("%s updated: %s", key, cmd)
             return
         """
 
         return
 
     def send_cmd(self, cmd):
+        if not self._ser:
+            self._log.warning("%s serial port closed, command not sent: %s", self.name, cmd)
+            return False
         self._ser.write((cmd+"\n").encode())
         # Wait for reply
-        rx_buf = ""
-        start = time.time()
-        while time.time() - start < 1.0:
-            rx_buf = rx_buf + self._ser.readline().decode()
-            if '\r\n' in rx_buf:
-                return rx_buf.strip()
-        return False
+        reply = self._readline(timeout=1.0)
+        if reply is None:
+            return False
+        return reply.strip()
 
     def check_config_format(self):
         self._config_format = "new"
@@ -276,16 +274,16 @@ class EmonHubOEMInterfacer(ehi.EmonHubSerialInterfacer):
         reply = self.send_cmd("4v")
         if reply and reply != "4v":
             self._config_format = "old"
-        self._log.debug("Config format: " + self._config_format)
+        self._log.debug("Config format: %s", self._config_format)
         if self._config_format == "new":
             time.sleep(2.1)
 
     def send_config(self, key, cmd):
         reply = self.send_cmd(cmd)
         if reply:
-            self._log.debug("CONFIG SET:" + key.ljust(12, ' ') + " cmd:" + cmd.ljust(15, ' ') + " reply:" + reply)
+            self._log.debug("CONFIG SET:%-12s cmd:%-15s reply:%s", key, cmd, reply)
         else:
-            self._log.error("CONFIG FAIL: " + key + " cmd: " + cmd + " (no reply)")
+            self._log.error("CONFIG FAIL: %s cmd: %s (no reply)", key, cmd)
 
 
     def update_all(self):
@@ -365,11 +363,11 @@ class EmonHubOEMInterfacer(ehi.EmonHubSerialInterfacer):
 
         # Broadcast time to synchronize emonGLCD
         interval = int(self._settings['interval'])
-        if interval:  # A value of 0 means don't do anything
+        if interval and self._ser:  # A value of 0 means don't do anything
             if t - self._interval_timestamp > interval:
                 self._interval_timestamp = t
                 now = datetime.datetime.now()
-                self._log.debug(self.name + " Broadcasting time: %02d:%02d" % (now.hour, now.minute))
+                self._log.debug("%s Broadcasting time: %02d:%02d", self.name, now.hour, now.minute)
                 self._ser.write(b"00,%02d,%02d,00,s" % (now.hour, now.minute))
 
     def _process_post(self, databuffer):
@@ -378,7 +376,7 @@ class EmonHubOEMInterfacer(ehi.EmonHubSerialInterfacer):
         """
 
         for frame in databuffer:
-            self._log.debug("node = " + str(frame[1]) + " node_data = " + json.dumps(frame))
+            self._log.debug("node = %s node_data = %s", frame[1], frame)
             self.send(frame)
         return True
 
@@ -393,12 +391,12 @@ class EmonHubOEMInterfacer(ehi.EmonHubSerialInterfacer):
 
         for value in data:
             if not 0 <= int(value) <= 255:
-                self._log.error(self.name + " Discarding TX packet: value  out of range (0..255) " + str(value))
+                self._log.error("%s Discarding TX packet: value  out of range (0..255) %s", self.name, value)
                 return
             cmd += str(int(value)) + ","
         cmd = cmd[:-1]  #remove trailing ","
 
-        self._log.info(str(f.uri) + " Sending TX packet: " + cmd)
+        self._log.info("%s Sending TX packet: %s", f.uri, cmd)
         reply = self.send_cmd(cmd)
         if reply:
             self._log.debug(reply)
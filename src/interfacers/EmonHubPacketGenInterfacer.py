@@ -1,5 +1,6 @@
 import time
 import requests
+import emonhub_http
 from Cargo import new_cargo
 from emonhub_interfacer import EmonHubInterfacer
 
@@ -24,6 +25,7 @@ class EmonHubPacketGenInterfacer(EmonHubInterfacer):
         self._defaults.update({'interval': 5, 'datacode': 'b'})
         self._pg_settings = {'apikey': "", 'url': 'http://localhost/emoncms'}
         self._settings.update(self._pg_settings)
+        self._http = emonhub_http.HttpPoller(name, timeout=60)
 
     def read(self):
         """Read data from the PacketGen emonCMS module.
@@ -41,7 +43,7 @@ class EmonHubPacketGenInterfacer(EmonHubInterfacer):
         self._log.info("requesting packet: %sE-M-O-N-C-M-S-A-P-I-K-E-Y", req)
 
         try:
-            packet = requests.get(req + self._settings['apikey'], timeout=60).json()
+            packet = self._http.fetch([emonhub_http.Endpoint('packet', req + self._settings['apikey'])])['packet']
         except (ValueError, requests.exceptions.RequestException) as ex:
             self._log.warning("no packet returned: %s", ex)
             return
@@ -94,9 +96,9 @@ class EmonHubPacketGenInterfacer(EmonHubInterfacer):
                 return
 
             try:
-                z = requests.get(self._settings['url'] +
-                                 "/emoncms/packetgen/getinterval.json?apikey="
-                                 + self._settings['apikey'], timeout=60).text
+                z = self._http.fetch([emonhub_http.Endpoint('interval', self._settings['url'] +
+                                                            "/emoncms/packetgen/getinterval.json?apikey="
+                                                            + self._settings['apikey'], parse='text')])['interval']
                 i = int(z[1:-1])
             except:
                 self._log.info("request interval not returned")
@@ -89,14 +89,14 @@ class EmonHubRFM69LPLInterfacer(EmonHubInterfacer):
                 try:
                     self.radio = self.Radio(self.freqBand, self.node_id, self.network_id, verbose=False, **board)
                 except Exception as err:
-                    self._log.error("Error initializing RFM69 in polling mode: "+str(err))
+                    self._log.error("Error initializing RFM69 in polling mode: %s", err)
 
                 if self.radio:
                     self.polling_mode = True
                     self._log.warning("Polling mode enabled for RFM69 (interrupt setup failed)")
                 # == End of fallback to polling mode ==
             else:
-                self._log.error("Error initializing RFM69 in interrupt mode: "+str(err))
+                self._log.error("Error initializing RFM69 in interrupt mode: %s", err)
         
         if not self.radio.init_success:
             self._log.error("Could not connect to RFM69 module") 
@@ -126,7 +126,7 @@ class EmonHubRFM69LPLInterfacer(EmonHubInterfacer):
 
         packet = self.radio.get_packet()
         if packet:
-            self._log.info("Packet received "+str(len(packet.data))+" bytes")
+            self._log.debug("Packet received %d bytes", len(packet.data))
             # Make sure packet is a unique new packet rather than a 2nd or 3rd retry attempt
             if packet.sender==self.last_packet_nodeid and packet.data==self.last_packet_data and (time.time()-self.last_packet_time)<0.5:
                 self._log.info("Discarding duplicate packet")
@@ -146,7 +146,7 @@ class EmonHubRFM69LPLInterfacer(EmonHubInterfacer):
             return c
 
         if self.last_received and (time.time()-self.last_received) > self.watchdog_period:
-            self._log.warning("No radio packets received in last "+str(self.watchdog_period)+" seconds, restarting radio")
+            self._log.warning("No radio packets received in last %s seconds, restarting radio", self.watchdog_period)
             self.connect()
 
         return False
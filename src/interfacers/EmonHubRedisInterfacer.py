@@ -1,6 +1,6 @@
 import time
-import json
 import Cargo
+import emonhub_json
 from emonhub_interfacer import EmonHubInterfacer
 
 """
@@ -32,7 +32,9 @@ class EmonHubRedisInterfacer(EmonHubInterfacer):
         self._settings.update(self._defaults)
 
         # Interfacer specific settings
-        self._redis_settings = {'prefix': ''}
+        # extract: values published from the JSON messages, by default every key
+        self._redis_settings = {'prefix': '', 'extract': ['*']}
+        self._extractor = emonhub_json.JsonExtractor(self._redis_settings['extract'])
 
         # Only load module if it is installed
         try:
@@ -47,31 +49,31 @@ class EmonHubRedisInterfacer(EmonHubInterfacer):
         if self.r:
             result = self.r.lpop("emonhub:sub")
             if result:
-                try:  
-                    read_data = json.loads(result)
-                except Exception as e:
-                    logging.error(e)
-                
+                try:
+                    read_data = emonhub_json.loads(result)
+                except ValueError as e:
+                    self._log.error(e)
+                    return False
+
                 c = Cargo.new_cargo()
-                c.names = []
-                c.realdata = []
-                c.units = []
-                
+
                 c.nodeid = "redis"
                 if 'node' in read_data:
-                    c.nodeid = read_data['node']
-                    del read_data['node']
-
-                if 'time' in read_data:
-                    del read_data['time']
-                
-                for key in read_data:
-                    c.names.append(key)
-                    c.realdata.append(read_data[key])
-               
+                    c.nodeid = read_data.pop('node')
+
+                read_data.pop('time', None)
+
+                c.names, c.realdata, missing = self._extractor.extract(read_data)
+                if missing:
+                    self._log.warning("%s keys not found: %s", self.name, ", ".join(missing))
+                c.units = []
+
                 return c
         return False
 
+    def _sends_names(self):
+        return True
+
     def add(self, cargo):
         """set data in redis
 
@@ -94,7 +96,7 @@ class EmonHubRedisInterfacer(EmonHubInterfacer):
 
                 name = ":".join(name_parts)
 
-                self._log.info("redis set " + name + " " + str(value))
+                self._log.debug("redis set %s %s", name, value)
                 try:
                     self.r.set(name, value)
                 except Exception as err:
@@ -114,6 +116,15 @@ class EmonHubRedisInterfacer(EmonHubInterfacer):
                 self._log.info("Setting %s prefix: %s", self.name, setting)
                 self._settings[key] = setting
                 continue
+            elif key == 'extract':
+                try:
+                    self._extractor = emonhub_json.JsonExtractor(setting)
+                except ValueError as e:
+                    self._log.warning("'%s' is not valid for %s: %s (%s)", setting, self.name, key, e)
+                    continue
+                self._log.info("Setting %s extract: %s", self.name, setting)
+                self._settings[key] = setting
+                continue
             else:
                 self._log.warning("'%s' is not valid for %s: %s", setting, self.name, key)
 
@@ -0,0 +1,124 @@
+import time
+import emonhub_ringstore as ehr
+from emonhub_interfacer import EmonHubInterfacer, EmonHubInterfacerInitError
+
+"""
+[[RingStore]]
+    Type = EmonHubRingStoreInterfacer
+    [[[init_settings]]]
+        path = /var/lib/emonhub/ringstore
+        step = 10
+        length = 604800
+        api_port = 8082
+    [[[runtimesettings]]]
+        subchannels = ToEmonCMS,
+        write_interval = 60
+"""
+
+"""class EmonHubRingStoreInterfacer
+
+Stores the frames received on its subchannels in local fixed size ring files,
+one per input (see emonhub_ringstore), and serves them over HTTP so that
+local dashboards have recent history when the network is down.
+
+The values are buffered in memory and written every write_interval seconds.
+The last write_interval seconds of data are lost if emonHub stops abruptly.
+
+"""
+
+
+class EmonHubRingStoreInterfacer(EmonHubInterfacer):
+
+    def __init__(self, name, path='/var/lib/emonhub/ringstore', step=10, length=604800,
+                 api_host='127.0.0.1', api_port=8082):
+        """Initialize Interfacer
+
+        path (string): directory of the ring files
+        step (int): seconds per value of new ring files
+        length (int): seconds of history held by new ring files
+        api_host, api_port: address of the HTTP API, api_port 0 disables it
+
+        """
+        super().__init__(name)
+
+        self._settings.update(self._defaults)
+
+        # Interfacer specific settings
+        self._ringstore_settings = {'write_interval': 60}
+
+        try:
+            self._store = ehr.RingStore(path, step, length)
+        except (ValueError, ehr.RingStoreError) as e:
+            raise EmonHubInterfacerInitError("Invalid ring store settings: %s" % e)
+
+        self._api_address = (api_host, int(api_port))
+        self._api = None
+        self._api_retry = 0
+        self._write_timestamp = time.time()
+
+    def _sends_names(self):
+        return True
+
+    def add(self, cargo):
+        """Append the values of a frame to the ring store
+
+        """
+        node = cargo.nodename or cargo.nodeid
+        names = cargo.names
+        for i, value in enumerate(cargo.realdata):
+            # Unnamed values are numbered from 1, as emoncms does
+            name = names[i] if i < len(names) else str(i + 1)
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                continue
+            self._store.append(node, name, cargo.timestamp, value)
+
+    def action(self):
+        """Write the buffered values, start the API if not serving yet
+
+        """
+        now = time.time()
+        if self._api is None and self._api_address[1] and now > self._api_retry:
+            try:
+                self._api = ehr.RingStoreServer(self._store, *self._api_address)
+            except OSError as e:
+                # e.g. still used by the interfacer this one replaces
+                self._log.warning("%s unable to serve on %s:%d: %s", self.name, *self._api_address, e)
+                self._api_retry = now + 10
+
+        if now - self._write_timestamp >= float(self._settings['write_interval']):
+            self._write_timestamp = now
+            self._store.flush()
+
+    def run(self):
+        super().run()
+        # Stopped, write what is buffered and release the files and port
+        if self._api:
+            self._api.close()
+        self._store.flush()
+        self._store.close()
+
+    def set(self, **kwargs):
+        for key, setting in self._ringstore_settings.items():
+            # Decide which setting value to use
+            if key in kwargs:
+                setting = kwargs[key]
+            else:
+                setting = self._ringstore_settings[key]
+            if key in self._settings and self._settings[key] == setting:
+                continue
+            elif key == 'write_interval':
+                try:
+                    float(setting)
+                except ValueError:
+                    self._log.warning("'%s' is not valid for %s: %s", setting, self.name, key)
+                    continue
+                self._log.info("Setting %s %s: %s", self.name, key, setting)
+                self._settings[key] = setting
+                continue
+            else:
+                self._log.warning("'%s' is not valid for %s: %s", setting, self.name, key)
+
+        # include kwargs from parent
+        super().set(**kwargs)
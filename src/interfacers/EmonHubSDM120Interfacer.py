@@ -1,8 +1,9 @@
-import time
 import json
+import struct
 import Cargo
 import os
 import glob
+import emonhub_modbus
 from emonhub_interfacer import EmonHubInterfacer
 
 """
@@ -21,15 +22,45 @@ from emonhub_interfacer import EmonHubInterfacer
         precision = 2,2,4,4,3,3
 """
 
+# SDM120 input registers (float32): datafield -> (register, read batch)
+# The registers of a batch are read with a single request
+SDM120_REGISTERS = {
+    "voltage": (0x0000, 1),
+    "current": (0x0006, 1),
+    "power_active": (0x000c, 1),
+    "power_apparent": (0x0012, 1),
+    "power_reactive": (0x0018, 1),
+    "power_factor": (0x001e, 1),
+    "phase_angle": (0x0024, 1),
+    "frequency": (0x0046, 1),
+    "import_energy_active": (0x0048, 1),
+    "export_energy_active": (0x004a, 1),
+    "import_energy_reactive": (0x004c, 1),
+    "export_energy_reactive": (0x004e, 1),
+    "total_demand_power_active": (0x0054, 2),
+    "maximum_total_demand_power_active": (0x0056, 2),
+    "import_demand_power_active": (0x0058, 2),
+    "maximum_import_demand_power_active": (0x005a, 2),
+    "export_demand_power_active": (0x005c, 2),
+    "maximum_export_demand_power_active": (0x005e, 2),
+    "total_demand_current": (0x0102, 3),
+    "maximum_total_demand_current": (0x0108, 3),
+    "total_energy_active": (0x0156, 4),
+    "total_energy_reactive": (0x0158, 4)
+}
+
 """class EmonHubSDM120Interfacer
 
 SDM120 interfacer for use in development
 
+The meter is read through the Modbus transport shared with the other Modbus
+interfacers on the same serial bus.
+
 """
 
 class EmonHubSDM120Interfacer(EmonHubInterfacer):
 
-    def __init__(self, name, device="/dev/modbus", baud=2400):
+    def __init__(self, name, device="/dev/modbus", baud=2400, address=1):
         """Initialize Interfacer
 
         """
@@ -49,18 +80,54 @@ class EmonHubSDM120Interfacer(EmonHubInterfacer):
             'precision': [2,2,4,4,3,3]
         }
         
-        self.next_interval = True
+        self._address = int(address)
 
         # Only load module if it is installed
         try:
-            import sdm_modbus
             self._log.info("Connecting to SDM120 device=" + str(device) + " baud=" + str(baud))
-            self._sdm = sdm_modbus.SDM120(device=device, baud=int(baud))
-            self._sdm_registers = sdm_modbus.registerType.INPUT
+            self._sdm = emonhub_modbus.get_serial_transport(self.name, device, baud)
         except ModuleNotFoundError as err:
             self._log.error(err)
             self._sdm = False
 
+    def run(self):
+        super().run()
+        # Stopped, e.g. replaced after a configuration change, release the shared Modbus transport
+        self.close()
+
+    def close(self):
+        """Release the shared Modbus transport"""
+        if self._sdm:
+            self._sdm.detach(self.name)
+            self._sdm = False
+
+    def read_all(self, datafields):
+        """Read the input registers of the datafields, one request per batch
+
+        Returns a dict of datafield: value
+
+        """
+        batches = {}
+        for datafield in datafields:
+            if datafield in SDM120_REGISTERS:
+                register, batch = SDM120_REGISTERS[datafield]
+                batches.setdefault(batch, []).append((register, datafield))
+
+        r = {}
+        for batch in sorted(batches):
+            registers = batches[batch]
+            start = min(registers)[0]
+            count = max(registers)[0] + 2 - start
+
+            def read_registers(instrument):
+                instrument.address = self._address
+                return instrument.read_registers(start, count, functioncode=4)
+
+            words = self._sdm.request(self.name, read_registers)
+            raw = struct.pack('>%dH' % count, *words)
+            for register, datafield in registers:
+                r[datafield] = struct.unpack_from('>f', raw, (register - start) * 2)[0]
+        return r
 
     def read(self):
         """Read data and process
@@ -69,55 +136,54 @@ class EmonHubSDM120Interfacer(EmonHubInterfacer):
 
         """
         
-        if int(time.time())%self._settings['read_interval']==0:
-            if self.next_interval: 
-                self.next_interval = False
-
-                c = Cargo.new_cargo()
-                c.names = []
-                c.realdata = []
-                c.nodeid = self._settings['nodename']
-
-                if self._sdm and self._sdm.connected():
-                    try:
-                        r = self._sdm.read_all(self._sdm_registers)
-                    except Exception as e:
-                        self._log.error("Could not read from SDM120: " + str(e))
-                    # for i in r:
-                    #     self._log.debug(i+" "+str(r[i]))
-                    
-                    # Can r be False in any reasonable situation? Why not just return in the exception handler above? 
-                    # Unless read_all can return, e.g., [] or None then this is just overcomplicating things.
-                    if r:
-                        try:
-                            for i in range(len(self._settings['datafields'])):
-                                datafield = self._settings['datafields'][i]
-                                if datafield in r:
-                                    # default name is datafield name
-                                    name = datafield 
-                                    # datafield value
-                                    value = r[datafield]
-                                    # replace datafield name with custom name
-                                    if i<len(self._settings['names']):
-                                        name = self._settings['names'][i]
-                                    # apply rounding if set
-                                    if i<len(self._settings['precision']):
-                                        value = round(value,self._settings['precision'][i])
-                                    
-                                    c.names.append(self._settings['prefix']+name)
-                                    c.realdata.append(value)
-
-                            self._log.debug(c.realdata)
-                        except Exception as e:
-                            self._log.error("Error parsing data: " + str(e))
-
-                    if len(c.realdata) > 0:
-                        return c
-                else:
-                    self._log.error("Not connected to SDM120")
-
+        if not self._poll_due(self._settings['read_interval']):
+            return False
+
+        c = Cargo.new_cargo()
+        c.names = []
+        c.realdata = []
+        c.nodeid = self._settings['nodename']
+
+        if self._sdm:
+            r = False
+            try:
+                r = self.read_all(self._settings['datafields'])
+            except emonhub_modbus.ModbusTransportError as e:
+                self._log.debug(str(e))
+            except Exception as e:
+                self._log.error("Could not read from SDM120: %s", e)
+            # for i in r:
+            #     self._log.debug(i+" "+str(r[i]))
+
+            # Can r be False in any reasonable situation? Why not just return in the exception handler above? 
+            # Unless read_all can return, e.g., [] or None then this is just overcomplicating things.
+            if r:
+                try:
+                    for i in range(len(self._settings['datafields'])):
+                        datafield = self._settings['datafields'][i]
+                        if datafield in r:
+                            # default name is datafield name
+                            name = datafield 
+                            # datafield value
+                            value = r[datafield]
+                            # replace datafield name with custom name
+                            if i<len(self._settings['names']):
+                                name = self._settings['names'][i]
+                            # apply rounding if set
+                            if i<len(self._settings['precision']):
+                                value = round(value,self._settings['precision'][i])
+
+                            c.names.append(self._settings['prefix']+name)
+                            c.realdata.append(value)
+
+                    self._log.debug(c.realdata)
+                except Exception as e:
+                    self._log.error("Error parsing data: " + str(e))
+
+            if len(c.realdata) > 0:
+                return c
         else:
-            self.next_interval = True
+            self._log.error("Not connected to SDM120")
 
         return False
 
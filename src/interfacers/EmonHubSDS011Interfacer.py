@@ -118,7 +118,7 @@ class EmonHubSDS011Interfacer(EmonHubInterfacer):
                 readings = self.sensor.query()
                 if readings is not None: readings = list(readings)
                 else: return False
-                self._log.debug("READINGS:" + str(readings))
+                self._log.debug("READINGS:%s", readings)
                 if self.readinterval >= 30:
                     self.sensor.sleep()
                     self._log.debug("Sensor returned to sleep")
@@ -129,7 +129,7 @@ class EmonHubSDS011Interfacer(EmonHubInterfacer):
                 c.nodeid = self._settings['nodename']
                 c.names = ["pm_25", "pm_10", "msg"]
                 c.realdata = [readings[0], readings[1], self.count]
-                self._log.info("SDS011 Cargo : " + str(c.realdata))
+                self._log.info("SDS011 Cargo : %s", c.realdata)
                 return c
             elif self.timenow >= self.previous_time + self.readinterval - self.warmup_time:
                 if self.sensor_waking == True or self.readinterval <= 30:
@@ -20,6 +20,30 @@ import Cargo
 from emonhub_interfacer import EmonHubInterfacer
 from smalibrary import SMASolar_library
 
+# Spot values read from the inverter: [command, first, last] request arguments
+READINGS_TO_MAKE = {
+    "EnergyProduction": [0x54000200, 0x00260100, 0x002622FF],
+
+    #This causes problems with some inverters
+    #readingsToMake["SpotDCPower"] = [0x53800200, 0x00251E00, 0x00251EFF]
+
+    "SpotACPower": [0x51000200, 0x00464000, 0x004642FF],
+    "SpotACTotalPower": [0x51000200, 0x00263F00, 0x00263FFF],
+    "SpotDCVoltage": [0x53800200, 0x00451F00, 0x004521FF],
+    "SpotACVoltage": [0x51000200, 0x00464800, 0x004655FF],
+    "SpotGridFrequency": [0x51000200, 0x00465700, 0x004657FF],
+    "OperationTime": [0x54000200, 0x00462E00, 0x00462FFF],
+    "InverterTemperature": [0x52000200, 0x00237700, 0x002377FF],
+    #Not very useful for reporting
+    #"MaxACPower": [0x51000200, 0x00411E00, 0x004120FF],
+    #"MaxACPower2": [0x51000200, 0x00832A00, 0x00832AFF],
+    #"GridRelayStatus": [0x51800200, 0x00416400, 0x004164FF],
+
+    #Only useful on off grid battery systems
+    #"ChargeStatus": [0x51000200, 0x00295A00, 0x00295AFF],
+    #"BatteryInfo": [0x51000200, 0x00491E00, 0x00495DFF],
+}
+
 """class EmonHubSMASolarInterfacer
 Monitors a SMA Solar inverter over bluetooth
 """
@@ -50,8 +74,10 @@ class EmonHubSMASolarInterfacer(EmonHubInterfacer):
         self._time_inverval = int(timeinverval)
         self._InverterPasswordArray = SMASolar_library.encodeInverterPassword(self._inverterpincode)
 
-        self._reset_duration_timer()
-        self._reset_time_to_disconnect_timer()
+        self._reset_logon_timer()
+
+        # Requests for the same command and nearby ranges are sent as one
+        self._requests = SMASolar_library.merge_requests(list(READINGS_TO_MAKE.values()))
 
         self._log.info("Reading from SMASolar every %d seconds", self._time_inverval)
 
@@ -61,12 +87,15 @@ class EmonHubSMASolarInterfacer(EmonHubInterfacer):
 
         self._log.info("Log into the SMA solar inverter %s", self._inverteraddress)
 
-        self._btSocket = self._open_bluetooth(self._inverteraddress, self._port)
+        btSocket = self._open_bluetooth(self._inverteraddress, self._port)
 
         #If bluetooth didn't work, exit here
-        if self._btSocket is None:
+        if btSocket is None:
             return
 
+        # Read the stream in blocks rather than a byte at a time
+        self._btSocket = SMASolar_library.BufferedBTSocket(btSocket)
+
         self._reset_packet_send_counter()
 
         self.mylocalBTAddress = SMASolar_library.BTAddressToByteArray(self._btSocket.getsockname()[0], ":")
@@ -81,7 +110,7 @@ class EmonHubSMASolarInterfacer(EmonHubInterfacer):
         SMASolar_library.logon(self._btSocket, self.mylocalBTAddress, self.MySerialNumber, self._packet_send_counter, self._InverterPasswordArray)
         self._increment_packet_send_counter()
 
-        self._reset_time_to_disconnect_timer()
+        self._reset_logon_timer()
 
         self._Inverters = {}
 
@@ -164,28 +193,24 @@ class EmonHubSMASolarInterfacer(EmonHubInterfacer):
 
         self._log.debug("packet count = {0:04x}".format(self._packet_send_counter))
 
-    def _reset_duration_timer(self):
-        """Reset timer to current date/time"""
-        self._last_time_reading = time.time()
-
-    def _is_it_time(self):
-        """Checks to see if the duration has expired
+    def _is_it_time_to_refresh_logon(self):
+        """Checks to see if 8 minutes has passed since we logged on, the logon
+        expires after 15 minutes
         Return true or false
         """
-
-        duration_of_delay = time.time() - self._last_time_reading
-        return int(duration_of_delay) > self._time_inverval
-
-    def _is_it_time_to_disconnect(self):
-        """Checks to see if 8 minutes has passed, if so, force a disconnect
-        Return true or false
-        """
-        duration_of_delay = time.time() - self._last_time_auto_disconnect
+        duration_of_delay = time.time() - self._last_time_logon
         return int(duration_of_delay) > 480
 
-    def _reset_time_to_disconnect_timer(self):
+    def _reset_logon_timer(self):
         """Reset timer to current date/time"""
-        self._last_time_auto_disconnect = time.time()
+        self._last_time_logon = time.time()
+
+    def _refresh_logon(self):
+        """Log on again over the open connection to keep the session alive"""
+        self._log.debug("Refreshing logon")
+        SMASolar_library.logon(self._btSocket, self.mylocalBTAddress, self.MySerialNumber, self._packet_send_counter, self._InverterPasswordArray)
+        self._increment_packet_send_counter()
+        self._reset_logon_timer()
 
     def _reset_bluetooth(self):
         subprocess.call(['sudo', 'systemctl', 'restart', 'bluetooth'],
@@ -210,11 +235,9 @@ class EmonHubSMASolarInterfacer(EmonHubInterfacer):
             return False
 
         #Wait until we are ready to read from inverter
-        if not self._is_it_time():
+        if not self._poll_due(self._time_inverval):
             return
 
-        self._reset_duration_timer()
-
         try:
             #self._log.debug("Entering read try section")
 
@@ -226,52 +249,30 @@ class EmonHubSMASolarInterfacer(EmonHubInterfacer):
             if self._btSocket is None:
                 return
 
-            readingsToMake = {
-                "EnergyProduction": [0x54000200, 0x00260100, 0x002622FF],
-
-                #This causes problems with some inverters
-                #readingsToMake["SpotDCPower"] = [0x53800200, 0x00251E00, 0x00251EFF]
-
-                "SpotACPower": [0x51000200, 0x00464000, 0x004642FF],
-                "SpotACTotalPower": [0x51000200, 0x00263F00, 0x00263FFF],
-                "SpotDCVoltage": [0x53800200, 0x00451F00, 0x004521FF],
-                "SpotACVoltage": [0x51000200, 0x00464800, 0x004655FF],
-                "SpotGridFrequency": [0x51000200, 0x00465700, 0x004657FF],
-                "OperationTime": [0x54000200, 0x00462E00, 0x00462FFF],
-                "InverterTemperature": [0x52000200, 0x00237700, 0x002377FF],
-                #Not very useful for reporting
-                #"MaxACPower": [0x51000200, 0x00411E00, 0x004120FF],
-                #"MaxACPower2": [0x51000200, 0x00832A00, 0x00832AFF],
-                #"GridRelayStatus": [0x51800200, 0x00416400, 0x004164FF],
-
-                #Only useful on off grid battery systems
-                #"ChargeStatus": [0x51000200, 0x00295A00, 0x00295AFF],
-                #"BatteryInfo": [0x51000200, 0x00491E00, 0x00495DFF],
-            }
 
             #Get first inverter in dictionary  # FIXME dicts aren't sorted, there is no "first"
             inverter = self._Inverters[list(self._Inverters.keys())[0]]
             self._log.debug("Reading from inverter %s", inverter["inverterName"])
 
-            #Loop through dictionary and take readings, building "output" dictionary as we go
+            #Loop through the requests and take readings, building "output" dictionary as we go
             output = {}
-            for reading, command in readingsToMake.items():
+            for cmd, first, last, ranges in self._requests:
                 data = SMASolar_library.request_data(
                     self._btSocket,
                     self._packet_send_counter,
                     self.mylocalBTAddress,
                     self.MySerialNumber,
-                    command[0],
-                    command[1],
-                    command[2],
+                    cmd,
+                    first,
+                    last,
                     inverter["susyid"],
                     inverter["serialNumber"])
 
                 self._increment_packet_send_counter()
                 if data is not None:
-                    output.update(SMASolar_library.extract_data(data))
+                    output.update(SMASolar_library.extract_data(data, ranges))
                     if self._packettrace:
-                        self._log.debug("Packet reply for %s. Packet from {0:04x}/{1:08x}".format(data.getTwoByte(14), data.getFourByteLong(16)), reading)
+                        self._log.debug("Packet reply for {0:08x}. Packet from {1:04x}/{2:08x}".format(cmd, data.getTwoByte(14), data.getFourByteLong(16)))
                         self._log.debug(data.debugViewPacket())
 
             #self._log.debug("Building cargo")
@@ -291,14 +292,11 @@ class EmonHubSMASolarInterfacer(EmonHubInterfacer):
             #TODO: We should be able to populate the rssi number from the bluetooth signal strength
             c.rssi = 0
 
-            #Inverter appears to kill our connection every 10 minutes, so disconnect after 8 minutes
-            #to avoid errors in log files
-            if self._is_it_time_to_disconnect():
-                self._log.info("Disconnecting Bluetooth after timer expired")
-                SMASolar_library.logoff(self._btSocket, self._packet_send_counter, self.mylocalBTAddress, self.MySerialNumber)
-                self._reset_time_to_disconnect_timer()
-                self._btSocket.close()
-                self._btSocket = None
+            #Keep the session alive rather than disconnecting and logging on again,
+            #the logon is refreshed before it expires. If the inverter drops the
+            #connection anyway we reconnect on the next read
+            if self._is_it_time_to_refresh_logon():
+                self._refresh_logon()
 
             self._log.debug("Returning cargo")
             return c
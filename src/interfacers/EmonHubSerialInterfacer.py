@@ -1,3 +1,7 @@
+import time
+import queue
+import select
+import threading
 import serial
 from emonhub_interfacer import EmonHubInterfacer
 
@@ -7,10 +11,27 @@ import Cargo
 
 Monitors the serial port for data
 
+A dedicated reader thread waits on the serial port file descriptor, reads
+whatever bytes are waiting and splits them into complete lines, which are
+queued for the interfacer thread. Every complete line is kept, however many
+arrive in a single read, and the interfacer loop wakes up as soon as a line
+is available rather than polling the port.
+
+If reading fails, e.g. a USB adapter is unplugged, the reader thread closes
+the port and exits, read() reopens it every 10s and starts a new reader.
+
+Subclasses implement read() on top of _reconnect() and _readline().
+
 """
 
 class EmonHubSerialInterfacer(EmonHubInterfacer):
 
+    # Maximum number of complete lines waiting to be processed
+    rx_queue_size = 100
+
+    # Maximum length of a line, anything longer without a line feed is discarded
+    rx_max_line_length = 4096
+
     def __init__(self, name, com_port='', com_baud=9600):
         """Initialize interfacer
 
@@ -24,10 +45,18 @@ class EmonHubSerialInterfacer(EmonHubInterfacer):
         self._connect_failure_count = 0
 
         # Open serial port
+        self._com_port = com_port
+        self._com_baud = com_baud
+        self._last_connection_attempt = time.time()
         self._ser = self._open_serial_port(com_port, com_baud)
 
-        # Initialize RX buffer
+        # Initialize RX buffer, line queue and reader thread
         self._rx_buf = ''
+        self._rx_frame = bytearray()
+        self._rx_lines = queue.Queue(self.rx_queue_size)
+        self._rx_ready = threading.Event()
+        self._rx_dropped = 0
+        self._reader = None
 
     def close(self):
         """Close serial port"""
@@ -55,11 +84,137 @@ class EmonHubSerialInterfacer(EmonHubInterfacer):
             self._connect_failure_count += 1
             if self._connect_failure_count==1:
                 self._log.error("Could not open serial port: %s @ %s bits/s (retry every 10s)", com_port, com_baud)
-                
+
             s = False
             # raise EmonHubInterfacerInitError('Could not open COM port %s' % com_port)
         return s
 
+    def _reconnect(self):
+        """Reopen the serial port every 10s while it is closed
+
+        Returns True if the port is open.
+
+        """
+
+        if not self._ser and time.time() - self._last_connection_attempt >= 10:
+            self._last_connection_attempt = time.time()
+            self._ser = self._open_serial_port(self._com_port, self._com_baud)
+        return bool(self._ser)
+
+    def _start_reader(self):
+        """Start the serial reader thread if it is not already running"""
+
+        if self._reader is not None and self._reader.is_alive():
+            return
+        self._rx_frame = bytearray()
+        self._reader = threading.Thread(target=self._read_serial, args=(self._ser,),
+                                        name=self.name + "-rx", daemon=True)
+        self._reader.start()
+
+    def _read_serial(self, ser):
+        """Reader thread: wait for serial data and queue every complete line
+
+        ser (serial.Serial): port to read, the thread exits if the interfacer
+        replaces or closes it
+
+        """
+
+        while not self.stop and self._ser is ser:
+            try:
+                ready, _, _ = select.select([ser.fileno()], [], [], 0.5)
+                if not ready:
+                    continue
+                # A readable fd with nothing waiting means the device has gone
+                data = ser.read(ser.in_waiting or 1)
+                if not data:
+                    raise serial.SerialException("device reports readiness to read but returned no data")
+            except Exception as e:
+                if self._ser is ser:
+                    self._log.error("Serial port read error, closing %s (retry every 10s): %s", self._com_port, e)
+                    try:
+                        ser.close()
+                    except Exception:
+                        pass
+                    self._ser = False
+                self._rx_ready.set()
+                return
+            self._frame_lines(data)
+
+    def _frame_lines(self, data):
+        """Append data to the framing buffer and queue all complete lines
+
+        data (bytes): raw bytes read from the serial port
+
+        """
+
+        frame = self._rx_frame
+        frame += data
+        end = frame.find(b'\n')
+        if end < 0:
+            if len(frame) > self.rx_max_line_length:
+                self._log.warning("Discarding %d bytes received without line feed", len(frame))
+                del frame[:]
+            return
+
+        start = 0
+        while end >= 0:
+            line = bytes(frame[start:end]).rstrip(b'\r')
+            start = end + 1
+            try:
+                self._rx_lines.put_nowait(line)
+            except queue.Full:
+                # Keep the most recent data, drop the oldest line
+                try:
+                    self._rx_lines.get_nowait()
+                except queue.Empty:
+                    pass
+                self._rx_lines.put_nowait(line)
+                self._rx_dropped += 1
+                if self._rx_dropped == 1 or self._rx_dropped % 100 == 0:
+                    self._log.warning("Serial line queue full, %d lines dropped", self._rx_dropped)
+            end = frame.find(b'\n', start)
+        del frame[:start]
+        self._rx_ready.set()
+
+    def _readline(self, timeout=0):
+        """Return the next complete line received, without line ending
+
+        timeout (float): seconds to wait for a line, 0 returns immediately
+
+        Returns None if no line is available or it can't be decoded.
+
+        """
+
+        if self._ser:
+            self._start_reader()
+
+        # Cleared before taking a line, a line queued meanwhile sets it again
+        self._rx_ready.clear()
+        try:
+            if timeout:
+                line = self._rx_lines.get(timeout=timeout)
+            else:
+                line = self._rx_lines.get_nowait()
+        except queue.Empty:
+            return None
+
+        if not self._rx_lines.empty():
+            self._rx_ready.set()
+
+        try:
+            return line.decode()
+        except UnicodeDecodeError:
+            self._log.debug("Discarding line that is not valid text: %s", line)
+            return None
+
+    def _wait_for_input(self, timeout):
+        """Return as soon as a line is waiting, or after timeout seconds"""
+
+        if self._ser and self._reader is not None and len(self._settings['pubchannels']):
+            self._rx_ready.wait(timeout)
+        else:
+            super()._wait_for_input(timeout)
+
     def read(self):
         """Read data from serial port and process if complete line received.
 
@@ -67,22 +222,13 @@ class EmonHubSerialInterfacer(EmonHubInterfacer):
 
         """
 
-        if not self._ser:
+        if not self._reconnect():
             return False
 
-        # Read serial RX
-        self._rx_buf = self._rx_buf + self._ser.readline().decode()
-
-        # If line incomplete, exit
-        if '\r\n' not in self._rx_buf:
+        f = self._readline()
+        if not f:
             return
 
-        # Remove CR,LF
-        f = self._rx_buf[:-2]
-
-        # Reset buffer
-        self._rx_buf = ''
-
         # Create a Payload object
         c = Cargo.new_cargo(rawdata=f)
 
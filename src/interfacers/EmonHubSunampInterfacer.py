@@ -1,4 +1,3 @@
-import time
 import json
 import datetime
 import Cargo
@@ -27,7 +26,6 @@ class EmonHubSunampInterfacer(ehi.EmonHubSerialInterfacer):
         # Display device firmware version and current settings
         self.info = ["", ""]
 
-        self._rx_buf = ""
         # self._ser.flushInput()
 
         # Initialize settings
@@ -38,41 +36,19 @@ class EmonHubSunampInterfacer(ehi.EmonHubSerialInterfacer):
         # comment out if diagnosing a startup value issue
         self._settings.update(self._defaults)
         
-        self._com_port = com_port
-        self._com_baud = com_baud
-        self._last_connection_attempt = time.time()
 
 
     def read(self):
 
-        if not self._ser:
-            if (time.time()-self._last_connection_attempt)>=10:
-                self._last_connection_attempt = time.time()
-                self._ser = self._open_serial_port(self._com_port, self._com_baud)
-        
-        if not self._ser:
-            return
-
-        # Read serial RX
-        try:
-            ser_data = self._ser.readline()
-            self._rx_buf = self._rx_buf + ser_data.decode()
-        except UnicodeDecodeError:
+        if not self._reconnect():
             return
-        except Exception as e:
-            self._log.error(e)
-            self._ser = False
 
-        # If line incomplete, exit
-        if '\n' not in self._rx_buf:
+        # Next complete line received, if any
+        f = self._readline()
+        if f is None:
             return
 
-        # Remove CR,LF.
-        f = self._rx_buf[:-1].strip()
-
-        # Reset buffer
-        self._rx_buf = ''
-
+        f = f.strip()
         if not f:
             return
 
@@ -70,8 +70,11 @@ class EmonHubTemplateInterfacer(EmonHubInterfacer):
 
         return c
 
-    def add(self, cargo):
-        """Append data to buffer.
+    def _sends_names(self):
+        return True
+
+    def _format(self, cargo):
+        """Return the frame of a cargo for the buffer.
 
           format: {"emontx":{"power1":100,"power2":200,"power3":300}}
 
@@ -97,7 +100,7 @@ class EmonHubTemplateInterfacer(EmonHubInterfacer):
         if cargo.rssi:
             f['data']['rssi'] = cargo.rssi
 
-        self.buffer.storeItem(f)
+        return f
 
     def _process_post(self, databuffer):
         """Send data to server/broker or other output
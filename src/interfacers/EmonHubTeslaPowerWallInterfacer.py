@@ -1,10 +1,16 @@
-import time, json, Cargo, requests
+import time, Cargo, requests
+import emonhub_http
+import emonhub_json
 from emonhub_interfacer import EmonHubInterfacer
 
 """class EmonHubTeslaPowerWallInterfacer
 
 Fetch Tesla Power Wall state of charge
 
+The published values are selected with the extract setting, a list of
+path[:name[:scale[:type]]] entries (see emonhub_json), by default the
+percentage key published as soc.
+
 """
 
 class EmonHubTeslaPowerWallInterfacer(EmonHubInterfacer):
@@ -17,7 +23,9 @@ class EmonHubTeslaPowerWallInterfacer(EmonHubInterfacer):
         # Interfacer specific settings
         self._template_settings = {'name': 'powerwall',
                                    'url': False,
-                                   'readinterval': 10.0}
+                                   'readinterval': 10.0,
+                                   'extract': ['percentage:soc']}
+        self._extractor = emonhub_json.JsonExtractor(self._template_settings['extract'])
 
         # FIXME is there a good reason to reduce this from the default of 1000? If so, document it here.
         # set an absolute upper limit for number of items to process per post
@@ -26,6 +34,8 @@ class EmonHubTeslaPowerWallInterfacer(EmonHubInterfacer):
         # Fetch first reading at one interval lengths time
         self._last_time = 0
 
+        self._http = emonhub_http.HttpPoller(self.name)
+
     def read(self):
         # Request Power Wall data at user specified interval
         if time.time() - self._last_time >= self._settings['readinterval']:
@@ -33,33 +43,30 @@ class EmonHubTeslaPowerWallInterfacer(EmonHubInterfacer):
 
             # If URL is set, fetch the SOC
             if self._settings['url']:
-                # HTTP Request
+                # HTTP Request, the Power Wall gateway uses a self-signed certificate
+                endpoint = emonhub_http.Endpoint('status', self._settings['url'], timeout=int(self._settings['readinterval']), verify=False)
                 try:
-                    reply = requests.get(self._settings['url'], timeout=int(self._settings['readinterval']), verify=False)
-                    reply.raise_for_status()  # Raise an exception if status code isn't 200
+                    data = self._http.fetch([endpoint])['status']
                 except requests.exceptions.RequestException as ex:
                     self._log.warning("%s couldn't send to server: %s", self.name, ex)
-
-                jsonstr = reply.text.rstrip()
-                self._log.debug("%s Request response: %s", self.name, jsonstr)
-
-                # Decode JSON
-                try:
-                    data = json.loads(jsonstr)
-                except Exception:  # FIXME Too general exception
+                    return
+                except ValueError:
                     self._log.warning("%s Invalid JSON", self.name)
                     return
 
-                # Check if battery percentage key is in data object
-                if not 'percentage' in data:
-                    self._log.warning("%s Percentage key not found", self.name)
+                self._log.debug("%s Request response: %s", self.name, data)
+
+                names, values, missing = self._extractor.extract(data)
+                if missing:
+                    self._log.warning("%s Keys not found: %s", self.name, ", ".join(missing))
+                if not names:
                     return
 
                 # Create cargo object
                 c = Cargo.new_cargo()
                 c.nodeid = self._settings['name']
-                c.names = ["soc"]
-                c.realdata = [data['percentage']]
+                c.names = names
+                c.realdata = values
                 return c
 
         # return empty if not time
@@ -86,6 +93,15 @@ class EmonHubTeslaPowerWallInterfacer(EmonHubInterfacer):
                 self._log.info("Setting %s %s: %s", self.name, key, setting)
                 self._settings[key] = setting
                 continue
+            elif key == 'extract':
+                try:
+                    self._extractor = emonhub_json.JsonExtractor(setting)
+                except ValueError as e:
+                    self._log.warning("'%s' is not valid for %s: %s (%s)", setting, self.name, key, e)
+                    continue
+                self._log.info("Setting %s %s: %s", self.name, key, setting)
+                self._settings[key] = setting
+                continue
             else:
                 self._log.warning("'%s' is not valid for %s: %s", setting, self.name, key)
 
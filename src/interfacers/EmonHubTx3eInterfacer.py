@@ -28,9 +28,6 @@ class EmonHubTx3eInterfacer(ehi.EmonHubSerialInterfacer):
             'nodename': ""
         })
 
-        # Initialize RX buffer
-        self._rx_buf = ''
-
     def read(self):
         """Read data from serial port and process if complete line received.
 
@@ -39,36 +36,25 @@ class EmonHubTx3eInterfacer(ehi.EmonHubSerialInterfacer):
 
         """
 
-        if not self._ser:
+        if not self._reconnect():
             return False
 
-        # Read serial RX
-        self._rx_buf = self._rx_buf + self._ser.readline().decode()
-
-        # If line incomplete, exit
-        if '\r\n' not in self._rx_buf:
-            # If string longer than 3 print message
-            if len(self._rx_buf) > 3:
-                self._log.info("START MESSAGE: %s", self._rx_buf.rstrip())
-
-            self._rx_buf = ''
+        # Next complete line received, if any
+        f = self._readline()
+        if f is None:
             return False
 
         #Check for MSG data string. If not found...
-        if self._rx_buf.find("MSG:",0,4) == -1:
-            self._log.info("START MESSAGE: %s", self._rx_buf.rstrip())
-            self._rx_buf = ''
+        if f.find("MSG:",0,4) == -1:
+            if len(f.strip()) > 3:
+                self._log.info("START MESSAGE: %s", f.rstrip())
             return False
 
-        # Remove CR,LF
-        f = self._rx_buf[:-2].strip()
+        f = f.strip()
 
         # Create a Payload object
         c = Cargo.new_cargo(rawdata=f)
 
-        # Reset buffer
-        self._rx_buf = ''
-
         # Parse the ESP format string
         values = []
         names = []
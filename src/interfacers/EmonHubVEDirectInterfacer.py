@@ -1,4 +1,3 @@
-import time
 import serial
 import Cargo
 from emonhub_interfacer import EmonHubInterfacer
@@ -11,7 +10,11 @@ class EmonHubVEDirectInterfacer(EmonHubInterfacer):
     """
 
 
-    WAIT_HEADER, IN_KEY, IN_VALUE, IN_CHECKSUM = range(4)
+    # Every block of fields ends with a Checksum field holding a single byte
+    CHECKSUM = b'\r\nChecksum\t'
+
+    # Maximum number of bytes buffered without a complete block
+    rx_max_block_size = 4096
 
     def __init__(self, name, com_port='', com_baud=9600, toextract='', poll_interval=30):
         """Initialize interfacer
@@ -26,66 +29,54 @@ class EmonHubVEDirectInterfacer(EmonHubInterfacer):
         # Open serial port
         self._ser = self._open_serial_port(com_port, com_baud)
 
-        # VE Direct state machine requirements
-        self.header1 = b'\r'
-        self.header2 = b'\n'
-        self.delimiter = b'\t'
-        self.key = bytearray()
-        self.value = bytearray()
-        self.bytes_sum = 0
-        self.state = self.WAIT_HEADER
-        self.dict = {}
+        # VE Direct block scanner requirements
+        self._rx_buf = bytearray()
+        self._latest = None
 
         # Parser requirements
         self._extract = toextract
         self.poll_interval = float(poll_interval)
 
-        # Polling timer
-        self.last_read = 0.0
-
-    def input(self, byte):
+    def input(self, data):
         """
-        Parse serial byte code from VE.Direct
+        Parse bytes received from VE.Direct
 
-        Return None if more data is needed, return an empty dict if the
-        checksum was wrong, return a dict of valid data otherwise.
+        The text protocol sends a block of "\r\nKEY\tVALUE" fields every second,
+        ending with a Checksum field whose byte makes the sum of all bytes in the
+        block 0 modulo 256. Bytes are buffered until a block is complete.
+
+        Return the fields of the last valid block completed by data as a dict,
+        an empty dict if the only complete blocks had a wrong checksum, or None
+        if more data is needed.
         """
-        self.bytes_sum += ord(byte)
-        if self.state == self.WAIT_HEADER:
-            if byte == self.header1:
-                self.state = self.WAIT_HEADER
-            elif byte == self.header2:
-                self.state = self.IN_KEY
-        elif self.state == self.IN_KEY:
-            if byte == self.delimiter:
-                if self.key.decode() == 'Checksum':
-                    self.state = self.IN_CHECKSUM
-                else:
-                    self.state = self.IN_VALUE
-            else:
-                self.key += byte
-        elif self.state == self.IN_VALUE:
-            if byte == self.header1:
-                self.state = self.WAIT_HEADER
-                self.dict[self.key.decode()] = self.value.decode()
-                self.key = bytearray()
-                self.value = bytearray()
-            else:
-                self.value += byte
-        elif self.state == self.IN_CHECKSUM:
-            self.state = self.WAIT_HEADER
-            self.key = bytearray()
-            self.value = bytearray()
-            try:
-                if self.bytes_sum % 256 == 0:
-                    return self.dict
-                self._log.error("Invalid checksum, discarding data")
-                return {}
-            finally:
-                self.dict = {}
-                self.bytes_sum = 0
-        else:
-            raise RuntimeError("Impossible state")
+        buf = self._rx_buf
+        buf += data
+        view = memoryview(buf)
+        marker = len(self.CHECKSUM)
+        packet = None
+        start = 0
+        try:
+            end = buf.find(self.CHECKSUM)
+            while end >= 0 and end + marker < len(buf):
+                stop = end + marker + 1
+                if sum(view[start:stop]) % 256 == 0:
+                    packet = dict(field.split(b'\t', 1) for field in bytes(view[start:end]).split(b'\r\n') if b'\t' in field)
+                elif packet is None:
+                    self._log.error("Invalid checksum, discarding data")
+                    packet = {}
+                start = stop
+                end = buf.find(self.CHECKSUM, start)
+        finally:
+            view.release()
+
+        del buf[:start]
+        if len(buf) > self.rx_max_block_size:
+            self._log.warning("Discarding %d bytes received without a complete block", len(buf))
+            del buf[:-marker]
+
+        if packet:
+            return {key.decode(errors='replace'): value.decode(errors='replace') for key, value in packet.items()}
+        return packet
 
     def close(self):
         """Close serial port"""
@@ -104,7 +95,7 @@ class EmonHubVEDirectInterfacer(EmonHubInterfacer):
         """
         try:
             self._log.debug("Opening serial port: %s @ %s bits/s", com_port, com_baud)
-            return serial.Serial(com_port, com_baud, timeout=10)
+            return serial.Serial(com_port, com_baud, timeout=0)
         except serial.SerialException:
             self._log.exception("Open error")
 
@@ -127,14 +118,15 @@ class EmonHubVEDirectInterfacer(EmonHubInterfacer):
         return clean_data
 
     def _read_serial(self):
-        self._log.debug("Starting Serial read from %s", self._ser)
+        """Read all waiting bytes and keep the latest complete block, never blocks"""
         try:
             while self._ser:
-                # Read one byte at a time from the serial port and pass it into
-                # the input FSM until we have a complete packet, then return it
-                packet = self.input(self._ser.read())
-                if packet is not None:
-                    return packet
+                data = self._ser.read(self._ser.in_waiting)
+                if not data:
+                    return
+                packet = self.input(data)
+                if packet:
+                    self._latest = packet
         except Exception:  # FIXME Too general Exception. Maybe SerialException?
             self._log.exception("Read error")
 
@@ -142,18 +134,16 @@ class EmonHubVEDirectInterfacer(EmonHubInterfacer):
         """Read data from serial port and process if complete line received.
         """
 
-        now = time.time()
-        if now - self.last_read <= self.poll_interval:
-            #self._log.debug("Waiting for %d seconds ", now - self.last_read)
-            # Wait to read based on poll_interval
-            return
+        # Keep up with the stream, blocks arrive every second
+        self._read_serial()
 
-        rx_buf = self._read_serial()
-        self.last_read = now
-        # If _read_serial raised an exception or returned empty dict, exit
-        if not rx_buf:
+        # Wait to read based on poll_interval
+        if self._latest is None or not self._poll_due(self.poll_interval, immediate=True):
             return
 
+        rx_buf = self._latest
+        self._latest = None
+
         #Sample data looks like {'FW': '0307', 'SOC': '1000', 'Relay': 'OFF', 'PID': '0x203', 'H10': '6', 'BMV': '700', 'TTG': '-1', 'H12': '0', 'H18': '0', 'I': '0', 'H11': '0', 'Alarm': 'OFF', 'CE': '0', 'H17': '9', 'P': '0', 'AR': '0', 'V': '26719', 'H8': '29011', 'H9': '0', 'H2': '0', 'H3': '0', 'H1': '-1633', 'H6': '-5775', 'H7': '17453', 'H4': '0', 'H5': '0'}
 
         if 'nodeoffset' not in self._settings:
@@ -1,14 +1,51 @@
 import time
+import struct
+import inspect
+import concurrent.futures
 import Cargo
 import emonhub_coder as ehc
+import emonhub_modbus
 from emonhub_interfacer import EmonHubInterfacer
 
 """class EmonModbusTcpInterfacer
 Monitors Modbus devices using modbus tcp
-At this stage, only read_holding_registers() is implemented in the read() method
-if needed, please change the function to read_input_registers()
+
+The registers to read are compiled into a read plan whenever the runtime
+settings or the node definition change. Registers of the same device, unit
+and register type that are close together are fetched with a single request,
+and the devices are read concurrently. Each host is reached through the
+Modbus transport shared with the other interfacers polling it, so requests to
+one host (or the RS485 bus behind a gateway) never collide. Holding registers
+are read by default, set register_type to 'input' (once, or once per register)
+to read input registers.
+
+The values are decoded and scaled here and published as they are, they are
+not encoded again for _process_rx to decode.
 """
 
+# Maximum number of registers returned by a single read request
+MODBUS_MAX_REGISTERS = 125
+
+# Number of 16 bit registers and big endian decoder for each datacode
+MODBUS_DATACODES = {
+    'h': (1, struct.Struct('>h')),
+    'H': (1, struct.Struct('>H')),
+    'i': (2, struct.Struct('>i')),
+    'l': (2, struct.Struct('>i')),
+    'I': (2, struct.Struct('>I')),
+    'L': (2, struct.Struct('>I')),
+    'f': (2, struct.Struct('>f')),
+    'q': (4, struct.Struct('>q')),
+    'Q': (4, struct.Struct('>Q')),
+    'd': (4, struct.Struct('>d'))
+}
+
+# Client method used for each register type
+MODBUS_REGISTER_TYPES = {
+    'holding': 'read_holding_registers',
+    'input': 'read_input_registers'
+}
+
 class EmonModbusTcpInterfacer(EmonHubInterfacer):
 
     def __init__(self, name, modbus_IP='192.168.1.10', modbus_port=0):
@@ -19,203 +56,317 @@ class EmonModbusTcpInterfacer(EmonHubInterfacer):
         # Initialization
         super().__init__(name)
 
-        self._modcon = False
+        self._modbus_settings = {
+            'max_gap': 10
+        }
+        self._settings.update(self._modbus_settings)
+
+        self._host = (str(modbus_IP), int(modbus_port) or 502)
+
+        # Read plan, rebuilt when the settings or the node definition change
+        self._plan = None
+        self._plan_rx = None
+        self._next_read = 0
+
+        # Shared transports by (host, port), and a thread pool to read several hosts at once
+        self._transports = {}
+        self._executor = None
+        self._executor_workers = 0
 
         self.pymodbus_found = True
         try:
-            from pymodbus.constants import Endian
-            self.Endian = Endian
-            from pymodbus.payload import BinaryPayloadDecoder
-            self.BinaryPayloadDecoder = BinaryPayloadDecoder
             from pymodbus.client import ModbusTcpClient
-            self.ModbusTcpClient = ModbusTcpClient
         except ModuleNotFoundError as err:
             self.pymodbus_found = False
             self._log.error(err)
 
         if not self.pymodbus_found:
             self._log.error("PYMODBUS NOT PRESENT BUT NEEDED !!")
-        # open connection
         else:
             self._log.info("pymodbus installed")
             self._log.debug("EmonModbusTcpInterfacer args: %s - %s", modbus_IP, modbus_port)
-            self._con = self._open_modTCP(modbus_IP, modbus_port)
-            if self._modcon:
-                self._log.info("Modbustcp client Connected")
-            else:
-                self._log.info("Connection to ModbusTCP client failed. Will try again")
+            # The unit keyword was renamed from slave to device_id in pymodbus 3.10
+            params = inspect.signature(ModbusTcpClient.read_holding_registers).parameters
+            self._unit_kw = 'device_id' if 'device_id' in params else 'slave'
 
     def set(self, **kwargs):
         for key in kwargs:
             setting = kwargs[key]
             self._settings[key] = setting
             self._log.debug("Setting %s %s: %s", self.name, key, setting)
+        self._plan = None
+
+    def run(self):
+        super().run()
+        # Stopped, e.g. replaced after a configuration change, release the shared Modbus transport
+        self.close()
 
     def close(self):
-        # Close TCP connection
-        if self._con is not None:
-            self._log.debug("Closing tcp port")
-            self._con.close()
+        # Let the reads in progress finish, then release TCP connections
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        for transport in self._transports.values():
+            transport.detach(self.name)
+        self._transports = {}
+
+    def _host_key(self, host):
+        """Return (host, port) for a 'host' or 'host:port' nHost entry"""
+        host = str(host).strip()
+        if not host:
+            return self._host
+        if ':' in host:
+            host, port = host.rsplit(':', 1)
+            return (host, int(port))
+        return (host, self._host[1])
+
+    def compile_plan(self):
+        """Build the read plan from the runtime settings and the node definition
+
+        Registers with the same host, unit and register type that are at most
+        max_gap registers apart are read with a single request, up to the
+        Modbus limit of 125 registers per request.
 
-    def _open_modTCP(self, modbus_IP, modbus_port):
-        """ Open connection to modbus device """
+        Returns (node, names, blocks) where blocks is a list of
+        (host, unit, register_type, start, count, [(index, offset, size, decoder, scale)]),
+        or None if the configuration is not valid.
+
+        """
+        # fetch nodeid
+        if 'nodeId' in self._settings:
+            node = str(self._settings["nodeId"])
+        else:
+            self._log.error("please provide a nodeId")
+            return
+
+        # stores registers
+        if 'register' in self._settings:
+            registers = self._settings["register"]
+            if not isinstance(registers, list):
+                registers = [registers]
+        else:
+            self._log.error("please provide a register number or a list of registers")
+            return
+
+        if node not in ehc.nodelist or 'rx' not in ehc.nodelist[node]:
+            self._log.error("please provide a node %s definition with names and datacodes", node)
+            return
+        rx = ehc.nodelist[node]['rx']
+
+        # stores names
+        rNames = rx.get('names', [])
+        if not isinstance(rNames, list):
+            rNames = [rNames]
+
+        # fetch datacode or datacodes
+        if 'datacodes' in rx:
+            datacodes = rx['datacodes']
+        elif 'datacode' in rx:
+            datacodes = [rx['datacode']] * len(rNames)
+        else:
+            self._log.error("please provide a datacode or a list of datacodes")
+            return
+
+        # check if number of registers and number of names are the same
+        if len(rNames) != len(registers):
+            self._log.error("You have to define an equal number of registers and of names")
+            return
+        # check if number of names and number of datacodes are the same
+        if len(datacodes) != len(rNames):
+            self._log.error("You are using datacodes. You have to define an equal number of datacodes and of names")
+            return
+        for code in datacodes:
+            if code not in MODBUS_DATACODES:
+                self._log.error("invalid datacode %s", code)
+                return
+
+        # fetch scales, if any
+        if 'scales' in rx:
+            scales = rx['scales']
+            if not isinstance(scales, list):
+                scales = [scales]
+            # A single entry is ignored, as it always has been by _process_rx
+            if len(scales) == 1:
+                scales = [1] * len(rNames)
+        else:
+            scales = [rx.get('scale', self._settings['scale'])] * len(rNames)
+
+        # fetch unitids, hosts and register types if present
+        def per_register(key, default):
+            setting = self._settings.get(key, default)
+            if not isinstance(setting, list):
+                return [setting] * len(registers)
+            if len(setting) != len(registers):
+                raise ValueError("%s needs one entry for each register" % key)
+            return setting
 
         try:
-            c = self.ModbusTcpClient(modbus_IP, modbus_port)
-            if c.connect():
-                self._log.info("Opening modbusTCP connection: %s @ %s", modbus_port, modbus_IP)
-                self._modcon = True
-            else:
-                self._log.debug("Connection failed")
-                self._modcon = False
+            units = [int(unit) for unit in per_register("nUnit", 1)]
+            hosts = [self._host_key(host) for host in per_register("nHost", "")]
+            register_types = [str(rtype).lower() for rtype in per_register("register_type", "holding")]
+            max_gap = int(self._settings['max_gap'])
+            items = []
+            for idx, register in enumerate(registers):
+                if register_types[idx] not in MODBUS_REGISTER_TYPES:
+                    raise ValueError("register_type must be holding or input")
+                size, decoder = MODBUS_DATACODES[datacodes[idx]]
+                scale = float(scales[idx]) if idx < len(scales) else 1.0
+                # float datacodes have always been published x10, to be scaled by 0.1 in the node
+                if datacodes[idx] in ('f', 'd'):
+                    scale *= 10
+                # According to the Modbus specification, registers numbered, e.g., 1-16 are
+                # transmitted as 0-15.
+                address = int(str(register).strip(), 0) - 1
+                items.append((hosts[idx], units[idx], register_types[idx], address, size, idx, decoder, scale))
+        except ValueError as e:
+            self._log.error("invalid register settings: %s", e)
+            return
+
+        blocks = []
+        for host, unit, rtype, address, size, idx, decoder, scale in sorted(items, key=lambda item: item[:5]):
+            if blocks:
+                last_host, last_unit, last_type, start, count, block_items = blocks[-1]
+                end = max(address + size, start + count)
+                if (last_host, last_unit, last_type) == (host, unit, rtype) \
+                        and address - (start + count) <= max_gap and end - start <= MODBUS_MAX_REGISTERS:
+                    block_items.append((idx, address - start, size, decoder, scale))
+                    blocks[-1] = (host, unit, rtype, start, end - start, block_items)
+                    continue
+            blocks.append((host, unit, rtype, address, size, [(idx, 0, size, decoder, scale)]))
+
+        self._log.debug("read plan for node %s: %d registers in %d requests", node, len(items), len(blocks))
+        return node, list(rNames), blocks
+
+    def _read_block(self, block):
+        """Read the registers of a block, returns the raw bytes"""
+        host, unit, rtype, start, count, block_items = block
+        transport = self._transports.get(host)
+        if transport is None:
+            transport = emonhub_modbus.get_tcp_transport(self.name, *host)
+            self._transports[host] = transport
+
+        def read_registers(client):
+            return getattr(client, MODBUS_REGISTER_TYPES[rtype])(start, count=count, **{self._unit_kw: unit})
+
+        try:
+            result = transport.request(self.name, read_registers)
+        except emonhub_modbus.ModbusTransportError:
+            raise
         except Exception as e:
-            self._log.error("modbusTCP connection failed %s", e)
-            #raise EmonHubInterfacerInitError('Could not open connection to host %s' %modbus_IP)
-        else:
-            return c
+            transport.invalidate(self.name, str(e))
+            raise
+        if result.isError():
+            raise ValueError("exception response %s" % result)
+        return struct.pack('>%dH' % count, *result.registers[:count])
+
+    def _read_host(self, blocks):
+        """Read blocks in turn, returns the raw bytes or the exception for each block"""
+        results = []
+        for block in blocks:
+            try:
+                results.append(self._read_block(block))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def _read_plan(self, blocks):
+        """Read all blocks, the hosts concurrently, in the order of blocks"""
+        hosts = {}
+        for block in blocks:
+            hosts.setdefault(block[0], []).append(block)
+        if len(hosts) == 1:
+            return self._read_host(blocks)
+
+        if self._executor is None or self._executor_workers < len(hosts):
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(hosts), thread_name_prefix=self.name)
+            self._executor_workers = len(hosts)
+        results = {}
+        for host_blocks, host_results in zip(hosts.values(), self._executor.map(self._read_host, hosts.values())):
+            for block, result in zip(host_blocks, host_results):
+                results[id(block)] = result
+        return [results[id(block)] for block in blocks]
+
+    def _split_block(self, block):
+        """Replace a block that the device refuses with one request per value"""
+        host, unit, rtype, start, count, block_items = block
+        return [(host, unit, rtype, start + offset, size, [(idx, 0, size, decoder, scale)])
+                for idx, offset, size, decoder, scale in block_items]
 
     def read(self):
         """ Read registers from client"""
-        if self.pymodbus_found:
-            time.sleep(float(self._settings["interval"]))
-            f = []
-            c = Cargo.new_cargo(rawdata="")
-            # valid datacodes list and number of registers associated
-            # in modbus protocol, one register is 16 bits or 2 bytes
-            valid_datacodes = ({'h': 1, 'H': 1, 'i': 2, 'l': 2, 'I': 2, 'L': 2, 'f': 2, 'q': 4, 'Q': 4, 'd': 4})
-
-            if not self._modcon:
-                self._con.close()
-                self._log.info("Not connected, retrying connect %s", self.init_settings)
-                self._con = self._open_modTCP(self.init_settings["modbus_IP"], self.init_settings["modbus_port"])
-
-            if self._modcon:
-                # fetch nodeid
-                if 'nodeId' in self._settings:
-                    node = str(self._settings["nodeId"])
-                else:
-                    self._log.error("please provide a nodeId")
-                    return
-
-                # stores registers
-                if 'register' in self._settings:
-                    registers = self._settings["register"]
-                else:
-                    self._log.error("please provide a register number or a list of registers")
-                    return
-
-                # fetch unitids if present
-                UnitIds = self._settings.get("nUnit", None)
-
-                # stores names
-                # fetch datacode or datacodes
-                if node in ehc.nodelist and 'rx' in ehc.nodelist[node]:
-                    rNames = ehc.nodelist[node]['rx']['names']
-                    if 'datacode' in ehc.nodelist[node]['rx']:
-                        datacode = ehc.nodelist[node]['rx']['datacode']
-                        datacodes = None
-                    elif 'datacodes' in ehc.nodelist[node]['rx']:
-                        datacodes = ehc.nodelist[node]['rx']['datacodes']
-                    else:
-                        self._log.error("please provide a datacode or a list of datacodes")
-                        return
-
-                # check if number of registers and number of names are the same
-                if len(rNames) != len(registers):
-                    self._log.error("You have to define an equal number of registers and of names")
-                    return
-                # check if number of names and number of datacodes are the same
-                if datacodes is not None:
-                    if len(datacodes) != len(rNames):
-                        self._log.error("You are using datacodes. You have to define an equal number of datacodes and of names")
-                        return
-
-                # calculate expected size in bytes and search for invalid datacode(s)
-                expectedSize = 0
-                if datacodes is not None:
-                    for code in datacodes:
-                        if code not in valid_datacodes:
-                            self._log.debug("-" * 46)
-                            self._log.debug("invalid datacode")
-                            self._log.debug("-" * 46)
-                            return
-                        else:
-                            expectedSize += valid_datacodes[code] * 2
-                else:
-                    if datacode not in valid_datacodes:
-                        self._log.debug("-" * 46)
-                        self._log.debug("invalid datacode")
-                        self._log.debug("-" * 46)
-                        return
-                    else:
-                        expectedSize = len(rNames) * valid_datacodes[datacode] * 2
-
-                self._log.debug("expected bytes number after encoding: %s", expectedSize)
-
-                # at this stage, we don't have any invalid datacode(s)
-                # so we can loop and read registers
-                for idx, rName in enumerate(rNames):
-                    register = int(registers[idx], 0)
-                    if UnitIds is not None:
-                        unitId = int(UnitIds[idx])
-                    else:
-                        unitId = 1
-                    if datacodes is not None:
-                        datacode = datacodes[idx]
-
-                    self._log.debug("datacode %s", datacode)
-                    qty = valid_datacodes[datacode]
-                    self._log.debug("reading register #: %s, qty #: %s, unit #: %s", register, qty, unitId)
-
-                    try:
-                        # According to the Modbus specification, input registers numbered, e.g., 1-16 are
-                        # transmitted as 0-15. If input registers must be read instead of holding registers,
-                        # change read_holding_registers to read_input_registers in the following line.
-                        self.rVal = self._con.read_holding_registers(register - 1, qty, slave=unitId)
-                        assert self.rVal.function_code < 0x80
-                    except Exception as e:
-                        self._log.error("Connection failed on read of register: %s : %s", register, e)
-                        self._modcon = False
-                        #missing datas will lead to an incorrect encoding
-                        #we have to drop the payload
-                        return
-                    else:
-                        #self._log.debug("register value: %s type= %s", self.rVal.registers, type(self.rVal.registers))
-                        #f = f + self.rVal.registers
-                        decoder = self.BinaryPayloadDecoder.fromRegisters(self.rVal.registers, byteorder=self.Endian.BIG, wordorder=self.Endian.BIG)
-                        if datacode == 'h':
-                            rValD = decoder.decode_16bit_int()
-                        elif datacode == 'H':
-                            rValD = decoder.decode_16bit_uint()
-                        elif datacode == 'i':
-                            rValD = decoder.decode_32bit_int()
-                        elif datacode == 'l':
-                            rValD = decoder.decode_32bit_int()
-                        elif datacode == 'I':
-                            rValD = decoder.decode_32bit_uint()
-                        elif datacode == 'L':
-                            rValD = decoder.decode_32bit_uint()
-                        elif datacode == 'f':
-                            rValD = decoder.decode_32bit_float() * 10
-                        elif datacode == 'q':
-                            rValD = decoder.decode_64bit_int()
-                        elif datacode == 'Q':
-                            rValD = decoder.decode_64bit_uint()
-                        elif datacode == 'd':
-                            rValD = decoder.decode_64bit_float() * 10
-
-                        t = ehc.encode(datacode, rValD)
-                        f = f + list(t)
-                        self._log.debug("Encoded value: %s", t)
-                        self._log.debug("value: %s", rValD)
-
-                #test if payload length is OK
-                if len(f) == expectedSize:
-                    self._log.debug("payload size OK (%d)", len(f))
-                    self._log.debug("reporting data: %s", f)
-                    c.nodeid = node
-                    c.realdata = f
-                    self._log.debug("Return from read data: %s", c.realdata)
-                    return c
-                else:
-                    self._log.error("incorrect payload size: %d expecting %d", len(f), expectedSize)
+        if not self.pymodbus_found:
+            return
+
+        now = time.time()
+        if now < self._next_read:
+            return
+        interval = float(self._settings["interval"])
+        self._next_read += interval
+        if self._next_read <= now:
+            self._next_read = now + interval
+
+        node = str(self._settings.get("nodeId", ""))
+        rx = ehc.nodelist.get(node, {}).get('rx')
+        if self._plan is None or rx is not self._plan_rx:
+            self._plan = self.compile_plan()
+            self._plan_rx = rx
+        if not self._plan:
+            return
+        node, names, blocks = self._plan
+
+        start = time.time()
+        results = self._read_plan(blocks)
+
+        values = [None] * len(names)
+        failed = False
+        split = []
+        for block, raw in zip(blocks, results):
+            if isinstance(raw, ValueError) and len(block[5]) > 1:
+                # The device refuses part of the range, read each value on its own from now on
+                self._log.warning("Block read of %d registers from %s failed, reading them one by one", block[4], block[3] + 1)
+                split.append(block)
+                failed = True
+            elif isinstance(raw, ValueError):
+                self._log.error("Read of register %s refused: %s", block[3] + 1, raw)
+                failed = True
+            elif isinstance(raw, emonhub_modbus.ModbusTransportError):
+                # already reported by the transport
+                failed = True
+            elif isinstance(raw, Exception):
+                self._log.error("Connection failed on read of register: %s : %s", block[3] + 1, raw)
+                failed = True
+            else:
+                for idx, offset, size, decoder, scale in block[5]:
+                    val = decoder.unpack_from(raw, offset * 2)[0]
+                    if scale != 1:
+                        val = val * scale
+                        if val % 1 == 0:
+                            val = int(val)
+                    values[idx] = val
+
+        self._log.debug("read %d requests in %.3fs", len(blocks), time.time() - start)
+
+        for block in split:
+            n = blocks.index(block)
+            blocks[n:n + 1] = self._split_block(block)
+
+        #missing datas will lead to an incomplete frame
+        #we have to drop the payload
+        if failed:
+            return
+
+        c = Cargo.new_cargo(rawdata="", nodeid=node, names=list(names), realdata=values)
+        self._log.debug("Return from read data: %s", c.realdata)
+        return c
+
+    def _process_rx(self, cargo):
+        """Values are decoded and scaled by the read plan, only add the node name"""
+        node = str(cargo.nodeid)
+        cargo.nodename = False
+        if node in ehc.nodelist and 'nodename' in ehc.nodelist[node]:
+            cargo.nodename = ehc.nodelist[node]['nodename']
+        self._log.debug("%d From Node : %s", cargo.uri, node)
+        self._log.debug("%d    Values : %s", cargo.uri, cargo.realdata)
+        return cargo
@@ -1,37 +1,86 @@
-__all__ = [
-    "EmonHubPulseCounterInterfacer",
-    "EmonHubDigitalInputInterfacer",
-    "EmonHubSocketInterfacer",
-    "EmonHubSerialInterfacer",
-    "EmonHubJeeInterfacer",
-    "EmonHubOEMInterfacer",
-    "EmonHubSunampInterfacer",
-    "EmonHubRF69Interfacer",
-    "EmonHubRFM69LPLInterfacer",
-    "EmonHubPacketGenInterfacer",
-    "EmonHubEmoncmsHTTPInterfacer",
-    "EmonHubMqttInterfacer",
-    "EmonHubTx3eInterfacer",
-    "EmonHubVEDirectInterfacer",
-    # "EmonHubSmilicsInterfacer",
-    "EmonHubSMASolarInterfacer",
-    "EmonHubGraphiteInterfacer",
-    "EmonHubBMWInterfacer",
-    "EmonHubJaguarLandRoverInterfacer",
-    "EmonModbusTcpInterfacer",
-    "EmonHubTeslaPowerWallInterfacer",
-    "EmonHubSDS011Interfacer",
-    "EmonHubModbusRenogyInterfacer",
-    "EmonHubTemplateInterfacer",
-    "EmonHubDS18B20Interfacer",
-    "EmonHubRedisInterfacer",
-    "EmonHubSDM120Interfacer",
-    "EmonHubMBUSInterfacer",
-    "EmonHubMinimalModbusInterfacer",
-    "EmonHubBleInterfacer",
-    "EmonHubGoodWeInterfacer",
-    "EmonHubInfluxInterfacer",
-    "EmonHubEconet300Interfacer",
-    "EmonHubEconextInterfacer"
-    #"EmonFroniusModbusTcpInterfacer"
-]
+"""
+
+  Registry of available interfacers.
+
+  Interfacers are imported on demand, the first time an interfacer of a given
+  'Type' is created, so that the dependencies of unused interfacers (paho-mqtt,
+  requests, serial, RPi.GPIO, bluetooth...) are never loaded.
+
+"""
+
+import time
+import importlib
+
+# Maps the interfacer 'Type' used in emonhub.conf to the module that defines it
+registry = {
+    "EmonHubPulseCounterInterfacer": "EmonHubPulseCounterInterfacer",
+    "EmonHubDigitalInputInterfacer": "EmonHubDigitalInputInterfacer",
+    "EmonHubSocketInterfacer": "EmonHubSocketInterfacer",
+    "EmonHubSerialInterfacer": "EmonHubSerialInterfacer",
+    "EmonHubJeeInterfacer": "EmonHubJeeInterfacer",
+    "EmonHubOEMInterfacer": "EmonHubOEMInterfacer",
+    "EmonHubSunampInterfacer": "EmonHubSunampInterfacer",
+    "EmonHubRF69Interfacer": "EmonHubRF69Interfacer",
+    "EmonHubRFM69LPLInterfacer": "EmonHubRFM69LPLInterfacer",
+    "EmonHubPacketGenInterfacer": "EmonHubPacketGenInterfacer",
+    "EmonHubEmoncmsHTTPInterfacer": "EmonHubEmoncmsHTTPInterfacer",
+    "EmonHubMqttInterfacer": "EmonHubMqttInterfacer",
+    "EmonHubTx3eInterfacer": "EmonHubTx3eInterfacer",
+    "EmonHubVEDirectInterfacer": "EmonHubVEDirectInterfacer",
+    # "EmonHubSmilicsInterfacer": "tmp.EmonHubSmilicsInterfacer",
+    "EmonHubSMASolarInterfacer": "EmonHubSMASolarInterfacer",
+    "EmonHubGraphiteInterfacer": "EmonHubGraphiteInterfacer",
+    "EmonHubBMWInterfacer": "EmonHubBMWInterfacer",
+    "EmonHubJaguarLandRoverInterfacer": "EmonHubJaguarLandRoverInterfacer",
+    "EmonModbusTcpInterfacer": "EmonModbusTcpInterfacer",
+    "EmonHubTeslaPowerWallInterfacer": "EmonHubTeslaPowerWallInterfacer",
+    "EmonHubSDS011Interfacer": "EmonHubSDS011Interfacer",
+    "EmonHubModbusRenogyInterfacer": "EmonHubModbusRenogyInterfacer",
+    "EmonHubTemplateInterfacer": "EmonHubTemplateInterfacer",
+    "EmonHubDS18B20Interfacer": "EmonHubDS18B20Interfacer",
+    "EmonHubRedisInterfacer": "EmonHubRedisInterfacer",
+    "EmonHubSDM120Interfacer": "EmonHubSDM120Interfacer",
+    "EmonHubMBUSInterfacer": "EmonHubMBUSInterfacer",
+    "EmonHubMinimalModbusInterfacer": "EmonHubMinimalModbusInterfacer",
+    "EmonHubBleInterfacer": "EmonHubBleInterfacer",
+    "EmonHubGoodWeInterfacer": "EmonHubGoodWeInterfacer",
+    "EmonHubInfluxInterfacer": "EmonHubInfluxInterfacer",
+    "EmonHubEconet300Interfacer": "EmonHubEconet300Interfacer",
+    "EmonHubEconextInterfacer": "EmonHubEconextInterfacer",
+    "EmonHubAggregatorInterfacer": "EmonHubAggregatorInterfacer",
+    "EmonHubRingStoreInterfacer": "EmonHubRingStoreInterfacer",
+    "EmonHubArchiveInterfacer": "EmonHubArchiveInterfacer",
+    # "EmonFroniusModbusTcpInterfacer": "tmp.EmonFroniusModbusTcpInterfacer",
+}
+
+__all__ = list(registry)
+
+# Time taken (seconds) to import each interfacer module, in load order
+import_times = {}
+
+
+def get_interfacer(type_name):
+    """Return the interfacer class for the 'Type' string, importing its module if needed.
+
+    Types that are not listed in the registry are looked up in a module of the same
+    name, so that interfacers dropped into this directory keep working.
+
+    Raises ImportError if the module can't be imported or doesn't define the class.
+
+    """
+    module_name = registry.get(type_name, type_name)
+    if not module_name.replace(".", "").isidentifier():
+        raise ImportError("Invalid interfacer type '%s'" % type_name)
+
+    module_path = __name__ + "." + module_name
+    if module_path not in import_times:
+        start = time.perf_counter()
+        module = importlib.import_module(module_path)
+        import_times[module_path] = time.perf_counter() - start
+    else:
+        module = importlib.import_module(module_path)
+
+    try:
+        return getattr(module, type_name)
+    except AttributeError:
+        raise ImportError("Module '%s' does not define '%s'" % (module_path, type_name))
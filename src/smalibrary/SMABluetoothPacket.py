@@ -1,6 +1,8 @@
 # GNU GENERAL PUBLIC LICENSE -  Version 2, June 1991
 # See LICENCE and README file for details
 
+from smalibrary.SMANET2PlusPacket import escape, unescape
+
 __author__ = 'Stuart Pittaway'
 
 class SMABluetoothPacket:
@@ -29,8 +31,8 @@ class SMABluetoothPacket:
 
     def pushRawByteArray(self, barray):
         # Raw byte array
-        for bte in barray:
-            self.pushRawByte(bte)
+        self.UnescapedArray += barray
+        self.RawByteArray += barray
 
     def pushRawByte(self, value):
         # Accept a byte of ESCAPED data (ie. raw byte from Bluetooth)
@@ -38,8 +40,8 @@ class SMABluetoothPacket:
         self.RawByteArray.append(value)
 
     def pushUnescapedByteArray(self, barray):
-        for bte in barray:
-            self.pushUnescapedByte(bte)
+        self.UnescapedArray += barray
+        self.RawByteArray += escape(barray)
 
     def pushUnescapedByte(self, value):
         # Store the raw byte
@@ -103,8 +105,13 @@ class SMABluetoothPacket:
         return self.UnescapedArray[indexfromstartofdatapayload]
 
     def pushEscapedByteArray(self, barray):
-        for bte in barray:
-            self.pushEscapedByte(bte)
+        # Unescape the whole array at once, unless the last byte pushed was an escape
+        if self.RawByteArray and self.RawByteArray[-1] == 0x7d:
+            for bte in barray:
+                self.pushEscapedByte(bte)
+            return
+        self.RawByteArray += barray
+        self.UnescapedArray += unescape(barray)
 
     def TotalUnescapedPacketLength(self):
         return len(self.UnescapedArray) + self.headerlength
@@ -14,24 +14,72 @@ __author__ = 'Stuart Pittaway'
 # https://github.com/Rincewind76/SMAInverter/blob/master/76_SMAInverter.pm
 # https://sbfspot.codeplex.com/ (credit back to myself!!)
 
+class BufferedBTSocket:
+    """Bluetooth socket wrapper reading the stream in blocks
+
+    recv(n) returns exactly n bytes from an internal buffer, refilled with
+    one recv() of up to recv_size bytes on the socket whenever it runs out,
+    rather than making a system call per byte. Other attributes are those
+    of the wrapped socket.
+
+    """
+
+    recv_size = 4096
+
+    def __init__(self, btSocket):
+        self.socket = btSocket
+        self._buffer = bytearray()
+
+    def __getattr__(self, name):
+        return getattr(self.socket, name)
+
+    def _fill(self):
+        data = self.socket.recv(self.recv_size)
+        if not data:
+            raise ConnectionError("Bluetooth connection closed by inverter")
+        self._buffer += data
+
+    def peek(self, n):
+        """Return the next n bytes without consuming them"""
+        while len(self._buffer) < n:
+            self._fill()
+        return bytes(self._buffer[:n])
+
+    def recv(self, n):
+        data = self.peek(n)
+        del self._buffer[:n]
+        return data
+
+    def skip_to(self, value):
+        """Discard bytes up to the next byte equal to value, which is kept"""
+        while True:
+            start = self._buffer.find(value)
+            if start >= 0:
+                del self._buffer[:start]
+                return
+            del self._buffer[:]
+            self._fill()
+
+
 def Read_Int_From_BT(btSocket):
     return int.from_bytes(btSocket.recv(1), "big")
 
 
 def Read_Level1_Packet_From_BT_Stream(btSocket, mylocalBTAddress):
+    """Read the next level 1 packet addressed to us from a BufferedBTSocket"""
     while True:
-        start = Read_Int_From_BT(btSocket)
-
-        while start != 0x7e:
-            start = Read_Int_From_BT(btSocket)
-
-        length1 = Read_Int_From_BT(btSocket)
-        length2 = Read_Int_From_BT(btSocket)
-        checksum = Read_Int_From_BT(btSocket)
-        SrcAdd = bytearray(btSocket.recv(6))
-        DestAdd = bytearray(btSocket.recv(6))
-
-        packet = SMABluetoothPacket(length1, length2, checksum, Read_Int_From_BT(btSocket), Read_Int_From_BT(btSocket), SrcAdd, DestAdd)
+        # Level 1 packets start with 0x7e and an 18 byte header
+        btSocket.skip_to(0x7e)
+        header = btSocket.peek(18)
+        if header[0] ^ header[1] ^ header[2] ^ header[3] != 0:
+            # Not the start of a packet, look for the next 0x7e
+            btSocket.recv(1)
+            continue
+        btSocket.recv(18)
+        SrcAdd = bytearray(header[4:10])
+        DestAdd = bytearray(header[10:16])
+
+        packet = SMABluetoothPacket(header[1], header[2], header[3], header[16], header[17], SrcAdd, DestAdd)
 
         # Read the whole byte stream unaltered (this contains ESCAPED characters)
         b = bytearray(btSocket.recv(packet.TotalPayloadLength()))
@@ -333,10 +381,34 @@ spotvalues = {
 
 SpotValueOutput = namedtuple("SpotValueOutput", ["Label", "Value"])
 
-def extract_data(level2Packet):
+def merge_requests(requests, max_gap=0x1000):
+    """Merge data requests so that fewer request/reply cycles are needed
+
+    requests: list of [cmd, first, last] as passed to request_data
+    max_gap: largest gap between two ranges of the same command merged into one
+
+    The inverter replies to a merged request with the records of the whole
+    range, extract_data(packet, ranges) drops those that were not requested.
+    Returns a list of [cmd, first, last, ranges], ranges being the requests merged.
+
+    """
+    merged = []
+    for cmd, first, last in sorted(requests):
+        if merged and merged[-1][0] == cmd and first - merged[-1][2] <= max_gap:
+            merged[-1][2] = max(merged[-1][2], last)
+            merged[-1][3].append((first, last))
+        else:
+            merged.append([cmd, first, last, [(first, last)]])
+    return merged
+
+def extract_data(level2Packet, ranges=None):
     #Return a dictionary
     outputlist = {}
 
+    #Record types (bits 8-23 of the first/last request arguments) to return
+    if ranges is not None:
+        ranges = [((first >> 8) & 0xFFFF, (last >> 8) & 0xFFFF) for first, last in ranges]
+
     #Start here
     offset = 40
 
@@ -349,6 +421,8 @@ def extract_data(level2Packet):
         if readingtype == 0:
             break
 
+        wanted = ranges is None or any(first <= readingtype <= last for first, last in ranges)
+
         if dataType != 0x10 and dataType != 0x08:
             # Not TEXT or STATUS, so it should be DWORD
             value = level2Packet.getTwoByte(offset + 8)
@@ -365,8 +439,10 @@ def extract_data(level2Packet):
                     value = level2Packet.getEightByte(offset + 8)
                     if value == 0x80000000 or value == 0xFFFFFFFF:
                         value = 0
+                if not wanted:
+                    pass
                 # Special case for DC voltage/current input (aka SPOT_UDC1 / SPOT_UDC2, etc)
-                if readingtype == 0x451f or readingtype == 0x4521:
+                elif readingtype == 0x451f or readingtype == 0x4521:
                     readingDescription = v.Description + str(classtype)
                     outputlist[readingDescription] = SpotValueOutput(readingDescription, round(float(value) / float(v.Scale), 4))
                 else:
@@ -375,9 +451,13 @@ def extract_data(level2Packet):
                 offset += v.RecSize
             else:
                 #Output to caller in raw format for debugging
-                outputlist[readingtype] = SpotValueOutput("DebugX{0:04x}".format(readingtype), value)
+                if wanted:
+                    outputlist[readingtype] = SpotValueOutput("DebugX{0:04x}".format(readingtype), value)
 
                 #Guess offset/default
                 offset += 28
+        else:
+            # TEXT and STATUS records are not decoded, skip them
+            offset += 40
 
     return outputlist
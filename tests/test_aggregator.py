@@ -0,0 +1,125 @@
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import Cargo
+from interfacers.EmonHubAggregatorInterfacer import EmonHubAggregatorInterfacer
+
+# Start of a 60 s window
+T0 = 1200000000
+
+
+class TestAggregator(unittest.TestCase):
+
+    def interfacer(self, **settings):
+        interfacer = EmonHubAggregatorInterfacer('aggregator')
+        interfacer.set(**dict({'window': 60, 'functions': 'mean,min,max,last,energy'}, **settings))
+        return interfacer
+
+    def add(self, interfacer, samples, nodeid=10):
+        for offset, value in samples:
+            interfacer.add(Cargo.new_cargo(timestamp=T0 + offset, nodeid=nodeid, nodename='emontx',
+                                           names=['P'], realdata=[value]))
+
+    def published(self, interfacer):
+        frames = []
+        while True:
+            c = interfacer.read()
+            if not c:
+                return frames
+            frames.append((c.timestamp - T0, dict(zip(c.names, c.realdata))))
+
+    def assertAggregate(self, result, expected):
+        self.assertEqual(sorted(result), sorted(expected))
+        for name, value in expected.items():
+            self.assertAlmostEqual(result[name], value, places=6, msg=name)
+
+    def test_mean_and_energy(self):
+        interfacer = self.interfacer()
+        self.add(interfacer, [(0, 100), (10, 100), (20, 300), (30, 300), (40, 100), (50, 100)])
+        self.assertEqual(self.published(interfacer), [])
+        # The first frame of the next window publishes the window
+        self.add(interfacer, [(60, 100)])
+        [(start, result)] = self.published(interfacer)
+        self.assertEqual(start, 0)
+        # Time weighted: 200 W for 20 s of the 60 s
+        self.assertAggregate(result, {'P': 10000 / 60, 'P_min': 100, 'P_max': 300, 'P_last': 100,
+                                      'P_energy': 10000 / 3600})
+        stats = interfacer.aggregate_stats
+        self.assertEqual((stats['frames_in'], stats['frames_out']), (7, 1))
+
+    def test_interval_split_at_window_end(self):
+        interfacer = self.interfacer(functions='mean,energy')
+        self.add(interfacer, [(40, 0), (50, 0), (70, 120), (80, 120), (130, 0)])
+        (_, first), (_, second) = self.published(interfacer)
+        # 60 W interpolated at the end of the first window, from 50 s to 70 s
+        self.assertAggregate(first, {'P': 300 / 20, 'P_energy': 300 / 3600})
+        # 24 W interpolated at 120 s, from 80 s to 130 s
+        area = (60 + 120) / 2 * 10 + 120 * 10 + (120 + 24) / 2 * 40
+        self.assertAggregate(second, {'P': area / 60, 'P_energy': area / 3600})
+        # The energy of the windows adds up to the energy from 40 s to 130 s
+        self.assertAlmostEqual(first['P_energy'] + second['P_energy'] + (24 / 2 * 10) / 3600,
+                               (60 * 20 + 120 * 10 + 60 * 50) / 3600)
+
+    def test_gap_not_integrated(self):
+        interfacer = self.interfacer(functions='mean,energy')
+        # More than a window between 10 s and 100 s
+        self.add(interfacer, [(0, 100), (10, 100), (100, 500), (110, 500), (120, 500)])
+        (_, first), (_, second) = self.published(interfacer)
+        self.assertAggregate(first, {'P': 100, 'P_energy': 1000 / 3600})
+        self.assertAggregate(second, {'P': 500, 'P_energy': 10000 / 3600})
+
+    def test_late_frame(self):
+        interfacer = self.interfacer(functions='mean,max,last')
+        self.add(interfacer, [(0, 100), (30, 100), (60, 200), (90, 200)])
+        self.assertEqual(len(self.published(interfacer)), 1)
+        # Buffered frame of the first window, published already
+        self.add(interfacer, [(45, 1000)])
+        self.assertEqual(interfacer.aggregate_stats['late'], 1)
+        self.add(interfacer, [(120, 200)])
+        [(start, result)] = self.published(interfacer)
+        self.assertEqual(start, 60)
+        # Counted in the current window, not integrated and not the last value
+        self.assertAggregate(result, {'P': 200, 'P_max': 1000, 'P_last': 200})
+
+    def test_deadline_closes_window(self):
+        interfacer = self.interfacer(functions='mean,last', window_delay=0)
+        now = time.time()
+        start = now - now % 60
+        interfacer.add(Cargo.new_cargo(timestamp=start + 59.99, nodeid=10, names=['P'], realdata=[100]))
+        time.sleep(0.02)
+        c = interfacer.read()
+        self.assertEqual((c.timestamp, c.names, c.realdata), (start, ['P', 'P_last'], [100, 100]))
+        self.assertIsNone(interfacer.read())
+
+    def test_deadline_then_next_frame(self):
+        interfacer = self.interfacer(functions='mean')
+        self.add(interfacer, [(40, 0), (50, 0)])
+        # Published on its deadline, before the next frame arrives
+        interfacer._nodes[10]['deadline'] = 0
+        [(_, first)] = self.published(interfacer)
+        self.assertAggregate(first, {'P': 0})
+        # Only the part of the interval after the start of the window is counted
+        self.add(interfacer, [(70, 120), (80, 120)])
+        interfacer._nodes[10]['deadline'] = 0
+        [(start, second)] = self.published(interfacer)
+        self.assertEqual(start, 60)
+        self.assertAggregate(second, {'P': ((60 + 120) / 2 * 10 + 120 * 10) / 20})
+
+    def test_input_functions(self):
+        interfacer = self.interfacer(functions='mean', inputs=['emontx.P:last', '11.1:max+energy'])
+        self.add(interfacer, [(0, 100), (30, 200), (60, 0)])
+        # Unnamed values, numbered from 1
+        for offset, values in [(0, [5, 6]), (30, [7, 6]), (60, [7, 6])]:
+            interfacer.add(Cargo.new_cargo(timestamp=T0 + offset, nodeid=11, realdata=values))
+        frames = self.published(interfacer)
+        self.assertEqual(frames[0], (0, {'P_last': 200}))
+        self.assertEqual(frames[1][0], 0)
+        self.assertAggregate(frames[1][1], {'1_max': 7, '1_energy': (6 * 30 + 7 * 30) / 3600, '2': 6})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,188 @@
+import os
+import sys
+import gzip
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import Cargo
+import emonhub_archive as ehar
+
+# Start of an hour (UTC)
+T0 = 1699999200
+
+
+def new_cargo(nodeid, timestamp, names, values, rssi=0):
+    c = Cargo.new_cargo(timestamp=timestamp, names=list(names), realdata=list(values), rssi=rssi)
+    # Interfacers such as MBUS name their nodes
+    c.nodeid = nodeid
+    return c
+
+
+def frames(path, node=None, start=None, end=None):
+    return [(c.nodeid, c.timestamp, dict(zip(c.names, c.realdata)), c.rssi)
+            for c in ehar.read_frames(path, node, start, end)]
+
+
+class TestArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def csv_file(self, node):
+        directory = os.path.join(self.path, node)
+        [file_name] = os.listdir(directory)
+        return os.path.join(directory, file_name)
+
+    def test_flushes_appended(self):
+        writer = ehar.ArchiveWriter(self.path)
+        writer.append(new_cargo(10, T0, ['P1'], [100], rssi=-52))
+        writer.append(new_cargo(10, T0 + 10, ['P1'], [110], rssi=-52))
+        writer.flush()
+        # Inputs of the node changed
+        writer.append(new_cargo(10, T0 + 20, ['P1', 'T1'], [120, 19.5]))
+        writer.append(new_cargo(10, T0 + 30, ['T1'], [19.6]))
+        writer.close()
+
+        path = self.csv_file('10')
+        self.assertEqual(os.path.basename(path), '2023-11-14T22.csv.gz')
+        with gzip.open(path, 'rt') as f:
+            self.assertEqual(f.read(), "time,rssi,P1\n"
+                                       "1699999200.0,-52,100\n"
+                                       "1699999210.0,-52,110\n"
+                                       "time,rssi,P1,T1\n"
+                                       "1699999220.0,,120,19.5\n"
+                                       "1699999230.0,,,19.6\n")
+        self.assertEqual(frames(self.path), [(10, T0, {'P1': 100}, -52),
+                                             (10, T0 + 10, {'P1': 110}, -52),
+                                             (10, T0 + 20, {'P1': 120, 'T1': 19.5}, 0),
+                                             (10, T0 + 30, {'T1': 19.6}, 0)])
+        self.assertEqual(writer.stats['frames'], 4)
+        self.assertEqual(writer.stats['flushes'], 2)
+
+    def test_unnamed_values_and_text(self):
+        writer = ehar.ArchiveWriter(self.path)
+        # Numbered from 1, names clashing with the time and rssi columns renamed
+        writer.append(new_cargo(10, T0, ['time'], [5, 'on']))
+        writer.close()
+        self.assertEqual(frames(self.path), [(10, T0, {'_time': 5, '2': 'on'}, 0)])
+
+    def test_frames_in_hourly_files(self):
+        writer = ehar.ArchiveWriter(self.path, max_rows=4)
+        for offset in range(0, 3 * 3600, 1800):
+            writer.append(new_cargo(10, T0 + offset, ['P1'], [offset]))
+        # Flushed by max_rows, then by close
+        self.assertEqual(writer.stats['flushes'], 1)
+        writer.close()
+        self.assertEqual(sorted(os.listdir(os.path.join(self.path, '10'))),
+                         ['2023-11-14T22.csv.gz', '2023-11-14T23.csv.gz', '2023-11-15T00.csv.gz'])
+        self.assertEqual([frame[1] - T0 for frame in frames(self.path, start=T0 + 3600, end=T0 + 7200)],
+                         [3600, 5400, 7200])
+
+    def test_truncated_file(self):
+        writer = ehar.ArchiveWriter(self.path)
+        for i in range(3):
+            writer.append(new_cargo(10, T0 + i, ['P1'], [i]))
+        writer.flush()
+        path = self.csv_file('10')
+        first_flush = os.path.getsize(path)
+        for i in range(3, 1000):
+            writer.append(new_cargo(10, T0 + i, ['P1'], [i]))
+        writer.flush()
+        expected = frames(self.path)
+
+        # Cut in the last flush, e.g. by a power failure: the rows read up to the cut are kept
+        with open(path, 'r+b') as f:
+            f.truncate((first_flush + os.path.getsize(path)) // 2)
+        with self.assertLogs('EmonHub', 'WARNING'):
+            read = frames(self.path)
+        self.assertGreaterEqual(len(read), 3)
+        self.assertLess(len(read), len(expected))
+        self.assertEqual(read, expected[:len(read)])
+
+        # Cut at the end of a flush
+        with open(path, 'r+b') as f:
+            f.truncate(first_flush)
+        self.assertEqual(frames(self.path), expected[:3])
+
+        # Appended to after the cut
+        writer.append(new_cargo(10, T0 + 1000, ['P1'], [1000]))
+        writer.close()
+        self.assertEqual(frames(self.path), expected[:3] + [(10, T0 + 1000, {'P1': 1000}, 0)])
+
+    def test_replay_by_node_name(self):
+        writer = ehar.ArchiveWriter(self.path)
+        writer.append(new_cargo(10, T0, ['P1'], [1]))
+        writer.append(new_cargo(9, T0, ['P1'], [2]))
+        # Unsafe characters replaced
+        writer.append(new_cargo('emon/mbus', T0, ['E'], [3]))
+        writer.append(new_cargo('..', T0, ['E'], [4]))
+        writer.close()
+        self.assertEqual(sorted(os.listdir(self.path)), ['10', '9', '_.', 'emon_mbus'])
+
+        # Numeric nodes first, in order
+        self.assertEqual([frame[0] for frame in frames(self.path)], [9, 10, '_.', 'emon_mbus'])
+        self.assertEqual(frames(self.path, 'emon/mbus'), [('emon_mbus', T0, {'E': 3}, 0)])
+        self.assertEqual(frames(self.path, 'emon_mbus'), frames(self.path, 'emon/mbus'))
+        self.assertEqual(frames(self.path, '..'), [('_.', T0, {'E': 4}, 0)])
+        self.assertEqual(frames(self.path, 10), [(10, T0, {'P1': 1}, 0)])
+        self.assertEqual(frames(self.path, 'emontx4'), [])
+
+    def test_other_directories_skipped(self):
+        writer = ehar.ArchiveWriter(self.path)
+        writer.append(new_cargo(10, T0, ['P1'], [1]))
+        writer.close()
+        # Not written by the archive
+        shutil.copytree(os.path.join(self.path, '10'), os.path.join(self.path, '.10'))
+        with open(os.path.join(self.path, '10', 'notes.csv.gz'), 'wb') as f:
+            f.write(gzip.compress(b'time,rssi,P1\n1,2,3\n'))
+        self.assertEqual(frames(self.path), [(10, T0, {'P1': 1}, 0)])
+
+    @unittest.skipIf(ehar.zstandard is None, "zstandard is not installed")
+    def test_zstd(self):
+        writer = ehar.ArchiveWriter(self.path, compression='zstd')
+        writer.append(new_cargo(10, T0, ['P1'], [1]))
+        writer.flush()
+        writer.append(new_cargo(10, T0 + 10, ['P1'], [2]))
+        writer.close()
+        self.assertTrue(self.csv_file('10').endswith('.csv.zst'))
+        self.assertEqual(frames(self.path), [(10, T0, {'P1': 1}, 0), (10, T0 + 10, {'P1': 2}, 0)])
+
+    @unittest.skipIf(ehar.pyarrow is None, "pyarrow is not installed")
+    def test_parquet(self):
+        # Converted once the hour is over
+        parquet_delay = ehar.PARQUET_DELAY
+        ehar.PARQUET_DELAY = 0
+        self.addCleanup(setattr, ehar, 'PARQUET_DELAY', parquet_delay)
+        writer = ehar.ArchiveWriter(self.path, fmt='parquet')
+        writer.append(new_cargo(10, T0, ['P1'], [1]))
+        writer.append(new_cargo(10, T0 + 10, ['P1', 'T1'], [2, 19.5]))
+        writer.close()
+        self.assertEqual(os.listdir(os.path.join(self.path, '10')), ['2023-11-14T22.parquet'])
+
+        # Late frames of the hour go to another file, left as CSV by a previous run
+        writer = ehar.ArchiveWriter(self.path, compression='gzip')
+        writer.append(new_cargo(10, T0 + 20, ['P1'], [3]))
+        writer.close()
+        writer = ehar.ArchiveWriter(self.path, fmt='parquet')
+        writer.close()
+        self.assertEqual(sorted(os.listdir(os.path.join(self.path, '10'))),
+                         ['2023-11-14T22-1.parquet', '2023-11-14T22.parquet'])
+        self.assertEqual(writer.stats['files'], 1)
+        self.assertEqual(frames(self.path), [(10, T0, {'P1': 1}, 0),
+                                             (10, T0 + 10, {'P1': 2, 'T1': 19.5}, 0),
+                                             (10, T0 + 20, {'P1': 3}, 0)])
+
+    def test_unavailable_format(self):
+        if ehar.pyarrow is None:
+            with self.assertRaises(ValueError):
+                ehar.ArchiveWriter(self.path, fmt='parquet')
+        with self.assertRaises(ValueError):
+            ehar.ArchiveWriter(self.path, compression='bzip2')
+
+
+if __name__ == '__main__':
+    unittest.main()
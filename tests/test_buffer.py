@@ -0,0 +1,240 @@
+import os
+import sys
+import shutil
+import logging
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import Cargo
+import emonhub_buffer as ehb
+import emonhub_memo as ehm
+
+
+def new_cargo(nodeid, value):
+    return Cargo.new_cargo(timestamp=1000 + value, nodeid=nodeid, names=['P'], realdata=[value])
+
+
+class SharedLogTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Small segments, restored with the logs of the hub after each test
+        self.segment_size = ehb.SEGMENT_SIZE
+        ehb.SEGMENT_SIZE = 4
+        self.shared_logs = dict(ehb._shared_logs)
+        self.settings = dict(ehb._shared_log_settings)
+        ehb._shared_logs.clear()
+        self.memo = ehm.memo
+        ehm.memo = ehm.SerializationMemo()
+
+    def tearDown(self):
+        ehb.SEGMENT_SIZE = self.segment_size
+        ehb._shared_logs.clear()
+        ehb._shared_logs.update(self.shared_logs)
+        ehb._shared_log_settings.update(self.settings)
+        ehm.memo = self.memo
+
+    def append(self, log, values, nodeid=5):
+        cargos = [new_cargo(nodeid, value) for value in values]
+        for cargo in cargos:
+            log.append(cargo)
+        return cargos
+
+
+class TestSharedLog(SharedLogTestCase):
+
+    def test_frames_without_cursor_not_kept(self):
+        log = ehb.SharedLog('ch')
+        self.append(log, range(3))
+        log.subscribe('a')
+        self.assertEqual(log.pending('a'), 0)
+        self.append(log, range(3, 5))
+        cursor, start, items = log.read('a', None, 10)
+        self.assertEqual((cursor, start), (3, 3))
+        self.assertEqual([frame.realdata for frame in items], [[3], [4]])
+
+    def test_reclaim_after_every_cursor_passed(self):
+        log = ehb.SharedLog('ch')
+        log.subscribe('a')
+        log.subscribe('b')
+        self.append(log, range(10))
+        self.assertEqual([segment.base for segment in log._segments], [0, 4, 8])
+
+        # b still needs every segment
+        self.assertEqual(log.advance_to('a', 10), 10)
+        self.assertEqual(len(log._segments), 3)
+        self.assertEqual(log.advance_to('b', 5), 5)
+        self.assertEqual([segment.base for segment in log._segments], [4, 8])
+        # Not beyond the head
+        self.assertEqual(log.advance_to('b', 20), 10)
+        self.assertEqual(len(log._segments), 0)
+        self.assertEqual(log.pending('b'), 0)
+
+        # New segment from the head
+        self.append(log, [10])
+        self.assertEqual([segment.base for segment in log._segments], [10])
+        _, start, items = log.read('b', None, 10)
+        self.assertEqual((start, [frame.realdata for frame in items]), (10, [[10]]))
+
+    def test_unsubscribe_reclaims(self):
+        log = ehb.SharedLog('ch')
+        log.subscribe('a')
+        log.subscribe('b')
+        self.append(log, range(6))
+        log.advance_to('a', 6)
+        self.assertEqual(len(log._segments), 2)
+        log.unsubscribe('b')
+        self.assertEqual(len(log._segments), 0)
+
+    def test_drop_oldest_moves_lagging_cursors(self):
+        memo = ehm.memo
+        memo.register('a', 'json')
+        memo.register('b', 'json')
+        log = ehb.SharedLog('ch', max_entries=8)
+        log.subscribe('a')
+        log.subscribe('b')
+        cargos = self.append(log, range(8))
+        for cargo in cargos:
+            memo.expect(cargo.uri, ['a', 'b'])
+        log.advance_to('a', 6)
+
+        with self.assertLogs('EmonHub', logging.WARNING) as logs:
+            self.append(log, [8])
+        self.assertIn('deleting oldest for b', logs.output[0])
+        self.assertEqual([segment.base for segment in log._segments], [4, 8])
+        self.assertEqual(log._cursors, {'a': 6, 'b': 4})
+        # The values of the frames dropped won't be got by b
+        self.assertEqual([memo._entries.get((cargo.uri, 'json'), [None, 0])[1] for cargo in cargos],
+                         [1, 1, 1, 1, 2, 2, 2, 2])
+
+        # Read from a position before the cursor starts at the cursor
+        cursor, start, items = log.read('b', 0, 3)
+        self.assertEqual((cursor, start), (4, 4))
+        self.assertEqual([frame.realdata for frame in items], [[4], [5], [6]])
+
+    def test_spill_to_files_and_read_back(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        log = ehb.SharedLog('emoncms/ch', path=path, memory_segments=1)
+        log.subscribe('a')
+        self.append(log, range(18))
+        # The last segment and memory_segments more in memory
+        self.assertEqual([segment.items is None for segment in log._segments], [True, True, True, False, False])
+        self.assertEqual(sorted(os.listdir(path)), ['emoncms_ch-0.seg', 'emoncms_ch-4.seg', 'emoncms_ch-8.seg'])
+
+        # Read across files and memory, the files stay until passed
+        cursor, start, items = log.read('a', 2, 12)
+        self.assertEqual((cursor, start), (0, 2))
+        self.assertEqual([frame.realdata[0] for frame in items], list(range(2, 14)))
+        self.assertIsNone(log._segments[0].items)
+        log.advance_to('a', 9)
+        self.assertEqual(os.listdir(path), ['emoncms_ch-8.seg'])
+        log.advance_to('a', 18)
+        self.assertEqual(os.listdir(path), [])
+
+    def test_unreadable_file_skipped(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        log = ehb.SharedLog('ch', path=path, memory_segments=1)
+        log.subscribe('a')
+        self.append(log, range(12))
+        with open(os.path.join(path, 'ch-0.seg'), 'wb') as f:
+            f.write(b'truncated')
+
+        with self.assertLogs('EmonHub', logging.ERROR) as logs:
+            _, _, items = log.read('a', None, 6)
+        self.assertIn('4 frames lost', logs.output[0])
+        self.assertEqual(items[:4], [None] * 4)
+        self.assertEqual([frame.realdata for frame in items[4:]], [[4], [5]])
+        self.assertNotIn('ch-0.seg', os.listdir(path))
+
+    def test_files_of_previous_run_removed(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        for file_name in ('ch-0.seg', 'other-0.seg'):
+            open(os.path.join(path, file_name), 'wb').close()
+        ehb.SharedLog('ch', path=path)
+        self.assertEqual(os.listdir(path), ['other-0.seg'])
+
+
+class TestSharedLogBuffer(SharedLogTestCase):
+
+    def buffer(self, name, channels):
+        buffer = ehb.SharedLogBuffer(name, 100)
+        # Node 2 isn't posted
+        buffer.formatter = lambda cargo: None if cargo.nodeid == 2 else [cargo.nodeid, cargo.realdata[0]]
+        buffer.subscribe(channels)
+        return buffer
+
+    def test_retrieve_and_discard_skipped_frames(self):
+        buffer = self.buffer('emoncms', ['ch'])
+        log = ehb.get_shared_log('ch')
+        for nodeid, value in [(1, 0), (2, 1), (1, 2), (2, 3), (2, 4), (1, 5), (1, 6)]:
+            log.append(new_cargo(nodeid, value))
+        self.assertEqual(buffer.size(), 7)
+
+        self.assertEqual(buffer.retrieveItems(2), [[1, 0], [1, 2]])
+        # Not discarded, retrieved again
+        self.assertEqual(buffer.retrieveItems(3), [[1, 0], [1, 2], [1, 5]])
+        # The frames skipped after the last one discarded go too
+        buffer.discardLastRetrievedItems(2)
+        self.assertEqual(log._cursors['emoncms'], 5)
+        self.assertEqual(buffer.size(), 2)
+        self.assertEqual(buffer.retrieveItems(5), [[1, 5], [1, 6]])
+        buffer.discardLastRetrievedItems(2)
+        self.assertFalse(buffer.hasItems())
+        self.assertEqual(buffer.size(), 0)
+
+    def test_has_items_discards_leading_skipped(self):
+        buffer = self.buffer('emoncms', ['ch'])
+        log = ehb.get_shared_log('ch')
+        self.append(log, range(3), nodeid=2)
+        self.assertFalse(buffer.hasItems())
+        self.assertEqual(buffer.size(), 0)
+        self.append(log, [3, 4], nodeid=2)
+        self.append(log, [5])
+        self.assertTrue(buffer.hasItems())
+        self.assertEqual(buffer.size(), 1)
+        self.assertEqual(buffer.retrieveItem(), [5, 5])
+
+    def test_cursors_are_independent(self):
+        first = self.buffer('first', ['ch'])
+        second = self.buffer('second', ['ch'])
+        log = ehb.get_shared_log('ch')
+        self.append(log, range(6))
+        self.assertEqual(first.retrieveItems(4), [[5, 0], [5, 1], [5, 2], [5, 3]])
+        first.discardLastRetrievedItems(4)
+        self.assertEqual(second.retrieveItems(2), [[5, 0], [5, 1]])
+        # Segments only dropped once both passed them
+        self.assertEqual([segment.base for segment in log._segments], [0, 4])
+        second.discardLastRetrievedItems(2)
+        second.retrieveItems(4)
+        second.discardLastRetrievedItems(4)
+        self.assertEqual([segment.base for segment in log._segments], [4])
+
+    def test_frames_dropped_while_retrieved(self):
+        ehb.configure_shared_logs(True, size=8)
+        buffer = self.buffer('emoncms', ['ch'])
+        log = ehb.get_shared_log('ch')
+        self.append(log, range(8))
+        self.assertEqual(len(buffer.retrieveItems(2)), 2)
+        with self.assertLogs('EmonHub', logging.WARNING):
+            self.append(log, [8])
+        # Discarded from where they were retrieved, the cursor is past them already
+        buffer.discardLastRetrievedItems(2)
+        self.assertEqual(log._cursors['emoncms'], 4)
+        self.assertEqual([item[1] for item in buffer.retrieveItems(10)], [4, 5, 6, 7, 8])
+
+    def test_unsubscribe_channel(self):
+        buffer = self.buffer('emoncms', ['a', 'b'])
+        self.append(ehb.get_shared_log('a'), [0])
+        self.append(ehb.get_shared_log('b'), [1])
+        self.assertEqual(buffer.retrieveItems(5), [[5, 0], [5, 1]])
+        buffer.subscribe(['b'])
+        self.assertNotIn('emoncms', ehb.get_shared_log('a')._cursors)
+        self.assertEqual(buffer.retrieveItems(5), [[5, 1]])
+
+
+if __name__ == '__main__':
+    unittest.main()
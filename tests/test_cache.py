@@ -0,0 +1,89 @@
+import os
+import sys
+import json
+import http.client
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import Cargo
+import emonhub_cache as ehc
+
+
+def new_cargo(nodeid, nodename, names, values, timestamp=1700000000, rssi=0):
+    return Cargo.new_cargo(timestamp=timestamp, nodeid=nodeid, nodename=nodename, names=list(names),
+                           realdata=list(values), rssi=rssi)
+
+
+class TestCacheServer(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = ehc.LastValueCache()
+        self.server = ehc.CacheServer(self.cache, port=0)
+        self.addCleanup(self.server.close)
+        self.port = self.server._httpd.server_address[1]
+
+    def get(self, path, etag=None):
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        self.addCleanup(connection.close)
+        connection.request('GET', path, headers={'If-None-Match': etag} if etag else {})
+        response = connection.getresponse()
+        body = response.read()
+        return response.status, response.getheader('ETag'), json.loads(body) if response.status == 200 else None
+
+    def test_node_values(self):
+        self.cache.update(new_cargo(10, 'emontx4', ['P1', 'T'], [1250, 'bad'], rssi=-52))
+        # Unnamed values are numbered from 1
+        self.cache.update(new_cargo(11, None, [], [5, 6]))
+        status, _, data = self.get('/nodes/emontx4')
+        self.assertEqual(status, 200)
+        self.assertEqual(data, {'P1': {'value': 1250.0, 'time': 1700000000.0, 'rssi': -52},
+                                'T': {'value': None, 'time': 1700000000.0, 'rssi': -52}})
+        # By node id too
+        self.assertEqual(self.get('/nodes/10')[2], data)
+        self.assertEqual(self.get('/nodes/emontx4/P1')[2], data['P1'])
+        self.assertEqual(sorted(self.get('/nodes/11')[2]), ['1', '2'])
+        self.assertEqual(sorted(self.get('/nodes')[2]), ['11', 'emontx4'])
+
+    def test_not_found(self):
+        self.cache.update(new_cargo(10, 'emontx4', ['P1'], [1250]))
+        for path in ['/nodes/emontx5', '/nodes/emontx4/P2', '/inputs', '/nodes/emontx4/P1/value']:
+            with self.subTest(path=path):
+                self.assertEqual(self.get(path)[0], 404)
+
+    def test_etag(self):
+        self.cache.update(new_cargo(10, 'emontx4', ['P1'], [1250]))
+        status, etag, _ = self.get('/nodes/emontx4')
+        self.assertEqual(status, 200)
+        self.assertEqual(self.get('/nodes/emontx4', etag), (304, etag, None))
+        # Another ETag gets the values
+        self.assertEqual(self.get('/nodes/emontx4', '"0"')[0], 200)
+
+        # Other nodes changing don't change the node, they change every node
+        _, nodes_etag, _ = self.get('/nodes')
+        self.cache.update(new_cargo(11, 'emonth', ['T'], [20.5]))
+        self.assertEqual(self.get('/nodes/emontx4', etag)[0], 304)
+        status, new_nodes_etag, _ = self.get('/nodes', nodes_etag)
+        self.assertEqual(status, 200)
+        self.assertNotEqual(new_nodes_etag, nodes_etag)
+
+        # The node changing
+        self.cache.update(new_cargo(10, 'emontx4', ['P1'], [1300], timestamp=1700000010))
+        status, new_etag, data = self.get('/nodes/emontx4', etag)
+        self.assertEqual(status, 200)
+        self.assertNotEqual(new_etag, etag)
+        self.assertEqual(data['P1']['value'], 1300)
+        self.assertEqual(self.get('/nodes/emontx4/P1', new_etag)[0], 304)
+
+    def test_etags_unique_across_nodes(self):
+        # The same ETag never stands for two contents of a path
+        self.cache.update(new_cargo(10, 'emontx4', ['P1'], [1250]))
+        self.cache.update(new_cargo(11, 'emonth', ['T'], [20.5]))
+        etags = {self.get(path)[1] for path in ['/nodes/emontx4', '/nodes/emonth', '/nodes']}
+        self.assertEqual(len(etags), 2)
+        self.cache.update(new_cargo(10, 'emontx4', ['P1'], [1300]))
+        self.assertNotIn(self.get('/nodes/emontx4')[1], etags)
+
+
+if __name__ == '__main__':
+    unittest.main()
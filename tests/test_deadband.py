@@ -0,0 +1,51 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import Cargo
+import emonhub_deadband as ehd
+from emonhub_interfacer import EmonHubInterfacer
+
+
+def new_cargo(timestamp, names, values):
+    return Cargo.new_cargo(timestamp=timestamp, nodeid=5, names=list(names), realdata=list(values))
+
+
+class TestDeadbandFilter(unittest.TestCase):
+
+    def test_positional_output_gets_whole_frames(self):
+        deadband = ehd.DeadbandFilter('0.5')
+        first = deadband.filter(new_cargo(1000, ['P', 'T'], [100, 20]))
+        second = deadband.filter(new_cargo(1010, ['P', 'T'], [100, 21]))
+        self.assertEqual(first.realdata, [100, 20])
+        self.assertEqual(second.names, ['P', 'T'])
+        self.assertEqual(second.realdata, [100, 21])
+        self.assertIsNone(deadband.filter(new_cargo(1020, ['P', 'T'], [100.2, 21.1])))
+
+    def test_positional_interfacer_frames(self):
+        interfacer = EmonHubInterfacer('positional')
+        interfacer.set(deadband='0.5')
+        frames = [interfacer._format_logged(new_cargo(1000, ['P', 'T'], [100, 20])),
+                  interfacer._format_logged(new_cargo(1010, ['P', 'T'], [100, 21]))]
+        self.assertEqual(frames, [[1000, 5, 100, 20], [1010, 5, 100, 21]])
+
+    def test_named_output_gets_changed_values(self):
+        deadband = ehd.DeadbandFilter('0.5')
+        deadband.filter(new_cargo(1000, ['P', 'T'], [100, 20]), by_name=True)
+        cargo = new_cargo(1010, ['P', 'T'], [100, 21])
+        changed = deadband.filter(cargo, by_name=True)
+        self.assertEqual((changed.names, changed.realdata), (['T'], [21]))
+        # The cargo is shared with the other subscribers
+        self.assertEqual(cargo.realdata, [100, 21])
+
+    def test_heartbeat(self):
+        deadband = ehd.DeadbandFilter('0.5', heartbeat=60)
+        deadband.filter(new_cargo(1000, ['P'], [100]))
+        self.assertIsNone(deadband.filter(new_cargo(1030, ['P'], [100])))
+        self.assertIsNotNone(deadband.filter(new_cargo(1060, ['P'], [100])))
+
+
+if __name__ == '__main__':
+    unittest.main()
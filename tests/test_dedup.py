@@ -0,0 +1,72 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import Cargo
+import emonhub_dedup as ehdd
+
+
+def new_cargo(values, names=None, rssi=0):
+    return Cargo.new_cargo(nodeid=5, names=list(names or []), realdata=list(values), rssi=rssi)
+
+
+class TestMessageCounter(unittest.TestCase):
+
+    def test_missed_packets(self):
+        counter = ehdd.MessageCounter()
+        counter.update(5, 10, now=0)
+        self.assertEqual(counter.update(5, 13, now=10), (2, 100.0 * 2 / 3))
+
+    def test_late_copy_from_another_gateway(self):
+        counter = ehdd.MessageCounter()
+        counter.update(5, 10, now=0)
+        counter.update(5, 12, now=10)
+        self.assertEqual(counter.update(5, 11, now=11)[0], 0)
+
+    def test_jump_beyond_history(self):
+        counter = ehdd.MessageCounter()
+        counter.update(5, 10, now=0)
+        self.assertEqual(counter.update(5, 110, now=10)[0], 99)
+        # Only the last MSG_HISTORY counters are remembered
+        self.assertEqual(counter.update(5, 109, now=11)[0], 98)
+        self.assertEqual(counter.update(5, 40, now=12)[0], 0)
+
+    def test_jump_taken_as_reset(self):
+        counter = ehdd.MessageCounter()
+        counter.update(5, 10, now=0)
+        self.assertEqual(counter.update(5, 2 ** 31, now=10), (0, 0))
+        self.assertEqual(counter.update(5, 2 ** 31 + 2, now=20), (1, 50.0))
+
+    def test_counter_reset_within_history(self):
+        counter = ehdd.MessageCounter()
+        for msg in range(20, 31):
+            counter.update(5, msg, now=msg * 10)
+        # The node restarted, its counter starts again
+        self.assertEqual(counter.update(5, 1, now=320), (0, 0))
+        self.assertEqual(counter.update(5, 2, now=330), (0, 0))
+        self.assertEqual(counter.update(5, 4, now=340), (1, 100.0 / 3))
+
+
+class TestFrameDeduplicator(unittest.TestCase):
+
+    def test_copy_with_better_rssi(self):
+        dedup = ehdd.FrameDeduplicator(window=2, hold=0.5)
+        first = new_cargo([1, 100], ['MSG', 'P'], rssi=-80)
+        copy = new_cargo([1, 100], ['MSG', 'P'], rssi=-50)
+        dedup.submit('ToEmonCMS', first, 'RFM2Pi', now=0)
+        dedup.submit('ToEmonCMS', copy, 'RFM2Pi2', now=0.1)
+        self.assertEqual(dedup.ready(now=0.6), [('ToEmonCMS', copy)])
+
+    def test_identical_frames_from_one_gateway(self):
+        dedup = ehdd.FrameDeduplicator(window=2, hold=0.5)
+        frames = [new_cargo([100, 20]) for _ in range(3)]
+        dedup.submit('ToEmonCMS', frames[0], 'RFM2Pi', now=0)
+        dedup.submit('ToEmonCMS', frames[1], 'RFM2Pi2', now=0.1)
+        dedup.submit('ToEmonCMS', frames[2], 'RFM2Pi', now=1)
+        self.assertEqual(dedup.ready(now=1.5), [('ToEmonCMS', frames[0]), ('ToEmonCMS', frames[2])])
+
+
+if __name__ == '__main__':
+    unittest.main()
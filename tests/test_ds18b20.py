@@ -0,0 +1,178 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from interfacers import EmonHubDS18B20Interfacer as ds18b20
+from interfacers.EmonHubDS18B20Interfacer import DS18B20, EmonHubDS18B20Interfacer
+
+
+def w1_slave(temperature, crc=True):
+    """Contents of the w1_slave file of a sensor at temperature"""
+    return ("72 01 4b 46 7f ff 0e 10 57 : crc=57 %s\n"
+            "72 01 4b 46 7f ff 0e 10 57 t=%d\n" % ('YES' if crc else 'NO', round(temperature * 1000)))
+
+
+class FakeSysfs:
+    """w1 devices directory, with the sensors linked to the directory of their bus master"""
+
+    def __init__(self, bulk_read=True):
+        self.directory = tempfile.mkdtemp()
+        self.base_dir = os.path.join(self.directory, 'devices') + '/'
+        self.master = os.path.join(self.directory, 'w1_bus_master1')
+        os.makedirs(self.base_dir)
+        os.makedirs(self.master)
+        self.bulk_read = os.path.join(self.master, 'therm_bulk_read')
+        if bulk_read:
+            with open(self.bulk_read, 'w') as f:
+                f.write('1\n')
+
+    def close(self):
+        shutil.rmtree(self.directory)
+
+    def add(self, sensor, contents):
+        os.makedirs(os.path.join(self.master, sensor), exist_ok=True)
+        self.write(sensor, contents)
+        if not os.path.islink(self.base_dir + sensor):
+            os.symlink(os.path.join(self.master, sensor), self.base_dir + sensor)
+
+    def write(self, sensor, contents):
+        with open(os.path.join(self.master, sensor, 'w1_slave'), 'w') as f:
+            f.write(contents)
+
+    def remove(self, sensor):
+        os.remove(self.base_dir + sensor)
+        shutil.rmtree(os.path.join(self.master, sensor))
+
+
+class DS18B20TestCase(unittest.TestCase):
+
+    def sysfs(self, **kwargs):
+        sysfs = FakeSysfs(**kwargs)
+        self.addCleanup(sysfs.close)
+        return sysfs
+
+    def ds(self, sysfs):
+        ds = DS18B20(sysfs.base_dir)
+        ds.retry_delay = 0
+        self.addCleanup(ds.close)
+        return ds
+
+
+class TestDS18B20(DS18B20TestCase):
+
+    def test_device_list_cached(self):
+        sysfs = self.sysfs()
+        sysfs.add('28-000008e2db06', w1_slave(21.5))
+        sysfs.add('28-000009770529', w1_slave(45.25))
+        ds = self.ds(sysfs)
+        self.assertEqual(ds.sensors(), ['28-000008e2db06', '28-000009770529'])
+
+        # Not seen before the next scan
+        sysfs.add('28-0000096a49b4', w1_slave(50))
+        self.assertEqual(len(ds.sensors()), 2)
+        ds.rescan()
+        self.assertEqual(len(ds.sensors()), 3)
+
+    def test_missing_sensor_rescans(self):
+        sysfs = self.sysfs()
+        sysfs.add('28-000008e2db06', w1_slave(21.5))
+        sysfs.add('28-000009770529', w1_slave(45.25))
+        ds = self.ds(sysfs)
+        self.assertEqual(len(ds.sensors()), 2)
+        sysfs.remove('28-000009770529')
+        with self.assertLogs('EmonHub', 'WARNING'):
+            self.assertIsNone(ds.tempC('28-000009770529'))
+        self.assertEqual(ds.sensors(), ['28-000008e2db06'])
+
+    def test_crc_failure_retried(self):
+        sysfs = self.sysfs()
+        sysfs.add('28-000008e2db06', w1_slave(21.5, crc=False))
+        ds = self.ds(sysfs)
+        reads = []
+        read_raw = ds._read_raw
+
+        def flaky_read(sensor):
+            # The second conversion passes its CRC check
+            reads.append(sensor)
+            lines = read_raw(sensor)
+            sysfs.write(sensor, w1_slave(22.0))
+            return lines
+
+        ds._read_raw = flaky_read
+        self.assertEqual(ds.tempC('28-000008e2db06'), 22.0)
+        self.assertEqual(len(reads), 2)
+
+        # Failing every attempt
+        sysfs.write('28-000008e2db06', w1_slave(22.0, crc=False))
+        ds._read_raw = lambda sensor: reads.append(sensor) or read_raw(sensor)
+        del reads[:]
+        self.assertIs(ds.tempC('28-000008e2db06'), False)
+        self.assertEqual(len(reads), ds.retries + 1)
+
+    def test_bulk_read(self):
+        sysfs = self.sysfs()
+        sysfs.add('28-000008e2db06', w1_slave(21.5))
+        sysfs.add('28-000009770529', w1_slave(-5.125))
+        ds = self.ds(sysfs)
+        self.assertEqual(ds._bus_masters(ds.sensors()), {sysfs.bulk_read})
+        self.assertEqual(ds.read_all(ds.sensors()), {'28-000008e2db06': 21.5, '28-000009770529': -5.125})
+        # One conversion triggered for the bus
+        with open(sysfs.bulk_read) as f:
+            self.assertEqual(f.read(), 'trigger\n')
+
+    def test_without_bulk_read(self):
+        sysfs = self.sysfs(bulk_read=False)
+        sysfs.add('28-000008e2db06', w1_slave(21.5))
+        ds = self.ds(sysfs)
+        self.assertEqual(ds._bus_masters(ds.sensors()), set())
+        self.assertEqual(ds.read_all(ds.sensors()), {'28-000008e2db06': 21.5})
+        self.assertEqual(ds.read_all([]), {})
+
+
+class TestDS18B20Interfacer(DS18B20TestCase):
+
+    def interfacer(self, sysfs):
+        # Without loading the w1 kernel modules
+        with mock.patch.object(ds18b20, 'DS18B20'):
+            interfacer = EmonHubDS18B20Interfacer('ds18b20')
+        interfacer.ds = self.ds(sysfs)
+        interfacer.set(read_interval=10, nodename='sensors', ids=['28-000009770529'], names=['cylb'])
+        return interfacer
+
+    def read(self, interfacer):
+        # The first poll is scheduled at the next slot, make it due now
+        interfacer._poll_due(interfacer._settings['read_interval'])
+        interfacer._polls['read']['deadline'] = 0
+        return interfacer.read()
+
+    def test_read(self):
+        sysfs = self.sysfs()
+        sysfs.add('28-000008e2db06', w1_slave(21.5))
+        sysfs.add('28-000009770529', w1_slave(45.25))
+        sysfs.add('28-0000096a49b4', w1_slave(50, crc=False))
+        interfacer = self.interfacer(sysfs)
+        with self.assertLogs('EmonHub', 'WARNING') as logs:
+            c = self.read(interfacer)
+        self.assertIn('no valid reading from 28-0000096a49b4', logs.output[0])
+        self.assertEqual(c.nodeid, 'sensors')
+        self.assertEqual(c.names, ['28-000008e2db06', 'cylb'])
+        self.assertEqual(c.realdata, [21.5, 45.25])
+
+    def test_run_releases_workers(self):
+        sysfs = self.sysfs()
+        sysfs.add('28-000008e2db06', w1_slave(21.5))
+        interfacer = self.interfacer(sysfs)
+        self.read(interfacer)
+        self.assertIsNotNone(interfacer.ds._pool)
+        interfacer.stop = True
+        interfacer.run()
+        self.assertIsNone(interfacer.ds._pool)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,196 @@
+import os
+import sys
+import time
+import socket
+import asyncio
+import select
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from goodwe import Goodwe_inverter as gw
+from interfacers.EmonHubGoodWeInterfacer import EmonHubGoodWeInterfacer
+
+
+def aa55_response(response_type, payload):
+    """AA55 response frame: header, response type, payload length, payload, checksum"""
+    frame = bytes.fromhex("AA557FC0" + response_type) + bytes([len(payload)]) + bytes(payload)
+    return frame + (sum(frame) % 65536).to_bytes(2, 'big')
+
+
+def es_device_info(model_name, serial_number):
+    """AA55 0182 response of an ES inverter"""
+    payload = bytearray(b' ' * 0x50)
+    payload[5:15] = model_name.ljust(10).encode('ascii')
+    payload[31:47] = serial_number.encode('ascii')
+    payload[51:63] = b'V1.2.3      '
+    return aa55_response("0182", payload)
+
+
+def es_runtime_data(vpv1):
+    """AA55 0186 response of an ES inverter, PV1 voltage in V and every other value 0"""
+    payload = bytearray(100)
+    payload[0:2] = round(vpv1 * 10).to_bytes(2, 'big')
+    return aa55_response("0186", payload)
+
+
+READ_DEVICE_INFO = bytes.fromhex("AA55C07F0102000241")
+READ_RUNTIME_DATA = bytes.fromhex("AA55C07F0106000245")
+
+
+class InverterReplay:
+    """UDP endpoint replaying the responses recorded for each request
+
+    responses: {request: [datagram, ...]}, all sent in turn to each request,
+    requests not listed get no response
+    drop: number of requests ignored first
+
+    """
+
+    def __init__(self, responses, drop=0):
+        self.responses = responses
+        self.drop = drop
+        self.requests = []
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind(('127.0.0.1', 0))
+        self.port = self._socket.getsockname()[1]
+        self._stop = False
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop = True
+        self._thread.join()
+        self._socket.close()
+
+    def _serve(self):
+        while not self._stop:
+            ready, _, _ = select.select([self._socket], [], [], 0.05)
+            if not ready:
+                continue
+            request, address = self._socket.recvfrom(1024)
+            self.requests.append(request)
+            if len(self.requests) <= self.drop:
+                continue
+            for response in self.responses.get(request, []):
+                self._socket.sendto(response, address)
+
+
+class GoodWeTestCase(unittest.TestCase):
+
+    def replay(self, *args, **kwargs):
+        replay = InverterReplay(*args, **kwargs)
+        self.addCleanup(replay.close)
+        return replay
+
+
+class TestUdpConnection(GoodWeTestCase):
+
+    def request(self, replay, command, retries):
+        async def request():
+            loop = asyncio.get_running_loop()
+            transport, connection = await loop.create_datagram_endpoint(
+                gw._UdpConnection, remote_addr=('127.0.0.1', replay.port))
+            try:
+                return await connection.request(command, 0.2, retries)
+            finally:
+                transport.close()
+        return asyncio.run(request())
+
+    def test_invalid_responses_ignored(self):
+        response = es_device_info('GW5048-EM', '95048EMU00000001')
+        # Truncated, wrong checksum and another response type before the valid one
+        bad_checksum = response[:-1] + bytes([response[-1] ^ 1])
+        other_type = es_runtime_data(350)
+        replay = self.replay({READ_DEVICE_INFO: [response[:20], bad_checksum, other_type, response]})
+        command = gw.Aa55ProtocolCommand("010200", "0182")
+        self.assertEqual(command.request, READ_DEVICE_INFO)
+        self.assertEqual(self.request(replay, command, 0), response)
+        self.assertEqual(len(replay.requests), 1)
+
+    def test_retried_after_timeout(self):
+        response = es_device_info('GW5048-EM', '95048EMU00000001')
+        replay = self.replay({READ_DEVICE_INFO: [response]}, drop=2)
+        command = gw.Aa55ProtocolCommand("010200", "0182")
+        self.assertEqual(self.request(replay, command, 3), response)
+        self.assertEqual(replay.requests, [READ_DEVICE_INFO] * 3)
+
+    def test_no_valid_response(self):
+        replay = self.replay({READ_DEVICE_INFO: [b'\xaa\x55']})
+        command = gw.Aa55ProtocolCommand("010200", "0182")
+        with self.assertRaises(gw.InverterError):
+            self.request(replay, command, 1)
+        self.assertEqual(len(replay.requests), 2)
+
+
+class TestGoodWeInterfacer(GoodWeTestCase):
+
+    def interfacer(self, replay):
+        interfacer = EmonHubGoodWeInterfacer('goodwe')
+        self.addCleanup(interfacer.close)
+        interfacer.set(ip='127.0.0.1', port=replay.port, timeout=0.2, retries=0, readinterval=10)
+        return interfacer
+
+    def read(self, interfacer):
+        # Polls after the first are scheduled at the next slot, make it due now
+        interfacer._poll_due(interfacer._settings['readinterval'], immediate=True)
+        interfacer._polls['read']['deadline'] = 0
+        return interfacer.read()
+
+    def test_discovered_once(self):
+        replay = self.replay({READ_DEVICE_INFO: [es_device_info('GW5048-EM', '95048EMU00000001')],
+                              READ_RUNTIME_DATA: [es_runtime_data(350)]})
+        interfacer = self.interfacer(replay)
+        for _ in range(3):
+            c = self.read(interfacer)
+            self.assertEqual(c.nodeid, 'goodwe')
+            self.assertEqual(c.realdata[c.names.index('vpv1')], 350.0)
+        self.assertIsInstance(interfacer._inverter, gw.ES)
+        self.assertEqual(interfacer._inverter.serial_number, '95048EMU00000001')
+        self.assertEqual(replay.requests, [READ_DEVICE_INFO] + [READ_RUNTIME_DATA] * 3)
+
+    def test_discovered_again_after_failure(self):
+        replay = self.replay({READ_DEVICE_INFO: [es_device_info('GW5048-EM', '95048EMU00000001')],
+                              READ_RUNTIME_DATA: [es_runtime_data(350)]})
+        interfacer = self.interfacer(replay)
+        self.assertTrue(self.read(interfacer))
+        # The inverter stops answering
+        responses = replay.responses
+        replay.responses = {}
+        with self.assertLogs('EmonHub', 'WARNING'):
+            self.assertIsNone(self.read(interfacer))
+        self.assertIsNone(interfacer._inverter)
+
+        replay.responses = responses
+        del replay.requests[:]
+        self.assertTrue(self.read(interfacer))
+        self.assertEqual(replay.requests, [READ_DEVICE_INFO, READ_RUNTIME_DATA])
+
+    def test_settings_change_drops_inverter(self):
+        replay = self.replay({READ_DEVICE_INFO: [es_device_info('GW5048-EM', '95048EMU00000001')],
+                              READ_RUNTIME_DATA: [es_runtime_data(350)]})
+        interfacer = self.interfacer(replay)
+        self.assertTrue(self.read(interfacer))
+        interfacer.set(timeout=0.3)
+        self.assertIsNone(interfacer._inverter)
+
+    def test_run_closes_endpoint(self):
+        replay = self.replay({READ_DEVICE_INFO: [es_device_info('GW5048-EM', '95048EMU00000001')],
+                              READ_RUNTIME_DATA: [es_runtime_data(350)]})
+        interfacer = self.interfacer(replay)
+        self.assertTrue(self.read(interfacer))
+        connection = interfacer._inverter._connection
+        self.assertIsNotNone(connection.transport)
+        interfacer.stop = True
+        interfacer.run()
+        self.assertIsNone(interfacer._inverter)
+        # Closed on the event loop of the GoodWe interfacers
+        deadline = time.monotonic() + 2
+        while connection.transport is not None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertIsNone(connection.transport)
+
+
+if __name__ == '__main__':
+    unittest.main()
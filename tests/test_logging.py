@@ -0,0 +1,125 @@
+import os
+import sys
+import logging
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import emonhub_logging as ehl
+
+T0 = 1700000000.0
+
+
+class Records(logging.Handler):
+    """Keeps the records handled as (level name, message)"""
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append((record.levelname, record.getMessage()))
+
+
+class TestRateLimitFilter(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger('EmonHubTest.' + self.id())
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+        self.handler = Records()
+        self.logger.addHandler(self.handler)
+        self.addCleanup(self.logger.removeHandler, self.handler)
+        self.filter = ehl.RateLimitFilter(limit=3, period=60)
+        self.handler.addFilter(self.filter)
+
+    def log(self, created, level, msg, *args):
+        record = self.logger.makeRecord(self.logger.name, level, __file__, 0, msg, args, None)
+        record.created = T0 + created
+        self.logger.handle(record)
+
+    def test_suppressed_after_limit(self):
+        for i in range(5):
+            # The same message once formatted
+            self.log(i, logging.ERROR, "Connection to %s refused", 'emoncms.org')
+            self.log(i, logging.WARNING, "Connection to %s refused", 'localhost')
+        self.assertEqual(self.handler.records, [('ERROR', "Connection to emoncms.org refused"),
+                                                ('WARNING', "Connection to localhost refused")] * 3)
+
+    def test_not_limited(self):
+        for i in range(5):
+            self.log(i, logging.DEBUG, "Frame received")
+            self.log(i, logging.CRITICAL, "Unable to start")
+        self.assertEqual(len(self.handler.records), 10)
+
+        self.filter.limit = 0
+        for i in range(5):
+            self.log(i, logging.ERROR, "Connection refused")
+        self.assertEqual(len(self.handler.records), 15)
+
+    def test_summary_after_period(self):
+        for i in range(5):
+            self.log(i, logging.ERROR, "Connection refused")
+        self.log(30, logging.ERROR, "Connection refused")
+        self.assertEqual(len(self.handler.records), 3)
+
+        # Logged by the first record once the period is over, which passes again
+        self.log(60, logging.ERROR, "Connection refused")
+        self.assertEqual(self.handler.records[3:], [('ERROR', "Suppressed 3 similar messages: Connection refused"),
+                                                    ('ERROR', "Connection refused")])
+
+        # Nothing suppressed, no summary
+        self.log(120, logging.ERROR, "Connection refused")
+        self.assertEqual(self.handler.records[5:], [('ERROR', "Connection refused")])
+
+    def test_flush(self):
+        for i in range(4):
+            self.log(i, logging.WARNING, "Send buffer full")
+        self.filter.flush()
+        self.assertEqual(self.handler.records[3:], [('WARNING', "Suppressed 1 similar messages: Send buffer full")])
+        # Counted from a new period
+        self.log(5, logging.WARNING, "Send buffer full")
+        self.assertEqual(len(self.handler.records), 5)
+        self.filter.flush()
+        self.assertEqual(len(self.handler.records), 5)
+
+    def test_messages_counted_at_most(self):
+        rate_messages = ehl.RATE_MESSAGES
+        ehl.RATE_MESSAGES = 2
+        self.addCleanup(setattr, ehl, 'RATE_MESSAGES', rate_messages)
+        for i in range(5):
+            for node in range(3):
+                self.log(i, logging.WARNING, "Node %d not responding", node)
+        # The third message is not limited
+        self.assertEqual([message for _, message in self.handler.records].count("Node 2 not responding"), 5)
+        self.assertEqual(len(self.handler.records), 3 + 3 + 5)
+
+
+class TestLoggingPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger('EmonHubTest.pipeline')
+        self.logger.propagate = False
+        self.handler = Records()
+        self.logger.addHandler(self.handler)
+        self.addCleanup(self.logger.handlers.clear)
+        limit, period = ehl.rate_limit.limit, ehl.rate_limit.period
+        self.addCleanup(ehl.set_rate_limit, limit, period)
+        self.addCleanup(ehl.stop)
+
+    def test_records_written_by_listener(self):
+        ehl.set_rate_limit(2, 60)
+        ehl.start(self.logger)
+        # The handler moved behind the queue
+        self.assertNotIn(self.handler, self.logger.handlers)
+        self.assertEqual(ehl.handlers(self.logger), [self.handler])
+        for _ in range(3):
+            self.logger.warning("Serial port %s unavailable", '/dev/ttyAMA0')
+        # The pending summary is logged on stop
+        ehl.stop()
+        self.assertEqual(self.handler.records, [('WARNING', "Serial port /dev/ttyAMA0 unavailable")] * 2
+                         + [('WARNING', "Suppressed 1 similar messages: Serial port /dev/ttyAMA0 unavailable")])
+
+
+if __name__ == '__main__':
+    unittest.main()
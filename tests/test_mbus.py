@@ -0,0 +1,224 @@
+import os
+import pty
+import sys
+import time
+import select
+import shutil
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from interfacers.EmonHubMBUSInterfacer import EmonHubMBUSInterfacer, MBUS_MAX_BACKOFF
+
+
+def long_frame(address, records):
+    """RSP_UD long frame with the fixed data header and records"""
+    body = bytes([0x08, address, 0x72]) + bytes(12) + bytes(records)
+    return bytes([0x68, len(body), len(body), 0x68]) + body + bytes([sum(body) % 256, 0x16])
+
+
+class MBusSimulator:
+    """M-Bus slaves answering REQ_UD2 on the master side of a pty
+
+    meters: {address: records}, addresses not listed don't answer
+    delay: seconds before each answer
+    split: seconds between the two halves of each answer
+
+    """
+
+    def __init__(self, meters, delay=0.0, split=0.0):
+        self.meters = meters
+        self.delay = delay
+        self.split = split
+        self.requests = []
+        self.master, slave = pty.openpty()
+        self.directory = tempfile.mkdtemp()
+        # The interfacer only opens listed ports or symbolic links
+        self.device = os.path.join(self.directory, 'ttyMBUS')
+        os.symlink(os.ttyname(slave), self.device)
+        self._slave = slave
+        self._stop = False
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop = True
+        self._thread.join()
+        os.close(self.master)
+        os.close(self._slave)
+        shutil.rmtree(self.directory)
+
+    def _serve(self):
+        buffer = b''
+        while not self._stop:
+            ready, _, _ = select.select([self.master], [], [], 0.05)
+            if not ready:
+                continue
+            buffer += os.read(self.master, 256)
+            # Short frames: 0x10 C A CS 0x16
+            while len(buffer) >= 5 and buffer[0] == 0x10:
+                address = buffer[2]
+                buffer = buffer[5:]
+                self.requests.append(address)
+                if address in self.meters:
+                    self._answer(long_frame(address, self.meters[address]))
+            if buffer and buffer[0] != 0x10:
+                buffer = b''
+
+    def _answer(self, frame):
+        time.sleep(self.delay)
+        os.write(self.master, frame[:7])
+        time.sleep(self.split)
+        os.write(self.master, frame[7:])
+
+
+# Energy 1234 kWh (int32, VIF 0x06), FlowT 45 C (int16, VIF 0x5b)
+RECORDS = [0x04, 0x06, 0xd2, 0x04, 0x00, 0x00, 0x02, 0x5b, 0x2d, 0x00]
+
+
+def force_due(interfacer):
+    """Make every meter due at the next read(), with its current interval"""
+    for meter in interfacer._settings['meters']:
+        # Schedules the meters whose interval changed, e.g. backed off
+        interfacer._poll_due(interfacer._meter_interval(meter), meter)
+        interfacer._polls[meter]['deadline'] = 0
+
+
+# Reference telegrams, full RSP_UD frames
+TELEGRAMS = {
+    # Water meter example of EN 13757-3
+    'water': "68 1f 1f 68 08 02 72 78 56 34 12 24 40 01 07 55 00 00 00 03 13 15 31 00 da 02 3b 13 01 8b 60 04 37"
+             "18 02 18 16",
+    # Electricity meter: voltage and current with VIFE, float power, two energy registers
+    'electricity': "68 2f 2f 68 08 01 72 01 00 00 00 77 04 14 02 01 00 00 00 04 fd 47 0a 5a 00 00 05 fd 59 00 80 bb"
+                   "44 05 2b 00 c0 ac 43 04 06 d2 04 00 00 04 06 2e 16 00 00 a1 16",
+    # Heat meter: temperatures, flow, 6 byte energy, negative BCD volume, variable length record
+    'heat': "68 37 37 68 08 03 72 02 00 00 00 2d 2c 01 04 02 00 00 00 02 5a 9a 01 02 5e 2c 01 04 3b e8 03 00 00 06"
+            "06 01 00 00 00 01 00 0c 13 78 56 34 f1 0d 78 01 02 03 04 05 06 02 2b 64 00 d8 16",
+}
+
+GOLDEN = {
+    'water': {'Volume': [12.565, 'm3'], 'FlowRate_Max': [0.113, 'm3/h'], 'Energy': [218.37, 'kWh']},
+    'electricity': {'Voltage': [230.5, 'V'], 'Current': [1.5, 'A'], 'Power': [345.5, 'W'],
+                    'Energy': [1234, 'kWh'], 'Energy2': [5678, 'kWh']},
+    'heat': {'FlowT': [41.0, 'C'], 'ReturnT': [30.0, 'C'], 'FlowRate': [1.0, 'm3/h'],
+             'Energy': [4294967297, 'kWh'], 'Volume': [-1345.678, 'm3'], 'Power': [100, 'W'],
+             'heat_calc': [4150 * 11 * 1000 / 3600, 'W']},
+}
+
+
+class TestMBusParser(unittest.TestCase):
+
+    def setUp(self):
+        self.interfacer = EmonHubMBUSInterfacer('mbus', device='/dev/nonexistent')
+
+    def assertDecoded(self, result, expected):
+        self.assertEqual(list(result), list(expected))
+        for name, (value, unit) in expected.items():
+            self.assertAlmostEqual(result[name][0], value, places=6, msg=name)
+            self.assertEqual(result[name][1], unit, name)
+
+    def test_golden_telegrams(self):
+        for meter, telegram in TELEGRAMS.items():
+            with self.subTest(meter):
+                self.assertDecoded(self.interfacer.parse_frame(bytes.fromhex(telegram), []), GOLDEN[meter])
+
+    def test_record_selection(self):
+        result = self.interfacer.parse_frame(bytes.fromhex(TELEGRAMS['heat']), [1, 2, 7])
+        self.assertDecoded(result, {'FlowT': [41.0, 'C'], 'ReturnT': [30.0, 'C'], 'Power': [100, 'W']})
+
+    def test_layout_cache(self):
+        compiled = []
+        compile_layout = self.interfacer.compile_layout
+        self.interfacer.compile_layout = lambda *args: compiled.append(1) or compile_layout(*args)
+
+        frame = bytearray.fromhex(TELEGRAMS['electricity'])
+        self.interfacer.parse_frame(frame, [], 'sdm')
+        # Repeat telegram with another energy value, decoded with the cached layout
+        frame[41:45] = (4321).to_bytes(4, 'little')
+        frame[-2] = sum(frame[4:-2]) % 256
+        result = self.interfacer.parse_frame(frame, [], 'sdm')
+        self.assertEqual(result['Energy'][0], 4321)
+        self.assertEqual(len(compiled), 1)
+
+        # Same length, power in 10 W rather than W: the layout is compiled again
+        frame[34] = 0x2c
+        frame[-2] = sum(frame[4:-2]) % 256
+        result = self.interfacer.parse_frame(frame, [], 'sdm')
+        self.assertAlmostEqual(result['Power'][0], 3455)
+        self.assertEqual(len(compiled), 2)
+
+
+class TestMBusBus(unittest.TestCase):
+
+    def setUp(self):
+        self.simulators = []
+
+    def tearDown(self):
+        for simulator in self.simulators:
+            simulator.close()
+
+    def simulator(self, *args, **kwargs):
+        simulator = MBusSimulator(*args, **kwargs)
+        self.simulators.append(simulator)
+        return simulator
+
+    def interfacer(self, device, meters):
+        interfacer = EmonHubMBUSInterfacer('mbus', device=device, baud=2400)
+        interfacer.set(read_interval=10, meters=meters)
+        self.addCleanup(interfacer.close)
+        # First call schedules the meters
+        self.assertFalse(interfacer.read())
+        force_due(interfacer)
+        return interfacer
+
+    def test_frame_read_across_split_writes(self):
+        simulator = self.simulator({1: RECORDS}, split=0.05)
+        interfacer = self.interfacer(simulator.device, {'heat': {'address': 1}})
+        c = interfacer.read()
+        self.assertEqual(c.names, ['heat_Energy', 'heat_FlowT'])
+        self.assertEqual(c.realdata, [1234, 45])
+        self.assertEqual(c.units, ['kWh', 'C'])
+        self.assertEqual(c.nodeid, 'MBUS')
+
+    def test_meters_scheduled_individually(self):
+        simulator = self.simulator({1: RECORDS, 2: RECORDS})
+        interfacer = self.interfacer(simulator.device, {'a': {'address': 1},
+                                                        'b': {'address': 2, 'read_interval': 60}})
+        self.assertEqual(set(interfacer._polls), {'a', 'b'})
+        self.assertEqual(interfacer._polls['b']['params'][0], 60)
+        interfacer._polls['b']['deadline'] = time.monotonic() + 60
+        c = interfacer.read()
+        self.assertEqual(c.names, ['a_Energy', 'a_FlowT'])
+        self.assertEqual(simulator.requests, [1])
+
+    def test_silent_meter_backed_off(self):
+        simulator = self.simulator({1: RECORDS})
+        interfacer = self.interfacer(simulator.device, {'a': {'address': 1}, 'missing': {'address': 9}})
+        for failures in range(1, 5):
+            c = interfacer.read()
+            force_due(interfacer)
+            self.assertEqual(c.names, ['a_Energy', 'a_FlowT'])
+            self.assertEqual(interfacer._failures, {'a': 0, 'missing': failures})
+            self.assertEqual(interfacer._meter_interval('missing'), 10 * min(2 ** failures, MBUS_MAX_BACKOFF))
+        self.assertEqual(interfacer._meter_interval('a'), 10)
+        # REQ_UD2 is sent twice to a meter that doesn't answer
+        self.assertEqual(simulator.requests.count(9), 8)
+
+    def test_buses_read_in_parallel(self):
+        delay = 0.15
+        first = self.simulator({1: RECORDS}, delay=delay)
+        second = self.simulator({2: RECORDS}, delay=delay)
+        interfacer = self.interfacer(first.device, {'a': {'address': 1},
+                                                    'b': {'address': 2, 'device': second.device, 'baud': 2400}})
+        c = interfacer.read()
+        self.assertEqual(c.names, ['a_Energy', 'a_FlowT', 'b_Energy', 'b_FlowT'])
+        self.assertLess(interfacer.cycle_time, 2 * delay)
+        interfacer.close()
+        self.assertIsNone(interfacer._executor)
+
+
+if __name__ == '__main__':
+    unittest.main()
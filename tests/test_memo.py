@@ -0,0 +1,156 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+try:
+    import requests
+except ImportError:
+    requests = None
+
+import Cargo
+import emonhub_memo as ehm
+
+
+def new_cargo(timestamp, values):
+    return Cargo.new_cargo(timestamp=timestamp, nodeid=5, names=['P', 'T'], realdata=list(values))
+
+
+class Builder:
+    """Build functions for the memo, counting the values built"""
+
+    def __init__(self):
+        self.built = 0
+
+    def __call__(self, value):
+        def build():
+            self.built += 1
+            return [value]
+        return build
+
+
+class TestSerializationMemo(unittest.TestCase):
+
+    def setUp(self):
+        self.memo = ehm.SerializationMemo(max_entries=3)
+        self.memo.register('local', 'emoncms')
+        self.memo.register('remote', 'emoncms')
+        self.memo.register('mqtt', 'mqtt')
+        self.build = Builder()
+
+    def test_consumers_of_same_key_share(self):
+        self.memo.expect(1, ['local', 'remote', 'mqtt', 'unregistered'])
+        # Only the emoncms format has two consumers
+        self.assertEqual(list(self.memo._entries), [(1, 'emoncms')])
+        first = self.memo.get(1, 'local', self.build('a'))
+        second = self.memo.get(1, 'remote', self.build('b'))
+        self.assertIs(second, first)
+        self.assertEqual(self.build.built, 1)
+        self.assertEqual(self.memo.stats['hits'], 1)
+        # Dropped once every consumer had it
+        self.assertEqual(self.memo._entries, {})
+        self.assertEqual(self.memo.get(1, 'mqtt', self.build('c')), ['c'])
+        self.assertEqual(self.build.built, 2)
+
+    def test_delivered_on_two_channels(self):
+        self.memo.expect(1, ['local', 'remote'])
+        self.memo.expect(1, ['local', 'remote'])
+        values = [self.memo.get(1, consumer, self.build(consumer)) for consumer in ['local', 'remote'] * 2]
+        self.assertEqual(self.build.built, 1)
+        self.assertTrue(all(value is values[0] for value in values))
+        self.assertEqual(self.memo._entries, {})
+
+    def test_skip(self):
+        self.memo.expect(1, ['local', 'remote'])
+        # The deadband filter of remote drops the cargo
+        self.memo.skip(1, 'remote')
+        self.assertEqual(self.memo.get(1, 'local', self.build('a')), ['a'])
+        self.assertEqual(self.memo._entries, {})
+
+        # Skipped after the value was built
+        self.memo.expect(2, ['local', 'remote'])
+        self.memo.get(2, 'local', self.build('b'))
+        self.assertIn((2, 'emoncms'), self.memo._entries)
+        self.memo.skip(2, 'remote')
+        self.assertEqual(self.memo._entries, {})
+
+    def test_eviction(self):
+        for uri in range(1, 5):
+            self.memo.expect(uri, ['local', 'remote'])
+        # The oldest is evicted
+        self.assertEqual([uri for uri, key in self.memo._entries], [2, 3, 4])
+        self.assertEqual(self.memo.stats['evicted'], 1)
+        # Built by each consumer
+        self.memo.get(1, 'local', self.build('a'))
+        self.memo.get(1, 'remote', self.build('a'))
+        self.assertEqual(self.build.built, 2)
+        self.memo.get(2, 'local', self.build('b'))
+        self.memo.get(2, 'remote', self.build('b'))
+        self.assertEqual(self.build.built, 3)
+
+    def test_batch_shared_for_same_frames(self):
+        frames = {'local': [], 'remote': []}
+        for uri in (1, 2):
+            self.memo.expect(uri, ['local', 'remote'])
+            for consumer in frames:
+                frames[consumer].append(self.memo.get(uri, consumer, self.build(uri)))
+        body = self.memo.get_batch(frames['local'], 'emoncms', 'json', lambda: 'body')
+        self.assertEqual(self.memo.stats['batch_misses'], 1)
+        self.assertIs(self.memo.get_batch(frames['remote'], 'emoncms', 'json', lambda: 'other'), body)
+        self.assertEqual(self.memo.stats['batch_hits'], 1)
+        # Dropped once every consumer had it
+        self.assertEqual(self.memo._batches, {})
+
+    def test_batch_not_shared_for_equal_frames(self):
+        frames = []
+        for uri in (1, 2):
+            self.memo.expect(uri, ['local', 'remote'])
+            frames.append(self.memo.get(uri, 'local', self.build(uri)))
+        self.memo.get_batch(frames, 'emoncms', 'json', lambda: 'body')
+        # Equal frames that are other objects, e.g. built after the entry was evicted
+        copies = [list(frame) for frame in frames]
+        self.assertEqual(self.memo.get_batch(copies, 'emoncms', 'json', lambda: 'other'), 'other')
+        # Another batch starting with the same frame
+        self.assertEqual(self.memo.get_batch(frames[:1], 'emoncms', 'json', lambda: 'first'), 'first')
+        # Another kind of value
+        self.assertEqual(self.memo.get_batch(frames, 'emoncms', 'zlib', lambda: 'zlib'), 'zlib')
+        self.assertEqual(self.memo.stats['batch_hits'], 0)
+
+    def test_batch_of_unshared_frames_not_kept(self):
+        self.memo.expect(1, ['local'])
+        frames = [self.memo.get(1, 'local', self.build(1))]
+        self.memo.get_batch(frames, 'emoncms', 'json', lambda: 'body')
+        self.assertEqual(self.memo._batches, {})
+
+
+@unittest.skipIf(requests is None, "requests is not installed")
+class TestMemoDeadband(unittest.TestCase):
+
+    def setUp(self):
+        self.memo = ehm.memo
+        ehm.memo = ehm.SerializationMemo()
+
+    def tearDown(self):
+        ehm.memo = self.memo
+
+    def test_deadband_skip(self):
+        from interfacers.EmonHubEmoncmsHTTPInterfacer import EmonHubEmoncmsHTTPInterfacer
+        local = EmonHubEmoncmsHTTPInterfacer('local')
+        local.set()
+        remote = EmonHubEmoncmsHTTPInterfacer('remote')
+        remote.set(deadband='0.5')
+
+        frames = {}
+        for cargo in [new_cargo(1000, [100, 20]), new_cargo(1010, [100.2, 20.1])]:
+            ehm.memo.expect(cargo.uri, ['local', 'remote'])
+            frames[cargo.timestamp] = [local._format_logged(cargo), remote._format_logged(cargo)]
+        self.assertIs(frames[1000][0], frames[1000][1])
+        self.assertEqual(frames[1010], [[1010, 5, 100.2, 20.1], None])
+        self.assertEqual(ehm.memo.stats['hits'], 1)
+        # Nothing left waiting for remote
+        self.assertEqual(ehm.memo._entries, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+import os
+import pty
+import sys
+import struct
+import select
+import shutil
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+try:
+    import minimalmodbus
+except ImportError:
+    minimalmodbus = None
+
+from interfacers.EmonHubMinimalModbusInterfacer import EmonHubMinimalModbusInterfacer
+
+
+def crc16(data):
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return struct.pack('<H', crc)
+
+
+def float_words(value):
+    return list(struct.unpack('>HH', struct.pack('>f', value)))
+
+
+class RtuSlave:
+    """Modbus RTU slave answering register reads on the master side of a pty
+
+    registers: {functioncode: {register: word}}
+    strict: reads that include unmapped registers get an illegal data address exception
+
+    """
+
+    def __init__(self, address, registers, strict=False):
+        self.address = address
+        self.registers = registers
+        self.strict = strict
+        self.requests = []
+        self.master, slave = pty.openpty()
+        self.directory = tempfile.mkdtemp()
+        # The interfacer only opens listed ports or symbolic links
+        self.device = os.path.join(self.directory, 'ttyRS485')
+        os.symlink(os.ttyname(slave), self.device)
+        self._slave = slave
+        self._stop = False
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop = True
+        self._thread.join()
+        os.close(self.master)
+        os.close(self._slave)
+        shutil.rmtree(self.directory)
+
+    def _serve(self):
+        buffer = b''
+        while not self._stop:
+            ready, _, _ = select.select([self.master], [], [], 0.05)
+            if not ready:
+                continue
+            buffer += os.read(self.master, 256)
+            # Read requests: address, function code, start, count, CRC
+            while len(buffer) >= 8:
+                request, buffer = buffer[:8], buffer[8:]
+                if crc16(request[:6]) != request[6:]:
+                    buffer = b''
+                    break
+                address, functioncode, start, count = struct.unpack('>BBHH', request[:6])
+                if address != self.address:
+                    continue
+                self.requests.append((functioncode, start, count))
+                registers = self.registers.get(functioncode, {})
+                span = range(start, start + count)
+                if self.strict and any(register not in registers for register in span):
+                    response = struct.pack('>BBB', address, functioncode | 0x80, 2)
+                else:
+                    words = [registers.get(register, 0) for register in span]
+                    response = struct.pack('>BBB%dH' % count, address, functioncode, 2 * count, *words)
+                os.write(self.master, response + crc16(response))
+
+
+SDM120_REGISTERS = [0, 6, 12, 18, 30, 70, 72, 74, 76]
+
+
+@unittest.skipIf(minimalmodbus is None, "minimalmodbus is not installed")
+class TestMinimalModbus(unittest.TestCase):
+
+    def interfacer(self, device, meters):
+        interfacer = EmonHubMinimalModbusInterfacer('modbus', device=device, baud=38400)
+        self.addCleanup(interfacer.close)
+        interfacer.set(read_interval=10, meters=meters)
+        return interfacer
+
+    def read(self, interfacer):
+        # The first poll is scheduled at the next slot, make it due now
+        interfacer._poll_due(interfacer._settings['read_interval'])
+        interfacer._polls['read']['deadline'] = 0
+        return interfacer.read()
+
+    def slave(self, *args, **kwargs):
+        slave = RtuSlave(*args, **kwargs)
+        self.addCleanup(slave.close)
+        return slave
+
+    def test_plan_blocks_across_gaps(self):
+        interfacer = self.interfacer('/dev/nonexistent', {
+            'gaps': {'registers': SDM120_REGISTERS},
+            'adjacent': {'registers': SDM120_REGISTERS, 'max_gap': 0},
+            'limit': {'registers': [0, 100, 124], 'max_gap': 200},
+            'mixed': {'registers': [0, 1, 2], 'datatypes': ['int', 'float', 'int']}})
+        spans = {meter: [(block[0], block[1], block[2]) for block in blocks]
+                 for meter, blocks in interfacer._blocks.items()}
+        self.assertEqual(spans['gaps'], [(4, 0, 32), (4, 70, 8)])
+        self.assertEqual(spans['adjacent'], [(4, 0, 2), (4, 6, 2), (4, 12, 2), (4, 18, 2), (4, 30, 2), (4, 70, 8)])
+        # At most 125 registers per request
+        self.assertEqual(spans['limit'], [(4, 0, 102), (4, 124, 2)])
+        # Integers are holding registers, floats input registers
+        self.assertEqual(spans['mixed'], [(3, 0, 3), (4, 1, 2)])
+        self.assertEqual(interfacer._blocks['gaps'][1][3], [(5, 0, 'float'), (6, 2, 'float'), (7, 4, 'float'),
+                                                            (8, 6, 'float')])
+
+    def test_decode_byteorders(self):
+        interfacer = self.interfacer('/dev/nonexistent', {})
+        # 230.5 as sent by devices in minimalmodbus byteorders 0 to 3
+        words = {0: [0x4366, 0x8000], 1: [0x0080, 0x6643], 2: [0x6643, 0x0080], 3: [0x8000, 0x4366]}
+        for byteorder, registers in words.items():
+            with self.subTest(byteorder=byteorder):
+                self.assertEqual(interfacer.decode_registers([0] + registers, 1, 'float', byteorder), 230.5)
+        self.assertEqual(interfacer.decode_registers([0xFFFE], 0, 'int', 0), -2)
+
+    def test_block_read(self):
+        values = [230.5, 1.25, 288.0, 290.0, 0.75, 50.0, 1234.5, 0.0, 2.5]
+        registers = {}
+        for register, value in zip(SDM120_REGISTERS, values):
+            words = float_words(value)
+            registers[register], registers[register + 1] = words
+        slave = self.slave(1, {4: registers})
+        interfacer = self.interfacer(slave.device, {'sdm': {'address': 1, 'registers': SDM120_REGISTERS,
+                                                            'names': ['V', 'I', 'P', 'VA', 'PF', 'FR', 'EI', 'EE', 'RI']}})
+        c = self.read(interfacer)
+        self.assertEqual(c.names, ['sdm_V', 'sdm_I', 'sdm_P', 'sdm_VA', 'sdm_PF', 'sdm_FR', 'sdm_EI', 'sdm_EE', 'sdm_RI'])
+        self.assertEqual(c.realdata, values)
+        self.assertEqual(slave.requests, [(4, 0, 32), (4, 70, 8)])
+
+    def test_illegal_request_splits_block(self):
+        registers = {0: 1, 1: 2, 5: 3, 20: 4}
+        slave = self.slave(2, {3: registers}, strict=True)
+        interfacer = self.interfacer(slave.device, {'ashp': {'address': 2, 'registers': [0, 1, 5, 20],
+                                                             'datatypes': ['int'] * 4, 'max_gap': 5}})
+        self.assertEqual([(block[1], block[2]) for block in interfacer._blocks['ashp']], [(0, 6), (20, 1)])
+        c = self.read(interfacer)
+        self.assertEqual(c.realdata, [1, 2, 3, 4])
+        self.assertEqual([(block[1], block[2]) for block in interfacer._blocks['ashp']],
+                         [(0, 1), (1, 1), (5, 1), (20, 1)])
+
+        # Read register by register from then on
+        del slave.requests[:]
+        c = self.read(interfacer)
+        self.assertEqual(c.realdata, [1, 2, 3, 4])
+        self.assertEqual(slave.requests, [(3, 0, 1), (3, 1, 1), (3, 5, 1), (3, 20, 1)])
+
+    def test_no_response_keeps_blocks(self):
+        slave = self.slave(3, {3: {0: 1, 1: 2}})
+        interfacer = self.interfacer(slave.device, {'offline': {'address': 4, 'registers': [0, 1],
+                                                                'datatypes': ['int', 'int']}})
+        self.assertFalse(self.read(interfacer))
+        self.assertEqual([(block[1], block[2]) for block in interfacer._blocks['offline']], [(0, 2)])
+
+
+if __name__ == '__main__':
+    unittest.main()
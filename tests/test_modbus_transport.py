@@ -0,0 +1,181 @@
+import os
+import sys
+import time
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import emonhub_modbus
+
+
+class FakeBus:
+    """Connections opened and closed by a transport, failing while refuse is set"""
+
+    def __init__(self):
+        self.refuse = False
+        self.opened = 0
+        self.closed = 0
+
+    def open_connection(self):
+        if self.refuse:
+            raise OSError("no such device")
+        self.opened += 1
+        return self.opened
+
+    def close_connection(self, connection):
+        self.closed += 1
+
+
+class TestModbusTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.bus = FakeBus()
+        self.addCleanup(emonhub_modbus._transports.pop, 'bus', None)
+
+    def transport(self, owner, settings=None):
+        return emonhub_modbus.get_transport(owner, 'bus', self.bus.open_connection, self.bus.close_connection,
+                                            settings=settings)
+
+    def test_priority_ordering(self):
+        transport = self.transport('a')
+        self.addCleanup(transport.detach, 'a')
+        started = threading.Event()
+        release = threading.Event()
+        order = []
+
+        def hold(connection):
+            started.set()
+            release.wait(5)
+
+        def queue(label, priority):
+            transport.request(label, lambda connection: order.append(label), priority)
+
+        threads = [threading.Thread(target=transport.request, args=('holder', hold))]
+        threads[0].start()
+        started.wait(5)
+        # Queued while the bus is held, in this order
+        for label, priority in [('low', emonhub_modbus.PRIORITY_LOW), ('normal1', emonhub_modbus.PRIORITY_NORMAL),
+                                ('high', emonhub_modbus.PRIORITY_HIGH), ('normal2', emonhub_modbus.PRIORITY_NORMAL)]:
+            threads.append(threading.Thread(target=queue, args=(label, priority)))
+            threads[-1].start()
+            deadline = time.monotonic() + 5
+            while len(transport._queue) < len(threads) - 1 and time.monotonic() < deadline:
+                time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(order, ['high', 'normal1', 'normal2', 'low'])
+        self.assertEqual(transport.usage()['low'][0], 1)
+
+    def test_attach_detach_counting(self):
+        transport = self.transport('a')
+        # An interfacer being replaced and its replacement share the name
+        self.assertIs(self.transport('a'), transport)
+        self.assertIs(self.transport('b'), transport)
+        self.assertEqual(transport._users, {'a': 2, 'b': 1})
+        self.assertEqual(transport.request('a', lambda connection: connection), 1)
+
+        transport.detach('a')
+        transport.detach('b')
+        self.assertTrue(transport.connected)
+        self.assertIs(emonhub_modbus._transports['bus'], transport)
+        self.assertNotIn('b', transport.usage())
+
+        # The last user closes the connection
+        with self.assertLogs('EmonHub', 'INFO'):
+            transport.detach('a')
+        self.assertFalse(transport.connected)
+        self.assertEqual(self.bus.closed, 1)
+        self.assertNotIn('bus', emonhub_modbus._transports)
+        transport.detach('a')
+        self.assertEqual(self.bus.closed, 1)
+
+        # A new transport for the next user
+        replacement = self.transport('a')
+        self.addCleanup(replacement.detach, 'a')
+        self.assertIsNot(replacement, transport)
+
+    def test_detach_waits_for_request(self):
+        transport = self.transport('a')
+        started = threading.Event()
+        release = threading.Event()
+        closed_during_request = []
+
+        def hold(connection):
+            started.set()
+            release.wait(5)
+            closed_during_request.append(self.bus.closed)
+
+        thread = threading.Thread(target=transport.request, args=('a', hold))
+        thread.start()
+        started.wait(5)
+        detach = threading.Thread(target=transport.detach, args=('a',))
+        detach.start()
+        time.sleep(0.05)
+        self.assertTrue(detach.is_alive())
+        release.set()
+        thread.join(5)
+        detach.join(5)
+        self.assertEqual(closed_during_request, [0])
+        self.assertEqual(self.bus.closed, 1)
+
+    def test_backoff(self):
+        transport = self.transport('a')
+        self.addCleanup(transport.detach, 'a')
+        self.bus.refuse = True
+        retries = []
+        with self.assertLogs('EmonHub', 'DEBUG') as logs:
+            for _ in range(7):
+                with self.assertRaises(emonhub_modbus.ModbusTransportError):
+                    transport.request('a', lambda connection: connection)
+                retries.append(round(transport._next_attempt - time.time()))
+                # Not attempted again before the retry delay
+                with self.assertRaises(emonhub_modbus.ModbusTransportError):
+                    transport.request('a', lambda connection: connection)
+                transport._next_attempt = 0
+        self.assertEqual(retries, [10, 20, 40, 80, 160, 320, 320])
+        # Logged as an error once
+        self.assertEqual(len([line for line in logs.output if line.startswith('ERROR')]), 1)
+        self.assertEqual(transport.usage()['a'][:2], (14, 14))
+
+        self.bus.refuse = False
+        self.assertEqual(transport.request('a', lambda connection: connection), 1)
+        self.assertEqual(transport._failures, 0)
+
+    def test_reconfigure_resets_backoff(self):
+        transport = self.transport('a', settings=(9600, 'none'))
+        self.addCleanup(transport.detach, 'a')
+        self.bus.refuse = True
+        with self.assertLogs('EmonHub', 'ERROR'):
+            with self.assertRaises(emonhub_modbus.ModbusTransportError):
+                transport.request('a', lambda connection: connection)
+        self.bus.refuse = False
+        with self.assertLogs('EmonHub', 'INFO'):
+            self.assertIs(self.transport('a', settings=(19200, 'none')), transport)
+        # Attached twice by a
+        transport.detach('a')
+        self.assertEqual(transport.settings, (19200, 'none'))
+        self.assertEqual(transport.request('a', lambda connection: connection), 1)
+
+    def test_invalidate_reconnects(self):
+        transport = self.transport('a')
+        self.addCleanup(transport.detach, 'a')
+        self.assertEqual(transport.request('a', lambda connection: connection), 1)
+        with self.assertLogs('EmonHub', 'WARNING'):
+            transport.invalidate('a', "timeout")
+        # Reported once
+        transport.invalidate('b', "timeout")
+        self.assertEqual(transport.request('a', lambda connection: connection), 2)
+        self.assertEqual(self.bus.closed, 1)
+
+    def test_frame_gap(self):
+        transport = emonhub_modbus.get_transport('a', 'bus', self.bus.open_connection, self.bus.close_connection,
+                                                 frame_gap=0.05)
+        self.addCleanup(transport.detach, 'a')
+        times = [transport.request('a', lambda connection: time.time()) for _ in range(3)]
+        self.assertGreaterEqual(min(b - a for a, b in zip(times, times[1:])), 0.045)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import os
+import sys
+import time
+import socket
+import asyncio
+import logging
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+try:
+    from pymodbus.server import ModbusTcpServer
+    from pymodbus.datastore import ModbusSparseDataBlock, ModbusServerContext
+    try:
+        from pymodbus.datastore import ModbusDeviceContext
+    except ImportError:
+        # Before pymodbus 3.10
+        from pymodbus.datastore import ModbusSlaveContext as ModbusDeviceContext
+except ImportError:
+    ModbusTcpServer = None
+
+import emonhub_coder as ehc
+from interfacers.EmonModbusTcpInterfacer import EmonModbusTcpInterfacer
+
+
+class ModbusServer:
+    """pymodbus TCP server on a free local port, in its own event loop thread
+
+    registers: {address: word} of the holding registers of unit 1, reads
+    that include other addresses get an illegal data address exception
+
+    """
+
+    def __init__(self, registers):
+        probe = socket.socket()
+        probe.bind(('127.0.0.1', 0))
+        self.port = probe.getsockname()[1]
+        probe.close()
+
+        # (address, count) of the read requests received
+        self.requests = []
+        device = ModbusDeviceContext(hr=ModbusSparseDataBlock(registers))
+        self._context = ModbusServerContext(devices={1: device}, single=False)
+        self._server = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_until_complete, args=(self._serve(),), daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', self.port), 0.1).close()
+                break
+            except OSError:
+                time.sleep(0.01)
+
+    def _trace(self, sending, pdu):
+        if not sending:
+            self.requests.append((pdu.address, pdu.count))
+        return pdu
+
+    async def _serve(self):
+        self._server = ModbusTcpServer(self._context, address=('127.0.0.1', self.port), trace_pdu=self._trace)
+        await self._server.serve_forever()
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self._server.shutdown(), self._loop).result(5)
+        self._thread.join(5)
+        self._loop.close()
+
+
+@unittest.skipIf(ModbusTcpServer is None, "pymodbus is not installed")
+class TestModbusTcp(unittest.TestCase):
+
+    def setUp(self):
+        # pymodbus logs the deprecation of the datastore classes and each refused request
+        logging.getLogger('pymodbus').setLevel(logging.CRITICAL)
+        self.nodelist = ehc.nodelist
+        ehc.nodelist = {}
+
+    def tearDown(self):
+        ehc.nodelist = self.nodelist
+
+    def server(self, registers):
+        server = ModbusServer(registers)
+        self.addCleanup(server.close)
+        return server
+
+    def interfacer(self, server, registers, rx):
+        interfacer = EmonModbusTcpInterfacer('modbustcp', '127.0.0.1', server.port)
+        self.addCleanup(interfacer.close)
+        ehc.nodelist['7'] = {'rx': rx}
+        interfacer.set(nodeId=7, register=registers, interval=0)
+        return interfacer
+
+    def test_block_merging(self):
+        server = self.server({10: 100, 11: 65535, 12: 0x4366, 13: 0x8000, 40: 7})
+        interfacer = self.interfacer(server, [11, 12, 13, 41], {
+            'names': ['a', 'b', 'c', 'd'], 'datacodes': ['h', 'H', 'f', 'h'], 'scales': ['0.1', '1', '0.1', '1']})
+        c = interfacer.read()
+        self.assertEqual(c.names, ['a', 'b', 'c', 'd'])
+        self.assertEqual(c.realdata, [10, 65535, 230.5, 7])
+        # 10-13 in one request, 40 more than max_gap registers away
+        self.assertEqual(server.requests, [(10, 4), (40, 1)])
+
+    def test_single_scale_ignored(self):
+        server = self.server({0: 100, 1: 200})
+        interfacer = self.interfacer(server, [1, 2], {'names': ['a', 'b'], 'datacode': 'h', 'scales': ['0.1']})
+        self.assertEqual(interfacer.read().realdata, [100, 200])
+
+    def test_split_on_refused_block(self):
+        server = self.server({10: 1, 11: 2, 20: 3})
+        interfacer = self.interfacer(server, [11, 12, 21], {'names': ['a', 'b', 'c'], 'datacode': 'h'})
+        # 10-20 is refused, the incomplete frame is dropped
+        self.assertIsNone(interfacer.read())
+        self.assertEqual(server.requests, [(10, 11)])
+
+        # Each value is read on its own from then on
+        del server.requests[:]
+        c = interfacer.read()
+        self.assertEqual(c.realdata, [1, 2, 3])
+        self.assertEqual(server.requests, [(10, 1), (11, 1), (20, 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import http.client
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import emonhub_ringstore as ehr
+
+# Multiple of the steps and intervals used
+T0 = 1700000100
+
+
+class TestRingStore(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def store(self, step=10, length=100):
+        store = ehr.RingStore(self.path, step, length)
+        self.addCleanup(store.close)
+        return store
+
+    def test_slots_wrap_around(self):
+        store = self.store()
+        for i in range(20):
+            store.append('emontx4', 'P1', T0 + 10 * i, float(i))
+        store.flush()
+        # The file holds the last 10 slots
+        points = store.query('emontx4', 'P1', T0, T0 + 190)
+        self.assertEqual(points, [[T0 + 10 * i, float(i), float(i), float(i)] for i in range(10, 20)])
+        self.assertEqual(os.path.getsize(os.path.join(self.path, 'emontx4', 'P1.ring')),
+                         ehr.HEADER_SIZE + 10 * ehr._SLOT.size)
+
+        # Older than the slot holds now
+        store.append('emontx4', 'P1', T0 + 50, 100.0)
+        store.flush()
+        self.assertEqual(store.stats['old'], 1)
+        self.assertEqual(store.query('emontx4', 'P1', T0 + 150, T0 + 150), [[T0 + 150, 15.0, 15.0, 15.0]])
+
+        # A value after a gap leaves the slots in between empty
+        store.append('emontx4', 'P1', T0 + 250, 25.0)
+        store.flush()
+        self.assertEqual([point[0] - T0 for point in store.query('emontx4', 'P1', T0, T0 + 250)],
+                         [160, 170, 180, 190, 250])
+
+    def test_values_averaged_per_step(self):
+        store = self.store()
+        store.append('emontx4', 'P1', T0 + 1, 100.0)
+        store.append('emontx4', 'P1', T0 + 5, 200.0)
+        store.flush()
+        # Added to the slot written by the previous flush
+        store.append('emontx4', 'P1', T0 + 9, 600.0)
+        store.flush()
+        self.assertEqual(store.query('emontx4', 'P1', T0, T0 + 9), [[T0, 300.0, 300.0, 300.0]])
+
+    def test_downsampled_query(self):
+        store = self.store(length=1000)
+        values = [10, 20, 30, 40, 50, 60, 70]
+        for i, value in enumerate(values):
+            store.append('emontx4', 'P1', T0 + 10 * i, float(value))
+        # Two values in the slot at 10 s
+        store.append('emontx4', 'P1', T0 + 15, 50.0)
+        store.flush()
+        points = store.query('emontx4', 'P1', T0, T0 + 60, interval=30)
+        self.assertEqual(points, [[T0, (10 + 20 + 50 + 30) / 4, 10.0, 35.0],
+                                  [T0 + 30, 50.0, 40.0, 60.0],
+                                  [T0 + 60, 70.0, 70.0, 70.0]])
+        # Intervals are multiples of the step
+        rounded = store.query('emontx4', 'P1', T0, T0 + 60, interval=25)
+        self.assertEqual(rounded, store.query('emontx4', 'P1', T0, T0 + 60, interval=20))
+
+    def test_query_points_limited(self):
+        store = self.store(length=1000)
+        for i in range(60):
+            store.append('emontx4', 'P1', T0 + 10 * i, float(i))
+        store.flush()
+        max_points = ehr.MAX_POINTS
+        ehr.MAX_POINTS = 10
+        self.addCleanup(setattr, ehr, 'MAX_POINTS', max_points)
+        points = store.query('emontx4', 'P1', T0, T0 + 590)
+        # 60 s per point
+        self.assertEqual([point[0] - T0 for point in points], list(range(0, 600, 60)))
+        self.assertEqual(points[0][1:], [2.5, 0.0, 5.0])
+
+    def test_reopened(self):
+        store = self.store()
+        store.append('emontx4', 'P1', T0, 1.0)
+        store.append('emon/th', 'T', T0, 20.5)
+        store.flush()
+        store.close()
+
+        # Files of other settings are used as they are
+        store = self.store(step=5, length=50)
+        with self.assertLogs('EmonHub', 'WARNING'):
+            self.assertEqual(store.query('emontx4', 'P1', T0, T0 + 10), [[T0, 1.0, 1.0, 1.0]])
+        self.assertEqual(store.inputs(), {'emon_th': ['T'], 'emontx4': ['P1']})
+        self.assertIsNone(store.query('emontx4', 'P2', T0, T0 + 10))
+
+    def test_not_a_ring_file(self):
+        os.makedirs(os.path.join(self.path, 'emontx4'))
+        with open(os.path.join(self.path, 'emontx4', 'P1.ring'), 'wb') as f:
+            f.write(b'\0' * ehr.HEADER_SIZE)
+        store = self.store()
+        with self.assertLogs('EmonHub', 'ERROR'):
+            self.assertIsNone(store.query('emontx4', 'P1', T0, T0 + 10))
+
+    def test_dirty_pages_synced(self):
+        store = self.store(length=100000)
+        # Slots 0 and 1 share a page, slot 1000 is in another one
+        for offset in (0, 10, 10000):
+            store.append('emontx4', 'P1', T0 + offset, 1.0)
+        store.flush()
+        self.assertEqual(store.stats['pages'], 2)
+        store.flush()
+        self.assertEqual(store.stats['pages'], 2)
+
+
+class TestRingStoreServer(unittest.TestCase):
+
+    def setUp(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        self.store = ehr.RingStore(path, 10, 1000)
+        self.addCleanup(self.store.close)
+        server = ehr.RingStoreServer(self.store, port=0)
+        self.addCleanup(server.close)
+        self.port = server._httpd.server_address[1]
+
+    def get(self, path):
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        self.addCleanup(connection.close)
+        connection.request('GET', path)
+        response = connection.getresponse()
+        body = response.read()
+        return response.status, json.loads(body) if response.status == 200 else None
+
+    def test_queries(self):
+        for i in range(6):
+            self.store.append('emontx4', 'P1', T0 + 10 * i, float(i))
+        self.store.flush()
+        self.assertEqual(self.get('/feeds'), (200, {'emontx4': ['P1']}))
+        self.assertEqual(self.get('/feeds/emontx4/P1?start=%d&end=%d&interval=30' % (T0, T0 + 50)),
+                         (200, [[T0, 1.0, 0.0, 2.0], [T0 + 30, 4.0, 3.0, 5.0]]))
+        self.assertEqual(self.get('/feeds/emontx4/P2')[0], 404)
+        self.assertEqual(self.get('/feeds/emontx4/P1?start=yesterday')[0], 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
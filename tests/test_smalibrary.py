@@ -0,0 +1,159 @@
+import os
+import sys
+import socket
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from smalibrary.SMABluetoothPacket import SMABluetoothPacket
+from smalibrary.SMANET2PlusPacket import SMANET2PlusPacket, fcs16, escape, unescape
+from smalibrary import SMASolar_library as sma
+
+INVERTER_ADDRESS = bytearray([0x11, 0x22, 0x33, 0x44, 0x55, 0x7e])
+LOCAL_ADDRESS = bytearray([0x01, 0x02, 0x03, 0x04, 0x05, 0x06])
+SERIAL_NUMBER = bytearray([0x7d, 0x00, 0x12, 0x34, 0x56, 0x78])
+
+ESCAPED = (0x7d, 0x7e, 0x11, 0x12, 0x13)
+
+
+def request(counter):
+    """Level 2 spot AC power request, as sent by request_data"""
+    packet = SMANET2PlusPacket(0x09, 0xA0, counter, SERIAL_NUMBER, 0x00, 0x00, 0x00)
+    packet.pushLongs(0x51000200, 0x00263F00, 0x00263FFF)
+    return packet
+
+
+def level1_frame(level2, source=INVERTER_ADDRESS, destination=LOCAL_ADDRESS):
+    """Level 1 frame carrying the bytes of a level 2 packet"""
+    frame = SMABluetoothPacket(0x01, 0x01, 0x00, 0x01, 0x00, source, destination)
+    frame.pushRawByteArray(level2.getBytesForSending())
+    frame.finish()
+    return bytes(frame.header + frame.SourceAddress + frame.DestinationAddress + frame.cmdcode + frame.RawByteArray)
+
+
+class TestFrameCoding(unittest.TestCase):
+
+    def test_fcs16_check_value(self):
+        # CRC-16/X-25, the PPP frame check sequence
+        self.assertEqual(fcs16(b'123456789') ^ 0xffff, 0x906e)
+        self.assertEqual(fcs16(b''), 0xffff)
+        # Updated in parts as bytes are pushed
+        self.assertEqual(fcs16(b'6789', fcs16(b'12345')), fcs16(b'123456789'))
+
+    def test_escape_known_bytes(self):
+        self.assertEqual(escape(b'\x7e\x41\x11\x12\x13\x7d'), b'\x7d\x5e\x41\x7d\x31\x7d\x32\x7d\x33\x7d\x5d')
+        self.assertEqual(escape(b'\x5e\x5d\x20'), b'\x5e\x5d\x20')
+        self.assertEqual(unescape(b'\x7d\x5e\x41\x7d\x5d'), b'\x7e\x41\x7d')
+        # An escape at the end waits for the byte it escapes
+        self.assertEqual(unescape(b'\x41\x7d'), b'\x41\x7d')
+
+    def test_escape_round_trip(self):
+        data = bytes(range(256)) * 2
+        escaped = escape(data)
+        self.assertNotIn(0x7e, escaped)
+        self.assertEqual(len(escaped), len(data) + 2 * len(ESCAPED))
+        self.assertEqual(unescape(escaped), data)
+
+    def test_request_frame(self):
+        packet = request(1)
+        fcs = packet.calculateFCS()
+        frame = packet.getBytesForSending()
+        self.assertEqual(frame[:5], b'\x7e\xff\x03\x60\x65')
+        self.assertEqual(frame[-1], 0x7e)
+        body = unescape(frame[1:-1])
+        self.assertEqual(body[:-2], packet.packet)
+        self.assertEqual(body[-2:], fcs.to_bytes(2, 'little'))
+        # A frame followed by its FCS leaves the good FCS residue (RFC 1662)
+        self.assertEqual(fcs16(body), 0xf0b8)
+
+    def test_escaped_fcs(self):
+        # Packet counters whose FCS includes bytes that must be escaped
+        counters = [counter for counter in range(1, 2000)
+                    if any(bte in ESCAPED for bte in request(counter).calculateFCS().to_bytes(2, 'little'))]
+        self.assertTrue(counters)
+        for counter in counters[:20]:
+            with self.subTest(counter=counter):
+                packet = request(counter)
+                fcs = packet.calculateFCS()
+                frame = packet.getBytesForSending()
+                self.assertNotIn(0x7e, frame[1:-1])
+                self.assertEqual(unescape(frame[1:-1])[-2:], fcs.to_bytes(2, 'little'))
+
+
+class TestBufferedBTSocket(unittest.TestCase):
+
+    def socketpair(self):
+        inverter, local = socket.socketpair()
+        self.addCleanup(inverter.close)
+        self.addCleanup(local.close)
+        local.settimeout(5)
+        return inverter, sma.BufferedBTSocket(local)
+
+    def send_split(self, inverter, data, sizes, delay=0.02):
+        """Send data in writes of sizes from another thread, the rest at once"""
+        def send():
+            position = 0
+            for size in sizes:
+                inverter.sendall(data[position:position + size])
+                position += size
+                time.sleep(delay)
+            inverter.sendall(data[position:])
+        thread = threading.Thread(target=send, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+
+    def test_recv_across_writes(self):
+        inverter, buffered = self.socketpair()
+        self.send_split(inverter, b'abcdefgh', [1, 2, 2])
+        self.assertEqual(buffered.peek(4), b'abcd')
+        self.assertEqual(buffered.recv(3), b'abc')
+        self.assertEqual(buffered.recv(5), b'defgh')
+
+    def test_closed_connection(self):
+        inverter, buffered = self.socketpair()
+        inverter.sendall(b'ab')
+        inverter.close()
+        self.assertEqual(buffered.recv(2), b'ab')
+        with self.assertRaises(ConnectionError):
+            buffered.recv(1)
+
+    def test_level2_packet_across_writes(self):
+        # A counter with an escaped byte in the FCS
+        counter = next(counter for counter in range(1, 2000)
+                       if any(bte in ESCAPED for bte in request(counter).calculateFCS().to_bytes(2, 'little')))
+        frame = level1_frame(request(counter))
+        # Noise, a 0x7e that doesn't start a header, a frame for another address, then ours
+        other = level1_frame(request(counter), destination=bytearray(6))
+        data = b'\x00\x41' + b'\x7e' + bytes(17) + other + frame
+        for recv_size, sizes in [(4096, [3, 21, 7, len(other) - 7, 19, 5]), (5, [])]:
+            with self.subTest(recv_size=recv_size):
+                inverter, buffered = self.socketpair()
+                buffered.recv_size = recv_size
+                self.send_split(inverter, data, sizes)
+                reply = sma.read_SMA_BT_Packet(buffered, counter, True, LOCAL_ADDRESS)
+                self.assertEqual(reply.levelone.SourceAddress, INVERTER_ADDRESS)
+                self.assertEqual(reply.leveltwo.getPacketCounter(), counter)
+                self.assertEqual(reply.leveltwo.getArray(), request(counter).packet)
+
+
+class TestMergeRequests(unittest.TestCase):
+
+    def test_merge_requests(self):
+        requests = [[0x51000200, 0x00464000, 0x004642FF],
+                    [0x54000200, 0x00260100, 0x002622FF],
+                    [0x51000200, 0x00263F00, 0x00263FFF],
+                    [0x51000200, 0x00465700, 0x004657FF]]
+        # Records 0x4640-0x4642 and 0x4657 are more than max_gap apart by default
+        self.assertEqual(len(sma.merge_requests(requests)), 4)
+        self.assertEqual(sma.merge_requests(requests, max_gap=0x2000), [
+            [0x51000200, 0x00263F00, 0x00263FFF, [(0x00263F00, 0x00263FFF)]],
+            [0x51000200, 0x00464000, 0x004657FF, [(0x00464000, 0x004642FF), (0x00465700, 0x004657FF)]],
+            [0x54000200, 0x00260100, 0x002622FF, [(0x00260100, 0x002622FF)]]])
+        # Only requests of the same command are merged
+        self.assertEqual(len(sma.merge_requests(requests, max_gap=0x1000000)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()